@@ -0,0 +1,96 @@
+"""
+Afterglow Core: running functions in thread pools within the Flask context
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator
+
+from flask import current_app, g, has_request_context, request
+
+
+__all__ = ['in_current_context', 'imap_concurrently', 'map_concurrently']
+
+
+def in_current_context(func: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """
+    Wrap a function to be called in a worker thread with the current Flask
+    app and request context and the :data:`flask.g` attributes, e.g.
+    the authenticated user
+
+    :param func: function of a single argument
+
+    :return: wrapped function
+    """
+    app = current_app._get_current_object()
+    environ = request.environ if has_request_context() else None
+    g_vars = dict(vars(g))
+
+    def worker(item: Any) -> Any:
+        with app.request_context(environ) if environ is not None \
+                else app.app_context():
+            for name, val in g_vars.items():
+                setattr(g, name, val)
+            return func(item)
+
+    return worker
+
+
+def imap_concurrently(func: Callable[[Any], Any], items: Iterable,
+                      max_workers: int) -> Iterator[Future]:
+    """
+    Call a function for each item using a thread pool, keeping at most
+    `max_workers` items ahead of the consumer; worker threads inherit
+    the current Flask context (see :func:`in_current_context`)
+
+    :param func: function of a single argument
+    :param items: function arguments
+    :param max_workers: maximum number of worker threads
+
+    :return: iterator over futures for function values in the order of items
+    """
+    max_workers = max(max_workers, 1)
+    worker = in_current_context(func)
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(worker, item))
+            if len(futures) >= max_workers:
+                yield futures.popleft()
+        while futures:
+            yield futures.popleft()
+
+
+def map_concurrently(func: Callable[[Any], Any], items: Iterable,
+                     max_workers: int) -> list:
+    """
+    Call a function for each item using a thread pool; worker threads inherit
+    the current Flask context (see :func:`in_current_context`)
+
+    :param func: function of a single argument
+    :param items: function arguments
+    :param max_workers: maximum number of worker threads; process items
+        sequentially if < 2
+
+    :return: list of function values in the order of items; the first error,
+        if any, is raised after all items have been processed
+    """
+    items = list(items)
+    if not max_workers or max_workers < 2 or len(items) < 2:
+        return [func(item) for item in items]
+
+    worker = in_current_context(func)
+    with ThreadPoolExecutor(min(max_workers, len(items))) as executor:
+        futures = [executor.submit(worker, item) for item in items]
+
+    results, error = [], None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(None)
+            if error is None:
+                error = e
+    if error is not None:
+        raise error
+    return results
@@ -0,0 +1,20 @@
+"""Add data_files.image_metadata for caching header metadata"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('data_files') as batch_op:
+        batch_op.add_column(sa.Column('image_metadata', sa.UnicodeText(1 << 31), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('data_files') as batch_op:
+        batch_op.drop_column('image_metadata')
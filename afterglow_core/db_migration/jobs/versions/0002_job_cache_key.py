@@ -0,0 +1,22 @@
+"""Add jobs.cache_key for job result memoization"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.add_column(sa.Column('cache_key', sa.String(64), nullable=True))
+        batch_op.create_index('ix_jobs_cache_key', ['cache_key'])
+
+
+def downgrade():
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.drop_index('ix_jobs_cache_key')
+        batch_op.drop_column('cache_key')
@@ -0,0 +1,19 @@
+"""Index job_states.completed_on for bulk cleanup of expired jobs"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job_states') as batch_op:
+        batch_op.create_index('ix_job_states_completed_on', ['completed_on'])
+
+
+def downgrade():
+    with op.batch_alter_table('job_states') as batch_op:
+        batch_op.drop_index('ix_job_states_completed_on')
@@ -75,6 +75,21 @@ COOKIE_TOKEN_EXPIRES_IN = 86400
 DEFAULT_DATA_PROVIDER_AUTH = None
 
 # List of data provider specs [{'name': plugin_name, 'option': option ...} ...]
+# Local disk data providers may keep a persistent index of asset metadata to
+# speed up browsing and searching large archives:
+# {'name': 'local_disk', 'root': '/data/archive',
+#  'index': '/var/lib/afterglow/archive_index.sqlite', 'index_ttl': 60}
+# Disk usage of local disk data providers with a quota is tracked
+# incrementally and fully rescanned every 'usage_ttl' seconds (default: 3600)
+# and before saving data that would bring it above 'usage_rescan_threshold'
+# of the quota (default: 0.9); if 'index' is set, the tracked usage is stored
+# in the index database and shared by all Afterglow processes
+# Set 'hardlink_copies' to True to copy files within the same local disk
+# filesystem by creating hard links; files are then never modified in place
+# by Afterglow, but external tools writing to them affect all copies
+# The LCO, DSS, and imaging survey data providers cache downloaded images in
+# 'cache_dir' (default: DATA_ROOT/cache/[lco|dss|skyview]) up to 'cache_size'
+# bytes (default: 1 GB; 0 = disable)
 DATA_PROVIDERS = [
     {'name': 'local_disk', 'display_name': 'Workspace', 'root': DATA_ROOT,
      'readonly': False, 'peruser': True, 'quota': 10 << 30,
@@ -82,6 +97,17 @@ DATA_PROVIDERS = [
     {'name': 'imaging_surveys'},
 ]
 
+# Maximum number of threads used to copy assets between data providers
+DATA_PROVIDER_COPY_THREADS = 4
+
+# Number of assets copied at once; the storage quota is checked before each
+# batch
+DATA_PROVIDER_COPY_BATCH_SIZE = 100
+
+# Maximum number of data provider assets retrieved in parallel by batch
+# download jobs
+BATCH_DOWNLOAD_THREADS = 4
+
 
 ###############################################################################
 # Data file options
@@ -96,6 +122,10 @@ DATA_FILE_COMPRESSION = False
 # Data files authentication; defaults to any method registered in USER_AUTH
 DATA_FILE_AUTH = None
 
+# Maximum size of the low-resolution background maps saved along with data
+# files by source extraction and reused by other jobs; 0 = don't save
+DATA_FILE_BACKGROUND_MAP_SIZE = 256
+
 # Allow directly uploading files to Workbench
 DATA_FILE_UPLOAD = False
 
@@ -144,6 +174,34 @@ CATALOG_OPTIONS = {}
 # ]
 CUSTOM_VIZIER_CATALOGS = []
 
+# Local HEALPix-partitioned catalogs answering queries from disk; created from
+# downloaded catalog dumps with
+# resources.catalog_plugins.local_catalogs.import_local_catalog():
+# CUSTOM_LOCAL_CATALOGS = [
+#     {'name': 'APASS-local', 'display_name': 'APASS DR9 (local)',
+#      'path': '/var/lib/afterglow/catalogs/apass',
+#      'filter_lookup': {'R': "rprime - 0.2936*(rprime - iprime) - 0.1439"}},
+#     ...
+# ]
+CUSTOM_LOCAL_CATALOGS = []
+
+# Maximum number of simultaneous catalog queries within a job, e.g. when
+# querying multiple catalogs or non-overlapping image fields
+CATALOG_QUERY_THREADS = 4
+
+# Maximum number of object name -> coordinates resolutions cached in memory
+# by catalog queries by object names
+OBJECT_NAME_CACHE_SIZE = 10000
+
+# Time in seconds to remember object names that could not be resolved; errors
+# contacting the name resolver are never cached
+OBJECT_NAME_NOT_FOUND_TTL = 86400
+
+# Catalog of known variable stars used by photometric calibration to exclude
+# variables from comparison stars; may be set to a local catalog plugin, e.g.
+# for offline use
+VARIABLE_STAR_CATALOG = 'VSX'
+
 # Path or list of paths to Astrometry.net index files used for plate solving
 # ANET_INDEX_PATH = '/usr/local/astrometry-net/data'
 # or
@@ -175,8 +233,52 @@ JOB_SERVER_VHOST = 'afterglow'
 # operations
 JOB_MAX_RAM = 100.0
 
+# Number of job worker processes, i.e. jobs running concurrently on a host;
+# 0 = number of CPUs (the Celery default). Set this when starting Celery with
+# a custom --concurrency, as the default job RAM limit depends on it
+JOB_WORKERS = 0
+
+# Maximum RAM in megabytes a single job may use; jobs exceeding this limit
+# are terminated with an error instead of exhausting the host RAM and having
+# the whole worker killed by the OS; 0 = 75% of the RAM available to the
+# worker (container memory limit or total physical RAM) divided by JOB_WORKERS
+JOB_RAM_LIMIT = 0
+
+# Job RAM usage check interval in seconds; 0 = disable job RAM monitoring
+JOB_RAM_CHECK_INTERVAL = 0.5
+
+# Maximum number of threads used by a job to process multiple data files in
+# parallel; 0 = number of CPU cores, 1 = process data files sequentially
+JOB_MAX_THREADS = 0
+
 # Maximum allowed job run time in seconds; None = no limit
 JOB_TIMEOUT = 3600
 
 # Job cancellation timeout in seconds
 JOB_CANCEL_TIMEOUT = 10
+
+# Number of days to keep completed jobs and their results
+JOB_RETENTION = 1
+
+# Number of expired jobs deleted per transaction by the periodic job cleanup
+# task
+JOB_CLEANUP_BATCH_SIZE = 1000
+
+# Maximum number of expired jobs deleted per cleanup run (0 = no limit) and
+# maximum time in seconds spent on deleting them from the database per run
+# (0 = no limit); the remaining jobs are deleted on the next run. Job files are
+# deleted asynchronously by a separate task and do not count towards the limit
+JOB_CLEANUP_MAX_JOBS = 100000
+JOB_CLEANUP_TIME_LIMIT = 600
+
+# Hour of day (server time) when the expired job cleanup task runs
+JOB_CLEANUP_HOUR = 4
+
+# Reuse results of recently completed deterministic jobs (source extraction,
+# photometry, etc.) submitted again with the same parameters and unchanged
+# input data files
+JOB_RESULT_CACHE = False
+
+# Maximum age of reused job results in seconds; 0 = no limit other than the
+# job retention period
+JOB_RESULT_CACHE_AGE = 3600
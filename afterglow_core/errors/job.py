@@ -7,9 +7,9 @@ from . import AfterglowError
 
 __all__ = [
     'CannotCancelJobError', 'CannotCreateJobFileError', 'CannotDeleteJobError',
-    'CannotSetJobStatusError', 'InvalidMethodError', 'JobServerError',
-    'JobWorkerRAMExceeded', 'UnknownJobError', 'UnknownJobFileError',
-    'UnknownJobTypeError',
+    'CannotSetJobStatusError', 'InvalidMethodError', 'JobRAMLimitExceededError',
+    'JobServerError', 'JobWorkerRAMExceeded', 'UnknownJobError',
+    'UnknownJobFileError', 'UnknownJobTypeError',
 ]
 
 
@@ -113,6 +113,19 @@ class JobWorkerRAMExceeded(AfterglowError):
     message = 'Job worker RAM usage exceeded, try again later'
 
 
+class JobRAMLimitExceededError(AfterglowError):
+    """
+    Job used more RAM than allowed by the JOB_RAM_LIMIT option and was
+    terminated
+
+    Extra attributes::
+        ram_mb: RAM used by the job (MB)
+        limit_mb: job RAM limit (MB)
+    """
+    code = 500
+    message = 'Job RAM limit exceeded; try processing fewer or smaller images'
+
+
 class CannotCreateJobFileError(AfterglowError):
     """
     Error creating extra job file
@@ -9,6 +9,7 @@ import errno
 import sys
 import traceback
 import ctypes
+import hashlib
 import shutil
 import signal
 import time
@@ -18,6 +19,7 @@ from threading import Event, Thread
 from typing import Dict as TDict, Union
 from types import SimpleNamespace
 from urllib.parse import quote
+from uuid import uuid4
 
 from sqlalchemy import Column, Float, ForeignKey, Integer, String, text
 from sqlalchemy.orm import Mapped, relationship
@@ -57,7 +59,7 @@ from .errors import AfterglowError, MissingFieldError
 from .errors.job import *
 from .resources import data_files
 from .resources.users import DbUser
-from .models import Job, job_file_path, job_result_dir, job_result_path
+from .models import Job, JobMemoryGovernor, JobRAMLimitAbort, job_file_path, job_result_dir, job_result_path
 
 
 __all__ = ['init_jobs']
@@ -80,7 +82,7 @@ class DbJobState(db.Model):
     status = Column(String(16), nullable=False, index=True, default=js.PENDING)
     created_on = Column(DateTime, nullable=False)
     started_on = Column(DateTime, index=True)
-    completed_on = Column(DateTime)
+    completed_on = Column(DateTime, index=True)
     progress = Column(Float, nullable=False, default=0, index=True)
 
     job: Mapped['DbJob'] = relationship()
@@ -94,6 +96,7 @@ class DbJob(db.Model):
     user_id = Column(Integer, index=True)
     session_id = Column(Integer, nullable=True, index=True)
     args = Column(JSONType)
+    cache_key = Column(String(64), nullable=True, index=True)
 
     state: Mapped['DbJobState'] = relationship(back_populates='job')
 
@@ -230,6 +233,13 @@ def run_job(task: Task, *args, **kwargs):
                 job.state.status = js.CANCELED
                 job.add_error(e)
 
+            except JobRAMLimitAbort:
+                # Job terminated by memory governor; report a clear error instead of letting the OS kill the worker
+                current_app.logger.warning(
+                    '%s Job %s exceeded RAM limit: %.1f MB > %.1f MB', prefix, job_id, governor.peak_mb,
+                    governor.limit_mb)
+                job.add_error(governor.error())
+
             except Exception as e:
                 # Unexpected job exception; Celery task still succeeds
                 job.add_error(e)
@@ -242,9 +252,13 @@ def run_job(task: Task, *args, **kwargs):
                 except Exception:
                     pass
 
+    # Enforce the per-job RAM limit
+    governor = job._memory_governor = JobMemoryGovernor()
+
     job_thread = Thread(target=job_thread_body)
     job_thread.start()
     job_tid = job_thread.ident
+    governor.start(job_tid)
     job_cancel_ack_event.clear()
 
     def abort_handler(*_args) -> None:
@@ -261,6 +275,8 @@ def run_job(task: Task, *args, **kwargs):
     try:
         job_thread.join()
     finally:
+        governor.stop()
+
         # Restore the normal SIGINT handling
         signal.signal(signal.SIGINT, default_abort_handler)
 
@@ -282,26 +298,59 @@ def run_job(task: Task, *args, **kwargs):
 @shared_task(name='cleanup_jobs')
 def cleanup_jobs() -> None:
     """
-    Periodic task that erases jobs and job files older than 1 day
+    Periodic task that erases jobs and job files completed more than JOB_RETENTION days ago
+
+    Expired jobs are deleted in batches of JOB_CLEANUP_BATCH_SIZE, each in a separate short transaction, so that
+    the job tables are never locked for long; jobs that are still pending or running are never deleted. Job result
+    and job files of each batch are removed asynchronously by a separate :func:`delete_expired_job_files` task.
+    The total number of jobs deleted per invocation and the time spent on deleting them from the database are limited
+    by JOB_CLEANUP_MAX_JOBS and JOB_CLEANUP_TIME_LIMIT; the remaining jobs are deleted on the next run.
     """
-    expiration = datetime.utcnow() - timedelta(days=1)
+    app = current_app._get_current_object()
+    expiration = datetime.utcnow() - timedelta(days=app.config.get('JOB_RETENTION', 1))
+    batch_size = max(app.config.get('JOB_CLEANUP_BATCH_SIZE', 1000), 1)
+    max_jobs = app.config.get('JOB_CLEANUP_MAX_JOBS') or 0
+    time_limit = app.config.get('JOB_CLEANUP_TIME_LIMIT') or 0
+    start_time = time.time()
+
     count = 0
     try:
-        for job_state in DbJobState.query.filter(DbJobState.created_on < expiration):
-            job_id, user_id = job_state.id, job_state.job.user_id
-
-            delete_job_data(user_id, job_id)
-            DbJob.query.filter_by(id=job_id).delete()
+        while not max_jobs or count < max_jobs:
+            if time_limit and time.time() - start_time > time_limit:
+                break
+
+            # Expired jobs are selected via the indexed completion time, which is NULL for unfinished jobs
+            limit = min(batch_size, max_jobs - count) if max_jobs else batch_size
+            jobs = db.session.query(DbJob.id, DbJob.user_id) \
+                .join(DbJobState, DbJobState.id == DbJob.id) \
+                .filter(DbJobState.completed_on.isnot(None), DbJobState.completed_on < expiration) \
+                .limit(limit).all()
+            if not jobs:
+                break
+
+            job_ids = [job_id for job_id, _ in jobs]
+            try:
+                DbJobState.query.filter(DbJobState.id.in_(job_ids)).delete(synchronize_session=False)
+                DbJob.query.filter(DbJob.id.in_(job_ids)).delete(synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            count += len(jobs)
 
-            count += 1
+            # Job data are no longer accessible via the API; delete them asynchronously in a separate task
+            try:
+                delete_expired_job_files.delay([(job_id, user_id) for job_id, user_id in jobs])
+            except Exception:
+                current_app.logger.warning('Error scheduling deletion of expired job files', exc_info=True)
 
-        db.session.commit()
+            if len(jobs) < limit:
+                break
 
         if count:
             current_app.logger.info('Deleted %s expired job%s', count, 's' if count > 1 else '')
 
     except Exception:
-        db.session.rollback()
         current_app.logger.warning('Error deleting expired jobs', exc_info=True)
 
     finally:
@@ -311,6 +360,21 @@ def cleanup_jobs() -> None:
             pass
 
 
+# noinspection PyPackageRequirements
+@shared_task(name='delete_expired_job_files', ignore_result=True)
+def delete_expired_job_files(jobs: list) -> None:
+    """
+    Task that deletes result and job files of expired jobs already deleted from the database by :func:`cleanup_jobs`
+
+    :param jobs: list of (job ID, user ID) pairs
+    """
+    for job_id, user_id in jobs:
+        try:
+            delete_job_data(user_id, job_id)
+        except Exception:
+            current_app.logger.warning('Error deleting files for expired job %s', job_id, exc_info=True)
+
+
 # noinspection PyPackageRequirements
 @shared_task(name='cleanup_old_user_accounts')
 def cleanup_old_user_accounts(expiration: float, data_root: str) -> None:
@@ -485,10 +549,10 @@ def init_jobs(app: Flask, cipher: Fernet) -> Celery:
         task_time_limit=app.config['JOB_TIMEOUT'] + app.config['JOB_CANCEL_TIMEOUT']
         if app.config['JOB_TIMEOUT'] else None,
         beat_schedule={
-            # Wipe expired jobs daily at 4am
+            # Wipe expired jobs daily during off-peak hours (4am by default)
             'cleanup-jobs': dict(
                 task='cleanup_jobs',
-                schedule=crontab(hour='4', minute='0'),
+                schedule=crontab(hour=str(app.config.get('JOB_CLEANUP_HOUR', 4)), minute='0'),
             ),
         }
     )
@@ -499,6 +563,8 @@ def init_jobs(app: Flask, cipher: Fernet) -> Celery:
             schedule=crontab(hour='4', minute='0'),
             args=(app.config['DATA_FILE_EXPIRATION'], app.config['DATA_FILE_ROOT']),
         )
+    if app.config.get('JOB_WORKERS'):
+        config.update(worker_concurrency=app.config['JOB_WORKERS'])
     if sys.platform.startswith('win'):
         # https://stackoverflow.com/questions/41636273/celery-tasks-received-but-not-executing
         config.update(worker_pool='eventlet')
@@ -568,7 +634,8 @@ def get_job_result(db_job: DbJob) -> TDict[str, object]:
     """
     res = AsyncResult(db_job.id)
     res_schema = job_types[db_job.type].fields['result'].nested
-    if res.state == 'SUCCESS':
+    if res.state == 'SUCCESS' or res.state == 'PENDING' and db_job.state.status == js.COMPLETED:
+        # Completed job or a clone of a memoized job, which has no Celery task
         with open(job_result_path(db_job.id), 'rt', encoding='utf8') as f:
             result = json.load(f)
         result = res_schema(**result).to_dict()
@@ -624,6 +691,127 @@ def delete_job_data(user_id: Union[int, str], job_id: str) -> None:
         pass
 
 
+def get_job_input_file_ids(args: Union[dict, list]) -> set:
+    """
+    Return IDs of all data files referenced by job parameters, i.e. values of the "file_id", "file_ids", and similar
+    fields at any nesting level
+
+    :param args: job parameters
+
+    :return: set of data file IDs
+    """
+    file_ids = set()
+    if isinstance(args, dict):
+        for name, val in args.items():
+            if isinstance(name, str) and (name.endswith('file_id') or name.endswith('file_ids')):
+                if isinstance(val, (list, tuple)):
+                    file_ids.update(item for item in val if isinstance(item, (int, str)))
+                elif isinstance(val, (int, str)):
+                    file_ids.add(val)
+            elif isinstance(val, (dict, list)):
+                file_ids |= get_job_input_file_ids(val)
+    elif isinstance(args, list):
+        for item in args:
+            if isinstance(item, (dict, list)):
+                file_ids |= get_job_input_file_ids(item)
+    return file_ids
+
+
+def get_job_cache_key(user_id: Union[int, str, None], job_type: str, job_args: TDict[str, object]) -> Union[str, None]:
+    """
+    Return the job result memoization key: a hash of the job type, job parameters, and versions (modification times
+    and sizes) of all input data files
+
+    :param user_id: user ID
+    :param job_type: job type
+    :param job_args: job-specific parameters, without the common job fields
+
+    :return: SHA-256 hex digest or None if memoization is disabled for the given job type or any of the input data
+        files is missing
+    """
+    if not current_app.config.get('JOB_RESULT_CACHE') or not getattr(job_types[job_type], 'memoizable', False):
+        return None
+
+    versions = {}
+    for file_id in get_job_input_file_ids(job_args):
+        try:
+            versions[str(file_id)] = data_files.get_data_file_version(user_id, int(file_id))
+        except ValueError:
+            return None
+        if versions[str(file_id)] is None:
+            return None
+
+    return hashlib.sha256(json.dumps(
+        {'type': job_type, 'args': job_args, 'files': versions}, sort_keys=True, default=str).encode('utf8')
+    ).hexdigest()
+
+
+def find_cached_job(user_id: Union[int, str, None], cache_key: str) -> Union[DbJob, None]:
+    """
+    Return the most recent successfully completed job with the given memoization key that is not older than
+    JOB_RESULT_CACHE_AGE
+
+    :param user_id: user ID
+    :param cache_key: memoization key returned by :func:`get_job_cache_key`
+
+    :return: database job object or None if not found
+    """
+    q = DbJob.query.join(DbJobState, DbJobState.id == DbJob.id).filter(
+        DbJob.user_id == user_id, DbJob.cache_key == cache_key, DbJobState.status == js.COMPLETED,
+        DbJobState.progress >= 100)
+    max_age = current_app.config.get('JOB_RESULT_CACHE_AGE')
+    if max_age:
+        q = q.filter(DbJobState.completed_on >= datetime.utcnow() - timedelta(seconds=max_age))
+    for db_job in q.order_by(DbJobState.completed_on.desc()).limit(10):
+        # Only reuse jobs that completed without errors
+        # noinspection PyBroadException
+        try:
+            with open(job_result_path(db_job.id), 'rt', encoding='utf8') as f:
+                res = json.load(f)
+        except Exception:
+            continue
+        if not res.get('errors'):
+            return db_job
+    return None
+
+
+def clone_job(db_job: DbJob, session_id: Union[int, None], created_on: datetime) -> DbJob:
+    """
+    Create a completed copy of the given job, including its result and job files, in the given session; the caller
+    is responsible for committing the changes
+
+    :param db_job: database object of the job to clone
+    :param session_id: client session ID for the new job
+    :param created_on: job creation time
+
+    :return: new database job object
+    """
+    job_id = str(uuid4())
+    user_id = db_job.user_id
+
+    with open(job_result_path(db_job.id), 'rt', encoding='utf8') as f:
+        serialized = f.read()
+    for file_id in json.loads(serialized).get('files') or {}:
+        shutil.copyfile(job_file_path(user_id, db_job.id, file_id), job_file_path(user_id, job_id, file_id))
+    with open(job_result_path(job_id), 'w', encoding='utf8') as f:
+        f.write(serialized)
+
+    new_db_job = DbJob(
+        id=job_id,
+        type=db_job.type,
+        user_id=user_id,
+        session_id=session_id,
+        args=db_job.args,
+        cache_key=db_job.cache_key,
+    )
+    db.session.add(new_db_job)
+    db.session.add(DbJobState(
+        id=job_id, status=js.COMPLETED, created_on=created_on, started_on=created_on, completed_on=created_on,
+        progress=100))
+    db.session.flush()
+    return new_db_job
+
+
 def job_server_request(resource: str, method: str, **args) -> TDict[str, object]:
     """
     Make a request to job server and return response; must be called within a Flask request context
@@ -664,33 +852,58 @@ def job_server_request(resource: str, method: str, **args) -> TDict[str, object]
 
                 created_on = datetime.utcnow()
 
-                # Start a Celery task
-                res: AsyncResult = run_job.delay(**args)
-                job_id = res.id
+                # Convert message arguments to polymorphic job model
+                result = Job(**args).to_dict()
+                job_args = dict(result)
+                del job_args['state'], job_args['result']
+                # Delete the common indexable fields
+                for name in ('id', 'type', 'user_id', 'session_id'):
+                    job_args.pop(name, None)
 
-                # Convert message arguments to polymorphic job model and store it in the database
+                # Reuse the result of a recently completed identical job if any
                 try:
-                    result = Job(**args).to_dict()
-                    result['id'] = job_id
-                    result['state']['created_on'] = created_on
-                    job_args = dict(result)
-                    del job_args['state'], job_args['result']
-                    # Delete the common indexable fields
-                    for name in ('id', 'type', 'user_id', 'session_id'):
-                        del job_args[name]
-                    db.session.add(DbJob(
-                        id=job_id,
-                        type=job_type,
-                        user_id=user_id,
-                        session_id=session_id,
-                        args=job_args,
-                    ))
-                    db.session.add(DbJobState(id=job_id, created_on=created_on))
-                    db.session.commit()
+                    cache_key = get_job_cache_key(user_id, job_type, job_args)
+                    cached_job = find_cached_job(user_id, cache_key) if cache_key else None
+                    if cached_job is not None:
+                        db_job = clone_job(cached_job, session_id, created_on)
+                        db.session.commit()
                 except Exception:
                     db.session.rollback()
                     raise
 
+                if cached_job is not None:
+                    result = dict(
+                        id=db_job.id,
+                        type=db_job.type,
+                        user_id=db_job.user_id,
+                        session_id=db_job.session_id,
+                        state=get_job_state(db_job),
+                        result=get_job_result(db_job),
+                    )
+                    result.update(db_job.args)
+                else:
+                    # Start a Celery task
+                    res: AsyncResult = run_job.delay(**args)
+                    job_id = res.id
+
+                    # Store the job in the database
+                    try:
+                        result['id'] = job_id
+                        result['state']['created_on'] = created_on
+                        db.session.add(DbJob(
+                            id=job_id,
+                            type=job_type,
+                            user_id=user_id,
+                            session_id=session_id,
+                            args=job_args,
+                            cache_key=cache_key,
+                        ))
+                        db.session.add(DbJobState(id=job_id, created_on=created_on))
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        raise
+
                 http_status = 201
 
             elif method == 'get':
@@ -5,7 +5,10 @@ A catalog plugin must subclass :class:`Catalog` and implement at
 least its get_asset() and get_asset_data() methods.
 """
 
-from typing import Dict as TDict, List as TList, Optional
+from functools import lru_cache
+from types import CodeType
+from typing import (
+    Dict as TDict, Iterator, List as TList, Optional, Tuple)
 
 import numpy as np
 from marshmallow.fields import Dict, Integer, List, Nested, String
@@ -17,7 +20,15 @@ from .photometry import IPhotometry, Mag
 from .source_extraction import IAstrometry
 
 
-__all__ = ['Catalog', 'CatalogSource', 'ICatalogSource']
+__all__ = [
+    'Catalog', 'CatalogSource', 'ICatalogSource', 'compile_expr',
+    'concatenate_columns', 'eval_expr', 'eval_mag_expr', 'get_expr_names',
+    'sources_to_columns',
+]
+
+
+# NumPy-enabled context for catalog column and magnitude expressions
+_expr_context = dict(np.__dict__)
 
 
 class ICatalogSource(AfterglowSchema):
@@ -72,6 +83,13 @@ class Catalog(AfterglowSchema):
             region
         query_circ: return catalog objects within the specified circular
             region
+        query_objects_columns, query_box_columns, query_circ_columns: same
+            as above but return columnar data (see :meth:`columns_to_sources`)
+            suitable for serializing large query results without creating
+            a CatalogSource per row; by default, the results of the above
+            methods are converted; plugins producing columnar data natively
+            override these instead and implement the above methods via
+            :meth:`columns_to_sources`
     """
     __polymorphic_on__ = 'name'
 
@@ -99,6 +117,106 @@ class Catalog(AfterglowSchema):
         if self.display_name is None:
             self.display_name = self.name
 
+    @staticmethod
+    def _iter_columns(columns: TDict[str, np.ndarray]) \
+            -> Iterator[Tuple[TDict[str, object],
+                              TDict[str, Tuple[float, Optional[float]]]]]:
+        """
+        Iterate over rows of columnar query results
+
+        :param columns: dictionary of equal-length column arrays; see
+            :meth:`columns_to_sources`
+
+        :return: iterator over (attributes, magnitudes) pairs, where
+            attributes are unmasked attribute values and magnitudes are
+            {name: (value, error)}, error being None if unknown
+        """
+        attrs, mags = [], []
+        n = 0
+        for name, col in columns.items():
+            n = len(col)
+            if name.startswith('mag.'):
+                values = np.asarray(col, float)
+                errors = columns.get('err.' + name[4:])
+                if errors is not None:
+                    errors = np.asarray(errors, float)
+                    with np.errstate(invalid='ignore'):
+                        errors = np.where(
+                            np.isfinite(errors) & (errors != 0), errors,
+                            np.nan).tolist()
+                mags.append((
+                    name[4:], np.isfinite(values), values.tolist(), errors))
+            elif not name.startswith('err.'):
+                attrs.append((
+                    name, np.ma.getdata(col).tolist(),
+                    np.ma.getmaskarray(col).tolist()
+                    if isinstance(col, np.ma.MaskedArray) else None))
+
+        if mags:
+            # Skip sources having no magnitudes
+            rows = np.flatnonzero(np.logical_or.reduce(
+                [finite for _, finite, _, _ in mags])).tolist()
+            mags = [(name, finite.tolist(), values, errors)
+                    for name, finite, values, errors in mags]
+        else:
+            rows = range(n)
+
+        for i in rows:
+            yield {name: values[i] for name, values, mask in attrs
+                   if mask is None or not mask[i]}, \
+                {name: (values[i],
+                        errors[i] if errors is not None and
+                        errors[i] == errors[i] else None)
+                 for name, finite, values, errors in mags if finite[i]}
+
+    def columns_to_sources(self, columns: TDict[str, np.ndarray]) \
+            -> TList[CatalogSource]:
+        """
+        Return a list of CatalogSource objects from columnar query results
+
+        Columns are either source attributes (e.g. "id", "ra_hours", or
+        "dec_degs") or magnitudes and their errors ("mag.<name>" and
+        "err.<name>"). Masked attribute values and NaN magnitudes are skipped.
+        If there are any magnitude columns, objects are only created for
+        sources having at least one magnitude.
+
+        :param columns: dictionary of equal-length column arrays
+
+        :return: list of catalog objects
+        """
+        sources = []
+        for attrs, mags in self._iter_columns(columns):
+            source = CatalogSource(catalog_name=self.name, mags={})
+            for name, val in attrs.items():
+                setattr(source, name, val)
+            for name, (val, err) in mags.items():
+                m = Mag(value=val)
+                if err is not None:
+                    m.error = err
+                source.mags[name] = m
+            sources.append(source)
+        return sources
+
+    def columns_to_dicts(self, columns: TDict[str, np.ndarray]) \
+            -> TList[TDict[str, object]]:
+        """
+        Return serialized catalog sources from columnar query results
+
+        The output is the same as that of dumping the results of
+        :meth:`columns_to_sources` but is produced without creating
+        an object per source, which is much faster for large queries.
+
+        :param columns: dictionary of equal-length column arrays
+
+        :return: list of dictionaries with :class:`CatalogSource` fields
+        """
+        return [
+            {'catalog_name': self.name, **attrs, 'mags': {
+                name: {'value': val} if err is None
+                else {'value': val, 'error': err}
+                for name, (val, err) in mags.items()}}
+            for attrs, mags in self._iter_columns(columns)]
+
     def query_objects(self, names: TList[str]) -> TList[CatalogSource]:
         """
         Return a list of catalog objects with the specified names
@@ -195,3 +313,222 @@ class Catalog(AfterglowSchema):
         """
         raise errors.MethodNotImplementedError(
             class_name=self.__class__.__name__, method_name='query_circ')
+
+    def query_objects_columns(self, names: TList[str]) \
+            -> TDict[str, np.ndarray]:
+        """
+        Return columnar data for catalog objects with the specified names
+
+        Default implementation converts the output of :meth:`query_objects`.
+
+        :param names: object names
+
+        :return: dictionary of column arrays; see :meth:`columns_to_sources`
+        """
+        return sources_to_columns(self.query_objects(names))
+
+    def query_box_columns(self, ra_hours: float, dec_degs: float,
+                          width_arcmins: float,
+                          height_arcmins: Optional[float] = None,
+                          constraints: Optional[TDict[str, str]] = None,
+                          limit: Optional[int] = None) \
+            -> TDict[str, np.ndarray]:
+        """
+        Return columnar data for catalog objects within the specified
+        rectangular region
+
+        Default implementation converts the output of :meth:`query_box`; see
+        the latter for the description of parameters.
+
+        :return: dictionary of column arrays; see :meth:`columns_to_sources`
+        """
+        return sources_to_columns(self.query_box(
+            ra_hours, dec_degs, width_arcmins, height_arcmins, constraints,
+            limit))
+
+    def query_circ_columns(self, ra_hours: float, dec_degs: float,
+                           radius_arcmins: float,
+                           constraints: Optional[TDict[str, str]] = None,
+                           limit: Optional[int] = None) \
+            -> TDict[str, np.ndarray]:
+        """
+        Return columnar data for catalog objects within the specified
+        circular region
+
+        Default implementation converts the output of :meth:`query_circ`; see
+        the latter for the description of parameters.
+
+        :return: dictionary of column arrays; see :meth:`columns_to_sources`
+        """
+        return sources_to_columns(self.query_circ(
+            ra_hours, dec_degs, radius_arcmins, constraints, limit))
+
+
+def sources_to_columns(sources: TList[CatalogSource]) \
+        -> TDict[str, np.ndarray]:
+    """
+    Return columnar data for a list of catalog objects; inverse of
+    :meth:`Catalog.columns_to_sources` for :class:`CatalogSource` fields
+
+    :param sources: list of catalog objects
+
+    :return: dictionary of column arrays; attributes missing from some
+        objects are masked, and missing magnitudes and errors are NaNs
+    """
+    columns = {}
+    for name in CatalogSource._declared_fields:
+        if name in ('catalog_name', 'mags'):
+            continue
+        values = [getattr(source, name, None) for source in sources]
+        mask = [val is None for val in values]
+        if all(mask):
+            continue
+        col = np.empty(len(values), object)
+        col[:] = values
+        columns[name] = np.ma.masked_array(col, mask)
+
+    mag_names = {}
+    for source in sources:
+        mag_names.update(dict.fromkeys(getattr(source, 'mags', None) or {}))
+    for name in mag_names:
+        mags = [(getattr(source, 'mags', None) or {}).get(name)
+                for source in sources]
+        columns[f'mag.{name}'] = np.array(
+            [getattr(m, 'value', None) for m in mags], float)
+        columns[f'err.{name}'] = np.array(
+            [getattr(m, 'error', None) for m in mags], float)
+    return columns
+
+
+def concatenate_columns(columns_list: TList[TDict[str, np.ndarray]]) \
+        -> TDict[str, np.ndarray]:
+    """
+    Concatenate columnar results of several catalog queries
+
+    Attributes missing from some of the results are masked, and missing
+    magnitudes and errors are set to NaN.
+
+    :param columns_list: list of dictionaries of column arrays
+
+    :return: dictionary of concatenated column arrays
+    """
+    columns_list = [columns for columns in columns_list if columns]
+    if len(columns_list) < 2:
+        return columns_list[0] if columns_list else {}
+
+    lengths = [len(next(iter(columns.values()))) for columns in columns_list]
+    names = {}
+    for columns in columns_list:
+        names.update(dict.fromkeys(columns))
+    res = {}
+    for name in names:
+        if name.startswith('mag.') or name.startswith('err.'):
+            res[name] = np.concatenate([
+                np.asarray(columns[name], float) if name in columns
+                else np.full(n, np.nan)
+                for columns, n in zip(columns_list, lengths)])
+            continue
+        parts = []
+        for columns, n in zip(columns_list, lengths):
+            if name in columns:
+                parts.append(np.ma.asarray(columns[name]))
+            else:
+                parts.append(np.ma.masked_all(n, object))
+        if len({part.dtype.kind for part in parts}) > 1:
+            # Mixed types, e.g. string and integer IDs
+            parts = [part.astype(object) for part in parts]
+        res[name] = np.ma.concatenate(parts)
+    return res
+
+
+@lru_cache(maxsize=1024)
+def compile_expr(expr: str) -> CodeType:
+    """
+    Compile a catalog column mapping or filter lookup expression; compiled
+    expressions are cached, so each expression is compiled only once
+
+    :param expr: Python expression involving column names or magnitudes and
+        NumPy definitions
+
+    :return: code object
+    """
+    return compile(expr, '<string>', 'eval')
+
+
+def get_expr_names(expr: str) -> TList[str]:
+    """
+    Return the names referenced by a catalog expression that are not NumPy
+    definitions, i.e. the names of columns or magnitudes
+
+    :param expr: catalog expression
+
+    :return: list of variable names
+    """
+    return [name for name in compile_expr(expr).co_names
+            if name not in _expr_context]
+
+
+def eval_expr(expr: str, columns: TDict[str, object]) -> object:
+    """
+    Evaluate a catalog expression over whole columns
+
+    :param expr: catalog expression
+    :param columns: mapping between variable names and column values, either
+        scalars or arrays of the same length
+
+    :return: expression value; array if `columns` are arrays
+    """
+    ctx = dict(_expr_context)
+    ctx.update(columns)
+    with np.errstate(all='ignore'):
+        return eval(compile_expr(expr), ctx, {})
+
+
+def eval_mag_expr(expr: str, mags: TDict[str, np.ndarray],
+                  mag_errors: Optional[TDict[str, np.ndarray]] = None,
+                  eps: float = 1e-7) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluate a filter lookup expression, e.g. "V + B_V", for a batch of
+    catalog sources and propagate magnitude errors
+
+    Errors are calculated by coadding contributions from each filter,
+    the partial derivatives being computed numerically for all sources
+    at once.
+
+    :param expr: filter lookup expression
+    :param mags: mapping between filter names and arrays of the corresponding
+        catalog magnitudes; NaNs stand for missing magnitudes
+    :param mag_errors: optional mapping between filter names and arrays
+        of magnitude errors; NaNs or zeros stand for missing errors
+    :param eps: magnitude increment for numerical differentiation
+
+    :return: arrays of magnitudes and errors; NaN magnitude means that
+        the expression could not be evaluated for the given source, zero error
+        means that it is unknown
+    """
+    n = len(next(iter(mags.values()))) if mags else 0
+    names = [name for name in get_expr_names(expr) if name in mags]
+    columns = {name: np.asarray(mags[name], float) for name in names}
+    values = np.broadcast_to(
+        np.asarray(eval_expr(expr, columns), float), (n,)).copy()
+    values[~np.isfinite(values)] = np.nan
+
+    err2 = np.zeros(n)
+    if mag_errors:
+        for name in names:
+            try:
+                e = np.nan_to_num(np.asarray(mag_errors[name], float))
+            except KeyError:
+                continue
+            if not e.any():
+                continue
+            # Partial derivative of the final mag with resp. to the current
+            # filter
+            col = columns[name]
+            columns[name] = col + eps
+            try:
+                d = (np.asarray(eval_expr(expr, columns), float) - values)/eps
+            finally:
+                columns[name] = col
+            err2 += np.nan_to_num(d*e)**2
+    return values, np.sqrt(err2)
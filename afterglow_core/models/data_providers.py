@@ -6,7 +6,9 @@ A data provider plugin must subclass :class:`DataProvider`.
 
 from __future__ import annotations
 
-from typing import Any, Dict as TDict, List as TList, Optional, Tuple, Union
+from io import BytesIO
+from typing import (
+    Any, BinaryIO, Dict as TDict, List as TList, Optional, Tuple, Union)
 
 try:
     from PIL import Image as PILImage
@@ -21,6 +23,7 @@ from ..errors.auth import NotAuthenticatedError
 from ..errors.data_provider import (
     AssetNotFoundError, NonBrowseableDataProviderError, QuotaExceededError)
 from ..schemas import AfterglowSchema, Boolean
+from ..concurrency import map_concurrently
 
 
 __all__ = ['DataProvider', 'DataProviderAsset']
@@ -289,6 +292,31 @@ class DataProvider(AfterglowSchema):
         raise errors.MethodNotImplementedError(
             class_name=self.__class__.__name__, method_name='get_asset_data')
 
+    def get_asset_filename(self, path: str) -> Optional[str]:
+        """
+        Return the name of a local file holding data for a non-collection
+        asset at the given path; used to copy assets without reading them
+        into memory
+
+        :param path: asset path; must identify a non-collection asset
+
+        :return: absolute filename or None if asset data are not stored
+            in a local file
+        """
+        return None
+
+    def open_asset_data(self, path: str) -> BinaryIO:
+        """
+        Return a readable binary file-like object for a non-collection asset
+        at the given path; the default implementation wraps the output of
+        :meth:`get_asset_data`, providers may reimplement it to stream data
+
+        :param path: asset path; must identify a non-collection asset
+
+        :return: file-like object; use as a context manager to close it
+        """
+        return BytesIO(self.get_asset_data(path))
+
     def create_asset(self, path: str, data: Optional[bytes] = None, **kwargs) \
             -> DataProviderAsset:
         """
@@ -343,18 +371,55 @@ class DataProvider(AfterglowSchema):
         raise errors.MethodNotImplementedError(
             class_name=self.__class__.__name__, method_name='delete_asset')
 
-    def check_quota(self: DataProvider, path: Optional[str], data: bytes) \
+    def copy_asset_data(self, provider: DataProvider,
+                        src_asset: DataProviderAsset, dst_path: str,
+                        update: bool = False, force: bool = False,
+                        **kwargs) -> DataProviderAsset:
+        """
+        Copy a non-collection asset from the same or another data provider;
+        the default implementation reads the whole asset data into memory
+        and calls :meth:`create_asset` or :meth:`update_asset`, providers may
+        reimplement it to stream data or to avoid copying altogether
+
+        The quota is checked here only if the source asset size is unknown
+        (no "size" in metadata); otherwise, the caller is responsible
+        for checking it.
+
+        :param provider: source data provider
+        :param src_asset: source asset
+        :param dst_path: destination asset path within the current data
+            provider
+        :param update: update existing asset at `dst_path` vs create a new
+            asset
+        :param force: overwrite existing collection asset if updating
+        :param kwargs: optional provider-specific keyword arguments to
+            :meth:`create_asset` and :meth:`update_asset`
+
+        :return: new data provider asset
+        """
+        data = provider.get_asset_data(src_asset.path)
+        if src_asset.metadata.get('size') is None:
+            self.check_quota(dst_path if update else None, data)
+        if update:
+            return self.update_asset(dst_path, data, force=force, **kwargs)
+        return self.create_asset(dst_path, data, **kwargs)
+
+    def check_quota(self: DataProvider, path: Optional[str],
+                    data: Optional[bytes], size: Optional[int] = None) \
             -> None:
         """
         Check that the new asset data will not exceed the data provider's quota
 
         :param path: asset path; must be set if updating existing asset
         :param data: asset data being saved
+        :param size: total size of data being saved if `data` is not available
+            (e.g. when copying multiple assets at once)
         """
         quota = self.quota
         if quota:
             usage = self.usage or 0
-            size = len(data) if data is not None else 0
+            if size is None:
+                size = len(data) if data is not None else 0
             if path is not None:
                 usage -= self.get_asset(path).metadata.get('size', 0)
             if usage + size > quota:
@@ -406,6 +471,11 @@ class DataProvider(AfterglowSchema):
         Copy the whole asset from another data provider or a different path
         within the same data provider
 
+        The source collection tree is created first; then non-collection
+        assets are copied by :meth:`copy_asset_data` in batches of
+        DATA_PROVIDER_COPY_BATCH_SIZE using up to DATA_PROVIDER_COPY_THREADS
+        threads, with a single quota check per batch.
+
         :param provider: source data provider; can be the same as the current
             provider
         :param src_path: asset path within the source data provider
@@ -433,40 +503,69 @@ class DataProvider(AfterglowSchema):
                 update = True
 
         src_asset = provider.get_asset(src_path)
-        if src_asset.collection:
-            # Copying the whole collection asset tree; first, create/update
-            # empty collection asset at dst_path
-            if not provider.browseable:
-                raise NonBrowseableDataProviderError(id=provider.id)
-            if update:
-                res = self.update_asset(dst_path, None, force=force, **kwargs)
-            else:
-                res = self.create_asset(dst_path, None, **kwargs)
-
-            if not limit or _depth < limit - 1:
-                for child_asset in provider.get_child_assets(src_path)[0]:
-                    # For each child asset of a collection asset, recursively
-                    # copy its data; calculate the destination path by
-                    # appending the source asset name; always create
-                    # destination asset since no asset exists there yet
-                    self.recursive_copy(
-                        provider, child_asset.path,
-                        dst_path + '/' + child_asset.name, move=move,
-                        update=False, limit=limit, _depth=_depth + 1, **kwargs)
-        else:
+        if not src_asset.collection:
             # Copying a non-collection asset
-            src_data = provider.get_asset_data(src_path)
-            self.check_quota(dst_path if update else None, src_data)
-            if update:
-                # Updating top-level destination asset
-                res = self.update_asset(
-                    dst_path, src_data, force=force, **kwargs)
-            else:
-                # Creating non-collection asset
-                res = self.create_asset(dst_path, src_data, **kwargs)
+            size = src_asset.metadata.get('size')
+            if size is not None:
+                self.check_quota(dst_path if update else None, None, size)
+            res = self.copy_asset_data(
+                provider, src_asset, dst_path, update=update, force=force,
+                **kwargs)
+            if move:
+                # Delete the source asset after successful copy
+                provider.delete_asset(src_path, **kwargs)
+            return res
+
+        # Copying the whole collection asset tree; first, create/update empty
+        # collection asset at dst_path
+        if not provider.browseable:
+            raise NonBrowseableDataProviderError(id=provider.id)
+        if update:
+            res = self.update_asset(dst_path, None, force=force, **kwargs)
+        else:
+            res = self.create_asset(dst_path, None, **kwargs)
+
+        # Walk the source tree level by level, creating destination collection
+        # assets and collecting non-collection assets to copy; calculate
+        # the destination path by appending the source asset name; always
+        # create destination assets since nothing exists there yet
+        collections, files = [src_path], []
+        level, depth = [(src_path, dst_path)], _depth
+        while level and (not limit or depth < limit - 1):
+            next_level = []
+            for src, dst in level:
+                for child_asset in provider.get_child_assets(src)[0]:
+                    child_dst = dst + '/' + child_asset.name
+                    if child_asset.collection:
+                        self.create_asset(child_dst, None, **kwargs)
+                        collections.append(child_asset.path)
+                        next_level.append((child_asset.path, child_dst))
+                    else:
+                        files.append((child_asset, child_dst))
+            level = next_level
+            depth += 1
+
+        def copy(item: Tuple[DataProviderAsset, str]) -> None:
+            asset, path = item
+            self.copy_asset_data(provider, asset, path, **kwargs)
+            if move:
+                provider.delete_asset(asset.path, **kwargs)
+
+        # Copy data in batches using multiple threads; check the quota once
+        # per batch for assets of known size
+        batch_size = max(
+            current_app.config.get('DATA_PROVIDER_COPY_BATCH_SIZE', 100), 1)
+        num_threads = current_app.config.get('DATA_PROVIDER_COPY_THREADS', 4)
+        for i in range(0, len(files), batch_size):
+            batch = files[i:i + batch_size]
+            self.check_quota(None, None, sum(
+                asset.metadata.get('size') or 0 for asset, _ in batch))
+            map_concurrently(copy, batch, num_threads)
 
         if move:
-            # Delete the source asset after successful copy
-            self.delete_asset(src_path, **kwargs)
+            # Delete the source collection assets after successful copy,
+            # innermost first
+            for path in reversed(collections):
+                provider.delete_asset(path, **kwargs)
 
         return res
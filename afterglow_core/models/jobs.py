@@ -3,10 +3,15 @@ Afterglow Core: job data models
 """
 import os
 import sys
+import time
 import traceback
+import ctypes
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import Dict as TDict, List as TList, Optional, Union
+from threading import Event, Lock, RLock, Thread, get_ident
+from typing import Any, BinaryIO, Callable, Dict as TDict, Iterable, Iterator, List as TList, Optional, Union
 import errno
+from contextlib import contextmanager
 
 from marshmallow.fields import Dict, Integer, List, Nested, String
 from werkzeug.http import HTTP_STATUS_CODES
@@ -14,13 +19,16 @@ from flask import current_app
 from celery import Task
 
 from ..errors import MethodNotImplementedError
-from ..errors.job import CannotCreateJobFileError
+from ..errors.job import CannotCreateJobFileError, JobRAMLimitExceededError
 from ..schemas import AfterglowSchema, DateTime, Float
+from ..concurrency import in_current_context
 from .errors import AfterglowError as AfterglowErrorSchema
 
 
 __all__ = [
     'Job', 'JobFile', 'JobResult', 'JobState',
+    'JobMemoryGovernor', 'JobRAMLimitAbort', 'get_process_ram_mb',
+    'get_job_num_workers', 'parallel_map',
     'job_result_dir', 'job_result_path',
     'job_file_dir', 'job_file_path',
 ]
@@ -193,6 +201,14 @@ class Job(AfterglowSchema):
                 finally:
                     self.update_progress((file_no + 1)/len(file_ids)*100)
 
+    If the files are processed independently, the loop may be spread over
+    a bounded thread pool with :func:`parallel_map`, which preserves the order
+    of results, updates the job progress, and adds per-file errors:
+
+        def run(self):
+            self.result.values = parallel_map(
+                self, self.process_file, self.settings.file_ids)
+
     :meth:`run` may read and create the regular user data files by calling
     functions from :mod:`afterglow_core.resources.data_files` using
     self.user_id as the current user ID (works also for installations with no
@@ -263,13 +279,26 @@ class Job(AfterglowSchema):
         state: current job state, an instance of JobState
         result: job result structure, an instance of JobResult or its subclass
 
+    Class attributes::
+        memoizable: set to True in deterministic job types which result depends
+            only on job parameters and input data files, and not on external
+            data like online catalogs; if JOB_RESULT_CACHE is
+            enabled, resubmitting such a job with the same parameters returns
+            a copy of the recently completed job without running it again
+
     Methods::
         run(): run the job
         update(): called by :meth:`run` after an intermediate job result change
+        on_child_update(): called when a sub-job of this job changes its state
         add_error(): called by run() to add an intermediate error message
         add_warning(): called by run() to add an warning message
         update_progress(): update the current job progress value (0 to 100)
         create_job_file(): save data to an extra job data file and register in JobResult.files
+        open_job_file(): same as create_job_file() but write data incrementally to a file object
+        check_ram(): raise an error if the job would exceed its RAM limit
+        get_free_ram_mb(): return the RAM still available to the job
+        get_chunk_size(): return the number of items that can be processed
+            at once within the job RAM limit
     """
     __polymorphic_on__ = 'type'
 
@@ -280,9 +309,14 @@ class Job(AfterglowSchema):
     state: JobState = Nested(JobState)
     result: JobResult = Nested(JobResult)
 
+    memoizable: bool = False
+
     _task = None
+    _parent = None
+    _memory_governor = None
+    _job_file_prefix = ''
 
-    def __init__(self, *args, _task: Task = None, **kwargs):
+    def __init__(self, *args, _task: Task = None, _parent: Optional['Job'] = None, **kwargs):
         """
         Create a :class:`Job` instance; used both when loading job plugins and
         when creating a new job
@@ -290,11 +324,16 @@ class Job(AfterglowSchema):
         :param args: may include job object to initialize from
         :param _task: Celery task instance used to pass job state updates
             to job server; unused when loading job plugins
+        :param _parent: enclosing job instance if the job is run as a part of
+            another job (e.g. a pipeline step); state updates are then passed
+            to the parent job instead of the job server
         :param kwargs: job-specific parameters passed on job creation
         """
         super().__init__(*args, **kwargs)
 
         self._task = _task
+        self._parent = _parent
+        self._lock = RLock()
 
         # Initialize to default state and result
         if getattr(self, 'state', None) is None:
@@ -313,6 +352,19 @@ class Job(AfterglowSchema):
         Notify the job server about job state change; should be called after` modifying any of the JobState or JobResult
         fields while the job is still in progress; also called automatically upon job completion
         """
+        if self._parent is not None:
+            # Sub-job: let the enclosing job report the state change
+            self._parent.on_child_update(self)
+            return
+
+        with self._lock:
+            self._update()
+
+    def _update(self) -> None:
+        """
+        Implementation of :meth:`update`; must be called with the job lock held, as parts of the job may be running
+        in different threads
+        """
         self._task.update_state(
             task_id=self.id,
             state={
@@ -333,6 +385,15 @@ class Job(AfterglowSchema):
         with open(os.path.join(d, self.id), 'w', encoding='utf8') as f:
             print(self.result.dumps(self.result), file=f)
 
+    def on_child_update(self, child: 'Job') -> None:
+        """
+        Called by :meth:`update` of a sub-job created with `_parent` set to this job; by default, merely notifies
+        the job server about the enclosing job state
+
+        :param child: sub-job instance
+        """
+        self.update()
+
     def add_error(self, e: BaseException, meta: Optional[TDict[str, Union[str, int, float, bool]]] = None) -> None:
         """
         Add error to Job.result.errors; in debug mode, error metadata also includes exception traceback
@@ -352,8 +413,9 @@ class Job(AfterglowSchema):
         if meta:
             error['meta'] = dict(meta)
         error.setdefault('meta', {})['traceback'] = traceback.format_tb(sys.exc_info()[-1])
-        self.result.errors.append(error)
-        self.update()
+        with self._lock:
+            self.result.errors.append(error)
+            self.update()
 
     def add_warning(self, msg: str) -> None:
         """
@@ -361,8 +423,9 @@ class Job(AfterglowSchema):
 
         :param msg: warning message
         """
-        self.result.warnings.append(msg)
-        self.update()
+        with self._lock:
+            self.result.warnings.append(msg)
+            self.update()
 
     def update_progress(self, progress: float, stage: int = 0,
                         total_stages: int = 1) -> None:
@@ -389,7 +452,32 @@ class Job(AfterglowSchema):
             returned in the Content-Type header by GET /jobs/[id]/result/files
         :param headers: optional extra headers to be returned by GET /jobs/[id]/result/files
         """
-        # Write job file data to disk
+        with self.open_job_file(id, mimetype, headers) as f:
+            try:
+                f.write(data)
+            except Exception as e:
+                raise CannotCreateJobFileError(id=id, reason=str(e))
+
+    @contextmanager
+    def open_job_file(self, id: Union[int, str], mimetype: Optional[str] = None,
+                      headers: Optional[TDict[str, str]] = None) -> Iterator[BinaryIO]:
+        """
+        Create a new extra job file and return a file object for writing its data; used to create large files
+        without holding them in memory::
+
+            with self.open_job_file('download', 'application/zip') as f:
+                ...
+
+        The file is registered in the job result only if the with block completes without errors; otherwise, it is
+        deleted. Sub-jobs sharing the ID of the enclosing job may set `_job_file_prefix` to keep their job file IDs
+        distinct from those of other sub-jobs; the prefix is prepended to `id`.
+
+        :param id: extra job file ID; see :meth:`create_job_file`
+        :param mimetype: optional MIME type of the file being created
+        :param headers: optional extra headers to be returned by GET /jobs/[id]/result/files
+        """
+        if self._job_file_prefix:
+            id = f'{self._job_file_prefix}{id}'
         try:
             fp = job_file_path(self.user_id, self.id, id)
             try:
@@ -397,12 +485,21 @@ class Job(AfterglowSchema):
             except OSError as e:
                 if e.errno != errno.EEXIST:
                     raise
-
-            with open(fp, 'wb') as f:
-                f.write(data)
+            f = open(fp, 'wb')
         except Exception as e:
             raise CannotCreateJobFileError(id=id, reason=str(e))
 
+        try:
+            with f:
+                yield f
+        except BaseException:
+            # noinspection PyBroadException
+            try:
+                os.remove(fp)
+            except Exception:
+                pass
+            raise
+
         # Add job file to result
         file_def = JobFile()
         if mimetype is not None:
@@ -412,6 +509,384 @@ class Job(AfterglowSchema):
         self.result.files[id] = file_def
         self.update()
 
+    @property
+    def memory_governor(self) -> Optional['JobMemoryGovernor']:
+        """
+        Memory governor monitoring the job; sub-jobs share the governor of the enclosing job; None if the job is not
+        run by a job worker
+        """
+        job = self
+        while job._parent is not None:
+            job = job._parent
+        return job._memory_governor
+
+    def check_ram(self, extra_mb: float = 0) -> None:
+        """
+        Cooperative RAM limit check; should be called by memory-intensive jobs before allocating large arrays
+
+        :param extra_mb: RAM in megabytes that the job is going to allocate
+
+        :raises JobRAMLimitExceededError: if the job would exceed the JOB_RAM_LIMIT
+        """
+        governor = self.memory_governor
+        if governor is not None:
+            governor.check(extra_mb)
+
+    def get_free_ram_mb(self) -> float:
+        """
+        Return the RAM in megabytes that the job may still allocate without exceeding JOB_RAM_LIMIT
+
+        :return: free RAM in megabytes; infinity if the job RAM is not limited
+        """
+        governor = self.memory_governor
+        if governor is None:
+            return float('inf')
+        return governor.free_mb
+
+    def get_chunk_size(self, num_items: int, item_ram_mb: float) -> int:
+        """
+        Return the number of items (e.g. image rows or data files) that can be held in memory at once without
+        exceeding the job RAM limit; used by jobs to process large data in chunks
+
+        :param num_items: total number of items
+        :param item_ram_mb: RAM in megabytes required by a single item
+
+        :return: chunk size, from 1 to `num_items`
+        """
+        free_mb = self.get_free_ram_mb()
+        if item_ram_mb <= 0 or free_mb == float('inf'):
+            return max(num_items, 1)
+        return max(min(int(free_mb//item_ram_mb), num_items), 1)
+
+
+def get_process_ram_mb() -> Optional[float]:
+    """
+    Return the current resident set size of the worker process
+
+    :return: RSS in megabytes or None if not supported by the platform
+    """
+    try:
+        with open('/proc/self/statm', 'rt') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/(1 << 20)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if sys.platform == 'win32':
+        try:
+            from ctypes import wintypes
+
+            class ProcessMemoryCounters(ctypes.Structure):
+                _fields_ = [
+                    ('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t),
+                ]
+
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            kernel32 = ctypes.windll.kernel32
+            kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+            if ctypes.windll.psapi.GetProcessMemoryInfo(
+                    kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize/(1 << 20)
+        except Exception:
+            pass
+    return None
+
+
+# Memory limit files of the worker's cgroup, v2 and v1
+CGROUP_MEMORY_LIMIT_FILES = ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+
+
+def get_cgroup_ram_limit_mb() -> Optional[float]:
+    """
+    Return the memory limit of the cgroup (e.g. Docker or Kubernetes container) the worker is running in
+
+    :return: RAM limit in megabytes or None if not limited or not running in a cgroup
+    """
+    for filename in CGROUP_MEMORY_LIMIT_FILES:
+        try:
+            with open(filename, 'rt') as f:
+                val = f.read().strip()
+        except OSError:
+            continue
+        if val == 'max':
+            return None
+        try:
+            return int(val)/(1 << 20)
+        except ValueError:
+            continue
+    return None
+
+
+def get_total_ram_mb() -> Optional[float]:
+    """
+    Return the total RAM available to the worker: the cgroup memory limit if any or the total physical RAM of the host,
+    whichever is smaller; cgroup v1 reports a huge limit when unlimited, so it is always capped by the physical RAM
+
+    :return: RAM in megabytes or None if not supported by the platform
+    """
+    try:
+        total_mb = os.sysconf('SC_PHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')/(1 << 20)
+    except (OSError, ValueError, AttributeError):
+        total_mb = None
+    cgroup_mb = get_cgroup_ram_limit_mb()
+    if cgroup_mb and (total_mb is None or cgroup_mb < total_mb):
+        total_mb = cgroup_mb
+    return total_mb
+
+
+def get_job_worker_count() -> int:
+    """
+    Return the number of jobs that may run concurrently on the current host, which share the available RAM
+
+    :return: JOB_WORKERS option or, if zero, the number of CPUs (the Celery default)
+    """
+    if sys.platform == 'darwin':
+        # Single-process worker pool, see init_jobs()
+        return 1
+    return current_app.config.get('JOB_WORKERS') or os.cpu_count() or 1
+
+
+class JobRAMLimitAbort(BaseException):
+    """
+    Exception raised asynchronously by :class:`JobMemoryGovernor` in the job thread when the job exceeds its RAM
+    limit; a subclass of :class:`BaseException`, so that it is not accidentally caught by a job's exception handler
+    """
+    def __str__(self):
+        return 'Job RAM limit exceeded'
+
+
+class JobMemoryGovernor:
+    """
+    Worker-side job RAM monitor
+
+    The RAM used by a job is the growth of the worker process RSS since the job start. The governor thread checks it
+    every JOB_RAM_CHECK_INTERVAL seconds, and, if the job exceeds JOB_RAM_LIMIT, raises :class:`JobRAMLimitAbort` in
+    the job thread, which is then reported as :class:`JobRAMLimitExceededError`. This terminates the offending job
+    before the OS kills the whole worker. Jobs may also check the limit cooperatively via :meth:`Job.check_ram` and
+    adapt their memory usage via :meth:`Job.get_free_ram_mb` and :meth:`Job.get_chunk_size`.
+    """
+    def __init__(self, limit_mb: Optional[float] = None, check_interval: Optional[float] = None):
+        """
+        Create a memory governor for the job to be started
+
+        :param limit_mb: job RAM limit in megabytes; default: JOB_RAM_LIMIT option or, if zero, 75% of the RAM
+            available to the worker (see :func:`get_total_ram_mb`) divided by the number of concurrent jobs (see
+            :func:`get_job_worker_count`); None or 0 if RAM usage cannot be determined on the current platform
+        :param check_interval: RSS check interval in seconds; default: JOB_RAM_CHECK_INTERVAL
+        """
+        self.baseline_mb = get_process_ram_mb()
+        if limit_mb is None:
+            limit_mb = current_app.config.get('JOB_RAM_LIMIT')
+            if not limit_mb:
+                total_mb = get_total_ram_mb()
+                limit_mb = total_mb*0.75/get_job_worker_count() if total_mb else None
+        if self.baseline_mb is None:
+            limit_mb = None
+        self.limit_mb = limit_mb
+        if check_interval is None:
+            check_interval = current_app.config.get('JOB_RAM_CHECK_INTERVAL', 0.5)
+        self.check_interval = check_interval
+        self.peak_mb = 0.0
+        self.exceeded = False
+        self._stop_event = Event()
+        self._thread = None
+
+    @property
+    def used_mb(self) -> float:
+        """
+        RAM in megabytes currently used by the job
+        """
+        if self.baseline_mb is None:
+            return 0.0
+        used_mb = max((get_process_ram_mb() or 0) - self.baseline_mb, 0.0)
+        self.peak_mb = max(self.peak_mb, used_mb)
+        return used_mb
+
+    @property
+    def free_mb(self) -> float:
+        """
+        RAM in megabytes that the job may still allocate; infinity if not limited
+        """
+        if not self.limit_mb:
+            return float('inf')
+        return max(self.limit_mb - self.used_mb, 0.0)
+
+    def error(self) -> JobRAMLimitExceededError:
+        """
+        Return the error to report when the job exceeds its RAM limit
+        """
+        return JobRAMLimitExceededError(ram_mb=round(self.peak_mb, 1), limit_mb=round(self.limit_mb or 0, 1))
+
+    def check(self, extra_mb: float = 0) -> None:
+        """
+        Raise :class:`JobRAMLimitExceededError` if the job uses or is going to use more RAM than allowed
+
+        :param extra_mb: RAM in megabytes that the job is going to allocate
+        """
+        if self.limit_mb and self.used_mb + extra_mb > self.limit_mb:
+            self.peak_mb = max(self.peak_mb, self.used_mb + extra_mb)
+            raise self.error()
+
+    def start(self, tid: int) -> None:
+        """
+        Start monitoring the job
+
+        :param tid: ID of the job thread
+        """
+        if not self.limit_mb or not self.check_interval:
+            return
+
+        def monitor() -> None:
+            while not self._stop_event.wait(self.check_interval):
+                if self.used_mb > self.limit_mb:
+                    self.exceeded = True
+                    if ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                            ctypes.c_long(tid), ctypes.py_object(JobRAMLimitAbort)) > 1:
+                        ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(tid), None)
+                    break
+
+        self._thread = Thread(target=monitor, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop monitoring the job
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def get_job_num_workers(num_items: int, max_workers: Optional[int] = None,
+                        item_ram_mb: Optional[float] = None, free_ram_mb: Optional[float] = None) -> int:
+    """
+    Return the number of worker threads for processing the given number of items (usually data files) within a job;
+    limited by the JOB_MAX_THREADS option, the number of CPU cores, and, if the RAM required to process a single item
+    is known, by the JOB_MAX_RAM option and by the RAM the job may still allocate within JOB_RAM_LIMIT
+
+    :param num_items: number of items to process
+    :param max_workers: optional job-specific limit on the number of workers
+    :param item_ram_mb: optional estimated RAM in megabytes required to process a single item
+    :param free_ram_mb: RAM in megabytes available to the job, as returned by :meth:`Job.get_free_ram_mb`; None or
+        infinity if the job RAM is not limited
+
+    :return: number of worker threads; 1 means processing all items sequentially in the job thread
+    """
+    n = current_app.config.get('JOB_MAX_THREADS') or os.cpu_count() or 1
+    if max_workers:
+        n = min(n, max_workers)
+    if item_ram_mb:
+        max_ram_mb = current_app.config.get('JOB_MAX_RAM')
+        if max_ram_mb:
+            n = min(n, int(max_ram_mb//item_ram_mb))
+        if free_ram_mb is not None and free_ram_mb != float('inf'):
+            n = min(n, int(free_ram_mb//item_ram_mb))
+    return max(min(n, num_items), 1)
+
+
+def parallel_map(job: Job, func: Callable[[Any], Any], items: Iterable,
+                 max_workers: Optional[int] = None, item_ram_mb: Optional[float] = None,
+                 error_meta: Optional[Callable[[Any], TDict[str, Union[str, int, float, bool]]]] = None,
+                 stage: int = 0, total_stages: int = 1) -> TList[Any]:
+    """
+    Apply a function to each item (usually a data file ID) in a bounded thread pool; used by jobs that process
+    multiple independent data files
+
+    Each worker thread runs within its own copy of the job's Flask request context, so that data file and database
+    access work as in the job thread. The worker's :data:`flask.g` is a new object, but its attributes are copied
+    from the job thread by reference (e.g. the current user), so mutable objects stored in :data:`flask.g` are
+    accessed by all workers concurrently and must be thread-safe. Errors
+    are added to the job result via :meth:`Job.add_error` and yield None in place of the corresponding result. When
+    the job is canceled, the cancellation exception raised in the job thread is propagated to all running workers,
+    and the items not started yet are skipped. Functions that create new data files should not be run in parallel,
+    as unique default data file names are allocated via the database.
+
+    :param job: job class instance
+    :param func: function of a single argument (item) to apply
+    :param items: items to process
+    :param max_workers: optional job-specific limit on the number of worker threads
+    :param item_ram_mb: optional estimated RAM in megabytes required to process a single item; used to limit
+        the number of workers to the number of items that fit in JOB_MAX_RAM and in the job's JOB_RAM_LIMIT; also,
+        workers wait before processing the next item until the job has enough free RAM
+    :param error_meta: optional function that returns error metadata for the given item; default: {"file_id": item}
+    :param stage: optional processing stage number; used to properly update the job progress
+    :param total_stages: total number of stages in the job; set to 0 to disable progress updates
+
+    :return: list of function values for all items in the original order; None for failed items
+    """
+    items = list(items)
+    if error_meta is None:
+        def error_meta(_item):
+            return {'file_id': _item}
+
+    results = [None]*len(items)
+    num_workers = get_job_num_workers(len(items), max_workers, item_ram_mb, job.get_free_ram_mb())
+    if num_workers < 2:
+        # Process items sequentially in the job thread
+        for i, item in enumerate(items):
+            try:
+                results[i] = func(item)
+            except Exception as e:
+                job.add_error(e, error_meta(item))
+            finally:
+                if total_stages:
+                    job.update_progress((i + 1)/len(items)*100, stage, total_stages)
+        return results
+
+    ctx_func = in_current_context(func)
+    running = {}  # item index -> worker thread ID
+    running_lock = Lock()
+
+    def worker(i: int) -> Any:
+        with running_lock:
+            running[i] = get_ident()
+        try:
+            # Back-pressure: wait until there is enough RAM to process the item unless it is the only one running
+            while item_ram_mb and job.get_free_ram_mb() < item_ram_mb:
+                with running_lock:
+                    if len(running) < 2:
+                        break
+                time.sleep(0.1)
+            return ctx_func(items[i])
+        finally:
+            with running_lock:
+                del running[i]
+
+    executor = ThreadPoolExecutor(num_workers, thread_name_prefix=f'job-{job.id}')
+    try:
+        futures = {executor.submit(worker, i): i for i in range(len(items))}
+        pending, done_count = set(futures), 0
+        while pending:
+            # Wait with a timeout so that the job thread regularly executes Python code and can receive
+            # the asynchronous cancellation exception
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for fut in done:
+                i = futures[fut]
+                try:
+                    results[i] = fut.result()
+                except Exception as e:
+                    job.add_error(e, error_meta(items[i]))
+                done_count += 1
+                if total_stages:
+                    job.update_progress(done_count/len(items)*100, stage, total_stages)
+    except BaseException as e:
+        # Job canceled or timed out: skip pending items and interrupt running workers in the same way as the job thread
+        executor.shutdown(wait=False, cancel_futures=True)
+        with running_lock:
+            tids = list(running.values())
+        for tid in tids:
+            if ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(tid), ctypes.py_object(type(e))) > 1:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(tid), None)
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+    return results
+
 
 def job_result_dir() -> str:
     """
@@ -2,18 +2,19 @@
 Afterglow Core: photometry data models
 """
 
-from typing import Optional
+from datetime import datetime
+from typing import List as TList, Optional
 
-from marshmallow.fields import String
+from marshmallow.fields import Integer, List, Nested, String
 import numpy
 
-from ..schemas import AfterglowSchema, Boolean, Float
+from ..schemas import AfterglowSchema, Boolean, DateTime, Float
 from .source_extraction import SourceExtractionData
 
 
 __all__ = [
-    'IAperture', 'IPhotometry', 'Mag', 'Photometry', 'PhotometryData',
-    'PhotSettings',
+    'IAperture', 'IPhotometry', 'Lightcurve', 'LightcurveSource', 'Mag',
+    'Photometry', 'PhotometryData', 'PhotSettings',
 ]
 
 
@@ -148,3 +149,47 @@ class Photometry(AfterglowSchema):
     area: float = Float()
     background_area: float = Float()
     background: float = Float()
+
+
+class LightcurveSource(AfterglowSchema):
+    """
+    Lightcurve of a single source; all lists have one item per frame in the
+    order of :attr:`Lightcurve.file_ids`, with None for frames where the source
+    could not be measured
+
+    Attributes::
+        id: source ID
+        ra_hours, dec_degs: source position used to place the aperture in
+            the first frame, if available
+        x, y: aperture center in each frame, 1-based
+        flux, flux_error: background-subtracted flux and its error in ADUs
+        mag, mag_error: magnitude computed as -2.5log10(flux/texp) + zero point
+            and its error
+    """
+    id: str = String()
+    ra_hours: Optional[float] = Float()
+    dec_degs: Optional[float] = Float()
+    x: TList[float] = List(Float(), dump_default=[])
+    y: TList[float] = List(Float(), dump_default=[])
+    flux: TList[float] = List(Float(), dump_default=[])
+    flux_error: TList[float] = List(Float(), dump_default=[])
+    mag: TList[float] = List(Float(), dump_default=[])
+    mag_error: TList[float] = List(Float(), dump_default=[])
+
+
+class Lightcurve(AfterglowSchema):
+    """
+    Result of time-series photometry
+
+    Attributes::
+        file_ids: data file IDs of frames in chronological order
+        times: exposure start times
+        exp_lengths: exposure lengths in seconds
+        filters: filter names
+        sources: per-source lightcurves
+    """
+    file_ids: TList[int] = List(Integer(), dump_default=[])
+    times: TList[datetime] = List(DateTime(), dump_default=[])
+    exp_lengths: TList[float] = List(Float(), dump_default=[])
+    filters: TList[str] = List(String(allow_none=True), dump_default=[])
+    sources: TList[LightcurveSource] = List(Nested(LightcurveSource), dump_default=[])
@@ -5,10 +5,11 @@ Afterglow Core: source extraction data models
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Optional, Sequence, Tuple
 
 from marshmallow.fields import Integer, String
-from numpy import clip, cos, deg2rad, log, rad2deg, sin, sqrt, void
+from numpy import (
+    array, clip, cos, deg2rad, isfinite, log, nan, ndarray, rad2deg, sin, sqrt, void, where, zeros)
 from astropy.wcs import WCS
 
 from ..schemas import AfterglowSchema, DateTime, Float
@@ -16,7 +17,7 @@ from ..schemas import AfterglowSchema, DateTime, Float
 
 __all__ = [
     'IAstrometry', 'IFwhm', 'ISourceId', 'ISourceMeta', 'SourceExtractionData',
-    'sigma_to_fwhm', 'get_source_radec', 'get_source_xy',
+    'sigma_to_fwhm', 'get_source_radec', 'get_source_xy', 'get_sources_xy',
 ]
 
 
@@ -143,6 +144,57 @@ def get_source_xy(source, epoch: datetime, wcs: Optional[WCS]) \
     return source.x, source.y
 
 
+def get_sources_xy(sources: Sequence, epoch: Optional[datetime], wcs: Optional[WCS]) -> Tuple[ndarray, ndarray]:
+    """
+    Vectorized version of :func:`get_source_xy` for multiple sources; all
+    sources with RA/Dec are projected onto the image with a single WCS call
+
+    :param sources: source definitions
+    :param epoch: exposure start time
+    :param wcs: WCS structure from image header
+
+    :return: arrays of XY coordinates of the sources, 1-based; NaN for sources
+        with unknown coordinates
+    """
+    def column(name: str) -> ndarray:
+        return array([getattr(source, name, None) for source in sources], float)
+
+    n = len(sources)
+    x, y = column('x'), column('y')
+    if epoch is not None:
+        dt = array([
+            (epoch - source.pm_epoch).total_seconds()
+            if getattr(source, 'pm_epoch', None) is not None else None
+            for source in sources], float)
+    else:
+        dt = zeros(n) + nan
+
+    sky = zeros(n, bool)
+    if wcs is not None:
+        # Prefer RA/Dec if WCS is present
+        ra, dec = column('ra_hours')*15, column('dec_degs')
+        sky = isfinite(ra) & isfinite(dec)
+        if sky.any():
+            mu = column('pm_sky')*dt
+            theta = deg2rad(column('pm_pos_angle_sky'))
+            pm = sky & isfinite(mu) & isfinite(theta)
+            if pm.any():
+                cd = cos(deg2rad(dec[pm]))
+                ra[pm] = where(
+                    cd != 0, ra[pm] + mu[pm]*sin(theta[pm])/where(cd != 0, cd, 1), ra[pm]) % 360
+                dec[pm] = clip(dec[pm] + mu[pm]*cos(theta[pm]), -90, 90)
+            x[sky], y[sky] = wcs.all_world2pix(ra[sky], dec[sky], 1, quiet=True)
+
+    mu = column('pm_pixel')*dt
+    theta = deg2rad(column('pm_pos_angle_pixel'))
+    pm = ~sky & isfinite(mu) & isfinite(theta)
+    if pm.any():
+        x[pm] += mu[pm]*cos(theta[pm])
+        y[pm] += mu[pm]*sin(theta[pm])
+
+    return x, y
+
+
 def get_source_radec(source, epoch: datetime, wcs: Optional[WCS]) \
         -> Tuple[float, float]:
     """
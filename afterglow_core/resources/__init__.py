@@ -3,7 +3,7 @@ Afterglow Core: package containing all resources provided by the server API
 """
 
 from . import (
-    catalogs, data_files, data_providers, field_cals, imaging_surveys,
-    photometry, users,
+    catalogs, data_files, data_providers, field_cals, file_cache,
+    imaging_surveys, photometry, users,
 )
 from .base import *
@@ -3,12 +3,11 @@ Afterglow Core: Landolt catalog of UBVRI photometric standards accessed
 via VizieR
 """
 
-from typing import List as TList, Union
+from typing import Dict as TDict, Tuple, Union
 
-from numpy import hypot, sqrt
+from numpy import full, hypot, nan, nan_to_num, ndarray, sqrt, zeros
 from astropy.table import Table
 
-from ...models import CatalogSource, Mag
 from .vizier_catalogs import VizierCatalog
 
 
@@ -38,46 +37,42 @@ class LandoltCatalog(VizierCatalog):
         '(1 - 2*(DEJ2000.strip().startswith("-")))',
     }
 
-    def table_to_sources(self, table: Union[list, Table]) \
-            -> TList[CatalogSource]:
+    def table_to_columns(self, table: Union[list, Table]) \
+            -> TDict[str, ndarray]:
         """
-        Return a list of :class:`CatalogSource` objects from an Astropy table
+        Return columnar catalog data from an Astropy table
 
         Converts color indices to magnitudes.
 
         :param table: table of sources returned by astroquery
 
-        :return: list of catalog objects
+        :return: dictionary of column arrays
         """
-        sources = super().table_to_sources(table)
-
-        for source in sources:
-            mags = source.mags
-            v, v_err = mags['V'].value, getattr(mags['V'], 'error', 0)
-
-            mags['B'] = Mag(value=v + mags['B_V'].value)
-            err = hypot(v_err, getattr(mags['B_V'], 'error', 0))
-            if err:
-                mags['B'].error = err
-
-            mags['U'] = Mag(value=mags['B'].value + mags['U_B'].value)
-            err = hypot(getattr(mags['B'], 'error', 0),
-                        getattr(mags['V_R'], 'error', 0))
-            if err:
-                mags['U'].error = err
-
-            mags['R'] = Mag(value=v - mags['V_R'].value)
-            err = hypot(v_err, getattr(mags['V_R'], 'error', 0))
-            if err:
-                mags['R'].error = err
-
-            mags['I'] = Mag(
-                value=(mags['R'].value - mags['R_I'].value +
-                       v - mags['V_I'].value)/2)
-            err = sqrt((getattr(mags['R'], 'error', 0)**2 +
-                        getattr(mags['R_I'], 'error', 0)**2 +
-                        v_err**2 + getattr(mags['V_I'], 'error', 0)**2)/2)
-            if err:
-                mags['I'].error = err
-
-        return sources
+        columns = super().table_to_columns(table)
+        if not columns:
+            return columns
+
+        n = len(next(iter(columns.values())))
+
+        def get(name: str) -> Tuple[ndarray, ndarray]:
+            return columns.get(f'mag.{name}', full(n, nan)), \
+                nan_to_num(columns.get(f'err.{name}', zeros(n)))
+
+        v, v_err = get('V')
+        b_v, b_v_err = get('B_V')
+        u_b, _ = get('U_B')
+        v_r, v_r_err = get('V_R')
+        r_i, r_i_err = get('R_I')
+        v_i, v_i_err = get('V_I')
+
+        columns['mag.B'] = b = v + b_v
+        columns['err.B'] = b_err = hypot(v_err, b_v_err)
+        columns['mag.U'] = b + u_b
+        columns['err.U'] = hypot(b_err, v_r_err)
+        columns['mag.R'] = r = v - v_r
+        columns['err.R'] = r_err = hypot(v_err, v_r_err)
+        columns['mag.I'] = (r - r_i + v - v_i)/2
+        columns['err.I'] = sqrt(
+            (r_err**2 + r_i_err**2 + v_err**2 + v_i_err**2)/2)
+
+        return columns
@@ -0,0 +1,620 @@
+"""
+Afterglow Core: local HEALPix-partitioned catalog plugins
+
+A local catalog is stored on disk as a directory containing "catalog.json"
+with the catalog metadata and a "cells" subdirectory with one uncompressed
+NumPy .npz file per non-empty HEALPix cell (NESTED scheme) of the given order.
+Each cell file contains the columns "id", "ra_hours", "dec_degs", and
+"mag.<name>" and "err.<name>" for each magnitude. The "ids" subdirectory holds
+the source ID -> cell index used to look up sources by ID, partitioned into
+.npz files with the columns "id" and "cell" by a hash of the ID. Local catalogs
+are created from downloaded catalog dumps by :func:`import_local_catalog`.
+"""
+
+import json
+import os
+import re
+import zlib
+from glob import glob
+from typing import Dict as TDict, List as TList, Optional, Sequence, Union
+
+import numpy
+from astropy.table import Table
+from flask import current_app
+
+from ...models import Catalog, CatalogSource, eval_expr, get_expr_names
+
+
+__all__ = ['LocalCatalog', 'import_local_catalog']
+
+
+# Number of source ID -> cell index partitions
+ID_BUCKETS = 256
+
+
+def ang2pix_nest(order: int, ra_hours: Union[float, numpy.ndarray],
+                 dec_degs: Union[float, numpy.ndarray]) -> numpy.ndarray:
+    """
+    Return HEALPix NESTED pixel indices for the given sky positions
+
+    :param order: HEALPix order; NSIDE = 2**order
+    :param ra_hours: right ascension in hours, scalar or array
+    :param dec_degs: declination in degrees, same shape
+
+    :return: array of pixel indices
+    """
+    nside = 1 << order
+    z = numpy.sin(numpy.deg2rad(numpy.asarray(dec_degs, float)))
+    za = numpy.abs(z)
+    tt = (numpy.asarray(ra_hours, float) % 24)/6  # in [0, 4)
+    z, za, tt = numpy.broadcast_arrays(z, za, tt)
+
+    face = numpy.empty(z.shape, numpy.int64)
+    ix = numpy.empty(z.shape, numpy.int64)
+    iy = numpy.empty(z.shape, numpy.int64)
+
+    # Equatorial region
+    eq = za <= 2/3
+    t1 = nside*(0.5 + tt[eq])
+    t2 = nside*z[eq]*0.75
+    jp = (t1 - t2).astype(numpy.int64)
+    jm = (t1 + t2).astype(numpy.int64)
+    ifp, ifm = jp >> order, jm >> order
+    face[eq] = numpy.where(
+        ifp == ifm, ifp | 4, numpy.where(ifp < ifm, ifp, ifm + 8))
+    ix[eq] = jm & (nside - 1)
+    iy[eq] = nside - (jp & (nside - 1)) - 1
+
+    # Polar caps
+    pol = ~eq
+    ntt = numpy.minimum(tt[pol].astype(numpy.int64), 3)
+    tp = tt[pol] - ntt
+    tmp = nside*numpy.sqrt(3*(1 - za[pol]))
+    jp = numpy.minimum((tp*tmp).astype(numpy.int64), nside - 1)
+    jm = numpy.minimum(((1 - tp)*tmp).astype(numpy.int64), nside - 1)
+    north = z[pol] >= 0
+    face[pol] = numpy.where(north, ntt, ntt + 8)
+    ix[pol] = numpy.where(north, nside - jm - 1, jp)
+    iy[pol] = numpy.where(north, nside - jp - 1, jm)
+
+    # Interleave x and y bits to get the pixel index within the face
+    pix = numpy.zeros(z.shape, numpy.int64)
+    for bit in range(order):
+        pix |= ((ix >> bit) & 1) << (2*bit)
+        pix |= ((iy >> bit) & 1) << (2*bit + 1)
+    return pix + face*(nside*nside)
+
+
+def get_cone_cells(order: int, ra_hours: float, dec_degs: float,
+                   radius_arcmins: float) -> Optional[numpy.ndarray]:
+    """
+    Return HEALPix cells that may contain sources within the given cone
+
+    The cone extended by the cell size is sampled with a step smaller than
+    the cell inradius, so that each cell intersecting the cone contains at
+    least one sample.
+
+    :param order: HEALPix order
+    :param ra_hours: right ascension of cone center in hours
+    :param dec_degs: declination of cone center in degrees
+    :param radius_arcmins: cone radius in arcminutes
+
+    :return: sorted array of unique cell indices; None if the cone covers
+        a large fraction of the sky, and all cells should be used
+    """
+    cell_size = 58.6/(1 << order)  # degrees
+    r = radius_arcmins/60 + 1.5*cell_size
+    if r > 30:
+        return None
+
+    # Sample the tangent plane around the cone center and deproject samples
+    step = numpy.deg2rad(cell_size/8)
+    n = int(numpy.ceil(numpy.deg2rad(r)/step))
+    xi, eta = numpy.meshgrid(
+        numpy.arange(-n, n + 1)*step, numpy.arange(-n, n + 1)*step)
+    inside = numpy.hypot(xi, eta) <= numpy.tan(numpy.deg2rad(r)) + step
+    xi, eta = xi[inside], eta[inside]
+    ra0, dec0 = numpy.deg2rad(ra_hours*15), numpy.deg2rad(dec_degs)
+    d = numpy.cos(dec0) - eta*numpy.sin(dec0)
+    ra = numpy.rad2deg(ra0 + numpy.arctan2(xi, d))/15
+    dec = numpy.rad2deg(numpy.arctan2(
+        numpy.sin(dec0) + eta*numpy.cos(dec0), numpy.hypot(xi, d)))
+    return numpy.unique(ang2pix_nest(order, ra, dec))
+
+
+def get_id_buckets(ids: numpy.ndarray, num_buckets: int) -> numpy.ndarray:
+    """
+    Return source ID -> cell index partitions for the given source IDs
+
+    :param ids: array of source IDs
+    :param num_buckets: number of index partitions
+
+    :return: array of partition numbers, same shape
+    """
+    return numpy.fromiter(
+        (zlib.crc32(str(i).encode('utf8')) for i in ids), numpy.int64,
+        len(ids)) % num_buckets
+
+
+def append_columns(filename: str, columns: TDict[str, numpy.ndarray]) \
+        -> None:
+    """
+    Append columns to an .npz file, creating it if it does not exist;
+    magnitudes missing from either the existing or the new data are filled
+    with NaNs
+
+    :param filename: .npz file name
+    :param columns: dictionary of column arrays of the same length
+    """
+    if os.path.isfile(filename):
+        with numpy.load(filename) as data:
+            old = {name: data[name] for name in data.files}
+        n, m = len(old['id']), len(columns['id'])
+        columns = {name: numpy.concatenate([
+            old[name] if name in old else
+            numpy.full(n, numpy.nan, numpy.float32),
+            columns[name] if name in columns else
+            numpy.full(m, numpy.nan, numpy.float32)])
+            for name in set(old) | set(columns)}
+    tmp_path = filename + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        numpy.savez(f, **columns)
+    os.replace(tmp_path, filename)
+
+
+def apply_constraint(values: numpy.ndarray, constraint: str) -> numpy.ndarray:
+    """
+    Return a mask of values satisfying a VizieR-like numeric constraint:
+    "<x", "<=x", ">x", ">=x", "=x", "x..y", or "x"
+
+    :param values: column values
+    :param constraint: constraint expression
+
+    :return: boolean mask
+    """
+    constraint = constraint.strip()
+    with numpy.errstate(invalid='ignore'):
+        if '..' in constraint:
+            lo, hi = constraint.split('..', 1)
+            return (values >= float(lo)) & (values <= float(hi))
+        for op, func in (('<=', numpy.less_equal), ('>=', numpy.greater_equal),
+                         ('<', numpy.less), ('>', numpy.greater),
+                         ('=', numpy.equal)):
+            if constraint.startswith(op):
+                return func(values, float(constraint[len(op):]))
+        return values == float(constraint)
+
+
+def get_box_mask(ra_hours: numpy.ndarray, dec_degs: numpy.ndarray,
+                 ra0_hours: float, dec0_degs: float, width_arcmins: float,
+                 height_arcmins: float) -> numpy.ndarray:
+    """
+    Return a mask of positions within a rectangular region; the region is
+    defined in the same way as in :meth:`Catalog.query_box`
+
+    :param ra_hours: right ascensions in hours
+    :param dec_degs: declinations in degrees
+    :param ra0_hours: right ascension of region center in hours
+    :param dec0_degs: declination of region center in degrees
+    :param width_arcmins: width of region in arcminutes
+    :param height_arcmins: height of region in arcminutes
+
+    :return: boolean mask
+    """
+    h = height_arcmins/120
+    dec_min, dec_max = dec0_degs - h, dec0_degs + h
+    mask = (dec_degs >= dec_min) & (dec_degs <= dec_max)
+    if dec_min < -90 or dec_max > 90:
+        # Pole in FOV, use the whole RA range
+        return mask
+    with numpy.errstate(invalid='ignore'):
+        dra = numpy.rad2deg(numpy.arcsin(
+            numpy.sin(numpy.deg2rad(width_arcmins/120)) /
+            numpy.cos(numpy.deg2rad(dec0_degs))))/15
+    if not numpy.isfinite(dra) or 2*dra >= 24:
+        # RA spans the whole 24h range
+        return mask
+    # RA offset from the region center, wrapped to [-12, 12)
+    return mask & (numpy.abs((ra_hours - ra0_hours + 12) % 24 - 12) <= dra)
+
+
+class LocalCatalog(Catalog):
+    """
+    Base class for local HEALPix-partitioned catalog plugins
+
+    Subclasses must define the following:
+
+        name: unique Afterglow catalog name
+        path: catalog directory created by :func:`import_local_catalog`
+
+    Magnitude names and the number of sources are taken from the catalog
+    metadata; `filter_lookup` may be defined as for any other catalog.
+    """
+    path: str = None
+
+    _meta = None
+
+    def __init__(self, **kwargs):
+        """
+        Create a Catalog instance
+
+        :param kwargs: catalog plugin initialization parameters
+        """
+        super().__init__(**kwargs)
+
+        # noinspection PyBroadException
+        try:
+            meta = self.meta
+        except Exception:
+            # Catalog not imported yet
+            pass
+        else:
+            if getattr(self, 'num_sources', None) is None:
+                self.num_sources = meta.get('num_sources')
+            if not getattr(self, 'mags', None):
+                self.mags = {name: [] for name in meta.get('mags', [])}
+
+    @property
+    def meta(self) -> dict:
+        """Local catalog metadata"""
+        if self._meta is None:
+            with open(os.path.join(self.path, 'catalog.json'),
+                      encoding='utf8') as f:
+                self._meta = json.load(f)
+        return self._meta
+
+    def load_cells(self, cells: Optional[Sequence[int]]) \
+            -> TDict[str, numpy.ndarray]:
+        """
+        Load the given catalog cells and concatenate their columns
+
+        :param cells: cell indices; None = all cells
+
+        :return: dictionary of column arrays
+        """
+        if cells is None:
+            filenames = sorted(glob(os.path.join(self.path, 'cells', '*.npz')))
+        else:
+            filenames = [os.path.join(self.path, 'cells', f'{cell}.npz')
+                         for cell in cells]
+        cells_data = []
+        for filename in filenames:
+            try:
+                with numpy.load(filename) as data:
+                    cells_data.append(
+                        {name: data[name] for name in data.files})
+            except FileNotFoundError:
+                # Empty cell
+                pass
+        if not cells_data:
+            return {}
+
+        # Magnitudes missing from some cells are filled with NaNs
+        names = set().union(*cells_data)
+        return {name: numpy.concatenate([
+            data[name] if name in data
+            else numpy.full(len(data['id']), numpy.nan, numpy.float32)
+            for data in cells_data]) for name in names}
+
+    def query_objects(self, names: TList[str]) -> TList[CatalogSource]:
+        """
+        Return a list of local catalog objects with the specified IDs; see
+        :meth:`query_objects_columns`
+
+        :param names: object IDs
+
+        :return: list of catalog objects with the given IDs
+        """
+        return self.columns_to_sources(self.query_objects_columns(names))
+
+    def query_circ(self, ra_hours: float, dec_degs: float,
+                   radius_arcmins: float,
+                   constraints: Optional[TDict[str, str]] = None,
+                   limit: Optional[int] = None) -> TList[CatalogSource]:
+        """
+        Return local catalog objects within the specified circular region;
+        see :meth:`query_circ_columns`
+
+        :return: list of catalog objects within the specified circular region
+        """
+        return self.columns_to_sources(self.query_circ_columns(
+            ra_hours, dec_degs, radius_arcmins, constraints, limit))
+
+    def query_box(self, ra_hours: float, dec_degs: float, width_arcmins: float,
+                  height_arcmins: Optional[float] = None,
+                  constraints: Optional[TDict[str, str]] = None,
+                  limit: Optional[int] = None) -> TList[CatalogSource]:
+        """
+        Return local catalog objects within the specified rectangular region;
+        see :meth:`query_box_columns`
+
+        :return: list of catalog objects within the specified rectangular
+            region
+        """
+        return self.columns_to_sources(self.query_box_columns(
+            ra_hours, dec_degs, width_arcmins, height_arcmins, constraints,
+            limit))
+
+    def query_objects_columns(self, names: TList[str]) \
+            -> TDict[str, numpy.ndarray]:
+        """
+        Return columns of local catalog objects with the specified IDs
+
+        Only the cells containing the given sources are loaded, as found by
+        the source ID -> cell index; catalogs imported before the index was
+        introduced are searched as a whole.
+
+        :param names: object IDs
+
+        :return: dictionary of column arrays
+        """
+        names = numpy.array(names, str)
+        if not len(names):
+            return {}
+        num_buckets = self.meta.get('id_buckets')
+        if num_buckets:
+            cells = set()
+            for bucket in numpy.unique(
+                    get_id_buckets(names, num_buckets)).tolist():
+                try:
+                    with numpy.load(os.path.join(
+                            self.path, 'ids', f'{bucket}.npz')) as data:
+                        ids, id_cells = data['id'], data['cell']
+                except FileNotFoundError:
+                    continue
+                cells.update(id_cells[numpy.isin(ids, names)].tolist())
+            if not cells:
+                return {}
+            columns = self.load_cells(sorted(cells))
+        else:
+            columns = self.load_cells(None)
+        if not columns:
+            return {}
+        mask = numpy.isin(columns['id'], names)
+        return {name: col[mask] for name, col in columns.items()}
+
+    def query_circ_columns(self, ra_hours: float, dec_degs: float,
+                           radius_arcmins: float,
+                           constraints: Optional[TDict[str, str]] = None,
+                           limit: Optional[int] = None) \
+            -> TDict[str, numpy.ndarray]:
+        """
+        Return columns of local catalog objects within the specified circular
+        region
+
+        :param ra_hours: right ascension of region center in hours
+        :param dec_degs: declination of region center in degrees
+        :param radius_arcmins: region radius in arcminutes
+        :param constraints: optional constraints on the magnitude values,
+            e.g. {"V": "<15"}
+        :param limit: maximum number of sources to return; the brightest ones
+            in the first magnitude are returned
+
+        :return: dictionary of column arrays
+        """
+        columns = self.load_cells(get_cone_cells(
+            self.meta['order'], ra_hours, dec_degs, radius_arcmins))
+        if not columns:
+            return {}
+
+        # Exact cone selection via chord lengths between unit vectors
+        ra0, dec0 = numpy.deg2rad(ra_hours*15), numpy.deg2rad(dec_degs)
+        ra = numpy.deg2rad(columns['ra_hours']*15)
+        dec = numpy.deg2rad(columns['dec_degs'])
+        cos_dist = numpy.sin(dec0)*numpy.sin(dec) + \
+            numpy.cos(dec0)*numpy.cos(dec)*numpy.cos(ra - ra0)
+        mask = cos_dist >= numpy.cos(numpy.deg2rad(radius_arcmins/60))
+
+        return self.select_columns(columns, mask, constraints, limit)
+
+    def query_box_columns(self, ra_hours: float, dec_degs: float,
+                          width_arcmins: float,
+                          height_arcmins: Optional[float] = None,
+                          constraints: Optional[TDict[str, str]] = None,
+                          limit: Optional[int] = None) \
+            -> TDict[str, numpy.ndarray]:
+        """
+        Return columns of local catalog objects within the specified
+        rectangular region
+
+        Only the cells intersecting the circle enclosing the region are
+        loaded.
+
+        :param ra_hours: right ascension of region center in hours
+        :param dec_degs: declination of region center in degrees
+        :param width_arcmins: width of region in arcminutes
+        :param height_arcmins: optional height of region in arcminutes;
+            defaults to `width_arcmins`
+        :param constraints: optional constraints on the magnitude values,
+            e.g. {"V": "<15"}
+        :param limit: maximum number of sources to return; the brightest ones
+            in the first magnitude are returned
+
+        :return: dictionary of column arrays
+        """
+        if height_arcmins is None:
+            height_arcmins = width_arcmins
+        columns = self.load_cells(get_cone_cells(
+            self.meta['order'], ra_hours, dec_degs,
+            numpy.hypot(width_arcmins, height_arcmins)/2))
+        if not columns:
+            return {}
+
+        mask = get_box_mask(
+            columns['ra_hours'], columns['dec_degs'], ra_hours, dec_degs,
+            width_arcmins, height_arcmins)
+
+        return self.select_columns(columns, mask, constraints, limit)
+
+    @staticmethod
+    def select_columns(columns: TDict[str, numpy.ndarray],
+                       mask: numpy.ndarray,
+                       constraints: Optional[TDict[str, str]] = None,
+                       limit: Optional[int] = None) \
+            -> TDict[str, numpy.ndarray]:
+        """
+        Return columns of the sources selected by a region query
+
+        :param columns: columns of the loaded cells
+        :param mask: mask of sources within the query region
+        :param constraints: optional constraints on the magnitude values
+        :param limit: maximum number of sources to return; the brightest ones
+            in the first magnitude are returned
+
+        :return: dictionary of column arrays
+        """
+        if constraints:
+            for name, constraint in constraints.items():
+                try:
+                    values = columns[f'mag.{name}']
+                except KeyError:
+                    values = columns[name]
+                mask &= apply_constraint(values, constraint)
+
+        columns = {name: col[mask] for name, col in columns.items()}
+        if limit and len(columns['id']) > limit:
+            mag_names = [name for name in columns if name.startswith('mag.')]
+            if mag_names:
+                order = numpy.argsort(
+                    numpy.nan_to_num(columns[mag_names[0]], nan=numpy.inf),
+                    kind='stable')[:limit]
+            else:
+                order = numpy.arange(limit)
+            columns = {name: col[order] for name, col in columns.items()}
+
+        return columns
+
+
+def import_local_catalog(path: str, filenames: Union[str, TList[str]],
+                         col_mapping: TDict[str, str],
+                         mags: TDict[str, Union[str, Sequence[str]]],
+                         order: int = 6, format: Optional[str] = None) \
+        -> int:
+    """
+    Create or update a local catalog from catalog dump files
+
+    Column mapping and magnitude definitions are the same as for
+    :class:`VizierCatalog`, so that e.g. a VizieR dump of APASS can be
+    imported using the definitions from :class:`APASSCatalog`. Each dump file
+    is read as a whole and split into cells, which are then merged with
+    the existing catalog cells; the source ID -> cell index is updated
+    accordingly and is built from the existing cells if the catalog was
+    created without it.
+
+    :param path: local catalog directory
+    :param filenames: dump file name(s) or glob patterns in any format readable
+        by :meth:`astropy.table.Table.read`
+    :param col_mapping: mapping between "id", "ra_hours", and "dec_degs" and
+        dump column names or expressions
+    :param mags: mapping between magnitude names and dump column names:
+        {"name": ("mag column", "error column")} or {"name": "mag column"}
+    :param order: HEALPix order used for partitioning; order 6 yields cells
+        of about 1 degree
+    :param format: optional astropy table format, e.g. "fits" or "ascii.csv"
+
+    :return: total number of sources in the catalog
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    cells_dir = os.path.join(path, 'cells')
+    os.makedirs(cells_dir, exist_ok=True)
+    ids_dir = os.path.join(path, 'ids')
+    os.makedirs(ids_dir, exist_ok=True)
+    meta_path = os.path.join(path, 'catalog.json')
+    if os.path.isfile(meta_path):
+        with open(meta_path, encoding='utf8') as f:
+            meta = json.load(f)
+        order = meta['order']
+    else:
+        meta = {'order': order, 'num_sources': 0, 'id_buckets': ID_BUCKETS}
+    meta['mags'] = sorted(set(meta.get('mags', [])) | set(mags))
+
+    def index_ids(ids: numpy.ndarray, cells: numpy.ndarray) -> None:
+        # Add sources to the ID -> cell index
+        buckets = get_id_buckets(ids, meta['id_buckets'])
+        srt = numpy.argsort(buckets, kind='stable')
+        buckets, ids, cells = buckets[srt], ids[srt], cells[srt]
+        bucket_nums, bucket_starts = numpy.unique(buckets, return_index=True)
+        bucket_ends = numpy.r_[bucket_starts[1:], len(buckets)]
+        for bucket, bucket_start, bucket_end in zip(
+                bucket_nums.tolist(), bucket_starts, bucket_ends):
+            append_columns(os.path.join(ids_dir, f'{bucket}.npz'), {
+                'id': ids[bucket_start:bucket_end],
+                'cell': cells[bucket_start:bucket_end]})
+
+    if not meta.get('id_buckets'):
+        # Catalog created without the ID index; index the existing sources
+        meta['id_buckets'] = ID_BUCKETS
+        for cell_path in glob(os.path.join(cells_dir, '*.npz')):
+            with numpy.load(cell_path) as data:
+                cell_ids = data['id']
+            cell = int(os.path.splitext(os.path.basename(cell_path))[0])
+            index_ids(cell_ids, numpy.full(len(cell_ids), cell, numpy.int64))
+
+    def get_column(tbl: Table, expr: str) -> numpy.ndarray:
+        if expr in tbl.colnames:
+            return numpy.ma.filled(
+                numpy.ma.asarray(tbl[expr]).astype(float)
+                if tbl[expr].dtype.kind in 'iuf' else tbl[expr], numpy.nan)
+        return numpy.ma.filled(numpy.ma.asarray(eval_expr(expr, {
+            name: tbl[name] for name in get_expr_names(expr)
+            if name in tbl.colnames}), float), numpy.nan)
+
+    num_new = 0
+    for filename in sorted(set(sum(
+            [glob(os.path.expanduser(f)) or [f] for f in filenames], []))):
+        table = Table.read(filename, format=format)
+        columns = {
+            'id': numpy.asarray(table[col_mapping['id']]).astype(str),
+            'ra_hours': get_column(table, col_mapping['ra_hours']),
+            'dec_degs': get_column(table, col_mapping['dec_degs']),
+        }
+        for name, item in mags.items():
+            if isinstance(item, str):
+                item = [item]
+            columns[f'mag.{name}'] = get_column(table, item[0]).astype(
+                numpy.float32)
+            if len(item) > 1 and item[1]:
+                columns[f'err.{name}'] = get_column(table, item[1]).astype(
+                    numpy.float32)
+        good = numpy.isfinite(columns['ra_hours']) & \
+            numpy.isfinite(columns['dec_degs'])
+        columns = {name: col[good] for name, col in columns.items()}
+
+        # Split sources into cells and merge them with the existing ones
+        pix = ang2pix_nest(order, columns['ra_hours'], columns['dec_degs'])
+        srt = numpy.argsort(pix, kind='stable')
+        pix = pix[srt]
+        columns = {name: col[srt] for name, col in columns.items()}
+        cells, starts = numpy.unique(pix, return_index=True)
+        ends = numpy.r_[starts[1:], len(pix)]
+        for cell, start, end in zip(cells.tolist(), starts, ends):
+            append_columns(os.path.join(cells_dir, f'{cell}.npz'), {
+                name: col[start:end] for name, col in columns.items()})
+        index_ids(columns['id'], pix)
+        num_new += len(pix)
+
+    meta['num_sources'] += num_new
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+    return meta['num_sources']
+
+
+# Load local catalogs defined in the user's config
+for kw in current_app.config.get('CUSTOM_LOCAL_CATALOGS', []):
+    # noinspection PyBroadException
+    try:
+        # Generate Python class name from catalog name by removing all illegal
+        # chars and prepending underscore to names starting with a digit
+        classname = re.sub(
+            r'(^\d)', r'_\1', re.sub(
+                r'[^a-zA-z0-9_]', '', kw['name'])) + 'Catalog'
+        newclass = type(classname, (LocalCatalog,), kw)
+        newclass.__module__ = LocalCatalog.__module__
+        globals()[classname] = newclass
+        __all__.append(classname)
+    except Exception:
+        current_app.logger.warning(
+            'Could not initialize custom local catalog', exc_info=True)
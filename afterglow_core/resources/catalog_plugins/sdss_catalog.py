@@ -2,14 +2,13 @@
 Afterglow Core: SDSS catalog
 """
 
-from typing import Dict as TDict, List as TList, Optional
+from typing import Dict as TDict, List as TList, Optional, Tuple
 
 import numpy as np
 from astropy.coordinates import Angle, SkyCoord
 from astropy.units import arcmin, arcsec, deg, hour
 from astroquery.sdss import SDSSClass
 
-from ...models import CatalogSource
 from .vizier_catalogs import VizierCatalog
 
 
@@ -90,6 +89,39 @@ class AfterglowSDSS(SDSSClass):
 SDSS = AfterglowSDSS()
 
 
+def get_nearest_objects_query(positions: TList[Tuple[float, float]],
+                              radius_arcmins: float,
+                              photoobj_fields: TList[str]) -> str:
+    """
+    Return the SkyServer SQL query that cross-matches multiple positions
+    with SDSS stars in a single request
+
+    The positions are passed as an inline table; each of them is matched
+    via fGetNearbyObjEq, and the result includes the 0-based position index
+    "q" and the distance in arcminutes, so that the nearest star can be
+    selected for each position.
+
+    :param positions: list of (RA in hours, Dec in degrees)
+    :param radius_arcmins: match radius in arcminutes
+    :param photoobj_fields: Star table columns to return
+
+    :return: SQL query
+    """
+    values = ', '.join(
+        f'({i}, {float(ra)*15!r}, {float(dec)!r})'
+        for i, (ra, dec) in enumerate(positions))
+    # noinspection SqlResolve
+    return 'SELECT p.q, n.distance, {} ' \
+        'FROM (VALUES {}) AS p(q, ra, dec) ' \
+        'CROSS APPLY dbo.fGetNearbyObjEq(p.ra, p.dec, {!r}) AS n ' \
+        'JOIN Star AS s ON s.objID = n.objID ' \
+        'JOIN Field f ON s.fieldID = f.fieldID ' \
+        'WHERE f.quality = 3 AND s.clean = 1' \
+        .format(
+            ', '.join(f's.{sql_field}' for sql_field in photoobj_fields),
+            values, float(radius_arcmins))
+
+
 class SDSSCatalog(VizierCatalog):
     """
     SDSS catalog plugin
@@ -119,29 +151,37 @@ class SDSSCatalog(VizierCatalog):
         'I': 'i - 0.378*(i - z) - 0.3974'
     }
 
-    def query_objects(self, names: TList[str]) -> TList[CatalogSource]:
+    def query_nearest(self, positions: TList[Tuple[float, float]]) -> list:
         """
-        Return a list of SDSS catalog objects with the specified names
+        Return the nearest SDSS star within `name_match_radius` for each of
+        the given positions using a single SQL request; see
+        :func:`get_nearest_objects_query`
 
-        :param names: object names
+        :param positions: list of (RA in hours, Dec in degrees)
 
-        :return: list of catalog objects with the specified names
+        :return: list of table rows, same length as `positions`; None for
+            positions with no catalog objects nearby
         """
         sdss = SDSS()
-        rows = []
-        for name in names:
-            rows.append(sdss.query_object(
-                name, data_release=self.data_release,
-                photoobj_fields=self._columns, cache=self.cache)[0])
-        return self.table_to_sources(rows)
-
-    def query_box(self, ra_hours: float, dec_degs: float, width_arcmins: float,
-                  height_arcmins: Optional[float] = None,
-                  constraints: Optional[TDict[str, str]] = None,
-                  limit: Optional[int] = None) \
-            -> TList[CatalogSource]:
+        table = sdss.query_sql(
+            get_nearest_objects_query(
+                positions, self.name_match_radius/60, self._columns),
+            data_release=self.data_release, cache=self.cache)
+        nearest = {}
+        if table:
+            for row in table[np.argsort(table['distance'], kind='stable')]:
+                nearest.setdefault(int(row['q']), row)
+        return [nearest.get(i) for i in range(len(positions))]
+
+    def query_box_columns(self, ra_hours: float, dec_degs: float,
+                          width_arcmins: float,
+                          height_arcmins: Optional[float] = None,
+                          constraints: Optional[TDict[str, str]] = None,
+                          limit: Optional[int] = None) \
+            -> TDict[str, np.ndarray]:
         """
-        Return catalog objects within the specified rectangular region
+        Return columnar data for SDSS objects within the specified rectangular
+        region
 
         :param ra_hours: right ascension of region center in hours
         :param dec_degs: declination of region center in degrees
@@ -151,8 +191,7 @@ class SDSSCatalog(VizierCatalog):
         :param constraints: optional constraints on the column values
         :param limit: optional limit on the number of objects to return
 
-        :return: list of catalog objects within the specified rectangular
-            region
+        :return: dictionary of column arrays; see :meth:`table_to_columns`
         """
         if height_arcmins is None:
             height_arcmins = width_arcmins
@@ -168,19 +207,21 @@ class SDSSCatalog(VizierCatalog):
             height_arcmins = np.ceil(height_arcmins*5)/5
 
         sdss = SDSS()
-        return self.table_to_sources(sdss.query_region(
+        return self.table_to_columns(sdss.query_region(
             SkyCoord(ra=ra_hours, dec=dec_degs, unit=(hour, deg),
                      frame='icrs'),
             radius=(width_arcmins*arcmin, height_arcmins*arcmin),
             photoobj_fields=self._columns, data_release=self.data_release,
             cache=self.cache))
 
-    def query_circ(self, ra_hours: float, dec_degs: float,
-                   radius_arcmins: float,
-                   constraints: Optional[TDict[str, str]] = None,
-                   limit: Optional[int] = None) -> TList[CatalogSource]:
+    def query_circ_columns(self, ra_hours: float, dec_degs: float,
+                           radius_arcmins: float,
+                           constraints: Optional[TDict[str, str]] = None,
+                           limit: Optional[int] = None) \
+            -> TDict[str, np.ndarray]:
         """
-        Return catalog objects within the specified circular region
+        Return columnar data for SDSS objects within the specified circular
+        region
 
         :param ra_hours: right ascension of region center in hours
         :param dec_degs: declination of region center in degrees
@@ -188,7 +229,7 @@ class SDSSCatalog(VizierCatalog):
         :param constraints: optional constraints on the column values
         :param limit: maximum number of rows to return
 
-        :return: list of catalog objects within the specified circular region
+        :return: dictionary of column arrays; see :meth:`table_to_columns`
         """
         if self.cache:
             ra_hours = round(ra_hours*5400)/5400 % 24
@@ -200,7 +241,7 @@ class SDSSCatalog(VizierCatalog):
             radius_arcmins = np.ceil(radius_arcmins*5)/5
 
         sdss = SDSS()
-        return self.table_to_sources(sdss.query_region(
+        return self.table_to_columns(sdss.query_region(
             SkyCoord(ra=ra_hours, dec=dec_degs, unit=(hour, deg),
                      frame='icrs'), radius=radius_arcmins*arcmin,
             photoobj_fields=self._columns, data_release=self.data_release,
@@ -2,9 +2,10 @@
 Afterglow Core: SkyMapper catalog accessed via VizieR
 """
 
-from typing import Dict as TDict, List as TList, Optional
+from typing import Dict as TDict, Optional
+
+from numpy import ndarray
 
-from ...models import CatalogSource
 from .vizier_catalogs import VizierCatalog
 
 
@@ -38,9 +39,9 @@ class SkyMapperCatalog(VizierCatalog):
 
     def query_region(self, ra_hours: float, dec_degs: float,
                      constraints: Optional[TDict[str, str]] = None,
-                     limit: int = None, **region) -> TList[CatalogSource]:
+                     limit: int = None, **region) -> TDict[str, ndarray]:
         """
-        Return SkyMapper objects within the specified region
+        Return columnar data for SkyMapper objects within the specified region
 
         :param ra_hours: right ascension of region center in hours
         :param dec_degs: declination of region center in degrees
@@ -49,7 +50,7 @@ class SkyMapperCatalog(VizierCatalog):
         :param limit: maximum number of rows to return
         :param region: keywords defining the query region
 
-        :return: list of catalog objects within the specified region
+        :return: dictionary of column arrays; see :meth:`table_to_columns`
         """
         if constraints is None:
             constraints = {}
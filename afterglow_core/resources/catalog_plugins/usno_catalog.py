@@ -2,11 +2,11 @@
 Afterglow Core: USNO-B1.0 catalog accessed via VizieR
 """
 
-from typing import List as TList, Union
+from typing import Dict as TDict, Union
 
+from numpy import isnan, ndarray, where
 from astropy.table import Table
 
-from ...models import CatalogSource, Mag
 from .vizier_catalogs import VizierCatalog
 
 
@@ -32,32 +32,29 @@ class USNOB1Catalog(VizierCatalog):
     }
     sort = ['+B1mag']
 
-    def table_to_sources(self, table: Union[list, Table]) \
-            -> TList[CatalogSource]:
+    def table_to_columns(self, table: Union[list, Table]) \
+            -> TDict[str, ndarray]:
         """
-        Return a list of CatalogSource objects from an Astropy table
+        Return columnar catalog data from an Astropy table
 
         Adds the standard B and R magnitudes based on B1, B2 and R1, R2.
 
         :param table: table of sources returned by astroquery
 
-        :return: list of catalog objects
+        :return: dictionary of column arrays
         """
-        sources = super(USNOB1Catalog, self).table_to_sources(table)
-
-        for source in sources:
-            mags = source.mags
-            for m in ('B', 'R'):
-                m1, m2 = m + '1', m + '2'
-                try:
-                    mags[m] = Mag(value=(mags[m1].value + mags[m2].value)/2)
-                except (KeyError, ValueError):
-                    try:
-                        mags[m] = mags[m1]
-                    except KeyError:
-                        try:
-                            mags[m] = mags[m2]
-                        except KeyError:
-                            pass
-
-        return sources
+        columns = super(USNOB1Catalog, self).table_to_columns(table)
+
+        for m in ('B', 'R'):
+            m1, m2 = columns.get(f'mag.{m}1'), columns.get(f'mag.{m}2')
+            if m1 is None:
+                m1 = m2
+            elif m2 is None:
+                m2 = m1
+            if m1 is None:
+                continue
+            # Average of both epochs if available, otherwise either of them
+            columns[f'mag.{m}'] = where(
+                isnan(m1), m2, where(isnan(m2), m1, (m1 + m2)/2))
+
+        return columns
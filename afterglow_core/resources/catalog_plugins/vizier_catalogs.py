@@ -7,21 +7,26 @@ import re
 import time
 from datetime import timedelta
 from glob import glob
-from typing import Dict as TDict, List as TList, Optional, Union
+from threading import Lock
+from typing import (
+    Dict as TDict, List as TList, Optional, Tuple, Union)
 
 import numpy
 from astropy.coordinates import SkyCoord
+from astropy.coordinates.name_resolve import NameResolveError
 from astropy.config.paths import get_cache_dir
 from astropy.table import Table
-from astropy.units import arcmin, deg, hour
+from astropy.units import arcmin, arcsec, deg, hour
 from astroquery import query
 from astroquery.vizier import Vizier
 from flask import current_app
 
-from ...models import Catalog, CatalogSource, Mag
+from ...concurrency import map_concurrently
+from ...models import (
+    Catalog, CatalogSource, eval_expr, get_expr_names)
 
 
-__all__ = ['VizierCatalog']
+__all__ = ['VizierCatalog', 'resolve_object_names']
 
 
 # Monkey-patch astroquery to not raise an exception if caching a query fails
@@ -72,6 +77,76 @@ query.to_cache = to_cache
 query.AstroQuery = AstroQuery
 
 
+# Object name -> ((RA in hours, Dec in degrees), expiration time) cache shared
+# by all catalogs; coordinates are None for names unknown to Sesame, which
+# expire after OBJECT_NAME_NOT_FOUND_TTL, while resolved names never expire
+_name_cache: TDict[str, Tuple[Optional[Tuple[float, float]], float]] = {}
+_name_cache_lock = Lock()
+
+
+def resolve_object_names(names: TList[str]) \
+        -> TDict[str, Optional[Tuple[float, float]]]:
+    """
+    Resolve object names to coordinates via Sesame; names are resolved
+    concurrently, and the results are cached in memory; names that Sesame
+    does not know are cached for OBJECT_NAME_NOT_FOUND_TTL seconds, while
+    network errors are never cached
+
+    :param names: object names
+
+    :return: dictionary {name: (RA in hours, Dec in degrees)}; None for names
+        that could not be resolved
+    """
+    t = time.time()
+    with _name_cache_lock:
+        res = {}
+        for name in names:
+            try:
+                coords, expires = _name_cache[name]
+            except KeyError:
+                continue
+            if expires > t:
+                res[name] = coords
+            else:
+                del _name_cache[name]
+    missing = list({name: None for name in names if name not in res})
+    if missing:
+        def resolve(name: str) -> Union[Tuple[float, float], None, Exception]:
+            try:
+                c = SkyCoord.from_name(name, frame='icrs')
+            except NameResolveError as e:
+                if 'Unable to find coordinates' in str(e):
+                    # Sesame responded but does not know the name
+                    return None
+                # All Sesame mirrors failed; return the error to raise it
+                # after caching the other names
+                return e
+            except Exception as e:
+                return e
+            return c.ra.hour, c.dec.degree
+
+        resolved = dict(zip(missing, map_concurrently(
+            resolve, missing,
+            current_app.config.get('CATALOG_QUERY_THREADS', 4))))
+        coords = {name: val for name, val in resolved.items()
+                  if not isinstance(val, Exception)}
+        res.update(coords)
+        max_size = current_app.config.get('OBJECT_NAME_CACHE_SIZE', 10000)
+        not_found_ttl = current_app.config.get(
+            'OBJECT_NAME_NOT_FOUND_TTL', 86400)
+        with _name_cache_lock:
+            for name, val in coords.items():
+                _name_cache[name] = val, (
+                    float('inf') if val is not None else t + not_found_ttl)
+            while len(_name_cache) > max_size:
+                del _name_cache[next(iter(_name_cache))]
+
+        for val in resolved.values():
+            if isinstance(val, Exception):
+                raise val
+    return res
+
+
 class VizierCatalog(Catalog):
     """
     Base class for VizieR catalog plugins
@@ -81,7 +156,8 @@ class VizierCatalog(Catalog):
         name: unique Afterglow catalog name
         num_sources: number of sources in the catalog
         vizier_catalog: VizieR catalog ID, e.g. "II/246"
-        row_limit: default limit on the number of rows to query
+        row_limit: default limit on the number of rows to query; -1 means
+            no limit, None means the astroquery default (50 rows)
         col_mapping: mapping between :class:`CatalogObject` attributes
             and VizieR column names; the values are either column names as is
             (e.g. {'dec_degs': 'DEJ2000'}) or expressions involving these names
@@ -91,6 +167,12 @@ class VizierCatalog(Catalog):
             arguments but don't map to any :class:`CatalogObject` attributes
         sort: optional list of sorting column names: "+col" = ascending,
             "-col" = descending
+
+    Optional attributes used by :meth:`query_objects`:
+
+        name_match_radius: search radius around positions of named objects
+            in arcseconds
+        names_per_query: maximum number of object positions per request
     """
     vizier_server = None
     cache: bool = False
@@ -99,6 +181,8 @@ class VizierCatalog(Catalog):
     col_mapping = {'ra_hours': 'RAJ2000/15', 'dec_degs': 'DEJ2000'}
     extra_cols = []
     sort = []
+    name_match_radius = 30  # arcseconds
+    names_per_query = 100
 
     _columns = None
 
@@ -120,8 +204,8 @@ class VizierCatalog(Catalog):
         if self.col_mapping:
             for attrname, expr in self.col_mapping.items():
                 try:
-                    for name in compile(expr, '<string>', 'eval').co_names:
-                        if name not in numpy.__dict__ and name not in dir(''):
+                    for name in get_expr_names(expr):
+                        if name not in dir(''):
                             self._columns.append(name)
                 except SyntaxError:
                     # Columns that are not valid Python IDs or expressions
@@ -158,107 +242,220 @@ class VizierCatalog(Catalog):
                 else:
                     self._columns.append(col)
 
-    def table_to_sources(self, table: Union[TList, Table]) \
-            -> TList[CatalogSource]:
+    def table_to_columns(self, table: Union[TList, Table]) \
+            -> TDict[str, numpy.ndarray]:
         """
-        Return a list of CatalogSource objects from an Astropy table
+        Return columnar catalog data from an Astropy table
 
-        :param table: table of sources returned by astroquery
+        Column mapping expressions are evaluated for whole columns; those not
+        supporting arrays (e.g. involving string methods) are evaluated row by
+        row. Missing magnitudes and errors are set to NaN.
 
-        :return: list of catalog objects
+        :param table: table of sources returned by astroquery or a list of
+            its rows
+
+        :return: dictionary of columns suitable for
+            :meth:`Catalog.columns_to_sources`
         """
-        sources = []
+        table = self.as_table(table)
         if table is None:
             # Empty response
-            return sources
+            return {}
 
-        context = dict(numpy.__dict__)
+        columns = {}
 
-        for row in table:
-            source = CatalogSource(catalog_name=self.name, mags={})
-
-            # Map columns to CatalogObject attrs
-            if self.col_mapping:
-                for attr, expr in self.col_mapping.items():
-                    try:
-                        # Fast path
-                        val = row[expr]
-                    except KeyError:
-                        ctx = dict(context)
-                        ctx.update({name: row[name] for name in row.colnames})
-                        # noinspection PyBroadException
-                        try:
-                            val = eval(expr, ctx, {})
-                        except Exception:
-                            val = None
-                    if val is not None:
-                        setattr(source, attr, val)
-
-            # Initialize magnitudes and errors
-            if getattr(self, 'mags', None):
-                for mag, item in self.mags.items():
-                    try:
-                        mag_col, mag_err_col = item[:2]
-                    except ValueError:
-                        try:
-                            mag_col, mag_err_col = item[0], None
-                        except (IndexError, TypeError, ValueError):
-                            continue
+        # Map columns to CatalogObject attrs
+        if self.col_mapping:
+            for attr, expr in self.col_mapping.items():
+                if expr in table.colnames:
+                    # Fast path
+                    columns[attr] = table[expr]
+                    continue
+                names = [name for name in get_expr_names(expr)
+                         if name in table.colnames]
+                # noinspection PyBroadException
+                try:
+                    val = eval_expr(
+                        expr, {name: table[name] for name in names})
+                    if numpy.shape(val) == (len(table),):
+                        columns[attr] = val
+                        continue
+                except Exception:
+                    pass
+                values, mask = [], []
+                for row in table:
                     # noinspection PyBroadException
                     try:
-                        try:
-                            val = row[mag_col]
-                        except KeyError:
-                            val = row[mag_col.replace("'", '_')]
-                        if val and val < 99:
-                            m = Mag(value=val)
-                            # noinspection PyBroadException
-                            try:
-                                try:
-                                    val = row[mag_err_col]
-                                except KeyError:
-                                    val = row[mag_err_col.replace("'", '_')]
-                                if val:
-                                    m.error = val
-                            except Exception:
-                                pass
-                            source.mags[mag] = m
+                        values.append(eval_expr(
+                            expr, {name: row[name] for name in names}))
                     except Exception:
-                        # No such magnitude
-                        pass
+                        values.append(None)
+                    mask.append(values[-1] is None)
+                col = numpy.empty(len(values), object)
+                col[:] = values
+                columns[attr] = numpy.ma.masked_array(col, mask)
+
+        # Initialize magnitudes and errors
+        if getattr(self, 'mags', None):
+            for mag, item in self.mags.items():
+                try:
+                    mag_col, mag_err_col = item[:2]
+                except ValueError:
+                    try:
+                        mag_col, mag_err_col = item[0], None
+                    except (IndexError, TypeError, ValueError):
+                        continue
+                values = self._get_mag_column(table, mag_col)
+                if values is None:
+                    # No such magnitude
+                    continue
+                with numpy.errstate(invalid='ignore'):
+                    values[(values == 0) | (values >= 99)] = numpy.nan
+                columns[f'mag.{mag}'] = values
+                if mag_err_col:
+                    errors = self._get_mag_column(table, mag_err_col)
+                    if errors is not None:
+                        columns[f'err.{mag}'] = errors
+
+        return columns
+
+    @staticmethod
+    def as_table(table: Union[TList, Table, None]) -> Optional[Table]:
+        """
+        Return query results as an Astropy table
 
-            if source.mags:
-                sources.append(source)
+        :param table: table of sources returned by astroquery or a list of
+            its rows, possibly from different tables; in the latter case, only
+            the columns present in all rows are kept
 
-        return sources
+        :return: Astropy table or None if there are no rows
+        """
+        if table is None or not len(table):
+            return None
+        if not isinstance(table, Table):
+            colnames = [name for name in table[0].colnames
+                        if all(name in row.colnames for row in table[1:])]
+            table = Table(
+                {name: [row[name] for row in table] for name in colnames})
+        return table
+
+    @staticmethod
+    def _get_mag_column(table: Table, name: str) -> Optional[numpy.ndarray]:
+        """
+        Return a numeric table column as a float array with NaNs in place of
+        masked values
+
+        :param table: Astropy table
+        :param name: column name; apostrophes may be replaced by underscores
+            in the table
+
+        :return: float array or None if there is no such column or it is not
+            numeric
+        """
+        if name not in table.colnames:
+            name = name.replace("'", '_')
+            if name not in table.colnames:
+                return None
+        # noinspection PyBroadException
+        try:
+            return numpy.ma.filled(
+                numpy.ma.asarray(table[name]).astype(float), numpy.nan)
+        except Exception:
+            return None
+
+    def table_to_sources(self, table: Union[TList, Table]) \
+            -> TList[CatalogSource]:
+        """
+        Return a list of CatalogSource objects from an Astropy table
+
+        :param table: table of sources returned by astroquery
+
+        :return: list of catalog objects
+        """
+        return self.columns_to_sources(self.table_to_columns(table))
 
     def query_objects(self, names: TList[str]) -> TList[CatalogSource]:
         """
-        Return a list of VizieR catalog objects with the specified names
+        Return a list of catalog objects with the specified names; see
+        :meth:`query_objects_columns`
+
+        :param names: object names
+
+        :return: list of catalog objects with the specified names
+        """
+        return self.columns_to_sources(self.query_objects_columns(names))
+
+    def query_objects_columns(self, names: TList[str]) \
+            -> TDict[str, numpy.ndarray]:
+        """
+        Return columnar data for catalog objects with the specified names
+
+        Names are resolved to coordinates (see :func:`resolve_object_names`),
+        and the nearest catalog objects to all positions are requested in
+        batches of `names_per_query` positions via :meth:`query_nearest`, with
+        several batches run concurrently.
 
         :param names: object names
 
-        :return: list of catalog objects with the given names
+        :return: dictionary of column arrays; see :meth:`table_to_columns`
+        """
+        coords = resolve_object_names(names)
+        names = [name for name in names if coords.get(name) is not None]
+        if not names:
+            return {}
+
+        n = self.names_per_query
+        rows = sum(map_concurrently(
+            lambda batch: self.query_nearest(
+                [coords[name] for name in batch]),
+            [names[i:i + n] for i in range(0, len(names), n)],
+            current_app.config.get('CATALOG_QUERY_THREADS', 4)), [])
+        return self.table_to_columns([row for row in rows if row is not None])
+
+    def query_nearest(self, positions: TList[Tuple[float, float]]) -> list:
+        """
+        Return the nearest catalog object within `name_match_radius` for each
+        of the given positions using a single multi-position VizieR request
+
+        :param positions: list of (RA in hours, Dec in degrees)
+
+        :return: list of table rows, same length as `positions`; None for
+            positions with no catalog objects nearby
         """
         kwargs = {}
         if self.vizier_server:
             kwargs['vizier_server'] = self.vizier_server
+        columns = [col for col in self._columns if col[:1] not in '+-'] + \
+            ['+_r']
         viz = Vizier(
-            catalog=self.vizier_catalog, columns=self._columns,
-            row_limit=len(names), **kwargs)
-        rows = []
-        for name in names:
-            resp = viz.query_object(
-                name, catalog=viz.catalog, cache=self.cache)
-            if resp:
-                rows.append(resp[0][0])
-        return self.table_to_sources(rows)
+            catalog=self.vizier_catalog, columns=columns, row_limit=-1,
+            **kwargs)
+        resp = viz.query_region(
+            SkyCoord(
+                ra=[ra for ra, _ in positions],
+                dec=[dec for _, dec in positions],
+                unit=(hour, deg), frame='icrs'),
+            radius=self.name_match_radius*arcsec, catalog=viz.catalog,
+            cache=self.cache)
+        if not resp:
+            return [None]*len(positions)
+        table = resp[0]
+        # Rows are sorted by distance; take the nearest one for each position;
+        # "_q" is the 1-based position index, which is present only for
+        # multi-position queries
+        nearest = {}
+        for row in table:
+            nearest.setdefault(
+                int(row['_q']) - 1 if '_q' in table.colnames else 0, row)
+        return [nearest.get(i) for i in range(len(positions))]
 
     def query_region(self, ra_hours: float, dec_degs: float,
                      constraints: Optional[TDict[str, str]] = None,
-                     limit: int = None, **region) -> TList[CatalogSource]:
+                     limit: int = None, **region) \
+            -> TDict[str, numpy.ndarray]:
         """
-        Return VizieR catalog objects within the specified region
+        Return columnar data for VizieR catalog objects within the specified
+        region
 
         :param ra_hours: right ascension of region center in hours
         :param dec_degs: declination of region center in degrees
@@ -266,7 +463,7 @@ class VizierCatalog(Catalog):
         :param limit: maximum number of rows to return
         :param region: keywords defining the query region
 
-        :return: list of catalog objects within the specified region
+        :return: dictionary of column arrays; see :meth:`table_to_columns`
         """
         kwargs = {}
         if self.vizier_server:
@@ -286,15 +483,46 @@ class VizierCatalog(Catalog):
             SkyCoord(ra=ra_hours, dec=dec_degs, unit=(hour, deg), frame='fk5'),
             catalog=viz.catalog, cache=self.cache, **region)
         if resp:
-            return self.table_to_sources(resp[0])
-        return []
+            return self.table_to_columns(resp[0])
+        return {}
 
     def query_box(self, ra_hours: float, dec_degs: float, width_arcmins: float,
-                  height_arcmins: float = None,
+                  height_arcmins: Optional[float] = None,
                   constraints: Optional[TDict[str, str]] = None,
                   limit: Optional[int] = None) -> TList[CatalogSource]:
         """
-        Return VizieR catalog objects within the specified rectangular region
+        Return catalog objects within the specified rectangular region; see
+        :meth:`query_box_columns`
+
+        :return: list of catalog objects within the specified rectangular
+            region
+        """
+        return self.columns_to_sources(self.query_box_columns(
+            ra_hours, dec_degs, width_arcmins, height_arcmins, constraints,
+            limit))
+
+    def query_circ(self, ra_hours: float, dec_degs: float,
+                   radius_arcmins: float,
+                   constraints: Optional[TDict[str, str]] = None,
+                   limit: Optional[int] = None) -> TList[CatalogSource]:
+        """
+        Return catalog objects within the specified circular region; see
+        :meth:`query_circ_columns`
+
+        :return: list of catalog objects within the specified circular region
+        """
+        return self.columns_to_sources(self.query_circ_columns(
+            ra_hours, dec_degs, radius_arcmins, constraints, limit))
+
+    def query_box_columns(self, ra_hours: float, dec_degs: float,
+                          width_arcmins: float,
+                          height_arcmins: Optional[float] = None,
+                          constraints: Optional[TDict[str, str]] = None,
+                          limit: Optional[int] = None) \
+            -> TDict[str, numpy.ndarray]:
+        """
+        Return columnar data for VizieR catalog objects within the specified
+        rectangular region
 
         :param ra_hours: right ascension of region center in hours
         :param dec_degs: declination of region center in degrees
@@ -304,8 +532,7 @@ class VizierCatalog(Catalog):
         :param constraints: optional constraints on the column values
         :param limit: maximum number of rows to return
 
-        :return: list of catalog objects within the specified rectangular
-            region
+        :return: dictionary of column arrays; see :meth:`table_to_columns`
         """
         if self.cache:
             # Enforce field center and size granularity to avoid cache misses
@@ -326,12 +553,14 @@ class VizierCatalog(Catalog):
             height=(height_arcmins if height_arcmins
                     else width_arcmins)*arcmin)
 
-    def query_circ(self, ra_hours: float, dec_degs: float,
-                   radius_arcmins: float,
-                   constraints: Optional[TDict[str, str]] = None,
-                   limit: Optional[int] = None) -> TList[CatalogSource]:
+    def query_circ_columns(self, ra_hours: float, dec_degs: float,
+                           radius_arcmins: float,
+                           constraints: Optional[TDict[str, str]] = None,
+                           limit: Optional[int] = None) \
+            -> TDict[str, numpy.ndarray]:
         """
-        Return catalog objects within the specified circular region
+        Return columnar data for VizieR catalog objects within the specified
+        circular region
 
         :param ra_hours: right ascension of region center in hours
         :param dec_degs: declination of region center in degrees
@@ -339,7 +568,7 @@ class VizierCatalog(Catalog):
         :param constraints: optional constraints on the column values
         :param limit: maximum number of rows to return
 
-        :return: list of catalog objects within the specified circular region
+        :return: dictionary of column arrays; see :meth:`table_to_columns`
         """
         if self.cache:
             ra_hours = round(ra_hours*5400)/5400 % 24
@@ -2,11 +2,11 @@
 Afterglow Core: AAVSO International Variable Star indeX (VSX) interface
 """
 
-from typing import List as TList, Union
+from typing import Dict as TDict, Union
 
+from numpy import isin, isnan, ma, nan, ndarray, unique, where
 from astropy.table import Table
 
-from ...models import CatalogSource
 from .vizier_catalogs import VizierCatalog
 
 
@@ -21,6 +21,9 @@ class VSXCatalog(VizierCatalog):
     display_name = 'AAVSO International Variable Star Index'
     num_sources = 2115593
     vizier_catalog = 'B/vsx/vsx'
+    # Return all variable stars in the field instead of the astroquery
+    # default of 50 rows; needed to exclude them from field calibration
+    row_limit = -1
     mags = {
         # Johnson broad-band
         'U': '', 'B': '', 'V': '', 'R': '', 'I': '',
@@ -54,39 +57,53 @@ class VSXCatalog(VizierCatalog):
         'OID', 'Name', 'V', 'Type', 'max', 'n_max', 'f_min', 'min', 'Period',
     ]
 
-    def table_to_sources(self, table: Union[list, Table]) \
-            -> TList[CatalogSource]:
+    def table_to_columns(self, table: Union[list, Table]) \
+            -> TDict[str, ndarray]:
         """
-        Return a list of :class:`CatalogSource` objects from an Astropy table
+        Return columnar catalog data from an Astropy table
 
-        Converts color indices to magnitudes.
+        Skips constant, non-existing, and duplicate stars and maps
+        the magnitude at maximum to the specific passband.
 
         :param table: table of sources returned by astroquery
 
-        :return: list of catalog objects
+        :return: dictionary of column arrays
         """
-        sources = []
-        for row in table:
-            if row['V'] not in (0, 1):
-                # Skip constant/non-existing/duplicates
-                continue
-            source = CatalogSource(
-                catalog_name=self.name,
-                id=row['OID'],
-                name=row['Name'],
-                type=row['Type'],
-                mag=row['max'] or row['min'] or None,
-                amplitude=row['min'] if row['f_min'] == '('
-                else row['min'] - row['max'] or None,
-                period=row['Period'] or None,
-                ra_hours=row['RAJ2000']/15,
-                dec_degs=row['DEJ2000'],
-            )
-
-            # Map mag to specific passband
-            setattr(source, self._mag_mapping.get(row['n_max'], row['n_max']),
-                    row['max'])
-
-            sources.append(source)
-
-        return sources
+        table = self.as_table(table)
+        if table is None:
+            return {}
+        # Skip constant/non-existing/duplicates
+        table = table[isin(ma.filled(ma.asarray(table['V']), -1), (0, 1))]
+        if not len(table):
+            return {}
+
+        def get_values(name: str) -> ndarray:
+            # Masked and zero values are missing
+            values = ma.filled(ma.asarray(table[name]).astype(float), nan)
+            values[values == 0] = nan
+            return values
+
+        def get_strings(name: str) -> ndarray:
+            return ma.filled(ma.asarray(table[name]).astype(str), '')
+
+        mag_max, mag_min = get_values('max'), get_values('min')
+        columns = {
+            'id': table['OID'],
+            'name': table['Name'],
+            'type': table['Type'],
+            'mag': ma.masked_invalid(where(isnan(mag_max), mag_min, mag_max)),
+            'amplitude': ma.masked_invalid(where(
+                get_strings('f_min') == '(', mag_min, mag_min - mag_max)),
+            'period': ma.masked_invalid(get_values('Period')),
+            'ra_hours': table['RAJ2000']/15,
+            'dec_degs': table['DEJ2000'],
+        }
+
+        # Map mag to specific passband
+        passbands = get_strings('n_max')
+        for passband in unique(passbands).tolist():
+            if passband:
+                columns[self._mag_mapping.get(passband, passband)] = \
+                    ma.masked_array(mag_max, passbands != passband)
+
+        return columns
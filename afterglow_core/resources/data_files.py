@@ -5,25 +5,32 @@ Afterglow Core: data-files resource implementation
 import sys
 import os
 import errno
+import gzip
 import re
+from contextlib import contextmanager
 from glob import glob
+from hashlib import sha1
 from datetime import datetime, timezone
 import json
 from io import BytesIO
-from typing import BinaryIO
+from threading import RLock
+from typing import BinaryIO, Callable, Iterable, Iterator
+from uuid import uuid4
 import warnings
 
-from sqlalchemy import Boolean, CheckConstraint, Column, ForeignKey, Integer, String, Text, UniqueConstraint
+from sqlalchemy import Boolean, CheckConstraint, Column, ForeignKey, Integer, String, Text, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from alembic import config as alembic_config, context as alembic_context
 from alembic.script import ScriptDirectory
 from alembic.runtime.environment import EnvironmentContext
 import numpy as np
+from scipy.ndimage import zoom
 import astropy.io.fits as pyfits
 from astropy.wcs import FITSFixedWarning
 from astropy.io.fits.verify import VerifyWarning
-from flask import current_app
+from flask import current_app, g, has_app_context
 import cv2
+from skylib.util.fits import get_fits_exp_length, get_fits_time
 
 from .. import errors
 from ..database import db
@@ -51,13 +58,17 @@ except ImportError:
 
 __all__ = [
     'init_data_files',
+    # In-memory handoff of intermediate data files
+    'InMemoryDataFiles', 'in_memory_data_files',
     # Paths
     'get_root', 'get_data_file_path',
     # Metadata
-    'convert_exif_field',
+    'convert_exif_field', 'get_data_file_metadata',
     # Data/metadata retrieval
-    'get_data_file_bytes', 'get_data_file_data', 'get_data_file_fits',
-    'get_data_file_group_bytes',
+    'DataFileRowReader', 'get_data_file_bytes', 'get_data_file_data', 'get_data_file_fits',
+    'get_data_file_group_bytes', 'get_data_file_ram_mb', 'get_data_file_version',
+    # Cached background maps
+    'get_background_params', 'get_data_file_background', 'has_data_file_background', 'save_data_file_background',
     # Data file creation
     'create_data_file', 'import_data_file', 'save_data_file',
     # API endpoint interface
@@ -88,6 +99,7 @@ class DbDataFile(db.Model):
     asset_path = Column(String(16383))
     asset_type = Column(String(255), server_default='FITS')
     asset_metadata = Column(JSONType)
+    image_metadata = Column(JSONType)
     layer = Column(String(255))
     created_on = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     modified = Column(Boolean, default=False)
@@ -132,6 +144,198 @@ def init_data_files() -> None:
             alembic_context.run_migrations()
 
 
+class InMemoryDataFiles:
+    """
+    In-memory data file store used to pass intermediate data files between chained jobs without writing them to disk
+
+    While the store is active in the current app context (see :func:`in_memory_data_files`), :func:`save_data_file` keeps
+    the FITS HDUs in memory instead of writing them to the user's data file directory, and :func:`get_data_file_fits`
+    and other data retrieval functions serve such data files from memory. Database rows are created and updated as
+    usual, so data file IDs remain valid. If keeping a data file in memory would exceed the RAM available to the job,
+    it is written to disk as usual (but is still deleted on exit unless listed in `keep`).
+
+    The store is shared by all worker threads of a job (see :func:`afterglow_core.concurrency.in_current_context`), so
+    `files` and `created` must only be modified via the store methods, which hold `lock`.
+
+    Attributes::
+        files: in-memory FITS HDU lists indexed by data file ID, along with the user's data file storage root
+        created: IDs of data files created while the store was active
+        keep: IDs of created data files that should be written to disk when the store is deactivated; all other
+            created data files are deleted, while the pre-existing data files are always written back
+        get_free_ram_mb: optional callable returning the RAM in megabytes that may still be allocated, e.g.
+            :meth:`Job.get_free_ram_mb`; if omitted, all data files are kept in memory
+        lock: reentrant lock guarding `files`, `created`, and `keep`
+    """
+    def __init__(self, get_free_ram_mb: Callable[[], float] | None = None):
+        self.files: dict[int, tuple[str, pyfits.HDUList]] = {}
+        self.created: set[int] = set()
+        self.keep: set[int] = set()
+        self.get_free_ram_mb = get_free_ram_mb
+        self.lock = RLock()
+
+    def get(self, file_id: int | str) -> pyfits.HDUList | None:
+        """
+        Return in-memory FITS for the given data file if present
+
+        :param file_id: data file ID
+
+        :return: FITS HDU list stored in memory or None if the data file is stored on disk
+        """
+        try:
+            return self.files[int(file_id)][1]
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def can_hold(self, fits: pyfits.HDUList) -> bool:
+        """
+        Check whether the given FITS can be kept in memory without exceeding the available RAM
+
+        :param fits: FITS HDU list to be stored
+
+        :return: False if the data file should be written to disk instead
+        """
+        if self.get_free_ram_mb is None:
+            return True
+        size_mb = sum(hdu.data.nbytes for hdu in fits if hdu.data is not None)/(1 << 20)
+        return size_mb <= self.get_free_ram_mb()
+
+    def put(self, file_id: int, root: str, fits: pyfits.HDUList) -> bool:
+        """
+        Keep the given data file in memory if it fits in the available RAM
+
+        :param file_id: data file ID
+        :param root: user's data file storage root directory
+        :param fits: FITS HDU list
+
+        :return: True if the data file is now stored in memory, False if it should be written to disk
+        """
+        with self.lock:
+            if self.can_hold(fits):
+                self.files[file_id] = (root, fits)
+                return True
+            self.files.pop(file_id, None)
+            return False
+
+    def add_created(self, file_id: int) -> None:
+        """
+        Register a data file created while the store is active
+
+        :param file_id: data file ID
+        """
+        with self.lock:
+            self.created.add(file_id)
+
+    def discard(self, file_id: int) -> None:
+        """
+        Forget the given data file, e.g. after it has been deleted
+
+        :param file_id: data file ID
+        """
+        with self.lock:
+            self.files.pop(file_id, None)
+            self.created.discard(file_id)
+
+    def release(self, user_id: int | None, file_ids: Iterable[int]) -> None:
+        """
+        Delete the given data files created while the store was active, unless they are listed in `keep`; used to free
+        memory occupied by intermediate data files as soon as they are no longer needed
+
+        :param user_id: ID of the user owning the data files
+        :param file_ids: data file IDs
+        """
+        with self.lock:
+            file_ids = [file_id for file_id in file_ids if file_id in self.created and file_id not in self.keep]
+            for file_id in file_ids:
+                self.discard(file_id)
+
+        for file_id in file_ids:
+            try:
+                delete_data_file(user_id, file_id)
+            except Exception as e:
+                current_app.logger.warning('Error deleting intermediate data file %s [%s]', file_id, e)
+
+    def persist(self, user_id: int | None) -> None:
+        """
+        Write the pre-existing and the explicitly kept data files to disk and delete the other data files created
+        while the store was active
+
+        :param user_id: ID of the user owning the data files
+        """
+        with self.lock:
+            for file_id, (root, fits) in self.files.items():
+                if file_id in self.created and file_id not in self.keep:
+                    continue
+                _write_data_file(root, file_id, fits)
+            self.files.clear()
+
+            self.release(user_id, self.created - self.keep)
+            self.created.clear()
+            self.keep.clear()
+
+
+@contextmanager
+def in_memory_data_files(user_id: int | None, get_free_ram_mb: Callable[[], float] | None = None) \
+        -> Iterator[InMemoryDataFiles]:
+    """
+    Context manager that keeps all data files saved in the current app context in memory; on exit, the pre-existing data
+    files and the ones listed in :attr:`InMemoryDataFiles.keep` are written to disk, and the remaining newly created
+    data files are deleted
+
+        with in_memory_data_files(user_id, job.get_free_ram_mb) as store:
+            ...  # run jobs
+            store.keep.update(output_file_ids)
+
+    :param user_id: ID of the user owning the data files
+    :param get_free_ram_mb: optional callable returning the RAM in megabytes that may still be allocated; data files
+        that do not fit are written to disk
+
+    :return: in-memory data file store
+    """
+    store = _get_in_memory_store()
+    if store is not None:
+        # Nested usage: reuse the enclosing store
+        yield store
+        return
+
+    store = g._in_memory_data_files = InMemoryDataFiles(get_free_ram_mb)
+    try:
+        yield store
+    finally:
+        g._in_memory_data_files = None
+        store.persist(user_id)
+
+
+def _get_in_memory_store() -> InMemoryDataFiles | None:
+    """
+    Return in-memory data file store active in the current app context if any
+    """
+    if not has_app_context():
+        return None
+    return g.get('_in_memory_data_files')
+
+
+def _write_data_file(root: str, file_id: int, fits: pyfits.HDUList) -> str:
+    """
+    Write data file FITS to the user's data file directory
+
+    :param root: user's data file storage root directory
+    :param file_id: data file ID
+    :param fits: FITS HDU list to write
+
+    :return: data file path
+    """
+    try:
+        os.makedirs(root)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    filename = os.path.join(
+        root, f'{file_id}.fits{".gz" if current_app.config.get("DATA_FILE_COMPRESSION", True) else ""}')
+    fits.writeto(filename, 'silentfix+ignore', overwrite=True)
+    return filename
+
+
 def get_root(user_id: int | None) -> str:
     """
     Return the absolute path to the current authenticated user's data storage
@@ -193,23 +397,23 @@ def save_data_file(root: str, file_id: int, data: np.ndarray | np.ma.MaskedArray
         if isinstance(data, np.ma.MaskedArray):
             # Store masked values as NaNs
             data = data.filled(np.nan)
-        fits = pyfits.PrimaryHDU(data, hdr)
+        fits = pyfits.HDUList([pyfits.PrimaryHDU(data, hdr)])
     else:
-        fits = pyfits.BinTableHDU(data, hdr)
+        fits = pyfits.HDUList([pyfits.PrimaryHDU(), pyfits.BinTableHDU(data, hdr)])
 
-    try:
-        os.makedirs(root)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
-
-    # Save FITS to data file directory
-    fits.writeto(
-        os.path.join(root, f'{file_id}.fits{".gz" if current_app.config.get("DATA_FILE_COMPRESSION", True) else ""}'),
-        'silentfix+ignore', overwrite=True)
+    store = _get_in_memory_store()
+    if store is not None and store.put(file_id, root, fits):
+        # Keep the data file in memory until the store is deactivated
+        version = None
+    else:
+        # Save FITS to data file directory; also used when the in-memory store would exceed the available RAM
+        version = _get_file_version(_write_data_file(root, file_id, fits))
 
     # Update image dimensions and file modification timestamp
-    if data.dtype.fields is None:
+    if size is not None:
+        # Image stored partially: use the full image size
+        db_data_file.width, db_data_file.height = size
+    elif data.dtype.fields is None:
         # Image: get image dimensions from array shape
         db_data_file.height, db_data_file.width = data.shape
     else:
@@ -219,6 +423,69 @@ def save_data_file(root: str, file_id: int, data: np.ndarray | np.ma.MaskedArray
     if modified:
         db_data_file.modified = True
 
+    # Cache header metadata and valid data footprint used by batch jobs; the file version allows to detect header
+    # updates made without calling save_data_file()
+    if data.dtype.fields is None:
+        db_data_file.image_metadata = dict(
+            _get_image_metadata(hdr), **_get_footprint(data, origin), version=version)
+    else:
+        db_data_file.image_metadata = None
+
+
+def _get_image_metadata(hdr: pyfits.Header) -> dict:
+    """
+    Extract image metadata stored in the database along with the data file, so that batch jobs can group and sort
+    many images without opening their FITS files
+
+    :param hdr: FITS header
+
+    :return: JSON-serializable metadata dictionary
+    """
+    metadata = {
+        'origin': str(hdr.get('ORIGIN', '')),
+        'telescope': str(hdr.get('TELESCOP', '')),
+        'instrument': str(hdr.get('INSTRUME', '')),
+        'filter': str(hdr.get('FILTER', '')),
+        'exp_length': None,
+        'time': None,
+    }
+    # noinspection PyBroadException
+    try:
+        metadata['exp_length'] = get_fits_exp_length(hdr)
+    except Exception:
+        pass
+    # noinspection PyBroadException
+    try:
+        t = get_fits_time(hdr)[0]
+        if t is not None:
+            metadata['time'] = t.isoformat()
+    except Exception:
+        pass
+    return metadata
+
+
+def _get_footprint(data: np.ndarray, origin: tuple[int, int] | None = None) -> dict:
+    """
+    Return the bounding box of valid (finite) pixels of an image; used by automatic cropping to avoid reading images
+
+    :param data: image data with NaNs for masked pixels
+    :param origin: optional coordinates (X, Y) of the data in the full image, as passed to :func:`save_data_file`
+
+    :return: dictionary with "footprint" = [x0, y0, x1, y1], 0-based, upper bounds exclusive, in the full image frame
+        (None if there are no valid pixels), and "footprint_filled" = True if all pixels within the bounding box are
+        valid, i.e. the bounding box exactly describes the image mask
+    """
+    valid = np.isfinite(data)
+    rows, cols = np.flatnonzero(valid.any(1)), np.flatnonzero(valid.any(0))
+    if not len(rows):
+        return {'footprint': None, 'footprint_filled': False}
+    x0, y0, x1, y1 = int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+    filled = bool(valid[y0:y1, x0:x1].all())
+    if origin is not None:
+        x0, x1 = x0 + origin[0], x1 + origin[0]
+        y0, y1 = y0 + origin[1], y1 + origin[1]
+    return {'footprint': [x0, y0, x1, y1], 'footprint_filled': filled}
+
 
 def append_suffix(name: str, suffix: str):
     """
@@ -395,6 +662,10 @@ def create_data_file(user_id: int | None, name: str | None, root: str, data: np.
             db.session.add(db_data_file)
             db.session.flush()  # obtain the new row ID by flushing db
 
+            store = _get_in_memory_store()
+            if store is not None:
+                store.add_created(db_data_file.id)
+
         save_data_file(root, db_data_file.id, data, hdr, modified=False, origin=origin, size=size)
     except Exception:
         db.session.rollback()
@@ -765,15 +1036,25 @@ def get_data_file_fits(user_id: int | None, file_id: int, mode: str = 'readonly'
 
     :return: FITS file object
     """
-    filename = get_data_file_path(user_id, file_id)
-    if not os.path.isfile(filename):
-        if filename.lower().endswith('.gz'):
-            filename = filename[:-3]
-        else:
-            filename += '.gz'
+    store = _get_in_memory_store()
+    in_memory_fits = store.get(file_id) if store is not None else None
+    if in_memory_fits is None:
+        filename = get_data_file_path(user_id, file_id)
+        if not os.path.isfile(filename):
+            if filename.lower().endswith('.gz'):
+                filename = filename[:-3]
+            else:
+                filename += '.gz'
 
     try:
-        fits = pyfits.open(filename, mode)
+        if in_memory_fits is None:
+            fits = pyfits.open(filename, mode)
+        elif mode == 'update':
+            # Header updates go directly to the data file kept in memory
+            fits = pyfits.HDUList(list(in_memory_fits))
+        else:
+            # Share the in-memory data array but not the header
+            fits = pyfits.HDUList([hdu.__class__(data=hdu.data, header=hdu.header.copy()) for hdu in in_memory_fits])
         if read_data:
             # When reading a data file, convert to the standard form on the fly if necessary
             data = fits[0].data
@@ -904,6 +1185,379 @@ def get_data_file_data(user_id: int | None, file_id: int, x0: int | str | None =
     return data, hdr
 
 
+class DataFileRowReader:
+    """
+    Reader of horizontal strips of a data file image; used by jobs to process large images or many images at once
+    while keeping only a few rows of each image in memory
+
+    Rows are numbered from 0 in the full image frame: for data files stored with the AGORGN1/2, AGSIZE1/2 keywords,
+    rows outside the stored data and columns to the left and to the right of it are filled with NaNs, the same way as
+    :func:`get_data_file_data` does. Reading strips in ascending order streams the data from disk, including
+    gzip-compressed data files, without decompressing the whole file; reading backwards restarts from the beginning.
+
+        with DataFileRowReader(user_id, file_id) as reader:
+            for y in range(0, reader.height, 100):
+                data = reader.read(y, 100)
+
+    Attributes::
+        file_id: data file ID
+        header: FITS header, with NAXIS1/2 set to the full image size as returned by :func:`get_data_file_data`
+        width: full image width
+        height: full image height
+    """
+    def __init__(self, user_id: int | None, file_id: int):
+        """
+        Open a data file for reading; the file is not read until the first call to :meth:`read`
+
+        :param user_id: current user ID (None if user auth is disabled)
+        :param file_id: data file ID
+        """
+        self.file_id = file_id
+        self._filename = self._data = self._file = None
+        self._data_offset = self._row = 0
+
+        store = _get_in_memory_store()
+        in_memory_fits = store.get(file_id) if store is not None else None
+        try:
+            if in_memory_fits is None:
+                filename = get_data_file_path(user_id, file_id)
+                if not os.path.isfile(filename):
+                    if filename.lower().endswith('.gz'):
+                        filename = filename[:-3]
+                    else:
+                        filename += '.gz'
+                with pyfits.open(filename, 'readonly') as fits:
+                    hdr = fits[0].header
+                    self._data_offset = fits.fileinfo(0)['datLoc']
+                self._filename = filename
+            else:
+                hdr = in_memory_fits[0].header.copy()
+                self._data = in_memory_fits[0].data
+        except Exception:
+            raise UnknownDataFileError(file_id=file_id)
+
+        if hdr.get('NAXIS') != 2:
+            raise ValueError(f'Data file {file_id} does not contain an image')
+        self._dtype = np.dtype({8: 'u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8'}[hdr['BITPIX']])
+        self._bscale, self._bzero = hdr.get('BSCALE', 1), hdr.get('BZERO', 0)
+        self._stored_width, self._stored_height = int(hdr['NAXIS1']), int(hdr['NAXIS2'])
+        if all(s in hdr for s in ('AGORGN1', 'AGORGN2', 'AGSIZE1', 'AGSIZE2')):
+            self._x0, self._y0 = int(hdr['AGORGN1']), int(hdr['AGORGN2'])
+            self.width, self.height = int(hdr['AGSIZE1']), int(hdr['AGSIZE2'])
+            hdr['NAXIS1'], hdr['NAXIS2'] = self.width, self.height
+            for s in 'AGORGN1', 'AGORGN2', 'AGSIZE1', 'AGSIZE2':
+                del hdr[s]
+        else:
+            self._x0 = self._y0 = 0
+            self.width, self.height = self._stored_width, self._stored_height
+        self.header = hdr
+
+    def __enter__(self) -> 'DataFileRowReader':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the underlying file
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_stored(self, y0: int, y1: int) -> np.ndarray:
+        """
+        Return rows of the stored data
+
+        :param y0: first row, 0-based
+        :param y1: last row + 1
+
+        :return: float32 array of shape (y1 - y0, stored width)
+        """
+        if self._filename is None:
+            data = self._data[y0:y1]
+        else:
+            row_size = self._stored_width*self._dtype.itemsize
+            if self._file is None or y0 < self._row:
+                self.close()
+                if self._filename.lower().endswith('.gz'):
+                    self._file = gzip.open(self._filename, 'rb')
+                else:
+                    self._file = open(self._filename, 'rb')
+                self._file.seek(self._data_offset)
+                self._row = 0
+            if y0 > self._row:
+                self._file.seek((y0 - self._row)*row_size, os.SEEK_CUR)
+            buf = self._file.read((y1 - y0)*row_size)
+            if len(buf) != (y1 - y0)*row_size:
+                raise UnknownDataFileError(file_id=self.file_id)
+            self._row = y1
+            data = np.frombuffer(buf, self._dtype).reshape(y1 - y0, self._stored_width)
+
+        if self._bscale != 1 or self._bzero != 0:
+            return (data*self._bscale + self._bzero).astype(np.float32)
+        return data.astype(np.float32)
+
+    def read(self, y0: int, h: int) -> np.ndarray:
+        """
+        Return a horizontal strip of the image
+
+        :param y0: first row, 0-based
+        :param h: number of rows; truncated at the bottom image boundary
+
+        :return: float32 array of shape (h, width) with NaNs for masked pixels
+        """
+        y1 = min(y0 + h, self.height)
+        sy0, sy1 = max(y0 - self._y0, 0), min(y1 - self._y0, self._stored_height)
+        if (self._x0, self._y0, self._stored_width, self._stored_height) == (0, 0, self.width, self.height):
+            return self._read_stored(sy0, sy1)
+
+        # Pad the stored part of the strip with NaNs
+        data = np.full((y1 - y0, self.width), np.nan, np.float32)
+        if sy0 < sy1:
+            data[sy0 + self._y0 - y0:sy1 + self._y0 - y0, self._x0:self._x0 + self._stored_width] = \
+                self._read_stored(sy0, sy1)
+        return data
+
+
+def get_data_file_ram_mb(user_id: int | None, file_ids: list[int], copies: float = 1, itemsize: int = 4) -> float:
+    """
+    Return the estimated RAM needed to hold the largest of the given images in memory; used by jobs to limit
+    the number of images processed simultaneously
+
+    :param user_id: current user ID (None if user auth is disabled)
+    :param file_ids: data file IDs
+    :param copies: number of full-size arrays per image required by the processing algorithm
+    :param itemsize: size of a single pixel value in bytes
+
+    :return: RAM in megabytes; 0 if none of the data files exist
+    """
+    if not file_ids:
+        return 0
+    try:
+        npix = db.session.query(func.max(DbDataFile.width*DbDataFile.height)).filter(
+            DbDataFile.user_id == user_id, DbDataFile.id.in_(file_ids)).scalar()
+    except Exception:
+        db.session.rollback()
+        raise
+    return (npix or 0)*itemsize*copies/(1 << 20)
+
+
+def get_data_file_metadata(user_id: int | None, file_ids: list[int]) -> dict[int, dict]:
+    """
+    Return cached image metadata for multiple data files using a single database query; header metadata of data
+    files saved before it was cached or whose headers were updated since then (e.g. via the data file header API) is
+    extracted again from their FITS headers and stored in the database
+
+    :param user_id: current user ID (None if user auth is disabled)
+    :param file_ids: data file IDs
+
+    :return: dictionary {file_id: metadata} for all existing data files, with "width", "height", "origin",
+        "telescope", "instrument", "filter", "exp_length" (seconds or None), and "time" (exposure start
+        :class:`datetime.datetime` or None) keys; data files saved by :func:`save_data_file` also have "footprint" and
+        "footprint_filled" keys describing the bounding box of valid pixels, see :func:`_get_footprint`
+    """
+    if not file_ids:
+        return {}
+    try:
+        rows = db.session.query(
+            DbDataFile.id, DbDataFile.width, DbDataFile.height, DbDataFile.image_metadata).filter(
+            DbDataFile.user_id == user_id, DbDataFile.id.in_(file_ids)).all()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    result, stale = {}, {}
+    for file_id, width, height, metadata in rows:
+        version = get_data_file_version(user_id, file_id)
+        if metadata is None or version is None or metadata.get('version') != version:
+            # Header may have changed since the metadata were cached; header updates do not change pixel data, so
+            # keep the footprint
+            # noinspection PyBroadException
+            try:
+                with get_data_file_fits(user_id, file_id, read_data=False) as fits:
+                    metadata = dict(metadata or {}, **_get_image_metadata(fits[0].header), version=version)
+            except Exception:
+                continue
+            if version is not None:
+                stale[file_id] = metadata
+        metadata = dict(metadata, width=width, height=height)
+        if metadata.get('time'):
+            metadata['time'] = datetime.fromisoformat(metadata['time'])
+        result[file_id] = metadata
+
+    if stale:
+        # Caching is optional; ignore database errors
+        try:
+            for file_id, metadata in stale.items():
+                DbDataFile.query.filter_by(id=file_id).update({'image_metadata': metadata})
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning('Error caching data file metadata [%s]', e)
+
+    return result
+
+
+def get_data_file_version(user_id: int | None, file_id: int) -> str | None:
+    """
+    Return the current version of data file on disk, which changes whenever the file is updated; used as a key for
+    data derived from the file, like cached background maps or job results
+
+    :param user_id: current user ID (None if user auth is disabled)
+    :param file_id: data file ID
+
+    :return: version string based on file modification time and size; None for missing or in-memory data files
+    """
+    store = _get_in_memory_store()
+    if store is not None and store.get(file_id) is not None:
+        return None
+    filename = get_data_file_path(user_id, file_id)
+    if not os.path.isfile(filename):
+        # Stored with a different DATA_FILE_COMPRESSION setting
+        filename = filename[:-3] if filename.lower().endswith('.gz') else filename + '.gz'
+    return _get_file_version(filename)
+
+
+def _get_file_version(filename: str) -> str | None:
+    """
+    Return version of the given data file on disk; see :func:`get_data_file_version`
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return f'{st.st_mtime_ns}-{st.st_size}'
+
+
+def get_background_params(size: float, filter_size: int = 3) -> dict:
+    """
+    Return canonical background estimation parameters identifying background maps saved by
+    :func:`save_data_file_background`; all jobs build the parameters with this function, so that maps estimated by
+    one job are found by the others
+
+    :param size: background box size, as passed to :func:`skylib.calibration.background.estimate_background`
+    :param filter_size: background map median filter size
+
+    :return: parameters that can be also passed to `estimate_background` as keyword arguments
+    """
+    return {'size': float(size), 'filter_size': int(filter_size)}
+
+
+def _get_background_path(user_id: int | None, file_id: int, params: dict) -> str:
+    """
+    Return path to the background map sidecar of the given data file for the given background estimation parameters;
+    maps estimated with different parameters are stored separately; deleted along with the data file
+    """
+    h = sha1(json.dumps(params, sort_keys=True).encode('utf8')).hexdigest()[:12]
+    return os.path.join(get_root(user_id), f'{file_id}.bkg.{h}.npz')
+
+
+def save_data_file_background(user_id: int | None, file_id: int, background: np.ndarray, rms: np.ndarray,
+                              params: dict, version: str | None = None) -> None:
+    """
+    Persist background and RMS maps of a data file as a compact low-resolution sidecar, so that other jobs can reuse
+    them instead of estimating background again; background maps are smooth, so they are stored block-averaged to
+    at most DATA_FILE_BACKGROUND_MAP_SIZE pixels along the longest side
+
+    :param user_id: current user ID (None if user auth is disabled)
+    :param file_id: data file ID
+    :param background: full-resolution background map
+    :param rms: full-resolution background RMS map
+    :param params: background estimation parameters; :func:`get_data_file_background` returns the maps only if
+        called with the same parameters
+    :param version: data file version, as returned by :func:`get_data_file_version`, at the time when the image data
+        were read; defaults to the current version
+    """
+    max_size = current_app.config.get('DATA_FILE_BACKGROUND_MAP_SIZE')
+    if not max_size:
+        return
+    if version is None:
+        version = get_data_file_version(user_id, file_id)
+        if version is None:
+            return
+
+    shape = np.shape(background)
+    factor = max(-(-max(shape)//max_size), 1)
+
+    def downsample(a: np.ndarray) -> np.ndarray:
+        a = np.asarray(a, np.float32)
+        if factor > 1:
+            h, w = a.shape
+            a = np.pad(a, ((0, -h % factor), (0, -w % factor)), mode='edge')
+            a = a.reshape(a.shape[0]//factor, factor, a.shape[1]//factor, factor).mean((1, 3))
+        return a
+
+    filename = _get_background_path(user_id, file_id, params)
+    tmp_filename = f'{filename}.{uuid4().hex}.tmp'
+    try:
+        with open(tmp_filename, 'wb') as f:
+            np.savez_compressed(
+                f, background=downsample(background), rms=downsample(rms), shape=np.array(shape), factor=factor,
+                version=version, params=json.dumps(params, sort_keys=True))
+        os.replace(tmp_filename, filename)
+    except Exception as e:
+        current_app.logger.warning('Error saving background map for data file %s [%s]', file_id, e)
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
+
+
+def get_data_file_background(user_id: int | None, file_id: int, params: dict) \
+        -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Return the background and RMS maps of a data file previously saved by :func:`save_data_file_background`
+
+    :param user_id: current user ID (None if user auth is disabled)
+    :param file_id: data file ID
+    :param params: background estimation parameters
+
+    :return: full-resolution background and RMS maps or None if there are no maps for the current data file version
+        or they were estimated with different parameters
+    """
+    version = get_data_file_version(user_id, file_id)
+    if version is None:
+        return None
+    try:
+        with np.load(_get_background_path(user_id, file_id, params)) as f:
+            if str(f['version']) != version or str(f['params']) != json.dumps(params, sort_keys=True):
+                return None
+            shape, factor = tuple(f['shape']), int(f['factor'])
+            maps = f['background'], f['rms']
+    except Exception:
+        return None
+
+    if factor > 1:
+        maps = tuple(zoom(a, factor, order=1, mode='nearest', grid_mode=True)[:shape[0], :shape[1]] for a in maps)
+    return maps
+
+
+def has_data_file_background(user_id: int | None, file_id: int, params: dict, version: str | None = None) -> bool:
+    """
+    Check whether background maps estimated with the given parameters are saved for the current data file version;
+    used to avoid saving the same maps again
+
+    :param user_id: current user ID (None if user auth is disabled)
+    :param file_id: data file ID
+    :param params: background estimation parameters
+    :param version: data file version; defaults to the current version
+
+    :return: True if :func:`get_data_file_background` would return the maps
+    """
+    if version is None:
+        version = get_data_file_version(user_id, file_id)
+        if version is None:
+            return False
+    try:
+        # Maps are loaded from .npz lazily, so only the small version and parameter fields are read
+        with np.load(_get_background_path(user_id, file_id, params)) as f:
+            return str(f['version']) == version and str(f['params']) == json.dumps(params, sort_keys=True)
+    except Exception:
+        return False
+
+
 def get_data_file_uint8(user_id: int | None, file_id: int) -> np.ndarray:
     """
     Return image file data array scaled to 8-bit unsigned integer format suitable for exporting to PNG, JPEG, etc.
@@ -940,6 +1594,12 @@ def get_data_file_bytes(user_id: int | None, file_id: int | str, fmt: str | None
         fmt = get_data_file(user_id, file_id).asset_type or 'FITS'
 
     if fmt == 'FITS':
+        store = _get_in_memory_store()
+        in_memory_fits = store.get(file_id) if store is not None else None
+        if in_memory_fits is not None:
+            buf = BytesIO()
+            in_memory_fits.writeto(buf, output_verify='silentfix+ignore')
+            return buf.getvalue()
         try:
             with open(get_data_file_path(user_id, file_id), 'rb') as f:
                 return f.read()
@@ -1388,6 +2048,10 @@ def delete_data_file(user_id: int | None, file_id: int) -> None:
         db.session.rollback()
         raise
 
+    store = _get_in_memory_store()
+    if store is not None:
+        store.discard(int(file_id))
+
     for filename in glob(os.path.join(root, '{}.*'.format(file_id))):
         try:
             os.remove(filename)
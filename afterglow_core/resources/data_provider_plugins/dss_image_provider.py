@@ -14,6 +14,7 @@ from ...models import DataProvider, DataProviderAsset
 from ...schemas import Float
 from ...errors import MissingFieldError, ValidationError
 from ...errors.data_provider import AssetNotFoundError
+from ..imaging_surveys import get_survey_tile_cache
 
 
 __all__ = ['DSSImageDataProvider']
@@ -56,6 +57,8 @@ class DSSImageDataProvider(DataProvider):
         validate=OneOf(['STScI', 'ESO']), dump_default='STScI')
     timeout: float = Float(
         validate=Range(min=0, min_inclusive=False), dump_default=30)
+    cache_dir: Optional[str] = None
+    cache_size: int = 1 << 30
 
     @staticmethod
     def _get_asset_params(path: str) -> Tuple[float, float, float, float]:
@@ -208,54 +211,66 @@ class DSSImageDataProvider(DataProvider):
         :return: asset data
         """
         ra_degs, dec_degs, width, height = self._get_asset_params(path)
-        try:
-            if self.server == 'STScI':
-                url = 'https://archive.stsci.edu/cgi-bin/dss_search'
-                params = {
-                    'v': 'poss2ukstu_red',
-                    'r': str(ra_degs),
-                    'd': str(dec_degs),
-                    'e': 'J2000',
-                    'h': str(height),
-                    'w': str(width),
-                    'f': 'fits',
-                    'c': 'none',
-                    'fov': 'NONE',
-                    'v3': '',
-                }
-            else:
-                url = 'https://archive.eso.org/dss/dss/image'
-                params = {
-                    'ra': str(ra_degs),
-                    'dec': str(dec_degs),
-                    'equinox': 'J2000',
-                    'name': '',
-                    'x': str(width),
-                    'y': str(height),
-                    'Sky-Survey': 'DSS2-red',
-                    'mime-type': 'download-fits',
-                    'statsmode': 'WEBFORM',
-                }
-
-            res = requests.request(
-                'GET', url, params=params, timeout=self.timeout)
-        except Exception as e:
-            raise AssetNotFoundError(path=path, reason=str(e))
-
-        if res.status_code != 200:
-            raise AssetNotFoundError(
-                path=path,
-                reason='Request failed (HTTP status {})'
-                .format(res.status_code))
-
-        buf = BytesIO(res.content)
-        with pyfits.open(buf, 'readonly') as f:
-            if len(f) > 1:
-                try:
-                    # Remove extension HDU
-                    out = BytesIO()
-                    f[0].writeto(out, output_verify='silentfix+ignore')
-                    return out.getvalue()
-                finally:
-                    del f[0].data
-        return res.content
+
+        def fetch() -> bytes:
+            try:
+                if self.server == 'STScI':
+                    url = 'https://archive.stsci.edu/cgi-bin/dss_search'
+                    params = {
+                        'v': 'poss2ukstu_red',
+                        'r': str(ra_degs),
+                        'd': str(dec_degs),
+                        'e': 'J2000',
+                        'h': str(height),
+                        'w': str(width),
+                        'f': 'fits',
+                        'c': 'none',
+                        'fov': 'NONE',
+                        'v3': '',
+                    }
+                else:
+                    url = 'https://archive.eso.org/dss/dss/image'
+                    params = {
+                        'ra': str(ra_degs),
+                        'dec': str(dec_degs),
+                        'equinox': 'J2000',
+                        'name': '',
+                        'x': str(width),
+                        'y': str(height),
+                        'Sky-Survey': 'DSS2-red',
+                        'mime-type': 'download-fits',
+                        'statsmode': 'WEBFORM',
+                    }
+
+                res = requests.request(
+                    'GET', url, params=params, timeout=self.timeout)
+            except Exception as e:
+                raise AssetNotFoundError(path=path, reason=str(e))
+
+            if res.status_code != 200:
+                raise AssetNotFoundError(
+                    path=path,
+                    reason='Request failed (HTTP status {})'
+                    .format(res.status_code))
+
+            buf = BytesIO(res.content)
+            with pyfits.open(buf, 'readonly') as f:
+                if len(f) > 1:
+                    try:
+                        # Remove extension HDU
+                        out = BytesIO()
+                        f[0].writeto(out, output_verify='silentfix+ignore')
+                        return out.getvalue()
+                    finally:
+                        del f[0].data
+            return res.content
+
+        cache = get_survey_tile_cache(
+            'dss', self.cache_size, self.cache_dir)
+        if cache is None:
+            return fetch()
+        survey = 'dss:' + self.server
+        return cache.get(
+            survey, '{}:{:.6f}:{:.6f}:{:.4f}:{:.4f}'.format(
+                survey, ra_degs, dec_degs, width, height),
+            fetch, (ra_degs, dec_degs, width, height))
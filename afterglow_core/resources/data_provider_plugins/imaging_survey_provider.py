@@ -13,7 +13,7 @@ from astroquery.skyview import SkyView
 from ...models import DataProvider, DataProviderAsset
 from ...errors import MissingFieldError, ValidationError
 from ...errors.data_provider import AssetNotFoundError
-from ..imaging_surveys import survey_scales
+from ..imaging_surveys import get_survey_tile_cache, survey_scales
 
 
 __all__ = ['ImagingSurveyDataProvider']
@@ -42,6 +42,9 @@ class ImagingSurveyDataProvider(DataProvider):
     quota = usage = None
     allow_multiple_instances = False
 
+    cache_dir: Optional[str] = None
+    cache_size: int = 1 << 30
+
     _search_fields: dict = None
     _search_fields_lock: Lock = None
 
@@ -294,14 +297,43 @@ class ImagingSurveyDataProvider(DataProvider):
         :return: asset data
         """
         survey, position, width, height = self._get_asset_params(path)
+        kwargs = self._get_query_args(survey, width, height)
+
+        def fetch() -> bytes:
+            try:
+                res = SkyView.get_images(position, **kwargs)
+            except Exception as e:
+                raise AssetNotFoundError(path=path, reason=str(e))
+            if not res:
+                raise AssetNotFoundError(
+                    path=path, reason='No images returned by SkyView')
+            buf = BytesIO()
+            res[0].writeto(buf, output_verify='silentfix+ignore')
+            return buf.getvalue()
+
+        cache = get_survey_tile_cache(
+            'skyview', self.cache_size, self.cache_dir)
+        if cache is None:
+            return fetch()
+
+        # Images of surveys with unknown pixel scale are resampled depending
+        # on the field size and cannot be cut out from other images
+        if survey in survey_scales:
+            survey_id = 'skyview:' + survey
+        else:
+            survey_id = 'skyview:{}:{}:{:.4f}:{:.4f}'.format(
+                survey, kwargs['pixels'], width, height)
+
+        # Field center can be used to find covering images only if given by
+        # decimal coordinates in degrees; object names are not resolved
         try:
-            res = SkyView.get_images(
-                position, **self._get_query_args(survey, width, height))
-        except Exception as e:
-            raise AssetNotFoundError(path=path, reason=str(e))
-        if not res:
-            raise AssetNotFoundError(
-                path=path, reason='No images returned by SkyView')
-        buf = BytesIO()
-        res[0].writeto(buf, output_verify='silentfix+ignore')
-        return buf.getvalue()
+            ra, dec = [float(s) for s in position.replace(',', ' ').split()]
+        except ValueError:
+            field = None
+        else:
+            field = (ra, dec, width, height)
+
+        return cache.get(
+            survey_id, '{}:{}:{:.4f}:{:.4f}'.format(
+                survey_id, ' '.join(position.lower().split()), width, height),
+            fetch, field)
@@ -8,16 +8,23 @@ The user's LCO username becomes their Afterglow username.
 from typing import Any, Dict as TDict, List as TList, Optional, Tuple, Union
 from urllib.parse import parse_qs, urlparse
 from io import BytesIO
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
 import json
+import time
 
 from flask_login import current_user
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import astropy.io.fits as pyfits
 
 from ... import PaginationInfo
 from ...models import DataProvider, DataProviderAsset
 from ...errors import AfterglowError, ValidationError
 from ...errors.data_provider import AssetNotFoundError
+from ..file_cache import get_file_cache
 
 
 __all__ = ['LCODataProvider']
@@ -36,6 +43,20 @@ LCO_FILTER_MAP = {
     'air': 'Open', 'clear': 'Clear', 'Astrodon-Exo': 'Exop',
 }
 
+OBSERVE_API_URL = 'https://observe.lco.global/api'
+ARCHIVE_API_URL = 'https://archive-api.lco.global'
+
+# HTTP connection pool size, number of retries for failed requests, and
+# request timeout in seconds
+POOL_SIZE = 10
+MAX_RETRIES = 3
+TIMEOUT = 60
+
+# Lifetime of cached API responses in seconds and max number of responses
+# cached; expired responses are revalidated using conditional requests
+API_CACHE_TTL = 300
+API_CACHE_SIZE = 1000
+
 USER_OBS = 'User Observations'
 COLLAB_OBS = 'Collaboration Observations'
 OBS_CATEGORIES = (USER_OBS, COLLAB_OBS)
@@ -102,32 +123,97 @@ def get_username() -> str:
     return identity_data['id']
 
 
+_session: Optional[requests.Session] = None
+_session_lock = Lock()
+
+# (token hash, URL, params) -> (expiration time, ETag, Last-Modified, response)
+_api_cache: OrderedDict = OrderedDict()
+_api_cache_lock = Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Return HTTP session shared by all threads; reuses connections to LCO
+    servers and retries failed requests; after the last retry, the error
+    response is returned as is
+
+    :return: requests session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(
+                pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+                max_retries=Retry(
+                    total=MAX_RETRIES, backoff_factor=0.5,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=('GET', 'HEAD'), raise_on_status=False))
+            _session = requests.Session()
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
 def api_query(root: str, endpoint: str, params: Optional[TDict] = None) \
         -> TDict:
     """
     Run an LCO API query
 
+    Responses are cached per user for API_CACHE_TTL seconds; after that,
+    they are revalidated with a conditional request if the server provided
+    an ETag or Last-Modified header. Cached responses are shared and must not
+    be modified by the caller.
+
     :param root: root API URL
     :param endpoint: API endpoint
     :param params: optional request parameters as a dict
 
     :return: API response
     """
-    res = requests.get(
-        f'{root}/{endpoint}/', params=params,
-        headers={'Authorization': f'Token {get_token()}'})
-    if not res.ok:
-        e = AfterglowError(error_msg=res.reason)
-        e.message = res.reason
-        e.code = res.status_code
-        raise e
+    token = get_token()
+    url = f'{root}/{endpoint}/'
+    key = (sha256(token.encode('utf8')).hexdigest(), url,
+           json.dumps(params, sort_keys=True, default=str))
+    with _api_cache_lock:
+        entry = _api_cache.get(key)
+    if entry is not None and entry[0] > time.time():
+        return entry[3]
+
+    headers = {'Authorization': f'Token {token}'}
+    if entry is not None:
+        if entry[1]:
+            headers['If-None-Match'] = entry[1]
+        if entry[2]:
+            headers['If-Modified-Since'] = entry[2]
     try:
-        res = res.json()
-    except Exception:
-        raise LCOError(error_msg=res.text)
-    if 'detail' in res:
-        raise LCOError(error_msg=res['detail'])
-    return res
+        res = get_session().get(
+            url, params=params, headers=headers, timeout=TIMEOUT)
+    except requests.RequestException as e:
+        raise LCOError(error_msg=f'LCO API request failed: {e}')
+    if res.status_code == 304 and entry is not None:
+        # Not modified, reuse the cached response
+        data = entry[3]
+    else:
+        if not res.ok:
+            e = AfterglowError(error_msg=res.reason)
+            e.message = res.reason
+            e.code = res.status_code
+            raise e
+        try:
+            data = res.json()
+        except Exception:
+            raise LCOError(error_msg=res.text)
+        if 'detail' in data:
+            raise LCOError(error_msg=data['detail'])
+
+    with _api_cache_lock:
+        _api_cache[key] = (
+            time.time() + API_CACHE_TTL, res.headers.get('ETag'),
+            res.headers.get('Last-Modified'), data)
+        _api_cache.move_to_end(key)
+        while len(_api_cache) > API_CACHE_SIZE:
+            _api_cache.popitem(last=False)
+    return data
 
 
 def observe_api_query(endpoint: str, params: Optional[TDict] = None) -> TDict:
@@ -139,7 +225,7 @@ def observe_api_query(endpoint: str, params: Optional[TDict] = None) -> TDict:
 
     :return: API response
     """
-    return api_query('https://observe.lco.global/api', endpoint, params)
+    return api_query(OBSERVE_API_URL, endpoint, params)
 
 
 def archive_api_query(endpoint: str = 'frames',
@@ -152,7 +238,7 @@ def archive_api_query(endpoint: str = 'frames',
 
     :return: API response
     """
-    return api_query('https://archive-api.lco.global', endpoint, params)
+    return api_query(ARCHIVE_API_URL, endpoint, params)
 
 
 def split_asset_path(path: str, allow_collab_obs: bool) \
@@ -298,6 +384,8 @@ class LCODataProvider(DataProvider):
 
     allow_collab_obs = True
     allow_multiple_instances = False
+    cache_dir: Optional[str] = None
+    cache_size: int = 1 << 30
 
     def __init__(self, id: Optional[Union[str, int]] = None,
                  display_name: str = 'Las Cumbres Observatory',
@@ -624,9 +712,26 @@ class LCODataProvider(DataProvider):
         if frame is None:
             raise ValidationError('path', 'Missing frame ID')
 
-        # Obtain frame download URL and retrieve frame data
-        buf = BytesIO(requests.get(
-            archive_api_query(f'frames/{frame}')['url']).content)
+        # Obtain frame download URL; this also checks that the user has
+        # access to the frame
+        url = archive_api_query(f'frames/{frame}')['url']
+
+        # Frames are immutable, return data from the local cache if available
+        cache = get_file_cache('lco', self.cache_size, self.cache_dir)
+        if cache is not None:
+            data = cache.get(str(frame))
+            if data is not None:
+                return data
+
+        # Retrieve frame data
+        try:
+            res = get_session().get(url, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            raise LCOError(error_msg=f'Cannot retrieve frame {frame}: {e}')
+        if not res.ok:
+            raise LCOError(
+                error_msg=f'Cannot retrieve frame {frame}: {res.reason}')
+        buf = BytesIO(res.content)
 
         # Modify header to match Afterglow/Skynet standard
         with pyfits.open(buf, 'update') as f:
@@ -640,4 +745,7 @@ class LCODataProvider(DataProvider):
                 for _ in range(3):
                     del f[-1]
             f.flush()
-            return buf.getvalue()
+        data = buf.getvalue()
+        if cache is not None:
+            cache.put(str(frame), data)
+        return data
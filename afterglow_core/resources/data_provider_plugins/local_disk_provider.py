@@ -6,13 +6,26 @@ import sys
 import os
 import shutil
 import gzip
+import heapq
 import bz2
+import json
+import sqlite3
+import time
+from contextlib import closing
 from errno import EEXIST
 from datetime import datetime
 from glob import glob
-from typing import List as TList, Optional, Tuple, Union
+from threading import Lock, get_ident
+from typing import (
+    BinaryIO, Callable, Dict as TDict, List as TList, Optional, Tuple, Union)
 import warnings
 
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
 from flask_login import current_user
 import astropy.io.fits as pyfits
 from astropy.wcs import FITSFixedWarning
@@ -51,23 +64,86 @@ warnings.filterwarnings('ignore', category=VerifyWarning)
 
 MAX_PAGE_SIZE = 100
 
+# Buffer size for copying files that cannot be cloned by the filesystem
+COPY_CHUNK_SIZE = 1 << 20
 
-def paginate(items: TList[Union[str, DataProviderAsset]],
-             page_size: Optional[Union[int, str]], sort_by: str,
-             page: Optional[Union[int, str]]) \
-        -> Tuple[list, Optional[PaginationInfo]]:
+# Linux ioctl request to clone a file on copy-on-write filesystems
+FICLONE = 0x40049409
+
+
+def get_tmp_filename(filename: str) -> str:
     """
-    Handle pagination for lists of objects
+    Return a unique name of a hidden temporary file in the same directory as
+    the given file, used to atomically replace it
 
-    :param items: list of items to paginate
-    :param page_size: number of items per page
-    :param sort_by: sorting key: "name", "size", or "time", optionally prefixed
-        by "+" or "-", with "-" indicating reverse sorting
+    :param filename: target filename
+
+    :return: temporary filename
+    """
+    return os.path.join(os.path.dirname(filename), '.{}.{}.{}.tmp'.format(
+        os.path.basename(filename), os.getpid(), get_ident()))
+
+
+def copy_file(src: str, dst: str, hardlink: bool = False) -> None:
+    """
+    Copy a file using the cheapest method supported by the filesystem
+
+    Tries, in order, creating a hard link (if enabled), copy-on-write cloning
+    (reflink on Btrfs, XFS, etc.), and in-kernel copying with
+    copy_file_range(); falls back to a regular chunked copy.
+
+    :param src: source filename
+    :param dst: destination filename
+    :param hardlink: allow creating a hard link to the source file instead
+        of copying
+    """
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+
+        if hasattr(os, 'copy_file_range'):
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    n = os.copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), min(remaining, 1 << 30))
+                    if not n:
+                        break
+                    remaining -= n
+                return
+            except OSError:
+                # Not supported by the filesystem(s), start over
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+
+        shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+
+
+def get_page_bounds(num_items: int, page_size: Optional[Union[int, str]],
+                    page: Optional[Union[int, str]]) \
+        -> Tuple[int, int, int, int, int]:
+    """
+    Calculate the range of items on the requested page
+
+    :param num_items: total number of items
+    :param page_size: number of items per page; None = all items
     :param page: optional page number (for page-based pagination), "first",
         or "last"
 
-    :return: list of items to return, total number of pages, current page
-        number, and None, indicating page-based pagination
+    :return: offset and number of items to return, page size, total number of
+        pages, and current page number
     """
     if page_size is not None:
         try:
@@ -78,53 +154,572 @@ def paginate(items: TList[Union[str, DataProviderAsset]],
             raise ValidationError('page[size]')
         page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
     else:
-        page_size = len(items)
-    if not items:
-        return [], PaginationInfo(
-            sort=sort_by, page_size=page_size or MAX_PAGE_SIZE, total_pages=0,
-            current_page=0)
-    total_pages = (len(items) - 1)//page_size + 1
-
-    reverse = sort_by.startswith('-')
-    key = sort_by.lstrip('+-')
-    if key not in ('name', 'size', 'time'):
-        raise ValidationError('sort')
-    if isinstance(items[0], str):
-        items.sort(
-            key=lambda fn: (
-                os.path.isdir(fn) ^ (not reverse),
-                os.path.basename(fn)
-                if key == 'name' or key == 'size' and os.path.isdir(fn)
-                else os.stat(fn).st_size if key == 'size'
-                else os.stat(fn).st_mtime),
-            reverse=reverse)
-    else:
-        items.sort(
-            key=lambda asset: (
-                asset.collection ^ (not reverse),
-                asset.name
-                if key == 'name' or key == 'size' and asset.collection
-                else asset.metadata['size'] if key == 'size'
-                else asset.metadata['time']),
-            reverse=reverse)
+        page_size = num_items
+    if not num_items:
+        return 0, 0, page_size or MAX_PAGE_SIZE, 0, 0
+    total_pages = (num_items - 1)//page_size + 1
 
     if page == 'last':
         page = max(total_pages - 1, 0)
-        items = items[-page_size:]
+        offset = max(num_items - page_size, 0)
     elif page == 'first' or not page:
-        page = 0
-        items = items[:page_size]
+        page = offset = 0
     else:
         try:
             page = int(page)
         except ValueError:
             raise ValidationError('page[number]')
         offset = page*page_size
-        items = items[offset:offset + page_size]
+    return offset, page_size, page_size, total_pages, page
+
+
+def parse_sort(sort_by: str) -> Tuple[str, bool]:
+    """
+    Parse the sorting mode
+
+    :param sort_by: sorting key: "name", "size", or "time", optionally prefixed
+        by "+" or "-", with "-" indicating reverse sorting
+
+    :return: sorting key and reverse sorting flag
+    """
+    key = sort_by.lstrip('+-')
+    if key not in ('name', 'size', 'time'):
+        raise ValidationError('sort')
+    return key, sort_by.startswith('-')
+
+
+def is_keyset_page(page: Optional[Union[int, str]]) -> bool:
+    """
+    Is the given page specification a keyset-based one?
+
+    :param page: page number, "first", "last", ">cursor", or "<cursor"
+
+    :return: True if `page` is ">cursor" (page after the cursor) or
+        "<cursor" (page before the cursor)
+    """
+    return isinstance(page, str) and page[:1] in ('>', '<')
+
+
+def make_cursor(key: tuple) -> str:
+    """
+    Return keyset pagination cursor for the given item sort key
+
+    :param key: (collection flag, sort value, name) tuple
+
+    :return: cursor string passed back by the client in page[after] or
+        page[before]
+    """
+    return json.dumps(list(key), separators=(',', ':'))
+
+
+def parse_cursor(page: str) -> Tuple[bool, tuple]:
+    """
+    Parse keyset-based page specification
+
+    :param page: ">cursor" or "<cursor"; empty cursor means the first page
+        for ">" and the last page for "<"
+
+    :return: True for the page after the cursor, False for the page before,
+        and the (collection flag, sort value, name) cursor tuple or None
+    """
+    after = page[0] == '>'
+    if not page[1:]:
+        return after, None
+    try:
+        key = json.loads(page[1:])
+        if not isinstance(key, list) or len(key) != 3 or \
+                not isinstance(key[0], (bool, int)) or \
+                not isinstance(key[1], (str, int, float)) or \
+                not isinstance(key[2], str):
+            raise ValueError()
+    except ValueError:
+        raise ValidationError(
+            'page[after]' if after else 'page[before]', 'Invalid cursor')
+    return after, (bool(key[0]), key[1], key[2])
+
+
+def get_sort_value(key: str, collection: bool, size: Optional[int],
+                   t: Optional[Union[str, int]]) -> Union[str, int]:
+    """
+    Return the value used for sorting items besides the collection flag and
+    name
+
+    :param key: sorting key: "name", "size", or "time"
+    :param collection: item is a collection asset
+    :param size: item size
+    :param t: item time
+
+    :return: sort value; collections are sorted by name when sorting by size
+    """
+    if key == 'name':
+        return ''
+    if key == 'size':
+        return 0 if collection else size or 0
+    return t or ''
+
+
+def paginate(items: list, page_size: Optional[Union[int, str]], sort_by: str,
+             page: Optional[Union[int, str]],
+             get_key: Optional[Callable[[object, str], tuple]] = None) \
+        -> Tuple[list, Optional[PaginationInfo]]:
+    """
+    Handle pagination for lists of objects
 
-    return items, PaginationInfo(
+    Collections always go first. Sort keys are computed once per item; only
+    the requested page is fully sorted, so keyset-based requests for deep
+    pages do not require sorting the whole list.
+
+    :param items: list of items to paginate
+    :param page_size: number of items per page
+    :param sort_by: sorting key: "name", "size", or "time", optionally prefixed
+        by "+" or "-", with "-" indicating reverse sorting
+    :param page: optional page number (for page-based pagination), "first",
+        "last", ">cursor" (page after the given item), or "<cursor" (page
+        before the given item); see :func:`parse_cursor`
+    :param get_key: function returning the (collection flag, sort value,
+        name) tuple for the given item and sorting key; defaults to
+        :class:`DataProviderAsset` attributes
+
+    :return: list of items to return and pagination info
+    """
+    key, reverse = parse_sort(sort_by)
+    if get_key is None:
+        def get_key(asset: DataProviderAsset, k: str) -> tuple:
+            return (
+                bool(asset.collection),
+                get_sort_value(
+                    k, asset.collection, asset.metadata.get('size'),
+                    asset.metadata.get('time')),
+                asset.name)
+
+    # Put collections first in both sorting directions
+    def order_key(item_key: tuple) -> tuple:
+        return (item_key[0] ^ (not reverse),) + item_key[1:]
+
+    keyed = [(order_key(get_key(item, key)), item) for item in items]
+
+    if not is_keyset_page(page):
+        offset, limit, page_size, total_pages, page = get_page_bounds(
+            len(items), page_size, page)
+        if offset + limit < len(keyed)//2:
+            keyed = (heapq.nlargest if reverse else heapq.nsmallest)(
+                offset + limit, keyed, key=lambda x: x[0])
+        else:
+            keyed.sort(key=lambda x: x[0], reverse=reverse)
+        return [item for _, item in keyed[offset:offset + limit]], \
+            PaginationInfo(
+                sort=sort_by, page_size=page_size, total_pages=total_pages,
+                current_page=page)
+
+    _, limit, page_size, total_pages, _ = get_page_bounds(
+        len(items), page_size, None)
+    after, cursor = parse_cursor(page)
+    if cursor is None:
+        selected = keyed
+    else:
+        cursor = order_key(cursor)
+        if after ^ reverse:
+            selected = [x for x in keyed if x[0] > cursor]
+        else:
+            selected = [x for x in keyed if x[0] < cursor]
+    if after ^ reverse:
+        keyed = heapq.nsmallest(limit, selected, key=lambda x: x[0])
+    else:
+        keyed = heapq.nlargest(limit, selected, key=lambda x: x[0])
+    if not after:
+        keyed.reverse()
+    return [item for _, item in keyed], get_keyset_pagination(
+        [order_key(k) for k, _ in keyed], len(items) - len(selected),
+        len(selected), after, sort_by, page_size, total_pages)
+
+
+def get_keyset_pagination(keys: TList[tuple], num_skipped: int,
+                          num_selected: int, after: bool, sort_by: str,
+                          page_size: int, total_pages: int) \
+        -> PaginationInfo:
+    """
+    Return pagination info for a keyset-based page
+
+    :param keys: (collection flag, sort value, name) tuples for items on
+        the page
+    :param num_skipped: number of items on the other side of the cursor
+    :param num_selected: number of items on the requested side of the cursor
+    :param after: True for the page after the cursor, False for the page
+        before
+    :param sort_by: sorting mode
+    :param page_size: number of items per page
+    :param total_pages: total number of pages
+
+    :return: pagination info with cursors for the previous and next pages
+        if they exist
+    """
+    more = num_selected > len(keys)
+    if after:
+        has_prev, has_next = num_skipped > 0, more
+    else:
+        has_prev, has_next = more, num_skipped > 0
+    return PaginationInfo(
         sort=sort_by, page_size=page_size, total_pages=total_pages,
-        current_page=page)
+        first_item=make_cursor(keys[0]) if keys and has_prev else None,
+        last_item=make_cursor(keys[-1]) if keys and has_next else None)
+
+
+def glob_to_like(pattern: str) -> str:
+    """
+    Convert a glob-style name pattern to an SQL LIKE pattern with "\\" as
+    the escape character
+
+    :param pattern: pattern with "*" and "?" wildcards
+
+    :return: LIKE pattern
+    """
+    return ''.join(
+        '%' if c == '*' else '_' if c == '?'
+        else '\\' + c if c in '%_\\' else c for c in pattern)
+
+
+class AssetIndex(object):
+    """
+    Persistent SQLite index of local disk asset metadata
+
+    For each indexed directory, the index stores names, sizes, and
+    modification times of all its entries, as well as the metadata returned by
+    :meth:`LocalDiskDataProvider._get_asset` for data files. Directories are
+    synchronized with the index on access by scanning their entries without
+    reading files; a directory whose modification time has not changed is
+    rescanned only after `ttl` seconds to catch in-place file modifications.
+    File metadata is obtained lazily when needed for searching and is
+    refreshed when the file size or modification time changes. The index also
+    keeps the tracked disk usage of data roots, so that it is shared by all
+    processes using the same index.
+    """
+    def __init__(self, filename: str, ttl: float = 60):
+        """
+        Create or open an asset index
+
+        :param filename: SQLite database file name
+        :param ttl: directory rescan interval in seconds
+        """
+        self.filename = filename
+        self.ttl = ttl
+        d = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(d):
+            os.makedirs(d, exist_ok=True)
+        with closing(self.connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS assets ('
+                'dir TEXT NOT NULL, name TEXT NOT NULL, '
+                'collection INTEGER NOT NULL, size INTEGER, mtime_ns INTEGER, '
+                'parsed INTEGER NOT NULL DEFAULT 0, type TEXT, '
+                'width INTEGER, height INTEGER, object TEXT, filter TEXT, '
+                'time TEXT, metadata TEXT, PRIMARY KEY (dir, name))')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS assets_type '
+                'ON assets (dir, type)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS dirs ('
+                'dir TEXT PRIMARY KEY, mtime_ns INTEGER, synced REAL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS usage ('
+                'root TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                'scanned REAL NOT NULL)')
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Return a new connection to the index database
+
+        :return: SQLite connection; use as a context manager to commit
+            changes
+        """
+        return sqlite3.connect(self.filename, timeout=30)
+
+    def sync_dir(self, dirname: str) -> None:
+        """
+        Bring index entries for the given directory up to date
+
+        :param dirname: absolute directory path
+        """
+        st = os.stat(dirname)
+        with closing(self.connect()) as conn, conn:
+            row = conn.execute(
+                'SELECT mtime_ns, synced FROM dirs WHERE dir = ?',
+                (dirname,)).fetchone()
+            if row is not None and row[0] == st.st_mtime_ns and \
+                    time.time() - row[1] < self.ttl:
+                return
+
+            existing = {
+                name: (collection, size, mtime_ns)
+                for name, collection, size, mtime_ns in conn.execute(
+                    'SELECT name, collection, size, mtime_ns FROM assets '
+                    'WHERE dir = ?', (dirname,))}
+            seen, changed = set(), []
+            with os.scandir(dirname) as it:
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        # Hidden files are not listed
+                        continue
+                    # noinspection PyBroadException
+                    try:
+                        est = entry.stat()
+                        is_dir = entry.is_dir()
+                    except Exception:
+                        # Deleted while scanning
+                        continue
+                    seen.add(entry.name)
+                    key = (int(is_dir), est.st_size, est.st_mtime_ns)
+                    if existing.get(entry.name) == key:
+                        continue
+                    mtime = datetime.fromtimestamp(est.st_mtime).isoformat()
+                    changed.append((
+                        dirname, entry.name) + key + (
+                        int(is_dir), mtime,
+                        json.dumps({'time': mtime}) if is_dir else None))
+            if changed:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO assets (dir, name, collection, '
+                    'size, mtime_ns, parsed, time, metadata) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', changed)
+            deleted = [(dirname, name) for name in existing
+                       if name not in seen]
+            if deleted:
+                conn.executemany(
+                    'DELETE FROM assets WHERE dir = ? AND name = ?', deleted)
+            conn.execute(
+                'INSERT OR REPLACE INTO dirs (dir, mtime_ns, synced) '
+                'VALUES (?, ?, ?)', (dirname, st.st_mtime_ns, time.time()))
+
+    def parse(self, dirname: str, where: str, params: tuple,
+              get_asset: Callable[[str], DataProviderAsset]) -> None:
+        """
+        Obtain metadata for not yet parsed files matching the given condition
+
+        :param dirname: absolute directory path
+        :param where: extra SQL condition
+        :param params: condition parameters
+        :param get_asset: function returning asset for the given absolute
+            filename; raises :class:`errors.AfterglowError` for unsupported
+            files
+        """
+        with closing(self.connect()) as conn:
+            names = [name for name, in conn.execute(
+                f'SELECT name FROM assets WHERE dir = ? AND NOT parsed AND '
+                f'{where}', (dirname,) + params)]
+        updates = []
+        for name in names:
+            try:
+                metadata = get_asset(os.path.join(dirname, name)).metadata
+            except errors.AfterglowError:
+                # Not a supported data file
+                updates.append(('', None, None, None, None, None, None,
+                                dirname, name))
+                continue
+            except OSError:
+                # Deleted after scanning
+                continue
+            updates.append((
+                metadata.get('type'), metadata.get('width'),
+                metadata.get('height'), metadata.get('object'),
+                metadata.get('filter'), metadata.get('time'),
+                json.dumps(metadata, default=str), dirname, name))
+        if updates:
+            with closing(self.connect()) as conn, conn:
+                conn.executemany(
+                    'UPDATE assets SET parsed = 1, type = ?, width = ?, '
+                    'height = ?, object = ?, filter = ?, time = ?, '
+                    'metadata = ? WHERE dir = ? AND name = ?', updates)
+
+    def query(self, dirname: str, where: str, params: tuple, sort_by: str,
+              page_size: Optional[Union[int, str]],
+              page: Optional[Union[int, str]], time_col: str = 'time') \
+            -> Tuple[list, PaginationInfo]:
+        """
+        Return a page of index entries for the given directory matching
+        the given condition; sorting is the same as in :func:`paginate`
+
+        :param dirname: absolute directory path
+        :param where: extra SQL condition
+        :param params: condition parameters
+        :param sort_by: sorting key: "name", "size", or "time", optionally
+            prefixed by "+" or "-"
+        :param page_size: number of items per page
+        :param page: optional page number, "first", "last", ">cursor", or
+            "<cursor"
+        :param time_col: column used for sorting by time: "time" (metadata
+            time) or "mtime_ns" (file modification time)
+
+        :return: list of (name, collection, size, mtime_ns, metadata) tuples
+            and pagination info
+        """
+        key, reverse = parse_sort(sort_by)
+        if key == 'name':
+            value = "''"
+        elif key == 'size':
+            value = 'CASE WHEN collection THEN 0 ELSE COALESCE(size, 0) END'
+        else:
+            value = f"COALESCE({time_col}, '')" if time_col == 'time' \
+                else f'COALESCE({time_col}, 0)'
+        keyset = is_keyset_page(page)
+        if keyset:
+            after, cursor = parse_cursor(page)
+        else:
+            after, cursor = True, None
+        # Collections go first in both sorting directions
+        descending = reverse ^ (not after)
+        direction = 'DESC' if descending else 'ASC'
+        order = f'collection {"DESC" if after else "ASC"}, ' \
+            f'{value} {direction}, name {direction}'
+
+        with closing(self.connect()) as conn:
+            num_items = conn.execute(
+                f'SELECT COUNT(*) FROM assets WHERE dir = ? AND {where}',
+                (dirname,) + params).fetchone()[0]
+            if not keyset:
+                offset, limit, page_size, total_pages, page = \
+                    get_page_bounds(num_items, page_size, page)
+                rows = conn.execute(
+                    f'SELECT name, collection, size, mtime_ns, metadata '
+                    f'FROM assets WHERE dir = ? AND {where} '
+                    f'ORDER BY {order} LIMIT ? OFFSET ?',
+                    (dirname,) + params + (limit, offset)).fetchall() \
+                    if limit else []
+                return rows, PaginationInfo(
+                    sort=sort_by, page_size=page_size,
+                    total_pages=total_pages, current_page=page)
+
+            _, limit, page_size, total_pages, _ = get_page_bounds(
+                num_items, page_size, None)
+            if cursor is None:
+                num_selected = num_items
+            else:
+                c = int(cursor[0])
+                where += \
+                    f' AND (collection {"<" if after else ">"} ? OR ' \
+                    f'collection = ? AND ({value}, name) ' \
+                    f'{"<" if descending else ">"} (?, ?))'
+                params += (c, c, cursor[1], cursor[2])
+                num_selected = conn.execute(
+                    f'SELECT COUNT(*) FROM assets WHERE dir = ? AND {where}',
+                    (dirname,) + params).fetchone()[0]
+            rows = conn.execute(
+                f'SELECT name, collection, size, mtime_ns, metadata, {value} '
+                f'FROM assets WHERE dir = ? AND {where} '
+                f'ORDER BY {order} LIMIT ?',
+                (dirname,) + params + (limit,)).fetchall() if limit else []
+        if not after:
+            rows.reverse()
+        return [row[:-1] for row in rows], get_keyset_pagination(
+            [(bool(row[1]), row[-1], row[0]) for row in rows],
+            num_items - num_selected, num_selected, after, sort_by, page_size,
+            total_pages)
+
+    def invalidate(self, filename: str) -> None:
+        """
+        Remove the given file or directory tree from the index and force
+        rescanning of its parent directory; called after any modification
+
+        :param filename: absolute path
+        """
+        dirname, name = os.path.split(filename)
+        prefix = glob_to_like(filename + os.path.sep) + '%'
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                'DELETE FROM assets WHERE dir = ? AND name = ?',
+                (dirname, name))
+            conn.execute(
+                "DELETE FROM assets WHERE dir = ? OR dir LIKE ? ESCAPE '\\'",
+                (filename, prefix))
+            conn.execute(
+                "DELETE FROM dirs WHERE dir = ? OR dir LIKE ? ESCAPE '\\'",
+                (filename, prefix))
+            conn.execute(
+                'UPDATE dirs SET synced = 0 WHERE dir = ?', (dirname,))
+
+    def get_usage(self, root: str) -> Optional[Tuple[int, float]]:
+        """
+        Return the tracked disk usage of the given data root
+
+        :param root: absolute data root directory path
+
+        :return: usage in bytes and time of the last full scan or None if
+            the root has not been scanned yet
+        """
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                'SELECT size, scanned FROM usage WHERE root = ?',
+                (root,)).fetchone()
+
+    def set_usage(self, root: str, size: int, scanned: float) -> None:
+        """
+        Store the disk usage of the given data root after a full scan
+
+        :param root: absolute data root directory path
+        :param size: usage in bytes
+        :param scanned: scan time
+        """
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO usage (root, size, scanned) '
+                'VALUES (?, ?, ?)', (root, size, scanned))
+
+    def add_usage(self, root: str, delta: int) -> None:
+        """
+        Atomically adjust the tracked disk usage of the given data root;
+        does nothing if the root has not been scanned yet
+
+        :param root: absolute data root directory path
+        :param delta: change of the total size of files, in bytes
+        """
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                'UPDATE usage SET size = size + ? WHERE root = ?',
+                (delta, root))
+
+
+_indexes: TDict[str, AssetIndex] = {}
+_indexes_lock = Lock()
+
+
+def get_tree_size(filename: str) -> int:
+    """
+    Return the total size of a file or of all files within a directory tree
+
+    :param filename: absolute path to a file or directory
+
+    :return: number of bytes; 0 if the file does not exist
+    """
+    try:
+        if not os.path.isdir(filename):
+            return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+    total_size = 0
+    dirs = [filename]
+    while dirs:
+        try:
+            it = os.scandir(dirs.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                # noinspection PyBroadException
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    else:
+                        total_size += entry.stat().st_size
+                except Exception:
+                    # Deleted while scanning
+                    pass
+    return total_size
+
+
+# Tracked disk usage per data root for providers without an asset index:
+# root -> [usage, last full scan time]
+_usage: TDict[str, list] = {}
+_usage_lock = Lock()
 
 
 class LocalDiskDataProvider(DataProvider):
@@ -142,6 +737,8 @@ class LocalDiskDataProvider(DataProvider):
             enum=['file', 'directory', 'any']),
         width=dict(label='Image Width', type='int', min_val=1),
         height=dict(label='Image Height', type='int', min_val=1),
+        object=dict(label='Object Name', type='text'),
+        filter=dict(label='Filter', type='text'),
     )
     if PILImage is not None:
         search_fields['type']['enum'] += ['JPEG', 'PNG', 'TIFF']
@@ -150,19 +747,126 @@ class LocalDiskDataProvider(DataProvider):
 
     peruser: bool = False
     root: str = '.'
+    index: Optional[str] = None
+    index_ttl: float = 60
+    usage_ttl: float = 3600
+    usage_rescan_threshold: float = 0.9
+    hardlink_copies: bool = False
+
+    @property
+    def asset_index(self) -> Optional[AssetIndex]:
+        """
+        Persistent asset metadata index if enabled by setting `index` to
+        the index database file name; `index_ttl` is the directory rescan
+        interval in seconds
+
+        :return: asset index instance shared by all threads or None
+        """
+        if not self.index:
+            return None
+        filename = os.path.abspath(os.path.expanduser(self.index))
+        with _indexes_lock:
+            try:
+                return _indexes[filename]
+            except KeyError:
+                index = _indexes[filename] = AssetIndex(
+                    filename, self.index_ttl)
+                return index
+
+    def _invalidate_index(self, *filenames: str) -> None:
+        """
+        Update the asset index after modifying the given files or directories
+
+        :param filenames: absolute paths of modified assets
+        """
+        index = self.asset_index
+        if index is not None:
+            for filename in filenames:
+                index.invalidate(filename)
 
     @property
     def usage(self) -> int:
         """
         Return disk space usage
 
+        The full directory tree is scanned on the first call and then every
+        `usage_ttl` seconds to catch changes made outside of Afterglow; in
+        between, usage is updated incrementally by asset modification methods.
+        If the asset index is enabled, the tracked usage is stored there and
+        is shared by all processes; otherwise, it is tracked per process, and
+        :meth:`check_quota` rescans the tree when approaching the quota.
+
         :return: number of bytes within the data root directory
         """
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(self.abs_root):
-            for f in filenames:
-                total_size += os.path.getsize(os.path.join(dirpath, f))
-        return total_size
+        root = self.abs_root
+        index = self.asset_index
+        if index is not None:
+            tracked = index.get_usage(root)
+        else:
+            with _usage_lock:
+                tracked = _usage.get(root)
+        if tracked is not None and time.time() - tracked[1] < self.usage_ttl:
+            return tracked[0]
+        return self._rescan_usage()
+
+    def _rescan_usage(self) -> int:
+        """
+        Scan the data root directory tree and update the tracked disk usage
+
+        :return: number of bytes within the data root directory
+        """
+        root = self.abs_root
+        t = time.time()
+        usage = get_tree_size(root)
+        index = self.asset_index
+        if index is not None:
+            index.set_usage(root, usage, t)
+        else:
+            with _usage_lock:
+                _usage[root] = [usage, t]
+        return usage
+
+    def _update_usage(self, delta: int) -> None:
+        """
+        Adjust the tracked disk space usage after modifying assets
+
+        :param delta: change of the total size of files, in bytes
+        """
+        if delta:
+            index = self.asset_index
+            if index is not None:
+                index.add_usage(self.abs_root, delta)
+                return
+            with _usage_lock:
+                try:
+                    _usage[self.abs_root][0] += delta
+                except KeyError:
+                    # Not yet scanned; the next usage request will do it
+                    pass
+
+    def check_quota(self, path: Optional[str], data: Optional[bytes],
+                    size: Optional[int] = None) -> None:
+        """
+        Check that the new asset data will not exceed the data provider's quota
+
+        The tracked usage may miss changes made by other processes or outside
+        of Afterglow, so the data root is rescanned before checking if the
+        tracked usage after saving the data exceeds `usage_rescan_threshold`
+        of the quota.
+
+        :param path: asset path; must be set if updating existing asset
+        :param data: asset data being saved
+        :param size: total size of data being saved if `data` is not available
+            (e.g. when copying multiple assets at once)
+        """
+        quota = self.quota
+        if quota:
+            if size is None:
+                size = len(data) if data is not None else 0
+            if (self.usage or 0) + size > \
+                    quota*self.usage_rescan_threshold:
+                self._rescan_usage()
+        super().check_quota(path, data, size)
 
     @property
     def abs_root(self) -> str:
@@ -234,7 +938,7 @@ class LocalDiskDataProvider(DataProvider):
 
         # Asset is a file; try to read it and get metadata
         imtype = layers = imwidth = imheight = None
-        explength = exptime = telescope = flt = None
+        explength = exptime = telescope = flt = obj = None
 
         # A FITS file?
         # noinspection PyBroadException
@@ -259,6 +963,11 @@ class LocalDiskDataProvider(DataProvider):
                         except KeyError:
                             pass
 
+                        try:
+                            obj = str(hdr['OBJECT'])
+                        except KeyError:
+                            pass
+
                         try:
                             flt.append(str(hdr['FILTER']))
                         except KeyError:
@@ -413,6 +1122,8 @@ class LocalDiskDataProvider(DataProvider):
             asset.metadata['telescope'] = telescope
         if flt is not None:
             asset.metadata['filter'] = flt
+        if obj is not None:
+            asset.metadata['object'] = obj
 
         return asset
 
@@ -440,40 +1151,74 @@ class LocalDiskDataProvider(DataProvider):
         :param path: asset path; must identify a collection asset
         :param sort_by: optional sorting key
         :param page_size: optional number of assets per page
-        :param page: optional 0-based page number, "first", or "last"
+        :param page: optional 0-based page number, "first", "last",
+            ">cursor", or "<cursor", where cursor is the first_item or
+            last_item value returned in pagination info for keyset-based
+            pagination
 
         :return: list of :class:`DataProviderAsset` objects for child assets,
             total number of pages, and names of first and last asset on the
             page
         """
-        if isinstance(page, str) and page.startswith('>'):
-            raise ValidationError(
-                'page[after]', 'Keyset-based pagination not supported')
-        if isinstance(page, str) and page.startswith('<'):
-            raise ValidationError(
-                'page[before]', 'Keyset-based pagination not supported')
-
         filename = self._path_to_filename(path)
         if not os.path.isdir(filename):
             raise AssetNotFoundError(path=path)
 
         # Return directory contents
         root = self.abs_root
-        filenames, pagination = paginate(
-            glob(os.path.join(filename, '*')),
-            page_size, sort_by or 'name', page)
-
+        index = self.asset_index
+        if index is not None:
+            # List directory using the asset index
+            index.sync_dir(filename)
+            rows, pagination = index.query(
+                filename, '1', (), sort_by or 'name', page_size, page,
+                time_col='mtime_ns')
+            prefix = os.path.relpath(filename, root).replace('\\', '/')
+            return (
+                [DataProviderAsset(
+                     name=name,
+                     collection=bool(collection),
+                     path=name if prefix == '.' else prefix + '/' + name,
+                     metadata=dict(
+                         time=datetime.fromtimestamp(mtime_ns/1e9)
+                         .isoformat(),
+                         size=size,
+                     ),
+                 ) for name, collection, size, mtime_ns, _ in rows],
+                pagination)
+
+        # Stat each directory entry once: (name, collection, size, mtime_ns)
+        entries = []
+        with os.scandir(filename) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    # Skip hidden files like glob('*') does
+                    continue
+                # noinspection PyBroadException
+                try:
+                    st = entry.stat()
+                    entries.append((
+                        entry.name, entry.is_dir(), st.st_size,
+                        st.st_mtime_ns))
+                except Exception:
+                    # Deleted while scanning
+                    pass
+
+        entries, pagination = paginate(
+            entries, page_size, sort_by or 'name', page,
+            lambda e, k: (e[1], get_sort_value(k, e[1], e[2], e[3]), e[0]))
+
+        prefix = os.path.relpath(filename, root).replace('\\', '/')
         return (
             [DataProviderAsset(
-                 name=os.path.basename(fn),
-                 collection=os.path.isdir(fn),
-                 path=fn.split(root + os.path.sep)[1].replace('\\', '/'),
+                 name=name,
+                 collection=is_dir,
+                 path=name if prefix == '.' else prefix + '/' + name,
                  metadata=dict(
-                     time=datetime.fromtimestamp(os.stat(fn).st_mtime)
-                     .isoformat(),
-                     size=os.stat(fn).st_size,
+                     time=datetime.fromtimestamp(mtime_ns/1e9).isoformat(),
+                     size=size,
                  ),
-            ) for fn in filenames], pagination)
+             ) for name, is_dir, size, mtime_ns in entries], pagination)
 
     # noinspection PyShadowingBuiltins
     def find_assets(self, path: Optional[str] = None,
@@ -484,7 +1229,9 @@ class LocalDiskDataProvider(DataProvider):
                     type: Optional[str] = None,
                     collection: Optional[Union[str, int, bool]] = None,
                     width: Optional[Union[str, int]] = None,
-                    height: Optional[Union[str, int]] = None) \
+                    height: Optional[Union[str, int]] = None,
+                    object: Optional[str] = None,
+                    filter: Optional[str] = None) \
             -> Tuple[TList[DataProviderAsset], Optional[PaginationInfo]]:
         """
         Return a list of assets matching the given parameters
@@ -493,7 +1240,8 @@ class LocalDiskDataProvider(DataProvider):
             by default, search in the data provider root
         :param sort_by: optional sorting key; see :meth:`get_child_assets`
         :param page_size: optional number of assets per page
-        :param page: optional 0-based page number, "first", or "last"
+        :param page: optional 0-based page number, "first", "last",
+            ">cursor", or "<cursor"; see :meth:`get_child_assets`
         :param name: only return assets matching the given name; may include
             wildcards
         :param type: comma-separated list of data types ("FITS", "JPEG", etc.);
@@ -504,18 +1252,15 @@ class LocalDiskDataProvider(DataProvider):
             files)
         :param width: match only images of the given width
         :param height: match only images of the given height
+        :param object: match only images with object names containing
+            the given substring (case-insensitive)
+        :param filter: match only images with filter names containing
+            the given substring (case-insensitive)
 
         :return: list of :class:`DataProviderAsset` objects for assets matching
             the search query parameters, total number of pages, and names
             of first and last asset on the page
         """
-        if isinstance(page, str) and page.startswith('>'):
-            raise ValidationError(
-                'page[after]', 'Keyset-based pagination not supported')
-        if isinstance(page, str) and page.startswith('<'):
-            raise ValidationError(
-                'page[before]', 'Keyset-based pagination not supported')
-
         # Set up filters
         if type:
             type = type.split(',')
@@ -564,15 +1309,64 @@ class LocalDiskDataProvider(DataProvider):
         if not os.path.isdir(abs_path):
             raise AssetNotFoundError(path=path)
 
+        if name:
+            name = name.strip('*')
+
+        index = self.asset_index
+        if index is not None:
+            # Search using the asset index; parse only files that were not
+            # indexed yet or changed since the last search
+            where, params = ['1'], []
+            if name:
+                where.append("name LIKE ? ESCAPE '\\'")
+                params.append('%' + glob_to_like(name) + '%')
+            if collection is not None:
+                where.append('collection = ?')
+                params.append(int(collection))
+            index.sync_dir(abs_path)
+            index.parse(
+                abs_path, ' AND '.join(where + ['NOT collection']),
+                tuple(params),
+                lambda fn: self._get_asset(
+                    fn.split(root + os.path.sep)[1], fn))
+
+            where.append("(collection OR type != '')")
+            if type is not None:
+                where.append('type IN ({})'.format(','.join('?'*len(type))))
+                params += type
+            if width is not None:
+                where.append('width = ?')
+                params.append(width)
+            if height is not None:
+                where.append('height = ?')
+                params.append(height)
+            if object:
+                where.append("object LIKE ? ESCAPE '\\'")
+                params.append('%' + glob_to_like(object) + '%')
+            if filter:
+                where.append("filter LIKE ? ESCAPE '\\'")
+                params.append('%' + glob_to_like(filter) + '%')
+            rows, pagination = index.query(
+                abs_path, ' AND '.join(where), tuple(params),
+                sort_by or 'name', page_size, page)
+            prefix = os.path.relpath(abs_path, root).replace('\\', '/')
+            return (
+                [DataProviderAsset(
+                     name=asset_name,
+                     collection=bool(is_collection),
+                     path=asset_name if prefix == '.'
+                     else prefix + '/' + asset_name,
+                     metadata=json.loads(metadata) if metadata else {},
+                 ) for asset_name, is_collection, _, _, metadata in rows],
+                pagination)
+
         # Look through all files within the path with names containing
         # the given substring (case-insensitive)
         assets = []
         if name:
-            name = name.strip('*')
-            if name:
-                name = '*' + ''.join(
-                    '[{}{}]'.format(c.lower(), c.upper()) if c.isalpha() else c
-                    for c in name) + '*'
+            name = '*' + ''.join(
+                '[{}{}]'.format(c.lower(), c.upper()) if c.isalpha() else c
+                for c in name) + '*'
         if not name:
             name = '*'
         for filename in glob(os.path.join(abs_path, name)):
@@ -610,6 +1404,20 @@ class LocalDiskDataProvider(DataProvider):
                 except KeyError:
                     continue
 
+            if object:
+                try:
+                    if object.lower() not in asset.metadata['object'].lower():
+                        continue
+                except KeyError:
+                    continue
+
+            if filter:
+                try:
+                    if filter.lower() not in asset.metadata['filter'].lower():
+                        continue
+                except KeyError:
+                    continue
+
             # All checks passed
             assets.append(asset)
 
@@ -643,6 +1451,121 @@ class LocalDiskDataProvider(DataProvider):
             # noinspection PyUnresolvedReferences
             raise FilesystemError(reason=str(e))
 
+    def get_asset_filename(self, path: str) -> Optional[str]:
+        """
+        Return the name of the file holding data for a non-collection asset
+
+        :param path: asset path; must identify a non-collection asset
+
+        :return: absolute filename
+        """
+        filename = self._path_to_filename(path)
+        if not os.path.isfile(filename):
+            raise AssetNotFoundError(path=path)
+        return filename
+
+    def open_asset_data(self, path: str) -> BinaryIO:
+        """
+        Return a file object for reading data of a non-collection asset at
+        the given path; compressed files are decompressed on the fly, as in
+        :meth:`get_asset_data`
+
+        :param path: asset path; must identify a non-collection asset
+
+        :return: file object
+        """
+        filename = self.get_asset_filename(path)
+        try:
+            if os.path.splitext(filename)[1] == '.gz':
+                return gzip.GzipFile(filename, 'rb')
+            if os.path.splitext(filename)[1] == '.bz2':
+                return bz2.BZ2File(filename, 'rb')
+            return open(filename, 'rb')
+        except Exception as e:
+            # noinspection PyUnresolvedReferences
+            raise FilesystemError(reason=str(e))
+
+    def copy_asset_data(self, provider: DataProvider,
+                        src_asset: DataProviderAsset, dst_path: str,
+                        update: bool = False, force: bool = False,
+                        **kwargs) -> DataProviderAsset:
+        """
+        Copy a non-collection asset from the same or another data provider
+
+        Files stored on a local disk are copied as is without reading them
+        into memory (see :func:`copy_file`); if `hardlink_copies` is set,
+        hard links are created where possible. Data from other providers are
+        streamed to disk in chunks. The new file is written under a temporary
+        name and then atomically moved to the destination path.
+
+        :param provider: source data provider
+        :param src_asset: source asset
+        :param dst_path: destination asset path
+        :param update: update existing asset at `dst_path` vs create a new
+            asset
+        :param force: overwrite existing collection asset if updating
+
+        :return: new data provider asset object
+        """
+        filename = self._path_to_filename(dst_path)
+        if update:
+            if not os.path.exists(filename):
+                raise AssetNotFoundError(path=dst_path)
+            if os.path.isdir(filename) and not force:
+                raise CannotUpdateCollectionAssetError()
+            old_size = get_tree_size(filename)
+        else:
+            if os.path.exists(filename):
+                raise AssetAlreadyExistsError()
+            old_size = 0
+
+        src_filename = provider.get_asset_filename(src_asset.path)
+        tmp_filename = get_tmp_filename(filename)
+        try:
+            try:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                if src_filename is not None:
+                    copy_file(src_filename, tmp_filename, self.hardlink_copies)
+                else:
+                    with provider.open_asset_data(src_asset.path) as fsrc, \
+                            open(tmp_filename, 'wb') as fdst:
+                        shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+                size = os.path.getsize(tmp_filename)
+                if src_asset.metadata.get('size') is None:
+                    self.check_quota(dst_path if update else None, None, size)
+                if os.path.isdir(filename):
+                    shutil.rmtree(filename)
+                os.replace(tmp_filename, filename)
+            except Exception:
+                # noinspection PyBroadException
+                try:
+                    os.remove(tmp_filename)
+                except Exception:
+                    pass
+                raise
+        except errors.AfterglowError:
+            raise
+        except Exception as e:
+            # noinspection PyUnresolvedReferences
+            raise FilesystemError(reason=str(e))
+        finally:
+            self._invalidate_index(filename)
+            self._update_usage(get_tree_size(filename) - old_size)
+
+        try:
+            return self._get_asset(dst_path, filename)
+        except Exception:
+            if not update:
+                # Unsupported format or disk error
+                # noinspection PyBroadException
+                try:
+                    os.remove(filename)
+                except Exception:
+                    pass
+                else:
+                    self._update_usage(-size)
+            raise
+
     def create_asset(self, path: str, data: Optional[bytes] = None, **kwargs) \
             -> DataProviderAsset:
         """
@@ -675,10 +1598,13 @@ class LocalDiskDataProvider(DataProvider):
                 # Save data to disk
                 with open(filename, 'wb') as f:
                     f.write(data)
+                self._update_usage(len(data))
 
         except Exception as e:
             # noinspection PyUnresolvedReferences
             raise FilesystemError(reason=str(e))
+        finally:
+            self._invalidate_index(filename)
 
         try:
             return self._get_asset(path, filename)
@@ -689,6 +1615,8 @@ class LocalDiskDataProvider(DataProvider):
                 os.remove(filename)
             except Exception:
                 pass
+            else:
+                self._update_usage(-len(data or b''))
             raise
 
     def rename_asset(self, path: str, name: str, **kwargs) \
@@ -719,6 +1647,8 @@ class LocalDiskDataProvider(DataProvider):
             except Exception as e:
                 if new_filename.lower() != filename.lower():
                     raise FilesystemError(reason=str(e))
+            finally:
+                self._invalidate_index(filename, new_filename)
 
         return self._get_asset(
             new_filename.split(self.abs_root + os.path.sep)[1]
@@ -743,12 +1673,17 @@ class LocalDiskDataProvider(DataProvider):
         if os.path.isdir(filename):
             if not force:
                 raise CannotUpdateCollectionAssetError()
+            size = get_tree_size(filename)
             try:
                 shutil.rmtree(filename)
             except Exception as e:
                 raise FilesystemError(reason=str(e))
+            finally:
+                self._invalidate_index(filename)
+                self._update_usage(get_tree_size(filename) - size)
 
         try:
+            size = get_tree_size(filename)
             if data is None:
                 # Create a collection asset
                 if os.path.exists(filename):
@@ -756,11 +1691,17 @@ class LocalDiskDataProvider(DataProvider):
                     os.unlink(filename)
                 os.makedirs(filename)
             else:
-                # Save data to disk overwriting existing file
-                with open(filename, 'wb') as f:
+                # Save data to disk replacing the existing file instead of
+                # overwriting it, which would also modify its hard links
+                tmp_filename = get_tmp_filename(filename)
+                with open(tmp_filename, 'wb') as f:
                     f.write(data)
+                os.replace(tmp_filename, filename)
+            self._update_usage(len(data or b'') - size)
         except Exception as e:
             raise FilesystemError(reason=str(e))
+        finally:
+            self._invalidate_index(filename)
 
         return self._get_asset(path, filename)
 
@@ -775,18 +1716,24 @@ class LocalDiskDataProvider(DataProvider):
         if not os.path.exists(filename):
             raise AssetNotFoundError(path=path)
 
-        if os.path.isdir(filename):
-            try:
-                shutil.rmtree(filename)
-            except Exception as e:
-                # noinspection PyUnresolvedReferences
-                raise FilesystemError(reason=str(e))
-        else:
-            try:
-                os.remove(filename)
-            except Exception as e:
-                # noinspection PyUnresolvedReferences
-                raise FilesystemError(reason=str(e))
+        size = get_tree_size(filename)
+        try:
+            if os.path.isdir(filename):
+                try:
+                    shutil.rmtree(filename)
+                except Exception as e:
+                    # noinspection PyUnresolvedReferences
+                    raise FilesystemError(reason=str(e))
+            else:
+                try:
+                    os.remove(filename)
+                except Exception as e:
+                    # noinspection PyUnresolvedReferences
+                    raise FilesystemError(reason=str(e))
+        finally:
+            self._invalidate_index(filename)
+            # Account for partially deleted directory trees on failure
+            self._update_usage(get_tree_size(filename) - size)
 
 
 class RestrictedRWLocalDiskDataProvider(LocalDiskDataProvider):
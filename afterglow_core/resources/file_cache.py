@@ -0,0 +1,224 @@
+"""
+Afterglow Core: size-bounded on-disk cache of data retrieved from remote
+services
+"""
+
+import os
+from hashlib import sha256
+from threading import Event, Lock, get_ident
+from typing import Callable, Dict as TDict, Optional
+
+from flask import current_app
+
+
+__all__ = ['FileCache', 'get_file_cache']
+
+
+class _PendingItem(object):
+    """
+    Object being created by one of the threads requesting it
+    """
+    __slots__ = ['event', 'data', 'error']
+
+    def __init__(self):
+        self.event = Event()
+        self.data = self.error = None
+
+
+class FileCache(object):
+    """
+    Size-bounded on-disk cache of immutable binary objects
+
+    Objects are stored in files named by the SHA-256 hash of their keys and
+    are shared by all threads and processes using the same cache directory.
+    When the total size of cached files exceeds `max_size`, least recently
+    used files are evicted until the cache shrinks by 10% below the limit.
+    """
+    def __init__(self, root: str, max_size: int):
+        """
+        Create a file cache
+
+        :param root: cache directory
+        :param max_size: maximum total size of cached files in bytes
+        """
+        self.root = root
+        self.max_size = max_size
+        self._size = None
+        self._lock = Lock()
+        self._pending: TDict[str, _PendingItem] = {}
+        self._pending_lock = Lock()
+
+    def _filename(self, key: str) -> str:
+        """
+        Return the name of the file holding the object with the given key
+
+        :param key: object key
+
+        :return: absolute filename
+        """
+        h = sha256(key.encode('utf8')).hexdigest()
+        return os.path.join(self.root, h[:2], h)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Return cached object
+
+        :param key: object key
+
+        :return: object data or None if not cached
+        """
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        # Mark the file as recently used
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Add object to the cache, evicting least recently used objects
+        if needed; objects larger than the cache size are not cached
+
+        :param key: object key
+        :param data: object data
+        """
+        if len(data) > self.max_size:
+            return
+
+        filename = self._filename(key)
+        tmp_filename = '{}.{}.{}.tmp'.format(
+            filename, os.getpid(), get_ident())
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            try:
+                old_size = os.path.getsize(filename)
+            except OSError:
+                old_size = 0
+            with open(tmp_filename, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_filename, filename)
+        except OSError:
+            # Caching is optional; ignore disk errors
+            # noinspection PyBroadException
+            try:
+                os.remove(tmp_filename)
+            except Exception:
+                pass
+            return
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data) - old_size
+        self.evict()
+
+    def get_or_create(self, key: str, create: Callable[[], bytes]) -> bytes:
+        """
+        Return cached object or create and cache it; concurrent requests for
+        the same missing object wait for the first one to create it instead
+        of creating it again
+
+        :param key: object key
+        :param create: function returning object data; errors are propagated
+            to all waiting threads
+
+        :return: object data
+        """
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        with self._pending_lock:
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = _PendingItem()
+
+        if not owner:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.data
+
+        try:
+            pending.data = data = create()
+            self.put(key, data)
+            return data
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._pending_lock:
+                del self._pending[key]
+            pending.event.set()
+
+    def evict(self) -> None:
+        """
+        Remove least recently used objects if the cache size exceeds
+        the limit
+        """
+        with self._lock:
+            if self._size is not None and self._size <= self.max_size:
+                return
+
+            entries = []
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    filename = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(filename)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, filename))
+            self._size = sum(size for _, size, _ in entries)
+            if self._size <= self.max_size:
+                return
+
+            entries.sort()
+            target_size = self.max_size*0.9
+            for _, size, filename in entries:
+                if self._size <= target_size:
+                    break
+                try:
+                    os.remove(filename)
+                except OSError:
+                    continue
+                self._size -= size
+
+
+_caches: TDict[str, FileCache] = {}
+_caches_lock = Lock()
+
+
+def get_file_cache(name: str, max_size: int, root: Optional[str] = None) \
+        -> Optional[FileCache]:
+    """
+    Return a file cache shared by all threads
+
+    :param name: cache name; used as the cache subdirectory name in
+        DATA_ROOT/cache if `root` is not set
+    :param max_size: maximum total size of cached files in bytes; 0 disables
+        caching
+    :param root: optional cache directory
+
+    :return: file cache instance or None if caching is disabled
+    """
+    if not max_size:
+        return None
+    if root is None:
+        root = os.path.join(current_app.config['DATA_ROOT'], 'cache', name)
+    root = os.path.abspath(os.path.expanduser(root))
+    with _caches_lock:
+        try:
+            cache = _caches[root]
+        except KeyError:
+            cache = _caches[root] = FileCache(root, max_size)
+        else:
+            cache.max_size = max_size
+        return cache
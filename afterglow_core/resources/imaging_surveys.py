@@ -3,8 +3,23 @@ Afterglow Core: access to the various imaging surveys via SkyView
 (skyview.gsfc.nasa.gov)
 """
 
+from collections import OrderedDict
+from io import BytesIO
+from threading import Lock
+from typing import Callable, Dict as TDict, Optional, Tuple
 
-__all__ = ['default_size', 'survey_scales']
+import numpy as np
+import astropy.io.fits as pyfits
+from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_scales
+
+from .file_cache import FileCache, get_file_cache
+
+
+__all__ = [
+    'default_size', 'survey_scales', 'SurveyTileCache', 'crop_survey_image',
+    'get_survey_tile_cache',
+]
 
 
 # Default pixel scale for each known survey (arcsec/pixel); needed to return
@@ -114,3 +129,180 @@ survey_scales = {
 }
 
 default_size = 1024
+
+
+def crop_survey_image(data: bytes, ra: float, dec: float, width: float,
+                      height: float) -> Optional[bytes]:
+    """
+    Cut out a field from a larger survey image without resampling
+
+    :param data: FITS survey image
+    :param ra: field center RA in degrees
+    :param dec: field center Dec in degrees
+    :param width: field width in arcminutes
+    :param height: field height in arcminutes
+
+    :return: FITS image of the field, with WCS keywords adjusted for
+        the cutout, or None if the image has no celestial WCS or does not
+        fully cover the field
+    """
+    with pyfits.open(BytesIO(data), 'readonly') as f:
+        hdu = f[0]
+        hdr = hdu.header
+        if hdu.data is None or hdu.data.ndim != 2:
+            return None
+        # noinspection PyBroadException
+        try:
+            wcs = WCS(hdr)
+            if not wcs.has_celestial:
+                return None
+            wcs = wcs.celestial
+            scale_x, scale_y = proj_plane_pixel_scales(wcs)*60
+            x, y = wcs.all_world2pix(ra, dec, 0)
+        except Exception:
+            return None
+        if not np.isfinite([x, y]).all():
+            return None
+        w, h = int(width/scale_x + 0.5), int(height/scale_y + 0.5)
+        x0, y0 = int(np.floor(x - (w - 1)/2 + 0.5)), \
+            int(np.floor(y - (h - 1)/2 + 0.5))
+        ny, nx = hdu.data.shape
+        if w < 1 or h < 1 or x0 < 0 or y0 < 0 or x0 + w > nx or \
+                y0 + h > ny:
+            return None
+
+        hdr = hdr.copy()
+        for kw, offset in (('CRPIX1', x0), ('CRPIX2', y0)):
+            if kw in hdr:
+                hdr[kw] -= offset
+        # DSS plate solution keeps the cutout origin on the plate
+        for kw, offset in (('CNPIX1', x0), ('CNPIX2', y0)):
+            if kw in hdr:
+                hdr[kw] += offset
+        buf = BytesIO()
+        pyfits.PrimaryHDU(hdu.data[y0:y0 + h, x0:x0 + w], hdr).writeto(
+            buf, output_verify='silentfix+ignore')
+        return buf.getvalue()
+
+
+class SurveyTileCache(object):
+    """
+    Local cache of survey images ("tiles")
+
+    Images are cached on disk by a key identifying the survey, field center,
+    size, and pixel scale. A field that is not cached itself but is fully
+    covered by a larger cached image of the same survey at the same pixel
+    scale is cut out from that image. Concurrent requests for the same
+    missing image are coalesced into a single remote request.
+    """
+    max_tiles = 1000  # max number of tiles per survey used for cutouts
+
+    def __init__(self, cache: FileCache):
+        """
+        Create a survey image cache
+
+        :param cache: underlying file cache
+        """
+        self.cache = cache
+        # survey -> key -> (RA, Dec, width, height)
+        self._tiles: TDict[str, OrderedDict] = {}
+        self._lock = Lock()
+
+    def _find_covering_tiles(self, survey: str, ra: float, dec: float,
+                             width: float, height: float) -> list:
+        """
+        Return keys of known tiles that may cover the given field, smallest
+        first
+
+        :param survey: survey ID including pixel scale
+        :param ra: field center RA in degrees
+        :param dec: field center Dec in degrees
+        :param width: field width in arcminutes
+        :param height: field height in arcminutes
+
+        :return: list of tile keys
+        """
+        with self._lock:
+            tiles = list(self._tiles.get(survey, {}).items())
+        keys = []
+        for key, (tile_ra, tile_dec, tile_width, tile_height) in tiles:
+            dx = abs((ra - tile_ra + 180) % 360 - 180)*60 * \
+                np.cos(np.deg2rad(tile_dec))
+            dy = abs(dec - tile_dec)*60
+            if dx + width/2 <= tile_width/2 and \
+                    dy + height/2 <= tile_height/2:
+                keys.append((tile_width*tile_height, key))
+        return [key for _, key in sorted(keys)]
+
+    def get(self, survey: str, key: str,
+            fetch: Callable[[], bytes],
+            field: Optional[Tuple[float, float, float, float]] = None) \
+            -> bytes:
+        """
+        Return survey image from the cache, cut it out from a larger cached
+        image, or retrieve it
+
+        :param survey: survey ID; must include everything that affects pixel
+            scale
+        :param key: image key; must include survey ID
+        :param fetch: function retrieving the image from the remote service
+        :param field: optional (RA [deg], Dec [deg], width [arcmin],
+            height [arcmin]) of the image field; if omitted (e.g. if field
+            center is an object name), only exact matches are reused
+
+        :return: FITS image data
+        """
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        if field is not None:
+            for tile_key in self._find_covering_tiles(survey, *field):
+                tile = self.cache.get(tile_key)
+                if tile is None:
+                    # Evicted
+                    with self._lock:
+                        self._tiles.get(survey, {}).pop(tile_key, None)
+                    continue
+                data = crop_survey_image(tile, *field)
+                if data is not None:
+                    return data
+
+        data = self.cache.get_or_create(key, fetch)
+
+        if field is not None:
+            with self._lock:
+                tiles = self._tiles.setdefault(survey, OrderedDict())
+                tiles[key] = field
+                tiles.move_to_end(key)
+                while len(tiles) > self.max_tiles:
+                    tiles.popitem(last=False)
+        return data
+
+
+_tile_caches: TDict[str, SurveyTileCache] = {}
+_tile_caches_lock = Lock()
+
+
+def get_survey_tile_cache(name: str, max_size: int,
+                          root: Optional[str] = None) \
+        -> Optional[SurveyTileCache]:
+    """
+    Return a survey image cache shared by all threads
+
+    :param name: cache name; see :func:`get_file_cache`
+    :param max_size: maximum total size of cached images in bytes; 0 disables
+        caching
+    :param root: optional cache directory
+
+    :return: survey image cache instance or None if caching is disabled
+    """
+    cache = get_file_cache(name, max_size, root)
+    if cache is None:
+        return None
+    with _tile_caches_lock:
+        try:
+            return _tile_caches[cache.root]
+        except KeyError:
+            tile_cache = _tile_caches[cache.root] = SurveyTileCache(cache)
+            return tile_cache
@@ -214,91 +214,14 @@ class AlignmentJob(Job):
         else:
             ref_file_id = file_ids[ref_image]
 
-        alignment_kwargs = {}
-
         if isinstance(settings, AlignmentSettingsSourcesManual):
             # Check that all sources have file IDs
             if not settings.sources:
                 raise ValueError('Missing sources for manual alignment')
             if any(not hasattr(source, 'file_id') for source in settings.sources):
                 raise ValueError('Missing data file ID for at least one source')
-        elif isinstance(settings, AlignmentSettingsFeatures):
-            # Extract algorithm-specific keywords
-            alignment_kwargs['downsample'] = settings.downsample
-            if isinstance(settings, AlignmentSettingsFeaturesAKAZE):
-                if settings.descriptor_type not in ('KAZE', 'KAZE_UPRIGHT', 'MLDB', 'MLDB_UPRIGHT'):
-                    raise ValueError(f'Invalid descriptor type "{settings.descriptor_type}"')
-                if settings.diffusivity not in ('PM_G1', 'PM_G2', 'Weickert', 'Charbonnier'):
-                    raise ValueError(f'Invalid diffusivity "{settings.diffusivity}"')
-                alignment_kwargs = {
-                    'descriptor_type':
-                        cv.AKAZE_DESCRIPTOR_KAZE if settings.descriptor_type == 'KAZE' else
-                        cv.AKAZE_DESCRIPTOR_KAZE_UPRIGHT if settings.descriptor_type == 'KAZE_UPRIGHT' else
-                        cv.AKAZE_DESCRIPTOR_MLDB if settings.descriptor_type == 'MLDB' else
-                        cv.AKAZE_DESCRIPTOR_MLDB_UPRIGHT,
-                    'descriptor_size': settings.descriptor_size,
-                    'descriptor_channels': settings.descriptor_channels,
-                    'threshold': settings.threshold,
-                    'nOctaves': settings.octaves,
-                    'nOctaveLayers': settings.octave_layers,
-                    'diffusivity':
-                        cv.KAZE_DIFF_PM_G1 if settings.diffusivity == 'PM_G1' else
-                        cv.KAZE_DIFF_PM_G2 if settings.diffusivity == 'PM_G2' else
-                        cv.KAZE_DIFF_WEICKERT if settings.diffusivity == 'Weickert' else
-                        cv.KAZE_DIFF_CHARBONNIER,
-                }
-            elif isinstance(settings, AlignmentSettingsFeaturesBRISK):
-                alignment_kwargs = {
-                    'thresh': settings.threshold,
-                    'octaves': settings.octaves,
-                    'patternScale': settings.pattern_scale,
-                }
-            elif isinstance(settings, AlignmentSettingsFeaturesKAZE):
-                if settings.diffusivity not in ('PM_G1', 'PM_G2', 'Weickert', 'Charbonnier'):
-                    raise ValueError(f'Invalid diffusivity "{settings.diffusivity}"')
-                alignment_kwargs = {
-                    'extended': settings.extended,
-                    'upright': settings.upright,
-                    'threshold': settings.threshold,
-                    'nOctaves': settings.octaves,
-                    'nOctaveLayers': settings.octave_layers,
-                    'diffusivity':
-                        cv.KAZE_DIFF_PM_G1 if settings.diffusivity == 'PM_G1' else
-                        cv.KAZE_DIFF_PM_G2 if settings.diffusivity == 'PM_G2' else
-                        cv.KAZE_DIFF_WEICKERT if settings.diffusivity == 'Weickert' else
-                        cv.KAZE_DIFF_CHARBONNIER,
-                }
-            elif isinstance(settings, AlignmentSettingsFeaturesORB):
-                if settings.score_type not in ('Harris', 'fast'):
-                    raise ValueError(f'Invalid score type "{settings.score_type}"')
-                alignment_kwargs = {
-                    'nfeatures': settings.nfeatures,
-                    'scaleFactor': settings.scale_factor,
-                    'nlevels': settings.nlevels,
-                    'edgeThreshold': settings.edge_threshold,
-                    'firstLevel': settings.first_level,
-                    'WTA_K': settings.wta_k,
-                    'scoreType': cv.ORB_HARRIS_SCORE if settings.score_type == 'Harris' else cv.ORB_FAST_SCORE,
-                    'patchSize': settings.patch_size,
-                    'fastThreshold': settings.fast_threshold,
-                }
-            elif isinstance(settings, AlignmentSettingsFeaturesSIFT):
-                alignment_kwargs = {
-                    'nfeatures': settings.nfeatures,
-                    'nOctaveLayers': settings.octave_layers,
-                    'contrastThreshold': settings.contrast_threshold,
-                    'edgeThreshold': settings.edge_threshold,
-                    'sigma': settings.sigma,
-                    'descriptorType': cv.CV_32F if settings.descriptor_type == '32F' else cv.CV_8U,
-                }
-            elif isinstance(settings, AlignmentSettingsFeaturesSURF):
-                alignment_kwargs = {
-                    'hessianThreshold': settings.hessian_threshold,
-                    'nOctaves': settings.octaves,
-                    'nOctaveLayers': settings.octave_layers,
-                    'extended': settings.extended,
-                    'upright': settings.upright,
-                }
+
+        alignment_kwargs = get_alignment_kwargs(settings)
 
         # Handle progress: at least 2 stages (calculating and applying transforms)
         total_stages = 2
@@ -348,7 +271,7 @@ class AlignmentJob(Job):
         else:  # Mosaicing mode
             # Crop images to prevent memory overflow if realigning
             fovs, shapes, filters = {}, {}, {}
-            all_data = {}
+            all_data, contrast_step = {}, None
             for i, file_id in enumerate(file_ids):
                 with get_data_file_fits(self.user_id, file_id) as f:
                     hdr = f[0].header
@@ -405,7 +328,16 @@ class AlignmentJob(Job):
                 if isinstance(settings, AlignmentSettingsFeatures) and settings.global_contrast:
                     if settings.detect_edges:
                         data = np.hypot(nd.sobel(data, 0, mode='nearest'), nd.sobel(data, 1, mode='nearest'))
-                    all_data.setdefault(flt, []).append(data.ravel())
+                    if contrast_step is None:
+                        # Use a uniform subsample of pixels for global percentiles if the pixels of all images
+                        # (plus a concatenated copy) do not fit in the job RAM limit
+                        n = self.get_chunk_size(len(file_ids), data.nbytes*2/(1 << 20))
+                        contrast_step = -(-len(file_ids)//n)
+                    pixels = data.ravel()
+                    if contrast_step > 1:
+                        pixels = pixels[::contrast_step].copy()
+                    all_data.setdefault(flt, []).append(pixels)
+                    del pixels
 
                 del data
                 self.update_progress((i + 1)/len(file_ids)*100, stage, total_stages)
@@ -839,11 +771,103 @@ def calc_contrast(data: np.ndarray, percentile_min: float, percentile_max: float
     return clip_min, clip_max
 
 
-def get_transform(job: AlignmentJob, alignment_kwargs: dict[str, object], file_id: int, ref_file_id: int,
+def get_alignment_kwargs(settings: AlignmentSettings) -> dict[str, object]:
+    """
+    Return the algorithm-specific keywords for :func:`get_transform`
+    """
+    alignment_kwargs = {}
+    if isinstance(settings, AlignmentSettingsFeatures):
+        # Extract algorithm-specific keywords
+        alignment_kwargs['downsample'] = settings.downsample
+        if isinstance(settings, AlignmentSettingsFeaturesAKAZE):
+            if settings.descriptor_type not in ('KAZE', 'KAZE_UPRIGHT', 'MLDB', 'MLDB_UPRIGHT'):
+                raise ValueError(f'Invalid descriptor type "{settings.descriptor_type}"')
+            if settings.diffusivity not in ('PM_G1', 'PM_G2', 'Weickert', 'Charbonnier'):
+                raise ValueError(f'Invalid diffusivity "{settings.diffusivity}"')
+            alignment_kwargs = {
+                'descriptor_type':
+                    cv.AKAZE_DESCRIPTOR_KAZE if settings.descriptor_type == 'KAZE' else
+                    cv.AKAZE_DESCRIPTOR_KAZE_UPRIGHT if settings.descriptor_type == 'KAZE_UPRIGHT' else
+                    cv.AKAZE_DESCRIPTOR_MLDB if settings.descriptor_type == 'MLDB' else
+                    cv.AKAZE_DESCRIPTOR_MLDB_UPRIGHT,
+                'descriptor_size': settings.descriptor_size,
+                'descriptor_channels': settings.descriptor_channels,
+                'threshold': settings.threshold,
+                'nOctaves': settings.octaves,
+                'nOctaveLayers': settings.octave_layers,
+                'diffusivity':
+                    cv.KAZE_DIFF_PM_G1 if settings.diffusivity == 'PM_G1' else
+                    cv.KAZE_DIFF_PM_G2 if settings.diffusivity == 'PM_G2' else
+                    cv.KAZE_DIFF_WEICKERT if settings.diffusivity == 'Weickert' else
+                    cv.KAZE_DIFF_CHARBONNIER,
+            }
+        elif isinstance(settings, AlignmentSettingsFeaturesBRISK):
+            alignment_kwargs = {
+                'thresh': settings.threshold,
+                'octaves': settings.octaves,
+                'patternScale': settings.pattern_scale,
+            }
+        elif isinstance(settings, AlignmentSettingsFeaturesKAZE):
+            if settings.diffusivity not in ('PM_G1', 'PM_G2', 'Weickert', 'Charbonnier'):
+                raise ValueError(f'Invalid diffusivity "{settings.diffusivity}"')
+            alignment_kwargs = {
+                'extended': settings.extended,
+                'upright': settings.upright,
+                'threshold': settings.threshold,
+                'nOctaves': settings.octaves,
+                'nOctaveLayers': settings.octave_layers,
+                'diffusivity':
+                    cv.KAZE_DIFF_PM_G1 if settings.diffusivity == 'PM_G1' else
+                    cv.KAZE_DIFF_PM_G2 if settings.diffusivity == 'PM_G2' else
+                    cv.KAZE_DIFF_WEICKERT if settings.diffusivity == 'Weickert' else
+                    cv.KAZE_DIFF_CHARBONNIER,
+            }
+        elif isinstance(settings, AlignmentSettingsFeaturesORB):
+            if settings.score_type not in ('Harris', 'fast'):
+                raise ValueError(f'Invalid score type "{settings.score_type}"')
+            alignment_kwargs = {
+                'nfeatures': settings.nfeatures,
+                'scaleFactor': settings.scale_factor,
+                'nlevels': settings.nlevels,
+                'edgeThreshold': settings.edge_threshold,
+                'firstLevel': settings.first_level,
+                'WTA_K': settings.wta_k,
+                'scoreType': cv.ORB_HARRIS_SCORE if settings.score_type == 'Harris' else cv.ORB_FAST_SCORE,
+                'patchSize': settings.patch_size,
+                'fastThreshold': settings.fast_threshold,
+            }
+        elif isinstance(settings, AlignmentSettingsFeaturesSIFT):
+            alignment_kwargs = {
+                'nfeatures': settings.nfeatures,
+                'nOctaveLayers': settings.octave_layers,
+                'contrastThreshold': settings.contrast_threshold,
+                'edgeThreshold': settings.edge_threshold,
+                'sigma': settings.sigma,
+                'descriptorType': cv.CV_32F if settings.descriptor_type == '32F' else cv.CV_8U,
+            }
+        elif isinstance(settings, AlignmentSettingsFeaturesSURF):
+            alignment_kwargs = {
+                'hessianThreshold': settings.hessian_threshold,
+                'nOctaves': settings.octaves,
+                'nOctaveLayers': settings.octave_layers,
+                'extended': settings.extended,
+                'upright': settings.upright,
+            }
+    return alignment_kwargs
+
+
+def get_transform(job: Job, alignment_kwargs: dict[str, object], file_id: int, ref_file_id: int,
                   wcs_cache: dict[int, WCS], data_cache: dict[int, object], clip_min1: float | None = None,
-                  clip_max1: float | None = None, clip_min2: float | None = None, clip_max2: float | None = None) \
+                  clip_max1: float | None = None, clip_min2: float | None = None, clip_max2: float | None = None,
+                  settings: AlignmentSettings | None = None) \
         -> tuple[tuple[np.ndarray | None, np.ndarray], str]:
-    settings = job.settings
+    """
+    Return the transformation (matrix or None for pure shift, offset) of 0-based (y, x) reference image pixel
+    coordinates to the given image coordinates, i.e. in the backward direction assumed by :func:`apply_transform`, and
+    its description for the FITS history; `settings` default to the job settings
+    """
+    if settings is None:
+        settings = job.settings
     user_id = job.user_id
 
     if isinstance(settings, AlignmentSettingsWCS):
@@ -2,13 +2,17 @@
 Afterglow Core: data file and data provider asset batch download job plugins
 """
 
-from io import BytesIO
-from zipfile import ZIP_DEFLATED, ZipFile
+import os
+import shutil
+import time
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
 from typing import List as TList
 
 from marshmallow.fields import Integer, List, Nested, String
+from flask import current_app
 
 from ...models import Job
+from ...concurrency import imap_concurrently
 from ...errors import MissingFieldError, ValidationError
 from ...errors.data_file import UnknownDataFileGroupError
 from ...errors.data_provider import NonBrowseableDataProviderError, UnknownDataProviderError
@@ -19,6 +23,38 @@ from .. import data_providers
 __all__ = ['BatchDownloadJob', 'BatchAssetDownloadJob']
 
 
+# Extensions of files that are already compressed and are stored in archives
+# as is
+COMPRESSED_EXTENSIONS = {
+    '.gz', '.bz2', '.xz', '.fz', '.zip', '.7z', '.jpg', '.jpeg', '.png',
+    '.gif', '.webp', '.cr2', '.cr3', '.nef', '.arw', '.dng',
+}
+
+# MIME types of compressed local files downloaded as is
+COMPRESSED_MIMETYPES = {
+    '.gz': 'application/gzip',
+    '.bz2': 'application/x-bzip2',
+}
+
+# Buffer size for streaming data to archives
+CHUNK_SIZE = 1 << 20
+
+
+def get_compress_type(filename: str) -> int:
+    """
+    Return ZIP compression method for the given file: no compression for
+    already compressed files (e.g. gzipped or tile-compressed FITS), deflate
+    otherwise
+
+    :param filename: file name
+
+    :return: ZIP_STORED or ZIP_DEFLATED
+    """
+    if os.path.splitext(filename.lower())[1] in COMPRESSED_EXTENSIONS:
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+
 class BatchDownloadJob(Job):
     """
     Data file batch download job
@@ -72,34 +108,27 @@ class BatchDownloadJob(Job):
                 filenames[i] = filename
 
         # Add single-file groups to the archive as individual files at top
-        # level, multi-file groups as directories
-        data = BytesIO()
-        with ZipFile(data, 'w', ZIP_DEFLATED) as zf:
+        # level, multi-file groups as directories; the archive is written
+        # directly to the job file, and compressed data files are not
+        # recompressed
+        with self.open_job_file('download', 'application/zip') as f, \
+                ZipFile(f, 'w', ZIP_DEFLATED) as zf:
             for file_no, (file_ids, filename) in enumerate(
                     zip(file_id_lists, filenames)):
-                if len(file_ids) == 1:
-                    file_id = file_ids[0]
+                for i, file_id in enumerate(file_ids):
                     try:
+                        path = get_data_file_path(self.user_id, file_id)
                         zf.write(
-                            get_data_file_path(self.user_id, file_id),
-                            filename)
+                            path,
+                            filename if len(file_ids) == 1
+                            else filename + '/' + filename + '.' + str(i + 1),
+                            get_compress_type(path))
                     except Exception as e:
                         self.add_error(
                             e, {'file_id': file_id, 'filename': filename})
-                else:
-                    for i, file_id in enumerate(file_ids):
-                        try:
-                            zf.write(
-                                get_data_file_path(self.user_id, file_id),
-                                filename + '/' + filename + '.' + str(i + 1))
-                        except Exception as e:
-                            self.add_error(
-                                e, {'file_id': file_id, 'filename': filename})
 
                 self.update_progress((file_no + 1)/len(filenames)*100)
 
-        self.create_job_file('download', data.getvalue(), 'application/zip')
-
 
 class BatchAssetDownloadJob(Job):
     """
@@ -141,21 +170,48 @@ class BatchAssetDownloadJob(Job):
         for path in set(self.paths):
             walk(path)
 
+        def fetch(a):
+            # Return the local filename if available, otherwise retrieve
+            # asset data
+            fn = provider.get_asset_filename(a.path)
+            if fn is not None:
+                return fn
+            return provider.open_asset_data(a.path)
+
         if len(assets) == 1:
-            # Single non-collection asset; don't create archive
+            # Single non-collection asset; don't create archive, stream data
+            # to the job file; as in archives, local files are delivered as
+            # stored, without decompressing them
             asset = assets[0][0]
-            self.create_job_file('download', provider.get_asset_data(asset.path), mimetype=asset.mimetype)
+            src = fetch(asset)
+            mimetype = asset.mimetype
+            if isinstance(src, str):
+                mimetype = COMPRESSED_MIMETYPES.get(
+                    os.path.splitext(src.lower())[1], mimetype)
+                src = open(src, 'rb')
+            with src, self.open_job_file('download', mimetype) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
             return
 
-        # Add asset to archive
-        data = BytesIO()
-        with ZipFile(data, 'w', ZIP_DEFLATED) as zf:
-            for file_no, (asset, filename) in enumerate(assets):
+        # Add assets to archive while retrieving the next ones in parallel;
+        # the archive is written directly to the job file, and already
+        # compressed assets are not recompressed
+        with self.open_job_file('download', 'application/zip') as f, \
+                ZipFile(f, 'w', ZIP_DEFLATED) as zf:
+            for file_no, ((asset, filename), future) in enumerate(zip(
+                    assets, imap_concurrently(
+                        fetch, [asset for asset, _ in assets],
+                        current_app.config.get('BATCH_DOWNLOAD_THREADS', 4)))):
                 try:
-                    zf.writestr(filename, provider.get_asset_data(asset.path))
+                    src = future.result()
+                    if isinstance(src, str):
+                        zf.write(src, filename, get_compress_type(src))
+                    else:
+                        zinfo = ZipInfo(filename, time.localtime()[:6])
+                        zinfo.compress_type = get_compress_type(filename)
+                        with src, zf.open(zinfo, 'w', force_zip64=True) as dst:
+                            shutil.copyfileobj(src, dst, CHUNK_SIZE)
                 except Exception as e:
                     self.add_error(e, {'path': asset.path})
 
                 self.update_progress((file_no + 1)/len(assets)*100)
-
-        self.create_job_file('download', data.getvalue(), 'application/zip')
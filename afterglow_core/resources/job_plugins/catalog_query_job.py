@@ -2,20 +2,27 @@
 Afterglow Core: catalog query job plugin
 """
 
-from typing import Dict as TDict, List as TList, Optional
+from typing import Dict as TDict, List as TList, Optional, Tuple
 
 from marshmallow.fields import String, Integer, List, Nested, Dict
-from numpy import argmax, array, cos, deg2rad, r_, rad2deg, unwrap
-from numpy.ma import masked_array
+import numpy
+from numpy import array, asarray, cos, deg2rad, isfinite, sin, transpose, zeros
+from scipy.spatial import cKDTree
 from astropy.wcs import WCS
+from flask import current_app
 
-from ...models import Job, JobResult, CatalogSource
+from ...models import (
+    Job, JobResult, CatalogSource, concatenate_columns, parallel_map)
 from ...schemas import Float
 from ..catalogs import catalogs as known_catalogs
 from ..data_files import get_data_file_fits
 
 
-__all__ = ['CatalogQueryJob', 'run_catalog_query_job']
+__all__ = [
+    'CatalogQueryJob', 'get_unique_sources', 'merge_boxes',
+    'query_catalog_columns', 'radec_kdtree', 'radec_to_xyz',
+    'run_catalog_query_job',
+]
 
 
 def run_catalog_query_job(job: Job, catalogs: TList[str],
@@ -30,7 +37,37 @@ def run_catalog_query_job(job: Job, catalogs: TList[str],
                           skip_failed: bool = False) \
         -> TList[CatalogSource]:
     """
-    Catalog query job body; also used during photometric calibration
+    Catalog query returning catalog objects; used during photometric
+    calibration; see :func:`query_catalog_columns` for the description
+    of parameters
+
+    :return: list of catalog sources
+    """
+    return [
+        source
+        for catalog, columns in query_catalog_columns(
+            job, catalogs, ra_hours=ra_hours, dec_degs=dec_degs,
+            radius_arcmins=radius_arcmins, width_arcmins=width_arcmins,
+            height_arcmins=height_arcmins, file_ids=file_ids,
+            constraints=constraints, source_ids=source_ids,
+            skip_failed=skip_failed)
+        for source in known_catalogs[catalog].columns_to_sources(columns)]
+
+
+def query_catalog_columns(job: Job, catalogs: TList[str],
+                          ra_hours: Optional[float] = None,
+                          dec_degs: Optional[float] = None,
+                          radius_arcmins: Optional[float] = None,
+                          width_arcmins: Optional[float] = None,
+                          height_arcmins: Optional[float] = None,
+                          file_ids: Optional[TList[int]] = None,
+                          constraints: Optional[TDict[str, str]] = None,
+                          source_ids: Optional[TList[str]] = None,
+                          skip_failed: bool = False) \
+        -> TList[Tuple[str, TDict[str, numpy.ndarray]]]:
+    """
+    Catalog query job body; returns columnar query results (see
+    :meth:`Catalog.columns_to_sources`) for each catalog
 
     :param job: job class instance
     :param catalogs: list of catalog IDs to query
@@ -54,7 +91,8 @@ def run_catalog_query_job(job: Job, catalogs: TList[str],
         other query parameters
     :param skip_failed: ignore data files with no WCS in `file_ids` mode
 
-    :return: list of catalog sources
+    :return: list of (catalog ID, dictionary of column arrays) pairs in the
+        order of `catalogs`
     """
     # Check consistency of query parameters
     if not catalogs:
@@ -102,26 +140,26 @@ def run_catalog_query_job(job: Job, catalogs: TList[str],
         if catalog not in known_catalogs:
             raise ValueError('Unknown catalog "{}"'.format(catalog))
 
-    sources = []
-
     if source_ids:
         # Query specific sources by IDs
-        for catalog in catalogs:
-            sources += known_catalogs[catalog].query_objects(source_ids)
-        return sources
+        return list(zip(catalogs, run_catalog_queries(
+            job, [(catalog, 'query_objects_columns', (source_ids,))
+                  for catalog in catalogs])))
 
     if ra_hours is not None:
         # Query circular or rectangular area
         if radius_arcmins is None:
-            for catalog in catalogs:
-                sources += known_catalogs[catalog].query_box(
-                    ra_hours, dec_degs, width_arcmins, height_arcmins,
-                    constraints)
+            queries = [
+                (catalog, 'query_box_columns',
+                 (ra_hours, dec_degs, width_arcmins, height_arcmins,
+                  constraints))
+                for catalog in catalogs]
         else:
-            for catalog in catalogs:
-                sources += known_catalogs[catalog].query_circ(
-                    ra_hours, dec_degs, radius_arcmins, constraints)
-        return sources
+            queries = [
+                (catalog, 'query_circ_columns',
+                 (ra_hours, dec_degs, radius_arcmins, constraints))
+                for catalog in catalogs]
+        return list(zip(catalogs, run_catalog_queries(job, queries)))
 
     # Query by file IDs: analyze individual image FOVs to get the combined FOV,
     # which may be more efficient than querying each FOV separately if they
@@ -168,150 +206,271 @@ def run_catalog_query_job(job: Job, catalogs: TList[str],
             [(0, 0), (width - 1, 0), (width - 1, height - 1), (0, height - 1)],
             0).T
         ras %= 360
-        boxes.append((center[0], center[1],
-                      ras[ras < 180].max() - ras[ras >= 180].min() + 360,
-                      decs.max() - decs.min()))
-
-    if False:  # len(boxes) > 1:
-        # A catalog query region represented by its center and width/height is
-        # indeed a spherical rectangle bounded by two pairs of parallel great
-        # circles; to find the combined region, we first represent them by
-        # Lambert rectangles bounded by parallels and meridians, then find their
-        # bounding box using algorithm known from GIS, and finally enclose the
-        # combined Lambert rectangle in a true spherical rectangle
-        lats, lons = [], []
-        for ra, dec, width, height in boxes:
-            hw, hh = width/2, height/2
-            min_dec, max_dec = dec - hh, dec + hh
-            if min_dec > 0 or max_dec < 0:
-                hw /= max(cos(deg2rad(min_dec)), cos(deg2rad(max_dec)))
-            lats += [min_dec, max_dec]
-            lons.append(((ra - hw) % 360, (ra + hw) % 360))
-
-        # Use the minimal bounding box algorithm
-        min_dec, max_dec = min(lats), max(lats)
-        height = max_dec - min_dec
-        dec = min_dec + height/2
-        xs = array(lons).ravel()
-        xs.sort()
-        xs = r_[xs, xs[0] + 360]
-        biggest_gap = argmax(masked_array(
-            xs[1:] - xs[:-1],
-            [any(bb[0] <= xs[i] and bb[1] >= xs[i + 1]
-                 for bb in rad2deg(unwrap(deg2rad(lons))))
-             for i in range(len(xs) - 1)]))
-        ra_right, ra_left = xs[biggest_gap:biggest_gap + 2] % 360
-        if (ra_left, ra_right) == (0, 360):
-            width = 360
+        boxes.append((
+            float(center[0]), float(center[1]),
+            float(ras[ras < 180].max() - ras[ras >= 180].min() + 360),
+            float(decs.max() - decs.min())))
+
+    # Merge overlapping FOVs into a minimal set of query regions and query all
+    # catalogs for all regions concurrently
+    boxes = merge_boxes(boxes)
+    queries = [
+        (catalog, 'query_box_columns',
+         (ra/15, dec, width*60, height*60, constraints))
+        for catalog in catalogs for ra, dec, width, height in boxes]
+    results = run_catalog_queries(job, queries)
+    res = []
+    for i, catalog in enumerate(catalogs):
+        columns = concatenate_columns(
+            results[i*len(boxes):(i + 1)*len(boxes)])
+        if not columns:
+            res.append((catalog, columns))
+            continue
+        n = len(next(iter(columns.values())))
+        ra = get_float_column(columns, 'ra_hours', n)
+        dec = get_float_column(columns, 'dec_degs', n)
+        if len(boxes) > 1:
+            # Remove duplicates from overlapping regions
+            ids = columns.get('id')
+            if ids is None:
+                ids = [None]*n
+            else:
+                ids = [None if m else source_id for source_id, m in zip(
+                    numpy.ma.getdata(ids).tolist(),
+                    numpy.ma.getmaskarray(ids).tolist())]
+            good = zeros(n, bool)
+            good[get_unique_sources(ids, ra, dec)] = True
         else:
-            width = (ra_right - ra_left) % 360
-        ra = (ra_left + width/2) % 360
-        if min_dec > 0 or max_dec < 0:
-            width *= max(cos(deg2rad(min_dec)), cos(deg2rad(max_dec)))
+            good = numpy.ones(n, bool)
 
-        if width*height > sum(w*h for _, _, w, h in boxes):
-            # Individual FOVs are possibly too sparse for a combined FOV to be
-            # smaller; fall back to querying them one by one
-            ra = dec = width = height = None
-    else:
-        ra = dec = width = height = None
-
-    # TODO: Query a single enclosing region if data file FOVs overlap
-    # # To obtain the combined FOV, start with the first field
-    # total_ra, total_dec, total_ra_width, total_dec_width = boxes[0]
-    # for ra, dec, ra_width, dec_width in boxes[1:]:
-    #     # Extend the combined FOV; allow Dec to extend beyond the pole to get
-    #     # the correct box center and size
-    #     hw = total_ra_width/2
-    #     total_top, total_bottom = total_dec + hw, total_dec - hw
-    #     hw = dec_width/2
-    #     top, bottom = dec + hw, dec - hw
-    #     if top > total_top:
-    #         total_top = top
-    #     if bottom < total_bottom:
-    #         total_bottom = bottom
-    #     total_dec_width = total_top - total_bottom
-    #     total_dec = total_top - total_dec_width/2
-    #
-    #     total_cosd = cos(total_dec*pi/180)
-    #     if total_cosd:
-    #         hw = total_ra_width/2/total_cosd
-    #         if hw >= 180:
-    #             total_ra = total_ra_width = 180
-    #         else:
-    #             total_left = (total_ra - hw) % 360
-    #             total_right = (total_ra + hw) % 360
-    #             cosd = cos(dec*pi/180)
-    #             if cosd:
-    #                 hw = ra_width/2/cosd
-    #                 left, right = (ra - hw) % 360, (ra + hw) % 360
-    #                 if total_left > total_right:
-    #                     # Combined FOV crosses 0/360
-    #                     if left >= total_left or left <= total_right:
-    #                         # Partial overlap
-    #                         if right >= total_left or right <= total_right:
-    #                             # Combined FOV fully includes current FOV
-    #                             continue
-    #                         # Extend the right boundary
-    #                         total_right = right
-    #                     elif right >= total_left or right <= total_right:
-    #                         # Partial overlap, extend the left boundary
-    #                         total_left = left
-    #                     elif left > right:
-    #                         # Current FOV fully includes combined FOV
-    #                         total_left, total_right = left, right
-    #                     else:
-    #                         # No overlap; extend either left or right border,
-    #                         # depending on which one results in a smaller
-    #                         # combined FOV
-    #                         pass
-
-    if width is None:
-        # Query all data file FOVs
-        for catalog in catalogs:
-            catalog_sources = []
-            for ra, dec, width, height in boxes:
-                catalog_sources += known_catalogs[catalog].query_box(
-                    ra/15, dec, width*60, height*60, constraints)
-
-            if len(boxes) > 1 and catalog_sources:
-                # Remove duplicates from overlapping fields
-                i = 0
-                while i < len(catalog_sources):
-                    s = catalog_sources[i]
-                    id = [getattr(s, name, None)
-                          for name in ('id', 'ra_hours', 'dec_degs')]
-                    j = i + 1
-                    while j < len(catalog_sources):
-                        s1 = catalog_sources[j]
-                        if [getattr(s1, name, None) for name in (
-                                'id', 'ra_hours', 'dec_degs')] == id:
-                            del catalog_sources[j]
-                        else:
-                            j += 1
-                    i += 1
-
-            sources += catalog_sources
-    else:
-        # Query combined FOV
-        for catalog in catalogs:
-            sources += known_catalogs[catalog].query_box(
-                ra/15, dec, width*60, height*60, constraints)
-
-    # Keep only sources that are within any of the FOVs
-    final_sources = []
-    for s in sources:
-        good = False
+        # Keep only sources that are within any of the FOVs
+        in_fov = zeros(n, bool)
         for wcs in wcs_list:
-            x, y = wcs.all_world2pix(s.ra_hours*15, s.dec_degs, 0, quiet=True)
+            x, y = wcs.all_world2pix(ra*15, dec, 0, quiet=True)
             h, w = wcs.array_shape
-            if 0 <= x < w and 0 <= y < h:
-                good = True
-                break
-        if good:
-            final_sources.append(s)
+            in_fov |= (x >= 0) & (x < w) & (y >= 0) & (y < h)
+        good &= in_fov
+
+        res.append(
+            (catalog, {name: col[good] for name, col in columns.items()}))
+
+    return res
+
+
+def get_float_column(columns: TDict[str, numpy.ndarray], name: str, n: int) \
+        -> numpy.ndarray:
+    """
+    Return a numeric column of columnar query results as a float array with
+    NaNs in place of masked or missing values
+
+    :param columns: dictionary of column arrays
+    :param name: column name
+    :param n: number of rows
+
+    :return: float array
+    """
+    try:
+        col = columns[name]
+    except KeyError:
+        return numpy.full(n, numpy.nan)
+    return numpy.ma.filled(numpy.ma.asarray(col).astype(float), numpy.nan)
+
+
+def run_catalog_queries(job: Job,
+                        queries: TList[Tuple[str, str, tuple]]) \
+        -> TList[TDict[str, numpy.ndarray]]:
+    """
+    Run multiple columnar catalog queries concurrently in a bounded thread pool
+
+    The number of simultaneous queries is limited by the CATALOG_QUERY_THREADS
+    option. If any of the queries fails, the first error is raised after all
+    queries are complete.
+
+    :param job: job class instance
+    :param queries: list of (catalog name, query method name, positional
+        arguments), e.g. [("APASS", "query_box_columns", (ra, dec, w, h,
+        None))]
+
+    :return: list of query results in the original order
+    """
+    def query(q: Tuple[str, str, tuple]) \
+            -> Tuple[Optional[TDict[str, numpy.ndarray]], Optional[Exception]]:
+        catalog, method, args = q
+        try:
+            return getattr(known_catalogs[catalog], method)(*args), None
+        except Exception as e:
+            return None, e
+
+    results = parallel_map(
+        job, query, queries,
+        max_workers=current_app.config.get('CATALOG_QUERY_THREADS', 4),
+        total_stages=0)
+    for _, e in results:
+        if e is not None:
+            raise e
+    return [res or {} for res, _ in results]
 
-    return final_sources
+
+def merge_boxes(boxes: TList[Tuple[float, float, float, float]]) \
+        -> TList[Tuple[float, float, float, float]]:
+    """
+    Merge overlapping catalog query regions
+
+    Two regions are replaced by the enclosing one if the latter is not larger
+    than both regions combined. A region is represented by its center and
+    width/height, which is indeed a spherical rectangle bounded by two pairs
+    of parallel great circles; to find the combined region, the regions are
+    represented by Lambert rectangles bounded by parallels and meridians, then
+    their bounding box is found and enclosed in a true spherical rectangle.
+
+    :param boxes: list of regions (RA, Dec, width, height), all in degrees
+
+    :return: list of merged regions in the same format
+    """
+    def ra_half_width(box: Tuple[float, float, float, float]) -> float:
+        _, dec, width, height = box
+        hw = width/2
+        min_dec, max_dec = dec - height/2, dec + height/2
+        if min_dec > 0 or max_dec < 0:
+            hw /= max(cos(deg2rad(min_dec)), cos(deg2rad(max_dec)))
+        return hw
+
+    def enclose(box1: Tuple[float, float, float, float],
+                box2: Tuple[float, float, float, float]) \
+            -> Tuple[float, float, float, float]:
+        min_dec = min(box1[1] - box1[3]/2, box2[1] - box2[3]/2)
+        max_dec = max(box1[1] + box1[3]/2, box2[1] + box2[3]/2)
+        hw1, hw2 = ra_half_width(box1), ra_half_width(box2)
+        # RA range of the second box relative to the center of the first one
+        d = (box2[0] - box1[0] + 180) % 360 - 180
+        left, right = min(-hw1, d - hw2), max(hw1, d + hw2)
+        ra = (box1[0] + (left + right)/2) % 360
+        width = min(right - left, 360)
+        if min_dec > 0 or max_dec < 0:
+            width *= max(cos(deg2rad(min_dec)), cos(deg2rad(max_dec)))
+        return ra, (min_dec + max_dec)/2, width, max_dec - min_dec
+
+    # Discard identical regions, e.g. for a time series of the same field,
+    # and merge the remaining ones until no more regions can be merged
+    merged = sorted({
+        (round(ra*360), round(dec*360), round(width*300),
+         round(height*300)): (ra, dec, width, height)
+        for ra, dec, width, height in boxes}.values())
+    changed = True
+    while changed and len(merged) > 1:
+        changed = False
+        result = []
+        for box in merged:
+            for i, other in enumerate(result):
+                combined = enclose(other, box)
+                if combined[2]*combined[3] <= \
+                        other[2]*other[3] + box[2]*box[3]:
+                    result[i] = combined
+                    changed = True
+                    break
+            else:
+                result.append(box)
+        merged = result
+    return merged
+
+
+def remove_duplicates(sources: TList[CatalogSource],
+                      tol: float = 0.01) -> TList[CatalogSource]:
+    """
+    Remove duplicate sources returned by queries of overlapping regions of the
+    same catalog; sources are considered duplicate if they have the same ID
+    or, for sources without IDs, lie within the given distance; sources having
+    neither ID nor RA/Dec are always kept
+
+    :param sources: list of catalog sources
+    :param tol: position match tolerance in arcseconds
+
+    :return: list of unique sources in the original order
+    """
+    return [sources[i] for i in get_unique_sources(
+        [getattr(source, 'id', None) for source in sources],
+        array([getattr(source, 'ra_hours', None) for source in sources],
+              float),
+        array([getattr(source, 'dec_degs', None) for source in sources],
+              float),
+        tol)]
+
+
+def get_unique_sources(ids: list, ra_hours: numpy.ndarray,
+                       dec_degs: numpy.ndarray, tol: float = 0.01) \
+        -> TList[int]:
+    """
+    Return indices of unique sources in columnar results of queries of
+    overlapping regions of the same catalog; see :func:`remove_duplicates`
+
+    :param ids: source IDs, None for sources without IDs
+    :param ra_hours: source RAs in hours, NaN if unknown
+    :param dec_degs: source Decs in degrees, NaN if unknown
+    :param tol: position match tolerance in arcseconds
+
+    :return: sorted indices of unique sources
+    """
+    seen = set()
+    keep, anonymous = [], []
+    good_radec = (isfinite(ra_hours) & isfinite(dec_degs)).tolist()
+    for i, source_id in enumerate(ids):
+        if source_id is not None:
+            if source_id not in seen:
+                seen.add(source_id)
+                keep.append(i)
+        elif good_radec[i]:
+            anonymous.append(i)
+        else:
+            # Nothing to match by
+            keep.append(i)
+
+    if anonymous:
+        xyz = radec_to_xyz(ra_hours[anonymous], dec_degs[anonymous])
+        pairs = cKDTree(xyz).query_pairs(
+            2*sin(deg2rad(tol/3600)/2), output_type='ndarray')
+        duplicates = set()
+        for i, j in sorted(map(tuple, pairs)):
+            # Keep the first of each group of coincident sources
+            if i not in duplicates:
+                duplicates.add(j)
+        keep += [k for i, k in enumerate(anonymous) if i not in duplicates]
+
+    return sorted(keep)
+
+
+def radec_to_xyz(ra_hours, dec_degs) -> numpy.ndarray:
+    """
+    Convert RA/Dec to unit vectors; Euclidean distances between them are
+    chord lengths 2*sin(angdist/2), which allows angular matching with k-d
+    trees
+
+    :param ra_hours: RA in hours, scalar or array
+    :param dec_degs: Dec in degrees, same shape
+
+    :return: array of unit vectors of shape (..., 3)
+    """
+    ra = deg2rad(asarray(ra_hours, float)*15)
+    dec = deg2rad(asarray(dec_degs, float))
+    cd = cos(dec)
+    return numpy.stack([cd*cos(ra), cd*sin(ra), sin(dec)], -1)
+
+
+def radec_kdtree(sources: list) -> Optional[cKDTree]:
+    """
+    Build a k-d tree of unit vectors for sources with RA/Dec
+
+    :param sources: list of objects having `ra_hours` and `dec_degs`
+        attributes
+
+    :return: k-d tree or None if none of the sources has RA/Dec
+    """
+    radecs = [(source.ra_hours, source.dec_degs) for source in sources
+              if getattr(source, 'ra_hours', None) is not None and
+              getattr(source, 'dec_degs', None) is not None]
+    if not radecs:
+        return None
+    ra, dec = transpose(radecs)
+    return cKDTree(radec_to_xyz(ra, dec))
 
 
 class CatalogQueryJobResult(JobResult):
@@ -335,13 +494,18 @@ class CatalogQueryJob(Job):
     source_ids: TList[str] = List(String())
 
     def run(self):
-        object.__setattr__(self.result, 'data', run_catalog_query_job(
-            self, catalogs=self.catalogs,
-            ra_hours=getattr(self, 'ra_hours', None),
-            dec_degs=getattr(self, 'dec_degs', None),
-            radius_arcmins=getattr(self, 'radius_arcmins', None),
-            width_arcmins=getattr(self, 'width_arcmins', None),
-            height_arcmins=getattr(self, 'height_arcmins', None),
-            file_ids=getattr(self, 'file_ids', None),
-            constraints=getattr(self, 'constraints', None),
-            source_ids=getattr(self, 'source_ids', None)))
+        # Serialize columnar query results directly instead of creating
+        # a CatalogSource per row
+        data = []
+        for catalog, columns in query_catalog_columns(
+                self, catalogs=self.catalogs,
+                ra_hours=getattr(self, 'ra_hours', None),
+                dec_degs=getattr(self, 'dec_degs', None),
+                radius_arcmins=getattr(self, 'radius_arcmins', None),
+                width_arcmins=getattr(self, 'width_arcmins', None),
+                height_arcmins=getattr(self, 'height_arcmins', None),
+                file_ids=getattr(self, 'file_ids', None),
+                constraints=getattr(self, 'constraints', None),
+                source_ids=getattr(self, 'source_ids', None)):
+            data += known_catalogs[catalog].columns_to_dicts(columns)
+        object.__setattr__(self.result, 'data', data)
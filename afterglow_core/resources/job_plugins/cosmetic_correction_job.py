@@ -7,18 +7,20 @@ from __future__ import annotations
 from typing import List as TList, Optional
 
 import numpy as np
+from flask import current_app
 from marshmallow.fields import Integer, List, Nested
+import astropy.io.fits as pyfits
 
 from skylib.combine.stacking import combine
 from skylib.calibration.cosmetic import (
     correct_cols_and_pixels, flag_columns, flag_horiz, flag_pixels)
-from skylib.util.fits import get_fits_exp_length, get_fits_time
 
 from ...database import db
 from ...models import Job, JobResult
 from ...schemas import AfterglowSchema, Boolean, Float
 from ..data_files import (
-    create_data_file, get_data_file, get_data_file_data, get_data_file_fits, get_root, save_data_file)
+    DataFileRowReader, create_data_file, get_data_file, get_data_file_data, get_data_file_metadata, get_root,
+    save_data_file)
 
 
 __all__ = ['CosmeticCorrectionJob', 'run_cosmetic_correction_job']
@@ -62,38 +64,146 @@ class CosmeticCorrectionJob(Job):
             self, self.settings, getattr(self, 'file_ids', []), self.inplace)
 
 
-def group_key(user_id: int, file_id: int,
-              settings: CosmeticCorrectionSettings) -> Optional[tuple]:
+def group_key(metadata: dict,
+              settings: CosmeticCorrectionSettings) -> tuple:
     """
     Generate key identifying a group of uniform images that will be stacked to
     obtain defect map that will be then applied to all images in the group
 
-    :param user_id: job user ID
-    :param file_id: data file ID
+    :param metadata: cached data file metadata returned by
+        :func:`get_data_file_metadata`
     :param settings: cosmetic correction settings
 
-    :return: group key and exposure start time; (None, None) if data file
-        does not exist
+    :return: group key and exposure start time
     """
-    # noinspection PyBroadException
-    try:
-        with get_data_file_fits(user_id, file_id, read_data=False) as f:
-            hdr = f[0].header
-    except Exception:
-        return None, None
-
     # Always include image dimensions
-    key = hdr.get('NAXIS1', None), hdr.get('NAXIS2', None)
+    key = metadata['width'], metadata['height']
 
     if settings.group_by_instrument:
-        key += str(hdr.get('ORIGIN', '')) + '_' + \
-            str(hdr.get('TELESCOP', '')) + '_' + str(hdr.get('INSTRUME', '')),
+        key += metadata.get('origin', '') + '_' + \
+            metadata.get('telescope', '') + '_' + \
+            metadata.get('instrument', ''),
     if settings.group_by_filter:
-        key += hdr.get('FILTER', ''),
+        key += metadata.get('filter', ''),
     if settings.group_by_exp_length:
-        key += get_fits_exp_length(hdr),
+        key += metadata.get('exp_length'),
+
+    return key, metadata.get('time')
 
-    return key, get_fits_time(hdr)[0]
+
+def get_strip_height(job: Job, num_images: int, width: int, height: int,
+                     copies: float) -> int:
+    """
+    Return the number of image rows to process at once
+
+    :param job: job class instance
+    :param num_images: number of images processed simultaneously
+    :param width: image width
+    :param height: image height
+    :param copies: number of float32 arrays per image strip held in memory
+
+    :return: strip height that fits in the job RAM limit and, if possible,
+        in JOB_MAX_RAM
+    """
+    row_mb = num_images*width*copies*4/(1 << 20)
+    rows = job.get_chunk_size(height, row_mb)
+    max_ram = current_app.config.get('JOB_MAX_RAM')
+    if max_ram:
+        rows = min(rows, max(int(max_ram//row_mb), 1))
+    return rows
+
+
+def combine_group(job: Job, group: TList[int]) \
+        -> np.ndarray | np.ma.MaskedArray:
+    """
+    Combine images in horizontal strips streamed from all data files at once
+
+    :param job: job class instance
+    :param group: IDs of data files to combine; images must be of equal size
+
+    :return: combined image
+    """
+    readers = [DataFileRowReader(job.user_id, file_id) for file_id in group]
+    try:
+        width, height = readers[0].width, readers[0].height
+        rows = get_strip_height(job, len(readers), width, height, 3)
+        data = np.empty((height, width), np.float64)
+        mask = None
+        for y in range(0, height, rows):
+            h = min(rows, height - y)
+            res = combine(
+                [pyfits.HDUList([pyfits.PrimaryHDU(reader.read(y, h))])
+                 for reader in readers],
+                max_mem_mb=current_app.config.get('JOB_MAX_RAM'),
+                return_headers=False)[0]
+            data[y:y + h] = np.ma.getdata(res)
+            if isinstance(res, np.ma.MaskedArray) and \
+                    res.mask is not np.ma.nomask and res.mask.any():
+                if mask is None:
+                    mask = np.zeros(data.shape, bool)
+                mask[y:y + h] = res.mask
+            del res
+    finally:
+        for reader in readers:
+            reader.close()
+
+    if mask is not None:
+        data = np.ma.MaskedArray(data, mask)
+    return data
+
+
+def correct_image(job: Job, file_id: int, col_mask: np.ndarray,
+                  pixel_mask: np.ndarray,
+                  settings: CosmeticCorrectionSettings) \
+        -> tuple[np.ndarray, pyfits.Header]:
+    """
+    Apply cosmetic correction to a single image in horizontal strips; each
+    strip is corrected along with a few adjacent rows to avoid edge effects
+
+    :param job: job class instance
+    :param file_id: data file ID
+    :param col_mask: bad column mask returned by :func:`flag_columns`
+    :param pixel_mask: bad pixel mask returned by :func:`flag_pixels`
+    :param settings: cosmetic correction settings
+
+    :return: corrected float32 image with NaNs for masked pixels and FITS
+        header
+    """
+    def get_rows(mask: np.ndarray, y0: int, y1: int) -> np.ndarray:
+        if np.ndim(mask) == 2 and np.shape(mask)[0] == height:
+            return mask[y0:y1]
+        return mask
+
+    with DataFileRowReader(job.user_id, file_id) as reader:
+        width, height = reader.width, reader.height
+        halo = 4*max(settings.m_corr_pixel, 1)
+        rows = get_strip_height(job, 1, width, height, 4)
+        output = np.empty((height, width), np.float32)
+
+        # Rows [buf_y0, buf_y0 + len(buf)) read so far and still needed;
+        # keeping the overlapping rows allows to read the data file once
+        buf, buf_y0 = np.empty((0, width), np.float32), 0
+        for y in range(0, height, rows):
+            h = min(rows, height - y)
+            y0, y1 = max(y - halo, 0), min(y + h + halo, height)
+            buf_y1 = buf_y0 + len(buf)
+            buf = np.concatenate(
+                [buf[y0 - buf_y0:], reader.read(buf_y1, y1 - buf_y1)])
+            buf_y0 = y0
+
+            data = np.ma.masked_invalid(buf)
+            if data.mask is False or not data.mask.any():
+                data = data.data.copy()
+            data = correct_cols_and_pixels(
+                data, get_rows(col_mask, y0, y1),
+                get_rows(pixel_mask, y0, y1), m_col=settings.m_corr_col,
+                m_pixel=settings.m_corr_pixel)
+            if isinstance(data, np.ma.MaskedArray):
+                data = data.filled(np.nan)
+            output[y:y + h] = data[y - y0:y - y0 + h]
+            del data
+
+        return output, reader.header
 
 
 def run_cosmetic_correction_job(
@@ -116,11 +226,13 @@ def run_cosmetic_correction_job(
 
     :return: list of generated/modified data file IDs
     """
-    # Split files into groups by dimensions, instrument name, filter, and epoch
+    # Split files into groups by dimensions, instrument name, filter, and
+    # epoch using cached metadata, without opening data files
+    metadata = get_data_file_metadata(job.user_id, job_file_ids)
     groups = {}
     for file_id in job_file_ids:
-        key, t = group_key(job.user_id, file_id, settings)
-        if key is not None:
+        if file_id in metadata:
+            key, t = group_key(metadata[file_id], settings)
             groups.setdefault(key, []).append((t, file_id))
     # Sort images in each group by epoch; if no epoch, sort by file ID
     groups = [list(sorted(group)) for group in groups.values()]
@@ -149,30 +261,23 @@ def run_cosmetic_correction_job(
     new_file_ids = []
     files_processed = 0
     for group in groups:
-        if len(group) > 1:
-            # Combine images in group
-            fits = [get_data_file_fits(job.user_id, file_id) for file_id in group]
-            for hdul in fits:
-                if not hdul[0].data.dtype.isnative:
-                    hdul[0].data = hdul[0].data.astype(hdul[0].data.dtype.newbyteorder())
-            try:
-                data = combine(fits, return_headers=False)[0]
-            finally:
-                for f in fits:
-                    del f[0].data
-                    f.close()
-        else:
-            # Rely on the image itself to extract cosmetic correction data
-            data = get_data_file_data(job.user_id, group[0])[0]
-
-        # Extract cosmetic correction data
         try:
+            if len(group) > 1:
+                # Combine images in group in strips to limit the RAM usage
+                # regardless of the group size
+                data = combine_group(job, group)
+            else:
+                # Rely on the image itself to extract cosmetic correction data
+                data = get_data_file_data(job.user_id, group[0])[0]
+
+            # Extract cosmetic correction data
             if data.dtype.name != 'float64':
                 # Numba is faster for 64-bit floating point
                 data = data.astype(np.float64)
             initial_mask = flag_horiz(data, m=settings.m_col, nu=settings.nu_col)
             col_mask = flag_columns(initial_mask)
             pixel_mask = flag_pixels(data, col_mask, m=settings.m_pixel, nu=settings.nu_pixel)
+            del data, initial_mask
         except Exception as e:
             job.add_error(e, {'file_id': ','.join(str(file_id) for file_id in group)})
             continue
@@ -180,14 +285,7 @@ def run_cosmetic_correction_job(
         # Apply cosmetics data to all images in group
         for file_id in group:
             try:
-                data, hdr = get_data_file_data(job.user_id, file_id)
-                if data.dtype.name != 'float64':
-                    data = data.astype(np.float64)
-                if not data.dtype.isnative:
-                    data = data.astype(data.dtype.newbyteorder())
-                data = correct_cols_and_pixels(
-                    data, col_mask, pixel_mask, m_col=settings.m_corr_col,
-                    m_pixel=settings.m_corr_pixel)
+                data, hdr = correct_image(job, file_id, col_mask, pixel_mask, settings)
 
                 if inplace:
                     try:
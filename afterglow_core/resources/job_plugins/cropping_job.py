@@ -16,7 +16,9 @@ from ...database import db
 from ...models import Job, JobResult
 from ...schemas import AfterglowSchema, Boolean
 from ...errors import ValidationError
-from ..data_files import create_data_file, get_data_file, get_data_file_data, get_root, save_data_file
+from ..data_files import (
+    DataFileRowReader, create_data_file, get_data_file, get_data_file_data, get_data_file_metadata, get_root,
+    save_data_file)
 
 
 __all__ = ['CroppingJob', 'run_cropping_job']
@@ -77,23 +79,54 @@ def run_cropping_job(job: Job,
 
     auto_crop = not any([left, right, top, bottom])
     if auto_crop:
-        # Automatic cropping by masked pixels
+        # Automatic cropping by masked pixels; images whose valid pixels fill
+        # the bounding box stored along with the data file do not need to be
+        # read: their masks are exactly the complement of the bounding box
         width = height = mask = None
+        x0 = y0 = 0
+        x1 = y1 = None
+        metadata = get_data_file_metadata(job.user_id, job_file_ids)
 
         # Obtain the combined mask
         for file_id in job_file_ids:
-            data = get_data_file_data(job.user_id, file_id)[0]
+            footprint = metadata.get(file_id, {}).get('footprint')
+            if footprint is not None and \
+                    metadata[file_id].get('footprint_filled'):
+                shape = metadata[file_id]['height'], metadata[file_id]['width']
+                file_mask = None
+
+                # Intersect footprints
+                x0, y0 = max(x0, footprint[0]), max(y0, footprint[1])
+                x1 = footprint[2] if x1 is None else min(x1, footprint[2])
+                y1 = footprint[3] if y1 is None else min(y1, footprint[3])
+            else:
+                job.check_ram()
+                data = get_data_file_data(job.user_id, file_id)[0]
+                shape = data.shape
+                file_mask = data.mask \
+                    if isinstance(data, np.ma.MaskedArray) else None
+                del data
+
             if width is None:
-                height, width = data.shape
-            elif data.shape != (height, width):
+                height, width = shape
+            elif shape != (height, width):
                 raise ValueError('All images must be of equal shapes')
 
             # Merge all masks
-            if isinstance(data, np.ma.MaskedArray):
+            if file_mask is not None:
                 if mask is None:
-                    mask = data.mask.copy()
+                    mask = file_mask.copy()
                 else:
-                    mask |= data.mask
+                    mask |= file_mask
+
+        if x1 is not None and (x0, y0, x1, y1) != (0, 0, width, height):
+            # Mask everything outside the common footprint
+            if mask is None:
+                mask = np.zeros((height, width), bool)
+            footprint_mask = np.ones((height, width), bool)
+            footprint_mask[y0:y1, x0:x1] = False
+            mask |= footprint_mask
+            del footprint_mask
 
         if mask is not None and mask.any():
             left, right, bottom, top = get_auto_crop(mask)
@@ -108,13 +141,19 @@ def run_cropping_job(job: Job,
         # data files
         return job_file_ids
 
-    # Crop all data files and adjust WCS
+    # Crop all data files and adjust WCS; read only the rows within the crop
     new_file_ids = []
     for i, file_id in enumerate(job_file_ids):
         try:
-            data, hdr = get_data_file_data(job.user_id, file_id)
+            with DataFileRowReader(job.user_id, file_id) as reader:
+                hdr = reader.header
+                data = reader.read(
+                    bottom, max(reader.height - top - bottom, 0))[
+                    :, left:reader.width - right]
+            data = np.ma.masked_invalid(data)
+            if data.mask is False or not data.mask.any():
+                data = data.data
             if any([left, right, bottom, top]):
-                data = data[bottom:data.shape[0]-top, left:data.shape[1]-right]
                 hdr.add_history(
                     '[{}] Cropped by Afterglow with margins: left={}, '
                     'right={}, bottom={}, top={}'
@@ -2,6 +2,7 @@
 Afterglow Core: photometric calibration job plugin
 """
 
+from collections import Counter
 from datetime import datetime, timezone
 
 from marshmallow.fields import Integer, List, Nested
@@ -12,17 +13,16 @@ from scipy.optimize import brenth
 from astropy.wcs import WCS
 from flask import current_app
 
-from skylib.util.angle import angdist
 from skylib.util.fits import get_fits_time
 from skylib.util.stats import chauvenet
 
 from ...models import (
     Job, JobResult, CatalogSource, FieldCal, FieldCalResult, Mag, PhotSettings,
-    PhotometryData, SourceExtractionData, get_source_radec)
+    PhotometryData, SourceExtractionData, eval_mag_expr, get_source_radec)
 from ..data_files import get_data_file_fits
 from ..field_cals import get_field_cal
 from ..catalogs import catalogs as known_catalogs
-from .catalog_query_job import run_catalog_query_job
+from .catalog_query_job import radec_kdtree, radec_to_xyz, run_catalog_query_job
 from .source_extraction_job import (
     SourceExtractionSettings, run_source_extraction_job)
 from .photometry_job import run_photometry_job
@@ -137,10 +137,7 @@ class FieldCalJob(Job):
 
         wcss, epochs = {}, {}
         variable_check_tol = getattr(self.field_cal, 'variable_check_tol', 5)
-        if variable_check_tol and any(
-                None in (getattr(source, 'ra_hours', None), getattr(source, 'dec_degs'))
-                for source in catalog_sources
-                ) or getattr(self, 'source_extraction_settings', None) is not None:
+        if variable_check_tol or getattr(self, 'source_extraction_settings', None) is not None:
             for file_id in file_ids:
                 # noinspection PyBroadException
                 try:
@@ -165,16 +162,19 @@ class FieldCalJob(Job):
 
         if variable_check_tol:
             # To exclude known variable stars from the list of catalog sources, get all variable stars in all fields
-            var_stars = {}
-            for file_id in file_ids:
-                # noinspection PyBroadException
-                try:
-                    var_stars[file_id] = run_catalog_query_job(self, ['VSX'], file_ids=[file_id])
-                except Exception:
-                    # No WCS?
-                    var_stars[file_id] = []
-            unique_var_stars = list({star.id: star for star in sum(var_stars.values(), [])}.values())
-            for i, source in enumerate(list(catalog_sources)):
+            # with a single query over the combined footprint of all data files whenever possible
+            # noinspection PyBroadException
+            try:
+                var_stars = query_variable_stars([wcss[file_id] for file_id in file_ids if file_id in wcss],
+                                                 variable_check_tol)
+            except Exception as e:
+                self.add_warning(f'Could not query variable stars [{e}]')
+                var_stars = []
+            var_star_tree = radec_kdtree(var_stars)
+
+            # Calculate RA/Dec of catalog sources and group them by data file ID (None = all files)
+            source_radecs = {}
+            for i, source in enumerate(catalog_sources):
                 file_id = getattr(source, 'file_id', None)
                 if file_id is None:
                     epoch = wcs = None
@@ -188,11 +188,18 @@ class FieldCalJob(Job):
                         f"Could not check variability for source {getattr(source, 'id', None) or f'#{i + 1}'}: "
                         f"not enough info to calculate source RA/Dec [{e}]")
                     continue
-                file_id = getattr(source, 'file_id', None)
-                for star in var_stars[file_id] if file_id is not None else unique_var_stars:
-                    if angdist(ra, dec, star.ra_hours, star.dec_degs)*3600 < variable_check_tol:
-                        catalog_sources.remove(source)
-                        break
+                source_radecs.setdefault(file_id, []).append((i, ra, dec))
+
+            # Exclude sources within the given tolerance of known variable stars via a k-d tree of unit vectors
+            chord = 2*sin(deg2rad(variable_check_tol/3600)/2)
+            excluded = set()
+            if var_star_tree is not None:
+                for radecs in source_radecs.values():
+                    indices, ra, dec = transpose(radecs)
+                    counts = var_star_tree.query_ball_point(radec_to_xyz(ra, dec), chord, return_length=True)
+                    excluded.update(int(i) for i, n in zip(indices, counts) if n)
+            if excluded:
+                catalog_sources = [source for i, source in enumerate(catalog_sources) if i not in excluded]
 
         if detected_sources:
             # Match detected sources to input catalog sources by XY position in each image
@@ -407,21 +414,72 @@ class FieldCalJob(Job):
         if debug:
             logger.info('Filter lookup: %s', filter_lookup)
 
+        catalog_sources_by_id = {}
+        for catalog_source in catalog_sources:
+            catalog_sources_by_id.setdefault(catalog_source.id, catalog_source)
+        phot_data_for_file = {}
+        for source in phot_data:
+            phot_data_for_file.setdefault(source.file_id, []).append(source)
+
+        # Calculate reference magnitudes for filters missing from catalogs using filter lookup expressions; each
+        # expression is evaluated only once for all catalog sources sharing the same catalog and filter
+        derived_mags = {}
+        lookup_groups = {}
+        for source in phot_data:
+            catalog_source = catalog_sources_by_id.get(source.id)
+            if catalog_source is None:
+                continue
+            flt = getattr(source, 'filter', None)
+            if flt in (getattr(catalog_source, 'mags', None) or {}):
+                continue
+            lookup_groups.setdefault((getattr(catalog_source, 'catalog_name', None), flt), {})[catalog_source.id] = \
+                catalog_source
+        for (catalog_name, flt), group in lookup_groups.items():
+            try:
+                lookup = filter_lookup[catalog_name]
+            except KeyError:
+                continue
+            try:
+                expr = lookup[flt]
+            except KeyError:
+                # For unknown filters, try the default mapping if any
+                expr = lookup.get('*')
+                if expr is None:
+                    continue
+            group = list(group.values())
+            mag_names = {f for catalog_source in group for f in catalog_source.mags}
+            mags = {
+                f: array([getattr(catalog_source.mags.get(f), 'value', None) for catalog_source in group], float)
+                for f in mag_names}
+            mag_errors = {
+                f: array([getattr(catalog_source.mags.get(f), 'error', None) for catalog_source in group], float)
+                for f in mag_names}
+            # noinspection PyBroadException
+            try:
+                values, errors = eval_mag_expr(expr, mags, mag_errors)
+            except Exception:
+                # No magnitude available for the current filter+catalog; skip these sources
+                if debug:
+                    logger.warning('Magnitude calculation error for filter "%s"', flt, exc_info=True)
+                continue
+            for catalog_source, value, error in zip(group, values, errors):
+                if isfinite(value):
+                    mag = Mag(value=float(value))
+                    if error:
+                        mag.error = float(error)
+                    derived_mags[catalog_source.id, flt] = mag
+
         # For each data file ID, match photometry results to catalog sources and use (mag, ref_mag) pairs to obtain zero
         # point
-        context = dict(numpy.__dict__)
-        eps = 1e-7
         all_sources = []
         cal_results = {}
         for file_id in file_ids:
             sources = []
             total_sources = matched_sources = 0
-            for source in [source for source in phot_data if source.file_id == file_id]:
+            for source in phot_data_for_file.get(file_id, []):
                 total_sources += 1
-                try:
-                    catalog_source = [catalog_source for catalog_source in catalog_sources
-                                      if catalog_source.id == source.id][0]
-                except IndexError:
+                catalog_source = catalog_sources_by_id.get(source.id)
+                if catalog_source is None:
                     continue
                 matched_sources += 1
 
@@ -431,39 +489,9 @@ class FieldCalJob(Job):
                     mag = catalog_source.mags[flt]
                 except (AttributeError, KeyError):
                     # No magnitude available for the current filter+catalog; try custom filter lookup
-                    # noinspection PyBroadException
                     try:
-                        try:
-                            expr = filter_lookup[catalog_source.catalog_name][flt]
-                        except KeyError:
-                            # For unknown filters, try the default mapping if any
-                            expr = filter_lookup[catalog_source.catalog_name]['*']
-                        # Evaluate magnitude expression in the NumPy-enabled context extended with mags available for
-                        # the current catalog source
-                        ctx = dict(context)
-                        ctx.update({f: m.value for f, m in catalog_source.mags.items()})
-                        mag = Mag(value=eval(expr, ctx, {}))
-
-                        # Calculate the resulting magnitude error by coadding contributions from each filter
-                        err = 0
-                        for f, m in catalog_source.mags.items():
-                            e = getattr(m, 'error', None)
-                            if e:
-                                # Partial derivative of final mag with resp. to the current filter
-                                ctx[f] += eps
-                                # noinspection PyBroadException
-                                try:
-                                    err += ((eval(expr, ctx, {}) - mag.value)/eps*e)**2
-                                except Exception:
-                                    pass
-                                finally:
-                                    ctx[f] = m.value
-                        if err:
-                            mag.error = sqrt(err)
-                    except Exception:
-                        # No magnitude available for the current filter+catalog; skip this source
-                        if debug:
-                            logger.warning('Magnitude calculation error for filter "%s"', flt, exc_info=True)
+                        mag = derived_mags[catalog_source.id, flt]
+                    except KeyError:
                         continue
 
                 m = getattr(mag, 'value', None)
@@ -490,15 +518,13 @@ class FieldCalJob(Job):
         if source_inclusion_percent:
             # Keep only sources that are present in the given fraction of images
             nmin = max(int(source_inclusion_percent/100*len(cal_results) + 0.5), 1)
-            source_ids_to_keep, source_ids_to_remove = [], []
+            counts = Counter(source.id for source in all_sources if source.file_id in cal_results)
+            source_ids_to_keep, source_ids_to_remove = set(), set()
             for source in all_sources:
-                source_id = source.id
-                if source_id in source_ids_to_keep or source_id in source_ids_to_remove:
-                    continue
-                if len([s for s in all_sources if s.id == source_id and s.file_id in cal_results]) < nmin:
-                    source_ids_to_remove.append(source_id)
+                if counts[source.id] < nmin:
+                    source_ids_to_remove.add(source.id)
                 else:
-                    source_ids_to_keep.append(source_id)
+                    source_ids_to_keep.add(source.id)
             if source_ids_to_remove:
                 if source_ids_to_keep:
                     all_sources = [source for source in all_sources if source.id in source_ids_to_keep]
@@ -520,10 +546,9 @@ class FieldCalJob(Job):
         max_stars = getattr(self.field_cal, 'max_stars', 0)
         if len(cal_results) > 1 and (max_star_rms > 0 or max_stars > 0):
             # Recalculate the calibration using only best stars in terms of RMS for all images
-            sources_used = {
-                source_id: [source for source in all_sources if source.id == source_id]
-                for source_id in set(source.id for source in all_sources)
-            }
+            sources_used = {}
+            for source in all_sources:
+                sources_used.setdefault(source.id, []).append(source)
             sources_used = {source_id: sources for source_id, sources in sources_used.items() if len(sources) > 1}
             if not sources_used:
                 raise ValueError(
@@ -544,6 +569,7 @@ class FieldCalJob(Job):
                     raise ValueError('No sources satisfy max star RMS constraint')
             if max_stars > 0:
                 source_ids = source_ids[:max_stars]
+                source_ids = set(source_ids.tolist())
                 for file_id in list(cal_results.keys()):
                     sources = [source for source in cal_results[file_id][-1] if source.id in source_ids]
                     if sources:
@@ -585,6 +611,70 @@ class FieldCalJob(Job):
         object.__setattr__(self.result, 'data', result_data)
 
 
+def get_footprint_vectors(wcs: WCS) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Return the unit vectors of the image center and corners
+
+    :param wcs: image WCS with array shape set
+
+    :return: center unit vector and (4 x 3) array of corner unit vectors
+    """
+    h, w = wcs.array_shape
+    ra, dec = wcs.all_pix2world([(w - 1)/2, 0, w - 1, w - 1, 0], [(h - 1)/2, 0, 0, h - 1, h - 1], 0)
+    xyz = radec_to_xyz(asarray(ra) % 360/15, dec)
+    return xyz[0], xyz[1:]
+
+
+def query_variable_stars(wcs_list: list[WCS], tol: float) -> list[CatalogSource]:
+    """
+    Return known variable stars within the combined footprint of the given images
+
+    Identical footprints (e.g. a time series of the same field) are queried only once. If the circle enclosing all
+    distinct footprints is not larger than the footprints themselves, a single query is made; otherwise, each distinct
+    footprint is queried separately, and the results are merged.
+
+    :param wcs_list: WCSs of images
+    :param tol: variable star match tolerance in arcseconds; footprints are extended by this value
+
+    :return: list of unique variable stars
+    """
+    if not wcs_list:
+        return []
+    catalog = known_catalogs[current_app.config.get('VARIABLE_STAR_CATALOG', 'VSX')]
+
+    # Enclose each footprint in a circle and discard duplicate circles using the same granularity as catalog query
+    # caching
+    circles, centers, corners = {}, [], []
+    for wcs in wcs_list:
+        center, vertices = get_footprint_vectors(wcs)
+        radius = numpy.rad2deg(numpy.arccos(clip(vertices @ center, -1, 1)).max())*60 + tol/60
+        ra, dec = numpy.rad2deg(numpy.arctan2(center[1], center[0])) % 360/15, \
+            numpy.rad2deg(numpy.arcsin(clip(center[2], -1, 1)))
+        key = (round(ra*5400), round(dec*360), int(numpy.ceil(radius*5)))
+        if key not in circles:
+            circles[key] = (ra, dec, radius)
+            centers.append(center)
+            corners.append(vertices)
+
+    queries = list(circles.values())
+    if len(queries) > 1:
+        # Try a single circle enclosing all distinct footprints
+        center = numpy.sum(centers, 0)
+        norm = numpy.linalg.norm(center)
+        if norm > 1e-8:
+            center /= norm
+            radius = numpy.rad2deg(numpy.arccos(clip(numpy.concatenate(corners) @ center, -1, 1)).max())*60 + tol/60
+            if radius**2 <= sum(r**2 for _, _, r in queries):
+                queries = [(numpy.rad2deg(numpy.arctan2(center[1], center[0])) % 360/15,
+                            numpy.rad2deg(numpy.arcsin(clip(center[2], -1, 1))), radius)]
+
+    var_stars = {}
+    for ra, dec, radius in queries:
+        for star in catalog.query_circ(float(ra), float(dec), float(radius)):
+            var_stars.setdefault(getattr(star, 'id', None) or (star.ra_hours, star.dec_degs), star)
+    return list(var_stars.values())
+
+
 def sigma_eq(sigma2, sigmas2, b, m0):
     """
     Equation for finding sigma characterizing the goodness of fit
@@ -9,8 +9,10 @@ from scipy.ndimage import convolve
 from astropy.wcs import WCS
 from marshmallow.fields import Integer, List, Nested
 
-from ...models import Job, JobResult, ImageProperties
-from ..data_files import get_data_file_data, get_data_file_fits
+from ...models import Job, JobResult, ImageProperties, parallel_map
+from ..data_files import (
+    get_background_params, get_data_file_background, get_data_file_data,
+    get_data_file_fits, get_data_file_ram_mb)
 from .source_extraction_job import (
     SourceExtractionSettings, run_source_extraction_job)
 
@@ -30,6 +32,7 @@ class ImagePropsExtractionJobResult(JobResult):
 class ImagePropsExtractionJob(Job):
     type = 'image_props'
     description = 'Extraction of Image Properties'
+    memoizable = True
 
     result: ImagePropsExtractionJobResult = Nested(
         ImagePropsExtractionJobResult, dump_default={})
@@ -46,83 +49,110 @@ class ImagePropsExtractionJob(Job):
             SourceExtractionSettings()
         source_extraction_settings.centroid = False
 
-        for file_no, file_id in enumerate(self.file_ids):
-            try:
-                # Detect sources using the settings provided
-                sources, background_info = run_source_extraction_job(
-                    self, source_extraction_settings, [file_id],
-                    total_stages=0)
-                if not sources:
-                    raise RuntimeError('Could not detect any sources')
-                background, background_rms = background_info.get(
-                    file_id, (None, None))
-                signal = (get_data_file_data(self.user_id, file_id)[0] -
-                          background)
-                flux = signal.sum()
-                noise = flux + (background_rms**2).sum()
-                if noise > 0:
-                    global_snr = flux/sqrt(noise)
-                else:
-                    global_snr = 0
-                if background is not None:
-                    background = background.mean()
-                if background_rms is not None:
-                    background_rms = background_rms.mean()
-
-                # Calculate the median of FWHMs along the minor axis
-                seeing_pixels = median([source.fwhm_y for source in sources])
-
-                # Calculate median ellipticity
-                ellipticity = median([1 - source.fwhm_y/source.fwhm_x
-                                      for source in sources])
-
-                # Convert seeing to arcsecs if pixel scale is available
-                with get_data_file_fits(self.user_id, file_id, read_data=False) as f:
-                    hdr = f[0].header
-                # noinspection PyBroadException
-                try:
-                    hdr['CRVAL1'] %= 360  # Ensure RA is in [0, 360) range
-                    wcs = WCS(hdr, relax=True)
-                    if not wcs.has_celestial:
-                        wcs = None
-                except Exception:
-                    wcs = None
-                if wcs is None:
-                    scale = hdr.get('SECPIX')
-                else:
-                    scales = wcs.proj_plane_pixel_scales()
-                    scale = (scales[0].to('arcsec').value +
-                             scales[1].to('arcsec').value)/2
-                if scale:
-                    seeing_arcsec = seeing_pixels*scale
-                else:
-                    seeing_arcsec = None
-
-                # Calculate sharpness as stddev of absolute value of Laplacian
-                m = signal.mean()
-                if m:
-                    sharpness = abs(
-                        convolve(signal/m, L, mode='nearest')).std()
-                else:
-                    sharpness = 0
-
-                self.result.data.append(ImageProperties(
-                    file_id=file_id,
-                    background_counts=background,
-                    background_rms_counts=background_rms,
-                    num_sources=len(sources),
-                    num_saturated_sources=len(
-                        [source for source in sources
-                         if getattr(source, 'sat_pixels', 0)]),
-                    seeing_pixels=seeing_pixels,
-                    seeing_arcsec=seeing_arcsec,
-                    ellipticity=ellipticity,
-                    global_snr=global_snr,
-                    sharpness=sharpness,
-                ))
-
-            except Exception as e:
-                self.add_error(e, {'file_id': file_id})
-            finally:
-                self.update_progress(
-                    (file_no + 1)/len(self.file_ids)*100, 1, 2)
+        # Image, background, RMS (both extracted and saved), and temporaries,
+        # all in double precision
+        item_ram_mb = get_data_file_ram_mb(
+            self.user_id, self.file_ids, copies=10, itemsize=8)
+
+        self.result.data.extend(
+            props for props in parallel_map(
+                self,
+                lambda file_id: self.process_file(
+                    file_id, source_extraction_settings),
+                self.file_ids, item_ram_mb=item_ram_mb, stage=1,
+                total_stages=2)
+            if props is not None)
+
+    def process_file(self, file_id: int,
+                     source_extraction_settings: SourceExtractionSettings) \
+            -> ImageProperties:
+        """
+        Extract properties of a single image
+
+        :param file_id: data file ID
+        :param source_extraction_settings: source extraction settings
+
+        :return: image properties
+        """
+        # Full-frame background maps saved by a previous source extraction
+        # with the same background parameters if any
+        maps = get_data_file_background(
+            self.user_id, file_id, get_background_params(
+                source_extraction_settings.bk_size,
+                source_extraction_settings.bk_filter_size))
+
+        # Detect sources using the settings provided
+        sources, background_info = run_source_extraction_job(
+            self, source_extraction_settings, [file_id],
+            total_stages=0)
+        if not sources:
+            raise RuntimeError('Could not detect any sources')
+        data = get_data_file_data(self.user_id, file_id)[0]
+        if maps is None or maps[0].shape != data.shape:
+            # Use the maps estimated during extraction
+            maps = background_info.get(file_id, (None, None))
+        background, background_rms = maps
+        signal = data - background
+        del data
+        flux = signal.sum()
+        noise = flux + (background_rms**2).sum()
+        if noise > 0:
+            global_snr = flux/sqrt(noise)
+        else:
+            global_snr = 0
+        if background is not None:
+            background = background.mean()
+        if background_rms is not None:
+            background_rms = background_rms.mean()
+
+        # Calculate the median of FWHMs along the minor axis
+        seeing_pixels = median([source.fwhm_y for source in sources])
+
+        # Calculate median ellipticity
+        ellipticity = median([1 - source.fwhm_y/source.fwhm_x
+                              for source in sources])
+
+        # Convert seeing to arcsecs if pixel scale is available
+        with get_data_file_fits(self.user_id, file_id, read_data=False) as f:
+            hdr = f[0].header
+        # noinspection PyBroadException
+        try:
+            hdr['CRVAL1'] %= 360  # Ensure RA is in [0, 360) range
+            wcs = WCS(hdr, relax=True)
+            if not wcs.has_celestial:
+                wcs = None
+        except Exception:
+            wcs = None
+        if wcs is None:
+            scale = hdr.get('SECPIX')
+        else:
+            scales = wcs.proj_plane_pixel_scales()
+            scale = (scales[0].to('arcsec').value +
+                     scales[1].to('arcsec').value)/2
+        if scale:
+            seeing_arcsec = seeing_pixels*scale
+        else:
+            seeing_arcsec = None
+
+        # Calculate sharpness as stddev of absolute value of Laplacian
+        m = signal.mean()
+        if m:
+            sharpness = abs(
+                convolve(signal/m, L, mode='nearest')).std()
+        else:
+            sharpness = 0
+
+        return ImageProperties(
+            file_id=file_id,
+            background_counts=background,
+            background_rms_counts=background_rms,
+            num_sources=len(sources),
+            num_saturated_sources=len(
+                [source for source in sources
+                 if getattr(source, 'sat_pixels', 0)]),
+            seeing_pixels=seeing_pixels,
+            seeing_arcsec=seeing_arcsec,
+            ellipticity=ellipticity,
+            global_snr=global_snr,
+            sharpness=sharpness,
+        )
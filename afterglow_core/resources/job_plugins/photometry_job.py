@@ -2,11 +2,14 @@
 Afterglow Core: batch photometry job plugin
 """
 
+import warnings
 from datetime import datetime
-from typing import List as TList
+from typing import List as TList, Optional
 
 from marshmallow.fields import Integer, List, Nested
-from numpy import concatenate, deg2rad, isfinite, zeros
+from numba import njit, prange
+import numpy as np
+from numpy import deg2rad, errstate, isfinite, zeros
 from astropy.wcs import WCS
 import sep
 
@@ -16,12 +19,34 @@ from skylib.util.fits import (
     get_fits_exp_length, get_fits_gain, get_fits_time)
 
 from ...models import (
-    Job, JobResult, SourceExtractionData, PhotSettings, PhotometryData,
-    sigma_to_fwhm, get_source_xy)
-from ..data_files import get_data_file_data
+    Job, JobResult, Lightcurve, LightcurveSource, SourceExtractionData, PhotSettings, PhotometryData,
+    sigma_to_fwhm, get_sources_xy, parallel_map)
+from ...schemas import Boolean, NestedPoly
+from ..data_files import (
+    get_background_params, get_data_file_background, get_data_file_data, get_data_file_fits, get_data_file_ram_mb)
+from .alignment_job import AlignmentSettings, get_alignment_kwargs, get_transform
+from .source_extraction_job import SourceExtractionSettings
 
 
-__all__ = ['PhotometryJob', 'run_photometry_job']
+__all__ = ['PhotometryJob', 'run_lightcurve_photometry_job', 'run_photometry_job']
+
+
+def subtract_background(user_id: Optional[int], file_id: int, data: np.ndarray) -> np.ndarray:
+    """
+    Subtract the background map saved by source extraction with the default settings, if any, so that the local
+    annulus background only accounts for the residual sky level instead of the full background and its gradient
+
+    :param user_id: current user ID (None if user auth is disabled)
+    :param file_id: data file ID
+    :param data: full image data
+
+    :return: background-subtracted image data or the original data if there is no saved background map
+    """
+    settings = SourceExtractionSettings()
+    maps = get_data_file_background(user_id, file_id, get_background_params(settings.bk_size, settings.bk_filter_size))
+    if maps is None or maps[0].shape != data.shape:
+        return data
+    return data - maps[0]
 
 
 def run_photometry_job(job: Job,
@@ -104,120 +129,543 @@ def run_photometry_job(job: Job,
     # Apply custom zero point to instrumental mags if requested
     m0 = getattr(settings, 'zero_point', None) or 0
 
-    result_data = []
-    for file_no, file_id in enumerate(file_ids):
+    def photometer_file(file_id: int) -> TList[PhotometryData]:
+        file_phot_kw = dict(phot_kw)
+        data, hdr = get_data_file_data(job.user_id, file_id)
+        data = subtract_background(job.user_id, file_id, data)
+
+        # TODO: Don't override PhotSettings.gain = 1 once fixed in AgA
+        if settings.gain is None or settings.gain == 1:
+            gain = get_fits_gain(hdr)
+        else:
+            gain = settings.gain
+        if gain:
+            file_phot_kw['gain'] = gain
+
+        texp = get_fits_exp_length(hdr)
+        epoch = get_fits_time(hdr, texp)[1]
+        flt = hdr.get('FILTER')
+        scope = hdr.get('TELESCOP')
+
+        if texp:
+            file_phot_kw['texp'] = texp
+
+        # noinspection PyBroadException
         try:
-            data, hdr = get_data_file_data(job.user_id, file_id)
+            hdr['CRVAL1'] %= 360  # Ensure RA is in [0, 360) range
+            wcs = WCS(hdr, relax=True)
+            if not wcs.has_celestial:
+                wcs = None
+        except Exception:
+            wcs = None
+
+        # Project all sources onto the image at once and drop those outside image boundaries
+        file_sources = sources[file_id]
+        x, y = get_sources_xy(file_sources, epoch, wcs)
+        with errstate(invalid='ignore'):
+            inside = (x >= 0) & (x < data.shape[1]) & (y >= 0) & (y < data.shape[0])
+        if not inside.all():
+            file_sources = [source for source, keep in zip(file_sources, inside) if keep]
+            x, y = x[inside], y[inside]
+        if not file_sources:
+            if wcs is None:
+                raise ValueError('Missing WCS and no source XYs given')
+            raise ValueError('All sources are outside image boundaries')
+
+        source_table = zeros(
+            len(file_sources),
+            [('x', float), ('y', float), ('a', float), ('b', float), ('theta', float), ('flux', float),
+             ('saturated', int), ('flag', int)])
+        source_table['x'], source_table['y'] = x, y
+
+        r_cent = settings.centroid_radius
+        if settings.mode == 'auto':
+            # We need the ellipse parameters for adaptive photometry; derive them from the FWHMs if available,
+            # otherwise SkyLib will estimate them by isophotal analysis
+            file_phot_kw['radius'] = r_cent
+            for name, attr in (('a', 'fwhm_x'), ('b', 'fwhm_y'), ('theta', 'theta')):
+                source_table[name] = [getattr(source, attr, None) or 0 for source in file_sources]
+            if r_cent <= 0 and ((source_table['a'] == 0) | (source_table['b'] == 0)).any():
+                raise ValueError(
+                    'Centroiding radius must be provided for adaptive photometry with no FWHM info')
+            source_table['a'] /= sigma_to_fwhm
+            source_table['b'] /= sigma_to_fwhm
+            source_table['theta'] = deg2rad(source_table['theta'])
+
+        if r_cent > 0:
+            # Obtain the accurate centroids if requested
+            centroid_sources(data, source_table['x'], source_table['y'], r_cent)
+
+        # Photometer all sources in the current image
+        source_table = aperture_photometry(data, source_table, **file_phot_kw)
+
+        # Reject flagged and invalid measurements
+        good = (source_table['flag'] & (0xF0 & ~sep.APER_HASMASKED)) == 0
+        for name in ('x', 'y', 'flux', 'flux_err', 'mag', 'mag_err'):
+            good &= isfinite(source_table[name])
+        good = good.nonzero()[0]
+        source_table = source_table[good]
+
+        # Compute sky coordinates of the final source positions at once
+        if wcs is not None and len(source_table):
+            ra, dec = wcs.all_pix2world(source_table['x'], source_table['y'], 1)
+            ra_hours = (ra % 360)/15
+        else:
+            ra_hours = dec = None
+
+        result = []
+        for i, (row, j) in enumerate(zip(source_table, good)):
+            phot_data = PhotometryData(
+                source=file_sources[j],
+                row=row,
+                time=epoch,
+                filter=flt,
+                telescope=scope,
+                exp_length=texp,
+                zero_point=m0,
+            )
+            if ra_hours is not None:
+                phot_data.ra_hours, phot_data.dec_degs = float(ra_hours[i]), float(dec[i])
+            result.append(phot_data)
+        return result
 
-            # TODO: Don't override PhotSettings.gain = 1 once fixed in AgA
-            if settings.gain is None or settings.gain == 1:
-                gain = get_fits_gain(hdr)
-            else:
-                gain = settings.gain
-            if gain:
-                phot_kw['gain'] = gain
+    # Image, background and RMS maps, background-subtracted image, centroiding and photometry temporaries
+    item_ram_mb = get_data_file_ram_mb(job.user_id, list(file_ids), copies=7, itemsize=8)
+    return [phot_data for file_data in parallel_map(
+                job, photometer_file, file_ids, item_ram_mb=item_ram_mb, stage=stage, total_stages=total_stages)
+            if file_data for phot_data in file_data]
 
-            texp = get_fits_exp_length(hdr)
-            epoch = get_fits_time(hdr, texp)[1]
-            flt = hdr.get('FILTER')
-            scope = hdr.get('TELESCOP')
 
-            if texp:
-                phot_kw['texp'] = texp
+@njit(nogil=True, cache=True, parallel=True)
+def aperture_sums(cutouts: np.ndarray, cx: np.ndarray, cy: np.ndarray, a: float, b: float, theta: float,
+                  a_in: float, b_in: float, a_out: float, b_out: float, theta_out: float, nsub: int,
+                  reject_outliers: bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fixed elliptical aperture photometry with local background for a stack of cutouts
+
+    :param cutouts: (num_frames, num_sources, size, size) array of cutouts centered at sources; NaNs mark masked
+        pixels and pixels outside the image
+    :param cx: (num_frames, num_sources) array of aperture center X coordinates within cutouts, 0-based
+    :param cy: (num_frames, num_sources) array of aperture center Y coordinates within cutouts, 0-based
+    :param a: aperture semi-major axis in pixels
+    :param b: aperture semi-minor axis
+    :param theta: aperture position angle in radians
+    :param a_in: annulus inner semi-major axis
+    :param b_in: annulus inner semi-minor axis
+    :param a_out: annulus outer semi-major axis
+    :param b_out: annulus outer semi-minor axis
+    :param theta_out: annulus position angle in radians
+    :param nsub: number of subpixels per pixel side used to compute the partial pixel coverage by the aperture
+    :param reject_outliers: iteratively reject background pixels deviating from the median by more than 3 sigma
+
+    :return: background-subtracted flux, aperture area, background variance per pixel, and number of background
+        pixels, each of shape (num_frames, num_sources); flux is NaN if the aperture contains masked pixels
+    """
+    nf, ns, h, w = cutouts.shape
+    flux = np.full((nf, ns), np.nan)
+    area = np.zeros((nf, ns))
+    bkg_var = np.zeros((nf, ns))
+    nbkg = np.zeros((nf, ns))
+    ct, st = np.cos(theta), np.sin(theta)
+    cto, sto = np.cos(theta_out), np.sin(theta_out)
+    for k in prange(nf*ns):
+        f, s = k//ns, k % ns
+        x0, y0 = cx[f, s], cy[f, s]
+        if not np.isfinite(x0) or not np.isfinite(y0):
+            continue
+        buf = np.empty(h*w)
+        n = 0
+        total = ar = 0.0
+        bad = False
+        for i in range(h):
+            dy = i - y0
+            for j in range(w):
+                v = cutouts[f, s, i, j]
+                dx = j - x0
+
+                # Background annulus
+                u, t = dx*cto + dy*sto, dy*cto - dx*sto
+                if (u/a_out)**2 + (t/b_out)**2 <= 1 and (u/a_in)**2 + (t/b_in)**2 > 1 and np.isfinite(v):
+                    buf[n] = v
+                    n += 1
+
+                # Aperture coverage
+                if abs(dx) > a + 1 or abs(dy) > a + 1:
+                    continue
+                cov = 0
+                for p in range(nsub):
+                    sy = dy + (p + 0.5)/nsub - 0.5
+                    for q in range(nsub):
+                        sx = dx + (q + 0.5)/nsub - 0.5
+                        u, t = sx*ct + sy*st, sy*ct - sx*st
+                        if (u/a)**2 + (t/b)**2 <= 1:
+                            cov += 1
+                if cov:
+                    if not np.isfinite(v):
+                        bad = True
+                    else:
+                        wgt = cov/nsub**2
+                        total += wgt*v
+                        ar += wgt
+        if bad or not ar or not n:
+            continue
+        if reject_outliers:
+            while n > 2:
+                med, sigma = np.median(buf[:n]), np.std(buf[:n])
+                m = 0
+                for i in range(n):
+                    if abs(buf[i] - med) <= 3*sigma:
+                        buf[m] = buf[i]
+                        m += 1
+                if m == n:
+                    break
+                n = m
+        bkg = np.median(buf[:n])
+        flux[f, s] = total - bkg*ar
+        area[f, s] = ar
+        bkg_var[f, s] = np.var(buf[:n])
+        nbkg[f, s] = n
+    return flux, area, bkg_var, nbkg
+
+
+def aperture_correction(cutouts: np.ndarray, cx: np.ndarray, cy: np.ndarray, flux: np.ndarray, a: float, b: float,
+                        theta: float, a_in: float, b_in: float, a_out: float, b_out: float, theta_out: float,
+                        tol: float, reject_outliers: bool = False, max_sources: int = 20, step: float = 0.5) \
+        -> np.ndarray:
+    """
+    Aperture correction for a stack of cutouts from the growth curve of the brightest sources
+
+    The aperture is expanded in steps along the semi-major axis, keeping its shape, until the median relative flux
+    increment of the brightest sources becomes less than `tol` or the aperture reaches the background annulus.
+
+    :param cutouts: (num_frames, num_sources, size, size) array of cutouts; see :func:`aperture_sums`
+    :param cx: (num_frames, num_sources) array of aperture center X coordinates within cutouts, 0-based
+    :param cy: (num_frames, num_sources) array of aperture center Y coordinates within cutouts, 0-based
+    :param flux: (num_frames, num_sources) array of fluxes within the original aperture returned by
+        :func:`aperture_sums`
+    :param a: aperture semi-major axis in pixels
+    :param b: aperture semi-minor axis
+    :param theta: aperture position angle in radians
+    :param a_in: annulus inner semi-major axis
+    :param b_in: annulus inner semi-minor axis
+    :param a_out: annulus outer semi-major axis
+    :param b_out: annulus outer semi-minor axis
+    :param theta_out: annulus position angle in radians
+    :param tol: growth curve tolerance
+    :param reject_outliers: reject background outliers; see :func:`aperture_sums`
+    :param max_sources: maximum number of the brightest sources used to build the growth curve
+    :param step: aperture semi-major axis increment in pixels
+
+    :return: array of correction factors to multiply the fluxes by, one per frame; 1 if the growth curve is undefined
+    """
+    corr = np.ones(flux.shape[0])
+    with errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        typical = np.nanmedian(np.where(flux > 0, flux, np.nan), 0)
+    bright = np.argsort(-np.nan_to_num(typical, nan=-np.inf), kind='stable')[:max_sources]
+    bright = bright[isfinite(typical[bright])]
+    if not len(bright):
+        return corr
+    cutouts, cx, cy, flux = cutouts[:, bright], cx[:, bright], cy[:, bright], flux[:, bright]
+
+    done = np.zeros(len(corr), bool)
+    ai = a
+    while not done.all():
+        ai += step
+        bi = b*ai/a
+        if ai > a_in or bi > b_in:
+            break
+        f = aperture_sums(cutouts, cx, cy, ai, bi, theta, a_in, b_in, a_out, b_out, theta_out, 5, reject_outliers)[0]
+        with errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            growth = np.nanmedian(np.where(flux > 0, f/flux, np.nan), 1)
+        valid = ~done & isfinite(growth)
+        converged = valid & ((growth - corr)/corr < tol)
+        corr[valid] = growth[valid]
+        done |= ~isfinite(growth) | converged
+    return corr
+
+
+def extract_cutouts(data: np.ndarray, xs: np.ndarray, ys: np.ndarray, r: int, size: int) \
+        -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Extract square cutouts around sources for :func:`aperture_sums`
 
-            # noinspection PyBroadException
+    :param data: image data, optionally masked
+    :param xs: 1-based source X coordinates; NaN for unknown positions
+    :param ys: 1-based source Y coordinates
+    :param r: maximum aperture or annulus radius in pixels, including the safety margin
+    :param size: cutout size; must be at least 2*`r` + 2
+
+    :return: (num_sources, size, size) array of cutouts with NaNs for masked pixels and pixels outside the image, and
+        0-based X and Y coordinates of sources within the cutouts, NaN for sources too far outside the image
+    """
+    if isinstance(data, np.ma.MaskedArray):
+        data = data.astype(np.float32).filled(np.nan)
+    else:
+        data = np.asarray(data, np.float32)
+    h, w = data.shape
+    with errstate(invalid='ignore'):
+        valid = isfinite(xs) & isfinite(ys) & (xs > -r) & (xs < w + r) & (ys > -r) & (ys < h + r)
+    ix0 = np.where(valid, np.floor(np.nan_to_num(xs) - 1).astype(int) - r, 0)
+    iy0 = np.where(valid, np.floor(np.nan_to_num(ys) - 1).astype(int) - r, 0)
+    padded = np.pad(data, size, constant_values=np.nan)
+    del data
+    offsets = np.arange(size)
+    cutouts = padded[(iy0 + size)[:, None, None] + offsets[None, :, None],
+                     (ix0 + size)[:, None, None] + offsets[None, None, :]]
+    return cutouts, np.where(valid, xs - 1 - ix0, np.nan), np.where(valid, ys - 1 - iy0, np.nan)
+
+
+def transform_xy(xs: np.ndarray, ys: np.ndarray, mat: Optional[np.ndarray], offset: np.ndarray) \
+        -> tuple[np.ndarray, np.ndarray]:
+    """
+    Map 1-based reference image XYs onto another image using the alignment transformation returned by
+    :func:`get_transform`
+
+    :param xs: reference image X coordinates
+    :param ys: reference image Y coordinates
+    :param mat: 2x2 transformation matrix acting on 0-based (y, x); None for pure shift
+    :param offset: (y, x) offset
+
+    :return: X and Y coordinates in the other image, 1-based
+    """
+    if mat is None:
+        return xs + offset[1], ys + offset[0]
+    y, x = np.dot(mat, [ys - 1, xs - 1]) + np.asarray(offset)[:, None]
+    return x + 1, y + 1
+
+
+def run_lightcurve_photometry_job(job: Job,
+                                  settings: PhotSettings,
+                                  job_file_ids: TList[int],
+                                  job_sources: TList[SourceExtractionData],
+                                  stage: int = 0,
+                                  total_stages: int = 1,
+                                  alignment_settings: Optional[AlignmentSettings] = None) -> Lightcurve:
+    """
+    Time-series photometry of the same sources in a series of frames
+
+    Frames are processed in chronological order, and the first successfully processed frame is the reference one.
+    If alignment settings are given, source positions in the reference frame are mapped onto each other frame by the
+    alignment transformation between the two frames. Otherwise, they are obtained from WCS if available or propagated
+    from the previous frame. If centroiding is enabled, all apertures in a frame are then shifted by the median
+    centroid offset, which keeps the aperture geometry the same for all sources and tracks the residual drift even
+    for faint sources. Cutouts around all sources, with the background map saved by source extraction subtracted
+    if any, are then collected for a chunk of frames, with the chunk size limited by the job RAM, and photometered at once with fixed elliptical apertures and local background, optionally
+    rejecting background outliers and applying the per-frame aperture correction if `settings`.apcorr_tol > 0.
+
+    :param job: job class instance
+    :param settings: photometry settings; only mode="aperture" is supported
+    :param job_file_ids: data file IDs of frames
+    :param job_sources: sources to photometer in each frame; sources with the same ID are measured once
+    :param stage: optional processing stage number; used to properly update the job progress if photometry is a part
+        of other job
+    :param total_stages: total number of stages in the enclosing job if any; set to 0 to disable progress updates
+    :param alignment_settings: optional settings used to align each frame to the reference frame; see
+        :class:`AlignmentJob`
+
+    :return: lightcurves of all sources
+    """
+    if settings.mode != 'aperture':
+        raise ValueError('Lightcurve photometry requires mode="aperture"')
+    if settings.a is None:
+        raise ValueError('Missing aperture radius/semi-major axis for mode="aperture"')
+    if settings.a <= 0:
+        raise ValueError('Aperture radius/semi-major axis must be positive')
+    if not job_file_ids:
+        raise ValueError('Missing data file IDs')
+    if not job_sources:
+        raise ValueError('Missing sources')
+
+    # Aperture geometry shared by all sources and frames
+    a = settings.a
+    b = settings.b or a
+    if b > a:
+        a, b = b, a
+    theta = deg2rad(settings.theta or 0)
+    a_in = settings.a_in or a*1.5
+    a_out = settings.a_out or a*2
+    b_out = settings.b_out or a_out*b/a
+    b_in = a_in*b_out/a_out
+    theta_out = deg2rad(settings.theta_out) if settings.theta_out is not None else theta
+    r = int(np.ceil(max(a, a_out))) + 1
+    size = 2*r + 2
+
+    # Sources with the same ID are the same object
+    prefix = f'{datetime.utcnow().strftime("%Y%m%d%H%M%S")}_{job.id}_'
+    source_ids, sources = [], []
+    for i, source in enumerate(job_sources):
+        source_id = getattr(source, 'id', None) or prefix + str(i + 1)
+        if source_id not in source_ids:
+            source_ids.append(source_id)
+            sources.append(source)
+    num_sources = len(sources)
+
+    # Sort frames chronologically
+    frames = []
+    for file_id in job_file_ids:
+        with get_data_file_fits(job.user_id, file_id, read_data=False) as f:
+            hdr = f[0].header
+        texp = get_fits_exp_length(hdr)
+        frames.append((get_fits_time(hdr, texp)[1], file_id))
+    frames.sort(key=lambda item: (item[0] is None, item[0] or datetime.min))
+    num_frames = len(frames)
+
+    x, y = np.full((num_frames, num_sources), np.nan), np.full((num_frames, num_sources), np.nan)
+    flux = np.full((num_frames, num_sources), np.nan)
+    flux_err = np.full((num_frames, num_sources), np.nan)
+    texps, filters, gains = [None]*num_frames, [None]*num_frames, [None]*num_frames
+    m0 = getattr(settings, 'zero_point', None) or 0
+    r_cent = settings.centroid_radius
+    reject_outliers = bool(settings.reject_bkg_outliers)
+
+    chunk_size = min(job.get_chunk_size(num_frames, num_sources*size**2*4*2/(1 << 20)), 100)
+    if alignment_settings is not None:
+        alignment_kwargs = get_alignment_kwargs(alignment_settings)
+    wcs_cache, data_cache = {}, {}
+    ref_file_id = ref_xy = prev_xy = None
+    for chunk_start in range(0, num_frames, chunk_size):
+        chunk = range(chunk_start, min(chunk_start + chunk_size, num_frames))
+        cutouts = np.full((len(chunk), num_sources, size, size), np.nan, np.float32)
+        cx, cy = np.full((len(chunk), num_sources), np.nan), np.full((len(chunk), num_sources), np.nan)
+        for k, frame_no in enumerate(chunk):
+            epoch, file_id = frames[frame_no]
             try:
-                hdr['CRVAL1'] %= 360  # Ensure RA is in [0, 360) range
-                wcs = WCS(hdr, relax=True)
-                if not wcs.has_celestial:
+                data, hdr = get_data_file_data(job.user_id, file_id)
+                data = subtract_background(job.user_id, file_id, data)
+
+                if settings.gain is None or settings.gain == 1:
+                    gains[frame_no] = get_fits_gain(hdr)
+                else:
+                    gains[frame_no] = settings.gain
+                texps[frame_no] = get_fits_exp_length(hdr)
+                filters[frame_no] = hdr.get('FILTER')
+
+                # noinspection PyBroadException
+                try:
+                    hdr['CRVAL1'] %= 360  # Ensure RA is in [0, 360) range
+                    wcs = WCS(hdr, relax=True)
+                    if not wcs.has_celestial:
+                        wcs = None
+                except Exception:
                     wcs = None
-            except Exception:
-                wcs = None
 
-            source_table = zeros(
-                len(sources[file_id]),
-                [('x', float), ('y', float), ('a', float), ('b', float), ('theta', float), ('flux', float),
-                 ('saturated', int), ('flag', int)])
-            i = 0
-            while i < len(sources[file_id]):
-                x, y = get_source_xy(sources[file_id][i], epoch, wcs)
-                if x is not None and y is not None and 0 <= x < data.shape[1] and 0 <= y < data.shape[0]:
-                    source_table[i]['x'], source_table[i]['y'] = x, y
-                    i += 1
+                # Predict source positions
+                if alignment_settings is not None and ref_xy is not None:
+                    # Map the reference frame positions onto the current frame
+                    (mat, offset), _ = get_transform(
+                        job, alignment_kwargs, file_id, ref_file_id, wcs_cache, data_cache,
+                        settings=alignment_settings)
+                    xs, ys = transform_xy(ref_xy[0], ref_xy[1], mat, offset)
+                elif wcs is not None or prev_xy is None:
+                    xs, ys = get_sources_xy(sources, epoch, wcs)
+                    if prev_xy is None and not (isfinite(xs) & isfinite(ys)).any():
+                        raise ValueError('Missing WCS and no source XYs given')
                 else:
-                    # Source outside image boundaries, skip
-                    del sources[file_id][i]
-                    if i:
-                        if i < len(source_table) - 1:
-                            source_table = concatenate([source_table[:i], source_table[i + 1:]])
-                        else:
-                            source_table = source_table[:i]
-                    else:
-                        source_table = source_table[1:]
-            if not sources[file_id]:
-                if wcs is None:
-                    raise ValueError('Missing WCS and no source XYs given')
-                raise ValueError('All sources are outside image boundaries')
-
-            r_cent = settings.centroid_radius
-            if settings.mode == 'auto':
-                # We need the ellipse parameters for adaptive photometry; derive them from the FWHMs if available,
-                # otherwise SkyLib will estimate them by isophotal analysis
-                phot_kw['radius'] = r_cent
-                for i, source in enumerate(sources[file_id]):
-                    row = source_table[i]
-                    row['a'] = getattr(source, 'fwhm_x', None) or 0
-                    row['b'] = getattr(source, 'fwhm_y', None) or 0
-                    row['theta'] = getattr(source, 'theta', None) or 0
-                    if (not row['a'] or not row['b']) and r_cent <= 0:
-                        raise ValueError(
-                            'Centroiding radius must be provided for adaptive photometry with no FWHM info')
-                source_table['a'] /= sigma_to_fwhm
-                source_table['b'] /= sigma_to_fwhm
-                source_table['theta'] = deg2rad(source_table['theta'])
-
-            if r_cent > 0:
-                # Obtain the accurate centroids if requested
-                centroid_sources(data, source_table['x'], source_table['y'], r_cent)
-
-            # Photometer all sources in the current image
-            source_table = aperture_photometry(data, source_table, **phot_kw)
-
-            result_data += [
-                PhotometryData(
-                    source=source,
-                    row=row,
-                    time=epoch,
-                    filter=flt,
-                    telescope=scope,
-                    exp_length=texp,
-                    zero_point=m0,
-                    wcs=wcs,
-                )
-                for row, source in zip(source_table, sources[file_id])
-                if row['flag'] & (0xF0 & ~sep.APER_HASMASKED) == 0 and
-                isfinite([row['x'], row['y'], row['flux'], row['flux_err'], row['mag'], row['mag_err']]).all()]
-            if total_stages:
-                job.update_progress((file_no + 1)/len(file_ids)*100, stage, total_stages)
-        except Exception as e:
-            job.add_error(e, {'file_id': file_id})
-
-    return result_data
+                    xs, ys = prev_xy[0].copy(), prev_xy[1].copy()
+
+                if r_cent > 0:
+                    # Shift all apertures by the median centroid offset
+                    with errstate(invalid='ignore'):
+                        inside = (xs >= 1) & (xs <= data.shape[1]) & (ys >= 1) & (ys <= data.shape[0])
+                    if inside.any():
+                        xc, yc = xs[inside].copy(), ys[inside].copy()
+                        centroid_sources(data, xc, yc, r_cent)
+                        dx, dy = xc - xs[inside], yc - ys[inside]
+                        good = isfinite(dx) & isfinite(dy) & (np.hypot(dx, dy) <= r_cent)
+                        if good.any():
+                            xs += np.median(dx[good])
+                            ys += np.median(dy[good])
+                prev_xy = xs, ys
+                if ref_xy is None:
+                    ref_file_id, ref_xy = file_id, (xs.copy(), ys.copy())
+                x[frame_no], y[frame_no] = xs, ys
+
+                # Collect cutouts around sources; pixels outside the image are NaN
+                cutouts[k], cx[k], cy[k] = extract_cutouts(data, xs, ys, r, size)
+                del data
+            except Exception as e:
+                job.add_error(e, {'file_id': file_id})
+            finally:
+                if file_id != ref_file_id:
+                    # Keep only the reference frame WCS and alignment stars or features
+                    wcs_cache.pop(file_id, None)
+                    data_cache.pop(file_id, None)
+                if total_stages:
+                    job.update_progress((frame_no + 1)/num_frames*100, stage, total_stages)
+
+        # Photometer all sources in all frames of the chunk at once
+        f, area, bkg_var, nbkg = aperture_sums(
+            cutouts, cx, cy, a, b, theta, a_in, b_in, a_out, b_out, theta_out, 5, reject_outliers)
+        if settings.apcorr_tol:
+            apcorr = aperture_correction(
+                cutouts, cx, cy, f, a, b, theta, a_in, b_in, a_out, b_out, theta_out, settings.apcorr_tol,
+                reject_outliers)[:, None]
+        else:
+            apcorr = 1
+        del cutouts
+        gain = np.array([g or np.nan for g in gains[chunk.start:chunk.stop]])[:, None]
+        with errstate(invalid='ignore', divide='ignore'):
+            var = area*bkg_var*(1 + area/nbkg)
+            var += np.where(isfinite(gain), np.clip(f, 0, None)/gain, 0)
+            flux[chunk.start:chunk.stop] = f*apcorr
+            flux_err[chunk.start:chunk.stop] = np.sqrt(var)*apcorr
+
+    # Instrumental magnitudes
+    texp = np.array([t or 1 for t in texps])[:, None]
+    with errstate(invalid='ignore', divide='ignore'):
+        positive = flux > 0
+        mag = np.where(positive, -2.5*np.log10(flux/texp) + m0, np.nan)
+        mag_err = np.where(positive, 2.5/np.log(10)*flux_err/flux, np.nan)
+
+    return Lightcurve(
+        file_ids=[file_id for _, file_id in frames],
+        times=[epoch for epoch, _ in frames],
+        exp_lengths=texps,
+        filters=filters,
+        sources=[
+            LightcurveSource(
+                id=source_id,
+                ra_hours=getattr(source, 'ra_hours', None),
+                dec_degs=getattr(source, 'dec_degs', None),
+                x=x[:, j].tolist(),
+                y=y[:, j].tolist(),
+                flux=flux[:, j].tolist(),
+                flux_error=flux_err[:, j].tolist(),
+                mag=mag[:, j].tolist(),
+                mag_error=mag_err[:, j].tolist(),
+            )
+            for j, (source_id, source) in enumerate(zip(source_ids, sources))
+        ],
+    )
 
 
 class PhotometryJobResult(JobResult):
     data: TList[PhotometryData] = List(Nested(PhotometryData), dump_default=[])
+    lightcurve: Lightcurve = Nested(Lightcurve)
 
 
 class PhotometryJob(Job):
     type = 'photometry'
     description = 'Photometer Sources'
+    memoizable = True
 
     result: PhotometryJobResult = Nested(PhotometryJobResult, dump_default={})
     file_ids: TList[int] = List(Integer(), dump_default=[])
     sources: TList[SourceExtractionData] = List(Nested(SourceExtractionData), dump_default=[])
     settings: PhotSettings = Nested(PhotSettings, dump_default={})
+    lightcurve: bool = Boolean(dump_default=False)
+    alignment_settings: Optional[AlignmentSettings] = NestedPoly(
+        AlignmentSettings, allow_none=True, dump_default=None)
 
     def run(self):
+        if self.lightcurve:
+            # Time-series photometry
+            self.result.lightcurve = run_lightcurve_photometry_job(
+                self, self.settings, self.file_ids, self.sources,
+                alignment_settings=self.alignment_settings)
+            return
+
         object.__setattr__(
             self.result, 'data', run_photometry_job(self, self.settings, self.file_ids, self.sources))
@@ -0,0 +1,217 @@
+"""
+Afterglow Core: job pipeline plugin
+"""
+
+from typing import Dict as TDict, List as TList, Optional
+
+from marshmallow.fields import Dict, Integer, List, Nested, String
+
+from ...models import Job, JobResult, SourceExtractionData
+from ...schemas import AfterglowSchema, Boolean
+from ...errors import ValidationError
+from ...errors.job import UnknownJobTypeError
+from ..data_files import in_memory_data_files
+
+
+__all__ = ['PipelineJob']
+
+
+class PipelineStep(AfterglowSchema):
+    """
+    Single pipeline step
+
+    Fields::
+        id: unique step ID used to refer to the step in `inputs`; defaults to
+            the 0-based step index
+        job: job type and parameters, the same as for POST /jobs, e.g.
+            {"type": "cropping", "settings": {...}}
+        inputs: IDs of the steps which output data file IDs are appended to
+            the step job's file_ids; source extraction results of the input
+            steps are also passed as "sources" to jobs that accept them
+        persist: write the step output data files to disk and include its
+            result in the pipeline job result; defaults to True for the final
+            steps (those not used as inputs by other steps) and False for
+            intermediate steps
+    """
+    id: Optional[str] = String(dump_default=None)
+    job: TDict[str, object] = Dict(dump_default={})
+    inputs: TList[str] = List(String(), dump_default=[])
+    persist: Optional[bool] = Boolean(dump_default=None)
+
+
+class PipelineJobResult(JobResult):
+    file_ids: TList[int] = List(Integer(), dump_default=[])
+    steps: TDict[str, TDict[str, object]] = Dict(String, Dict(), dump_default={})
+
+
+class PipelineJob(Job):
+    """
+    Job pipeline
+
+    Runs a directed acyclic graph of other jobs within a single job. Output
+    data files of intermediate steps are passed to the dependent steps in
+    memory and are never written to disk, unless `persist` is set for the step
+    or they do not fit in the job RAM; intermediate outputs are deleted as soon
+    as the last step using them completes. Only the persisted step outputs are
+    returned in `result.file_ids`. Extra job files created by step jobs are
+    returned in `result.files` as "<step ID>.<job file ID>".
+    """
+    type = 'pipeline'
+    description = 'Job Pipeline'
+
+    result: PipelineJobResult = Nested(PipelineJobResult, dump_default={})
+    steps: TList[PipelineStep] = List(Nested(PipelineStep), dump_default=[])
+
+    _step_no = 0
+    _num_steps = 1
+
+    def on_child_update(self, child: Job) -> None:
+        self.state.progress = (self._step_no*100 + (getattr(child.state, 'progress', None) or 0))/self._num_steps
+        self.update()
+
+    def run(self):
+        if not self.steps:
+            return
+
+        steps = sort_steps(self.steps)
+        persisted = {
+            step.id for step in steps
+            if step.persist or step.persist is None and not any(step.id in other.inputs for other in steps)}
+
+        # Index of the last step consuming the output of each step; non-persisted outputs are released after that
+        last_use = {step.id: i for i, step in enumerate(steps)}
+        for i, step in enumerate(steps):
+            for step_id in step.inputs:
+                last_use[step_id] = i
+
+        self._num_steps = len(steps)
+        results = {}
+        with in_memory_data_files(self.user_id, self.get_free_ram_mb) as store:
+            for self._step_no, step in enumerate(steps):
+                try:
+                    # Fail early if the preceding steps already exhausted the job RAM
+                    self.check_ram()
+
+                    failed_inputs = [step_id for step_id in step.inputs if results.get(step_id) is None]
+                    if failed_inputs:
+                        raise RuntimeError(f'Input step(s) {", ".join(failed_inputs)} failed')
+
+                    child = self.create_step_job(step, [results[step_id] for step_id in step.inputs])
+                    try:
+                        child.run()
+                    finally:
+                        # Collect per-file errors and warnings reported by the step job
+                        for error in child.result.errors:
+                            error.setdefault('meta', {})['step'] = step.id
+                            self.result.errors.append(error)
+                        self.result.warnings += child.result.warnings
+                        self.result.files.update(child.result.files)
+
+                    results[step.id] = child.result
+                    if step.id in persisted:
+                        file_ids = get_step_file_ids(child.result)
+                        with store.lock:
+                            store.keep.update(file_ids)
+                        self.result.file_ids += [file_id for file_id in file_ids
+                                                 if file_id not in self.result.file_ids]
+                        res = child.result.to_dict()
+                        for name in ('errors', 'warnings', 'files'):
+                            res.pop(name, None)
+                        self.result.steps[step.id] = res
+                except Exception as e:
+                    results[step.id] = None
+                    self.add_error(e, {'step': step.id})
+                finally:
+                    # Free intermediate data files that are no longer needed by the remaining steps
+                    for step_id, i in last_use.items():
+                        if i == self._step_no and step_id not in persisted and results.get(step_id) is not None:
+                            store.release(self.user_id, get_step_file_ids(results[step_id]))
+                    self.update_progress(100, self._step_no, self._num_steps)
+
+    def create_step_job(self, step: PipelineStep, inputs: TList[JobResult]) -> Job:
+        """
+        Create a job instance for the given pipeline step
+
+        :param step: pipeline step
+        :param inputs: results of the input steps
+
+        :return: job instance ready to run
+        """
+        job_type = step.job.get('type')
+        if not job_type:
+            raise ValidationError('steps.job', f'Missing job type for step "{step.id}"')
+        if job_type == self.type:
+            raise ValidationError('steps.job', 'Nested pipelines are not supported')
+        kwargs = {name: val for name, val in step.job.items() if name not in ('id', 'user_id', 'session_id')}
+        child = Job(
+            _parent=self, id=self.id, user_id=self.user_id, session_id=self.session_id, **kwargs)
+        if type(child) is Job:
+            raise UnknownJobTypeError(type=job_type)
+
+        # Step jobs share the pipeline job ID; keep their job files apart
+        child._job_file_prefix = f'{step.id}.'
+
+        if inputs:
+            if 'file_ids' in child.fields:
+                file_ids = list(getattr(child, 'file_ids', None) or [])
+                for res in inputs:
+                    file_ids += [file_id for file_id in get_step_file_ids(res) if file_id not in file_ids]
+                child.file_ids = file_ids
+            if 'sources' in child.fields and not getattr(child, 'sources', None):
+                sources = [source for res in inputs for source in getattr(res, 'data', None) or []
+                           if isinstance(source, SourceExtractionData)]
+                if sources:
+                    child.sources = sources
+
+        return child
+
+
+def sort_steps(steps: TList[PipelineStep]) -> TList[PipelineStep]:
+    """
+    Assign default step IDs and sort pipeline steps so that each step follows all its inputs; the original order is
+    preserved for independent steps
+
+    :param steps: pipeline steps
+
+    :return: topologically sorted steps
+    """
+    for i, step in enumerate(steps):
+        if step.id is None:
+            step.id = str(i)
+    ids = [step.id for step in steps]
+    if len(set(ids)) != len(ids):
+        raise ValidationError('steps.id', 'Pipeline step IDs must be unique')
+    if any('/' in step_id or '\\' in step_id for step_id in ids):
+        # Step IDs are used in job file names
+        raise ValidationError('steps.id', 'Pipeline step IDs must not contain slashes')
+    for step in steps:
+        for step_id in step.inputs:
+            if step_id not in ids:
+                raise ValidationError('steps.inputs', f'Unknown input step "{step_id}" for step "{step.id}"')
+
+    sorted_steps, done = [], set()
+    remaining = list(steps)
+    while remaining:
+        ready = [step for step in remaining if set(step.inputs) <= done]
+        if not ready:
+            raise ValidationError('steps.inputs', 'Pipeline steps must not form a cycle')
+        for step in ready:
+            sorted_steps.append(step)
+            done.add(step.id)
+            remaining.remove(step)
+    return sorted_steps
+
+
+def get_step_file_ids(result: JobResult) -> TList[int]:
+    """
+    Return output data file IDs of a pipeline step
+
+    :param result: step job result
+
+    :return: list of data file IDs produced by the step, either via `file_ids` or via a single `file_id`
+    """
+    file_ids = getattr(result, 'file_ids', None)
+    if file_ids is None:
+        file_id = getattr(result, 'file_id', None)
+        file_ids = [file_id] if file_id is not None else []
+    return list(file_ids)
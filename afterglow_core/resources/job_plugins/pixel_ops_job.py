@@ -2,10 +2,12 @@
 Afterglow Core: pixel operations job plugin
 """
 
+import ast
 from datetime import datetime
 from types import ModuleType
 from typing import List as TList
 
+from flask import current_app
 from marshmallow.fields import Integer, List, Nested, String
 import numpy
 import numpy.fft
@@ -20,7 +22,14 @@ from skylib.calibration.cosmetic import correct_cosmetic, detect_defects
 from ...database import db
 from ...models import Job, JobResult
 from ...schemas import Boolean, Float
-from ..data_files import create_data_file, get_data_file_data, get_data_file_fits, get_root, save_data_file
+from ..data_files import (
+    DataFileRowReader, create_data_file, get_data_file_data, get_data_file_fits, get_data_file_ram_mb, get_root,
+    save_data_file)
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
 
 
 __all__ = ['PixelOpsJob']
@@ -56,6 +65,212 @@ context['estimate_background_rms'] = lambda *args: estimate_background(*args)[1]
 context['subtract_background'] = lambda img, *args: img - estimate_background(img, *args)[0]
 
 
+# Image variables available to expressions; "imgs" and "aux_imgs" are image
+# stacks
+IMAGE_NAMES = ('img', 'imgs', 'aux_img', 'aux_imgs')
+STACK_NAMES = ('imgs', 'aux_imgs')
+
+# Non-ufunc Numpy functions that process each pixel independently
+ELEMENTWISE_FUNCS = (numpy.where, numpy.clip, numpy.nan_to_num, numpy.round)
+
+# Numpy functions that process each pixel independently when reducing an image
+# stack along axis 0, e.g. np.mean(imgs, axis=0); bare names like mean() are
+# overridden by scipy.ndimage in the expression context and do not match
+STACK_REDUCTIONS = (
+    numpy.sum, numpy.prod, numpy.mean, numpy.average, numpy.median, numpy.std,
+    numpy.var, numpy.amin, numpy.amax, numpy.min, numpy.max, numpy.ptp,
+    numpy.percentile, numpy.quantile, numpy.nansum, numpy.nanprod,
+    numpy.nanmean, numpy.nanmedian, numpy.nanstd, numpy.nanvar, numpy.nanmin,
+    numpy.nanmax, numpy.nanpercentile, numpy.nanquantile, numpy.any,
+    numpy.all, numpy.count_nonzero,
+)
+
+# Functions supported by numexpr that have the same meaning as in Numpy
+NUMEXPR_FUNCS = (
+    'where', 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2',
+    'sinh', 'cosh', 'tanh', 'arcsinh', 'arccosh', 'arctanh', 'log', 'log10',
+    'log1p', 'exp', 'expm1', 'sqrt', 'abs',
+)
+
+# Estimated number of float32 arrays per input image strip held in memory
+# during evaluation: the strip itself, its mask, and temporaries
+STRIP_COPIES = 4
+
+
+def _is_one_of(obj, objs) -> bool:
+    return any(obj is o for o in objs)
+
+
+def _resolve(node: ast.AST):
+    """
+    Return the object referred to by a function name in the expression
+
+    :param node: function name node: "name" or "np.name"
+
+    :return: object or None if not a known function
+    """
+    if isinstance(node, ast.Name):
+        return context.get(node.id)
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) \
+            and node.value.id == 'np':
+        return getattr(numpy, node.attr, None)
+    return None
+
+
+def _uses_images(node: ast.AST) -> bool:
+    return any(isinstance(n, ast.Name) and n.id in IMAGE_NAMES
+               for n in ast.walk(node))
+
+
+def _is_stack(node: ast.AST) -> bool:
+    """
+    Does the expression yield a sequence of images, e.g. "imgs", "imgs[1:]",
+    or "(img, aux_img)"?
+    """
+    if isinstance(node, ast.Name):
+        return node.id in STACK_NAMES
+    if isinstance(node, ast.Subscript):
+        return isinstance(node.value, ast.Name) and \
+            node.value.id in STACK_NAMES and \
+            isinstance(node.slice, ast.Slice) and not _uses_images(node.slice)
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return all(_is_elementwise(elt) for elt in node.elts)
+    return False
+
+
+def _is_elementwise(node: ast.AST) -> bool:
+    """
+    Is the value of each output pixel computed from the same pixel of input
+    images only?
+    """
+    if not _uses_images(node):
+        # Does not depend on pixel data, e.g. header values or constants
+        return True
+    if isinstance(node, ast.Name):
+        return True
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return all(_is_elementwise(elt) for elt in node.elts)
+    if isinstance(node, ast.BinOp):
+        return not isinstance(node.op, ast.MatMult) and \
+            _is_elementwise(node.left) and _is_elementwise(node.right)
+    if isinstance(node, ast.UnaryOp):
+        return _is_elementwise(node.operand)
+    if isinstance(node, ast.Compare):
+        return all(_is_elementwise(n) for n in [node.left] + node.comparators)
+    if isinstance(node, ast.IfExp):
+        return not _uses_images(node.test) and \
+            _is_elementwise(node.body) and _is_elementwise(node.orelse)
+    if isinstance(node, ast.Subscript):
+        # Selecting an image from a stack, e.g. imgs[i], is allowed, while
+        # indexing pixels is not
+        return isinstance(node.value, ast.Name) and \
+            node.value.id in STACK_NAMES and not _uses_images(node.slice)
+    if isinstance(node, ast.Call):
+        if any(isinstance(arg, ast.Starred) for arg in node.args) or \
+                any(kw.arg is None for kw in node.keywords):
+            return False
+        func = _resolve(node.func)
+        if isinstance(func, numpy.ufunc) or \
+                _is_one_of(func, ELEMENTWISE_FUNCS):
+            if func is numpy.where and \
+                    len(node.args) + len(node.keywords) != 3:
+                # where(cond) returns pixel indices
+                return False
+            return all(_is_elementwise(n) for n in node.args + [
+                kw.value for kw in node.keywords])
+        if _is_one_of(func, STACK_REDUCTIONS):
+            kwargs = {kw.arg: kw.value for kw in node.keywords}
+            axis = kwargs.pop('axis', None)
+            return bool(node.args) and _is_stack(node.args[0]) and \
+                isinstance(axis, ast.Constant) and axis.value == 0 and \
+                not any(_uses_images(n)
+                        for n in node.args[1:] + list(kwargs.values()))
+    return False
+
+
+def is_elementwise(expr: str) -> bool:
+    """
+    Can the expression be evaluated separately for any part of the input
+    images? True for arithmetic, ufuncs like sqrt(), and Numpy stack
+    reductions like np.median(imgs, axis=0); False for filters, FFT, pixel
+    indexing, etc., as well as for expressions not involving images at all.
+    Note that the bare names sum(), mean(), median(), etc. refer to
+    scipy.ndimage measurements, which reduce whole images, so they are not
+    element-wise.
+
+    :param expr: pixel operation expression
+
+    :return: True if the expression is element-wise
+    """
+    tree = ast.parse(expr, mode='eval')
+    return _uses_images(tree) and _is_elementwise(tree.body)
+
+
+def _is_numexpr_compatible(node: ast.AST) -> bool:
+    """
+    Can the expression be evaluated by numexpr with the same result?
+    """
+    if isinstance(node, ast.Expression):
+        return _is_numexpr_compatible(node.body)
+    if isinstance(node, ast.Name):
+        return node.id in ('img', 'aux_img', 'i')
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, (int, float))
+    if isinstance(node, ast.BinOp):
+        return isinstance(
+            node.op, (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow)) and \
+            _is_numexpr_compatible(node.left) and \
+            _is_numexpr_compatible(node.right)
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, ast.USub) and \
+            _is_numexpr_compatible(node.operand)
+    if isinstance(node, ast.Compare):
+        return len(node.ops) == 1 and isinstance(
+            node.ops[0], (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt,
+                          ast.GtE)) and \
+            _is_numexpr_compatible(node.left) and \
+            _is_numexpr_compatible(node.comparators[0])
+    if isinstance(node, ast.Call):
+        return isinstance(node.func, ast.Name) and \
+            node.func.id in NUMEXPR_FUNCS and \
+            context.get(node.func.id) is getattr(numpy, node.func.id) and \
+            not node.keywords and \
+            all(_is_numexpr_compatible(arg) for arg in node.args)
+    return False
+
+
+def _mask_invalid(data: numpy.ndarray):
+    """
+    Convert image strip to a masked array if it contains NaNs, like
+    :func:`get_data_file_data` does for whole images
+    """
+    data = numpy.ma.masked_invalid(data)
+    if data.mask is False or not data.mask.any():
+        return data.data
+    return data
+
+
+class _StripSequence:
+    """
+    Sequence of strips of images from an image stack read on demand; replaces
+    "imgs" and "aux_imgs" during strip-wise evaluation
+    """
+    def __init__(self, readers, get_strip):
+        self._readers = readers
+        self._get_strip = get_strip
+
+    def __len__(self):
+        return len(self._readers)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return tuple(self[j] for j in range(*item.indices(len(self))))
+        return self._get_strip(self._readers[item])
+
+    def __iter__(self):
+        return (self[j] for j in range(len(self)))
+
+
 class PixelOpsJobResult(JobResult):
     file_ids: TList[int] = List(Integer(), dump_default=[])
     data: TList[float] = List(Float(), dump_default=[])
@@ -75,7 +290,7 @@ class PixelOpsJob(Job):
             F(img)  # apply F() to all images, e.g. img = img + 1
 
         - map all input images to one or more output images::
-            F(imgs)  # create a single data file; e.g. sum(imgs, axis=0)
+            F(imgs)  # create a single data file; e.g. np.sum(imgs, axis=0)
             F(imgs[0], imgs[1], ...)  # apply different operations to all input
                                   # images at once; e.g. (imgs[0], imgs[1] + 1)
 
@@ -97,6 +312,16 @@ class PixelOpsJob(Job):
     headers for data files listed in the `aux_file_ids` job parameter;
     the first auxiliary image/header is also available via "aux_img" and
     "aux_hdr" variables.
+
+    Element-wise expressions, i.e. those involving only arithmetic, Numpy
+    ufuncs like sqrt(), and Numpy reductions of image stacks along axis 0 like
+    np.median(imgs, axis=0), are evaluated in horizontal strips of all input
+    images at once, so that only the output images are held in memory in full;
+    numexpr is used for simple arithmetic expressions if installed. Other
+    expressions, e.g. filters or FFT, are evaluated for whole images. Since
+    the bare names sum(), mean(), median(), etc. refer to scipy.ndimage, stack
+    reductions must be written with the "np." prefix to be evaluated in
+    strips.
     """
     type = 'pixel_ops'
     description = 'Pixel Operations'
@@ -115,61 +340,224 @@ class PixelOpsJob(Job):
         expr = expr.strip()
         co = compile(expr, '<op>', 'eval')
 
-        # Load data files
-        data_files = [get_data_file_data(self.user_id, file_id)
-                      for file_id in self.file_ids]
+        # Element-wise expressions are evaluated in strips of rows streamed
+        # from all input images at once, which bounds the RAM usage regardless
+        # of the image size and the number of inputs; other expressions (e.g.
+        # filters) need whole images
+        readers, aux_readers = (
+            self.open_readers() if is_elementwise(expr) else (None, None))
+        chunked = readers is not None
 
         local_vars = {}
-
-        # Load optional auxiliary data files
-        if getattr(self, 'aux_file_ids', None):
-            local_vars['aux_imgs'], local_vars['aux_hdrs'] = tuple(zip(*[
-                get_data_file_data(self.user_id, file_id)
-                for file_id in self.aux_file_ids]))
-            local_vars['aux_img'] = local_vars['aux_imgs'][0]
-            local_vars['aux_hdr'] = local_vars['aux_hdrs'][0]
-        else:
-            local_vars['aux_imgs'], local_vars['aux_hdrs'] = [], []
-
-        if {'imgs', 'hdrs'} & set(co.co_names):
-            # Cases 2 and 3; each output must have access to all input images
-            if {'img', 'hdr'} & set(co.co_names):
-                raise ValueError('Cannot mix "imgs"/"hdrs" with "img"/"hdr"')
-            local_vars['imgs'], local_vars['hdrs'] = tuple(zip(*data_files))
-
-            if 'i' in co.co_names:
-                # Case 3: mixed input images; evaluate expression and create
-                # data file for all possible i's; ignore index errors (e.g.
-                # imgs[i+1] - imgs[i] for i = len(imgs) - 1)
-                if self.inplace:
-                    raise ValueError('inplace=True not allowed with "imgs[i]"')
-                for i in range(len(data_files)):
-                    local_vars['i'] = i
+        try:
+            # Load optional auxiliary data files
+            if chunked and aux_readers:
+                local_vars['aux_imgs'] = aux_readers
+                local_vars['aux_hdrs'] = [r.header for r in aux_readers]
+                local_vars['aux_img'] = local_vars['aux_imgs'][0]
+                local_vars['aux_hdr'] = local_vars['aux_hdrs'][0]
+            elif getattr(self, 'aux_file_ids', None):
+                local_vars['aux_imgs'], local_vars['aux_hdrs'] = tuple(zip(*[
+                    get_data_file_data(self.user_id, file_id)
+                    for file_id in self.aux_file_ids]))
+                local_vars['aux_img'] = local_vars['aux_imgs'][0]
+                local_vars['aux_hdr'] = local_vars['aux_hdrs'][0]
+            else:
+                local_vars['aux_imgs'], local_vars['aux_hdrs'] = [], []
+
+            if {'imgs', 'hdrs'} & set(co.co_names):
+                # Cases 2 and 3; each output must have access to all input
+                # images
+                if {'img', 'hdr'} & set(co.co_names):
+                    raise ValueError(
+                        'Cannot mix "imgs"/"hdrs" with "img"/"hdr"')
+
+                if chunked:
+                    local_vars['imgs'] = readers
+                    local_vars['hdrs'] = tuple(r.header for r in readers)
+                else:
+                    # Fail early if all input images do not fit in the job RAM
+                    # limit
+                    self.check_ram(get_data_file_ram_mb(self.user_id, self.file_ids)*len(self.file_ids))
+                    data_files = [get_data_file_data(self.user_id, file_id)
+                                  for file_id in self.file_ids]
+                    local_vars['imgs'], local_vars['hdrs'] = tuple(
+                        zip(*data_files))
+
+                if 'i' in co.co_names:
+                    # Case 3: mixed input images; evaluate expression and
+                    # create data file for all possible i's; ignore index
+                    # errors (e.g. imgs[i+1] - imgs[i] for i = len(imgs) - 1)
+                    if self.inplace:
+                        raise ValueError(
+                            'inplace=True not allowed with "imgs[i]"')
+                    n = len(self.file_ids)
+                    for i in range(n):
+                        local_vars['i'] = i
+                        try:
+                            self.handle_expr(
+                                expr, local_vars, [self.file_ids[i]], chunked)
+                        except IndexError:
+                            pass
+                        except Exception as e:
+                            self.add_error(e, {'image_no': i})
+                        finally:
+                            self.update_progress((i + 1)/n*100)
+                else:
+                    # Case 2: reduce to a single image/scalar or many-to-many
+                    # mapping
+                    self.handle_expr(expr, local_vars, self.file_ids, chunked)
+            else:
+                # Case 1: iterate over all input images; load them one at
+                # a time
+                for i, file_id in enumerate(self.file_ids):
                     try:
-                        self.handle_expr(expr, local_vars, [self.file_ids[i]])
-                    except IndexError:
-                        pass
+                        if chunked:
+                            local_vars['img'] = readers[i]
+                            local_vars['hdr'] = readers[i].header
+                        else:
+                            local_vars['img'], local_vars['hdr'] = get_data_file_data(self.user_id, file_id)
+                        self.handle_expr(expr, local_vars, [file_id], chunked)
                     except Exception as e:
-                        self.add_error(e, {'image_no': i})
+                        self.add_error(e, {'file_id': file_id})
                     finally:
-                        self.update_progress((i + 1)/len(data_files)*100)
-            else:
-                # Case 2: reduce to a single image/scalar or many-to-many
-                # mapping
-                self.handle_expr(expr, local_vars, self.file_ids)
+                        local_vars.pop('img', None)
+                        local_vars.pop('hdr', None)
+                        self.update_progress((i + 1)/len(self.file_ids)*100)
+        finally:
+            for reader in (readers or []) + (aux_readers or []):
+                reader.close()
+
+    def open_readers(self):
+        """
+        Open input and auxiliary data files for strip-wise evaluation
+
+        :return: lists of input and auxiliary data file readers or
+            (None, None) if any of the data files cannot be read in strips
+            (e.g. contains a table) or the images differ in size
+        """
+        file_ids = list(self.file_ids)
+        readers = []
+        try:
+            for file_id in file_ids + list(
+                    getattr(self, 'aux_file_ids', None) or []):
+                readers.append(DataFileRowReader(self.user_id, file_id))
+        except Exception:
+            # Report errors when loading whole images
+            ok = False
         else:
-            # Case 1: iterate over all input images
-            for i in range(len(data_files)):
-                local_vars['img'], local_vars['hdr'] = data_files[i]
+            ok = len({(r.width, r.height) for r in readers}) == 1
+        if not ok:
+            for reader in readers:
+                reader.close()
+            return None, None
+        return readers[:len(file_ids)], readers[len(file_ids):]
+
+    def eval_strips(self, expr, local_vars):
+        """
+        Evaluate element-wise expression in horizontal strips of input images;
+        the strip height is chosen to fit the strips of all input images used
+        by the expression in JOB_MAX_RAM and the job RAM limit
 
-                try:
-                    self.handle_expr(expr, local_vars, [self.file_ids[i]])
-                except Exception as e:
-                    self.add_error(e, {'file_id': self.file_ids[i]})
-                finally:
-                    self.update_progress((i + 1)/len(data_files)*100)
+        :param str expr: expression to evaluate
+        :param dict local_vars: local definitions; image variables are set to
+            :class:`DataFileRowReader` instances or lists thereof
 
-    def handle_expr(self, expr, local_vars, file_ids):
+        :return: list of output images
+        :rtype: list[numpy.ndarray]
+        """
+        co = compile(expr, '<op>', 'eval')
+        names = set(co.co_names)
+        use_numexpr = numexpr is not None and _is_numexpr_compatible(
+            ast.parse(expr, mode='eval'))
+
+        all_readers = set()
+        for val in local_vars.values():
+            if isinstance(val, DataFileRowReader):
+                all_readers.add(val)
+            elif isinstance(val, (list, tuple)) and val and \
+                    isinstance(val[0], DataFileRowReader):
+                all_readers.update(val)
+        width, height = next(iter(all_readers)).width, \
+            next(iter(all_readers)).height
+        max_ram = current_app.config.get('JOB_MAX_RAM') or 100.0
+
+        def get_strip_height(n: int) -> int:
+            row_mb = max(n, 1)*width*STRIP_COPIES*4/(1 << 20)
+            return min(self.get_chunk_size(height, row_mb),
+                       max(int(max_ram//row_mb), 1))
+
+        rows = get_strip_height(len(all_readers))
+        outputs = None
+        y = 0
+        while y < height:
+            h = min(rows, height - y)
+
+            # Read strips on demand and only once per reader, since "aux_img"
+            # is also "aux_imgs[0]"
+            strips = {}
+
+            def get_strip(reader):
+                try:
+                    return strips[reader]
+                except KeyError:
+                    data = strips[reader] = _mask_invalid(reader.read(y, h))
+                    return data
+
+            strip_vars = dict(local_vars)
+            for name, val in local_vars.items():
+                if isinstance(val, DataFileRowReader):
+                    if name in names:
+                        strip_vars[name] = get_strip(val)
+                    else:
+                        del strip_vars[name]
+                elif isinstance(val, (list, tuple)) and val and \
+                        isinstance(val[0], DataFileRowReader):
+                    strip_vars[name] = _StripSequence(val, get_strip)
+
+            if use_numexpr and not any(
+                    isinstance(data, numpy.ma.MaskedArray)
+                    for data in strips.values()):
+                res = numexpr.evaluate(
+                    expr, local_dict={name: strip_vars[name]
+                                      for name in names & set(strip_vars)},
+                    global_dict={})
+            else:
+                res = eval(co, context, strip_vars)
+
+            if numpy.ndim(res) == 2:
+                res = [res]
+            elif numpy.ndim(res) != 3:
+                raise ValueError(
+                    'Expression must yield one or multiple 2D arrays')
+            if any(numpy.shape(data) != (h, width) for data in res):
+                raise ValueError(
+                    'Expression must yield images of the same size as the '
+                    'input images')
+
+            if outputs is None:
+                self.check_ram(len(res)*width*height*4/(1 << 20))
+                outputs = [numpy.empty((height, width), numpy.float32)
+                           for _ in range(len(res))]
+
+                # Now that we know how many images the expression actually
+                # uses, make strips as large as possible
+                rows = get_strip_height(len(strips))
+            elif len(res) != len(outputs):
+                raise ValueError(
+                    'Expression must yield the same number of images for '
+                    'all strips')
+
+            for output, data in zip(outputs, res):
+                if isinstance(data, numpy.ma.MaskedArray):
+                    data = data.astype(numpy.float32).filled(numpy.nan)
+                output[y:y + h] = data
+            del strips, strip_vars, res
+            y += h
+
+        return outputs
+
+    def handle_expr(self, expr, local_vars, file_ids, chunked=False):
         """
         Evaluate expression for a single output data file
 
@@ -178,29 +566,34 @@ class PixelOpsJob(Job):
         :param dict local_vars: local definitions: "img", "imgs", "hdr", "hdrs"
         :param list[int | None] file_ids: original data file IDs, used with
             inplace=True
+        :param bool chunked: evaluate element-wise expression in strips;
+            image variables in `local_vars` are data file readers
 
         :return: None
         """
-        res = eval(expr, context, local_vars)
-
-        nd = numpy.ndim(res)
-        if not nd:
-            # Evaluation yields a scalar; append to result
-            self.result.data.append(float(res))
-            return
-
-        # Evaluation yields one or more arrays
-        if nd not in (2, 3):
-            raise ValueError(
-                'Expression must yield either a scalar or one or multiple 2D '
-                'arrays')
-
-        # Convert output to a list of (optionally masked) float32 arrays
-        if nd == 2:
-            res = [res]
-        res = [(data if isinstance(data, numpy.ma.MaskedArray)
-                else numpy.asarray(data)).astype(numpy.float32)
-               for data in res]
+        if chunked:
+            res = self.eval_strips(expr, local_vars)
+        else:
+            res = eval(expr, context, local_vars)
+
+            nd = numpy.ndim(res)
+            if not nd:
+                # Evaluation yields a scalar; append to result
+                self.result.data.append(float(res))
+                return
+
+            # Evaluation yields one or more arrays
+            if nd not in (2, 3):
+                raise ValueError(
+                    'Expression must yield either a scalar or one or multiple '
+                    '2D arrays')
+
+            # Convert output to a list of (optionally masked) float32 arrays
+            if nd == 2:
+                res = [res]
+            res = [(data if isinstance(data, numpy.ma.MaskedArray)
+                    else numpy.asarray(data)).astype(numpy.float32)
+                   for data in res]
 
         # Match file IDs to output arrays
         if self.inplace and len(res) != len(file_ids):
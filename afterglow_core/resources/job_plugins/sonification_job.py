@@ -15,7 +15,9 @@ from skylib.sonification import sonify_image
 
 from ...models import Job
 from ...schemas import AfterglowSchema, Boolean, Float
-from ..data_files import get_data_file, get_data_file_data
+from ..data_files import (
+    get_background_params, get_data_file, get_data_file_background, get_data_file_data, get_data_file_version,
+    save_data_file_background)
 
 
 __all__ = ['SonificationJob']
@@ -47,6 +49,7 @@ class SonificationSettings(AfterglowSchema):
 class SonificationJob(Job):
     type = 'sonification'
     description = 'Image Sonification'
+    memoizable = True
 
     file_id: int = Integer()
     settings: SonificationSettings = Nested(SonificationSettings, dump_default={})
@@ -63,13 +66,27 @@ class SonificationJob(Job):
 
         df = get_data_file(self.user_id, self.file_id)
         height, width = pixels.shape
+        # Reuse the background maps estimated for the whole image by a previous sonification or source extraction
+        # with the same background parameters if any
+        bkg_params = get_background_params(settings.bkg_scale)
+        maps = get_data_file_background(self.user_id, self.file_id, bkg_params)
+        if maps is not None and maps[0].shape != (df.height, df.width):
+            maps = None
         if width != df.width or height != df.height:
             # Sonifying a subimage; estimate background from the whole image first, then supply a cutout of background
             # and RMS to sonify_image()
-            full_img = get_data_file_data(self.user_id, self.file_id)[0]
-            bkg, rms = estimate_background(full_img, size=settings.bkg_scale)
+            if maps is None:
+                version = get_data_file_version(self.user_id, self.file_id)
+                full_img = get_data_file_data(self.user_id, self.file_id)[0]
+                maps = estimate_background(full_img, **bkg_params)
+                del full_img
+                if version is not None:
+                    save_data_file_background(self.user_id, self.file_id, maps[0], maps[1], bkg_params, version)
+            bkg, rms = maps
             bkg = bkg[y0:y0+height, x0:x0+width]
             rms = rms[y0:y0+height, x0:x0+width]
+        elif maps is not None:
+            bkg, rms = maps
         else:
             # When sonifying the whole image, sonify_image() will estimate background automatically
             bkg = rms = None
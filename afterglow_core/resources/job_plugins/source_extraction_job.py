@@ -11,9 +11,11 @@ from astropy.wcs import WCS
 from skylib.extraction import auto_sat_level, extract_sources
 from skylib.util.fits import get_fits_exp_length, get_fits_gain, get_fits_time
 
-from ...models import Job, JobResult, SourceExtractionData
+from ...models import Job, JobResult, SourceExtractionData, parallel_map
 from ...schemas import AfterglowSchema, Boolean, Float
-from ..data_files import get_data_file_data
+from ..data_files import (
+    get_background_params, get_data_file_data, get_data_file_ram_mb, get_data_file_version, has_data_file_background,
+    save_data_file_background)
 from .source_merge_job import SourceMergeSettings, merge_sources
 
 
@@ -61,6 +63,7 @@ class SourceExtractionJobResult(JobResult):
 class SourceExtractionJob(Job):
     type = 'source_extraction'
     description = 'Extract Sources'
+    memoizable = True
 
     result: SourceExtractionJobResult = Nested(SourceExtractionJobResult)
     file_ids: TList[int] = List(Integer(), dump_default=[])
@@ -97,10 +100,7 @@ def run_source_extraction_job(job: Job,
     extraction_kw = dict(
         downsample=settings.downsample,
         threshold=settings.threshold,
-        bkg_kw=dict(
-            size=settings.bk_size,
-            filter_size=settings.bk_filter_size,
-        ),
+        bkg_kw=get_background_params(settings.bk_size, settings.bk_filter_size),
         fwhm=settings.fwhm,
         ratio=settings.ratio,
         theta=settings.theta,
@@ -117,81 +117,94 @@ def run_source_extraction_job(job: Job,
         max_sources=settings.max_sources,
     )
 
-    result_data = []
-    backgrounds = {}
-    for file_no, file_id in enumerate(job_file_ids):
-        try:
-            # Get image data
-            pixels, hdr = get_data_file_data(
-                job.user_id, file_id, settings.x, settings.y, settings.width, settings.height)
-
-            if settings.gain is None:
-                gain = get_fits_gain(hdr)
-            else:
-                gain = settings.gain
-
-            epoch = get_fits_time(hdr)[0]
-            texp = get_fits_exp_length(hdr)
-            flt = hdr.get('FILTER')
-            scope = hdr.get('TELESCOP')
-
-            if settings.discard_saturated > 0:
-                if settings.auto_sat_level:
-                    sat_level = auto_sat_level(pixels)
-                    if sat_level is None:
-                        sat_level = settings.sat_level
-                else:
+    # Background maps are persisted only for the full unclipped images, so that they can be reused by other jobs
+    bkg_params = extraction_kw['bkg_kw']
+    persist_background = settings.x == 1 and settings.y == 1 and not settings.width and not settings.height and \
+        settings.clip_lo <= 0 and settings.clip_hi >= 100 and settings.downsample <= 1
+
+    def extract_file(file_id: int) -> Tuple[TList[SourceExtractionData], Tuple[np.ndarray, np.ndarray]]:
+        version = get_data_file_version(job.user_id, file_id) if persist_background else None
+        if version is not None and has_data_file_background(job.user_id, file_id, bkg_params, version):
+            # Maps are already saved for this data file version
+            version = None
+
+        # Get image data
+        pixels, hdr = get_data_file_data(
+            job.user_id, file_id, settings.x, settings.y, settings.width, settings.height)
+
+        if settings.gain is None:
+            gain = get_fits_gain(hdr)
+        else:
+            gain = settings.gain
+
+        epoch = get_fits_time(hdr)[0]
+        texp = get_fits_exp_length(hdr)
+        flt = hdr.get('FILTER')
+        scope = hdr.get('TELESCOP')
+
+        if settings.discard_saturated > 0:
+            if settings.auto_sat_level:
+                sat_level = auto_sat_level(pixels)
+                if sat_level is None:
                     sat_level = settings.sat_level
-                sat_img = pixels >= sat_level
             else:
-                sat_img = None
-
-            if settings.clip_lo > 0 or settings.clip_hi < 100:
-                if settings.clip_lo > 0 and settings.clip_hi < 100:
-                    lo, hi = np.percentile(pixels, (settings.clip_lo, settings.clip_hi))
-                elif settings.clip_lo > 0:
-                    lo, hi = np.percentile(pixels, settings.clip_lo), None
-                else:
-                    lo, hi = None, np.percentile(pixels, settings.clip_hi)
-                pixels = np.clip(pixels, lo, hi)
-
-            # Extract sources
-            source_table, background, background_rms = extract_sources(
-                pixels, gain=gain, sat_img=sat_img, **extraction_kw)
-            backgrounds[file_id] = (background, background_rms)
-
-            if settings.limit and len(source_table) > settings.limit:
-                # Leave only the given number of the brightest sources
-                source_table.sort(order='flux')
-                source_table = source_table[:-(settings.limit + 1):-1]
-
-            # Apply astrometric calibration if present
-            # noinspection PyBroadException
-            try:
-                hdr['CRVAL1'] %= 360  # Ensure RA is in [0, 360) range
-                wcs = WCS(hdr, relax=True)
-                if not wcs.has_celestial:
-                    wcs = None
-            except Exception:
+                sat_level = settings.sat_level
+            sat_img = pixels >= sat_level
+        else:
+            sat_img = None
+
+        if settings.clip_lo > 0 or settings.clip_hi < 100:
+            if settings.clip_lo > 0 and settings.clip_hi < 100:
+                lo, hi = np.percentile(pixels, (settings.clip_lo, settings.clip_hi))
+            elif settings.clip_lo > 0:
+                lo, hi = np.percentile(pixels, settings.clip_lo), None
+            else:
+                lo, hi = None, np.percentile(pixels, settings.clip_hi)
+            pixels = np.clip(pixels, lo, hi)
+
+        # Extract sources
+        source_table, background, background_rms = extract_sources(
+            pixels, gain=gain, sat_img=sat_img, **extraction_kw)
+        if version is not None and np.shape(background) == pixels.shape:
+            save_data_file_background(job.user_id, file_id, background, background_rms, bkg_params, version)
+
+        if settings.limit and len(source_table) > settings.limit:
+            # Leave only the given number of the brightest sources
+            source_table.sort(order='flux')
+            source_table = source_table[:-(settings.limit + 1):-1]
+
+        # Apply astrometric calibration if present
+        # noinspection PyBroadException
+        try:
+            hdr['CRVAL1'] %= 360  # Ensure RA is in [0, 360) range
+            wcs = WCS(hdr, relax=True)
+            if not wcs.has_celestial:
                 wcs = None
-
-            result_data += [
-                SourceExtractionData(
-                    row=row,
-                    ofs_x=settings.x - 1,
-                    ofs_y=settings.y - 1,
-                    wcs=wcs,
-                    file_id=file_id,
-                    time=epoch,
-                    filter=flt,
-                    telescope=scope,
-                    exp_length=texp,
-                )
-                for row in source_table]
-            if total_stages:
-                job.update_progress(
-                    (file_no + 1)/len(job_file_ids)*100, stage, total_stages)
-        except Exception as e:
-            job.add_error(e, {'file_id': file_id})
+        except Exception:
+            wcs = None
+
+        return [
+            SourceExtractionData(
+                row=row,
+                ofs_x=settings.x - 1,
+                ofs_y=settings.y - 1,
+                wcs=wcs,
+                file_id=file_id,
+                time=epoch,
+                filter=flt,
+                telescope=scope,
+                exp_length=texp,
+            )
+            for row in source_table], (background, background_rms)
+
+    # Image, saturation mask, background, RMS, and extraction temporaries
+    item_ram_mb = get_data_file_ram_mb(job.user_id, job_file_ids, copies=5, itemsize=8)
+    result_data = []
+    backgrounds = {}
+    for file_id, res in zip(job_file_ids, parallel_map(
+            job, extract_file, job_file_ids, item_ram_mb=item_ram_mb, stage=stage, total_stages=total_stages)):
+        if res is not None:
+            result_data += res[0]
+            backgrounds[file_id] = res[1]
 
     return result_data, backgrounds
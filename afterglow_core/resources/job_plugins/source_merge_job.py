@@ -183,6 +183,7 @@ class SourceMergeJobResult(JobResult):
 class SourceMergeJob(Job):
     type = 'source_merge'
     description = 'Merge Sources from Multiple Images'
+    memoizable = True
 
     result: SourceMergeJobResult = Nested(SourceMergeJobResult)
     sources: TList[SourceExtractionData] = List(Nested(SourceExtractionData))
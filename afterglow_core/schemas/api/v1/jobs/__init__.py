@@ -11,6 +11,7 @@ from .cropping_job import *
 from .field_cal_job import *
 from .image_properties_job import *
 from .photometry_job import *
+from .pipeline_job import *
 from .pixel_ops_job import *
 from .sonification_job import *
 from .source_extraction_job import *
@@ -2,13 +2,15 @@
 Afterglow Core: batch photometry job schemas
 """
 
-from typing import List as TList
+from typing import List as TList, Optional
 
 from marshmallow.fields import Integer, List, Nested
 
+from .... import Boolean, NestedPoly
 from ..job import JobSchema, JobResultSchema
-from ..photometry import PhotSettingsSchema, PhotometryDataSchema
+from ..photometry import LightcurveSchema, PhotSettingsSchema, PhotometryDataSchema
 from ..source_extraction import SourceExtractionDataSchema
+from .alignment_job import AlignmentSettingsSchema
 
 
 __all__ = ['PhotometryJobResultSchema', 'PhotometryJobSchema']
@@ -17,6 +19,7 @@ __all__ = ['PhotometryJobResultSchema', 'PhotometryJobSchema']
 class PhotometryJobResultSchema(JobResultSchema):
     data: TList[PhotometryDataSchema] = List(
         Nested(PhotometryDataSchema), dump_default=[])
+    lightcurve: LightcurveSchema = Nested(LightcurveSchema)
 
 
 class PhotometryJobSchema(JobSchema):
@@ -28,3 +31,6 @@ class PhotometryJobSchema(JobSchema):
     sources: TList[SourceExtractionDataSchema] = List(
         Nested(SourceExtractionDataSchema), dump_default=[])
     settings: PhotSettingsSchema = Nested(PhotSettingsSchema, dump_default={})
+    lightcurve: bool = Boolean(dump_default=False)
+    alignment_settings: Optional[AlignmentSettingsSchema] = NestedPoly(
+        AlignmentSettingsSchema, allow_none=True, dump_default=None)
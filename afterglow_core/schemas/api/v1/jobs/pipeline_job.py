@@ -0,0 +1,32 @@
+"""
+Afterglow Core: job pipeline schemas
+"""
+
+from typing import Dict as TDict, List as TList, Optional
+
+from marshmallow.fields import Dict, Integer, List, Nested, String
+
+from .... import AfterglowSchema, Boolean
+from ..job import JobSchema, JobResultSchema
+
+
+__all__ = ['PipelineStepSchema', 'PipelineJobResultSchema', 'PipelineJobSchema']
+
+
+class PipelineStepSchema(AfterglowSchema):
+    id: Optional[str] = String(dump_default=None)
+    job: TDict[str, object] = Dict(dump_default={})
+    inputs: TList[str] = List(String(), dump_default=[])
+    persist: Optional[bool] = Boolean(dump_default=None)
+
+
+class PipelineJobResultSchema(JobResultSchema):
+    file_ids: TList[int] = List(Integer(), dump_default=[])
+    steps: TDict[str, TDict[str, object]] = Dict(String, Dict(), dump_default={})
+
+
+class PipelineJobSchema(JobSchema):
+    type = 'pipeline'
+
+    result: PipelineJobResultSchema = Nested(PipelineJobResultSchema, dump_default={})
+    steps: TList[PipelineStepSchema] = List(Nested(PipelineStepSchema), dump_default=[])
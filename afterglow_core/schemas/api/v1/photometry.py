@@ -2,16 +2,18 @@
 Afterglow Core: photometry-related schemas
 """
 
-from typing import Optional
+from datetime import datetime
+from typing import List as TList, Optional
 
-from marshmallow.fields import String
+from marshmallow.fields import Integer, List, Nested, String
 
-from ... import AfterglowSchema, Boolean, Float
+from ... import AfterglowSchema, Boolean, DateTime, Float
 from .source_extraction import SourceExtractionDataSchema
 
 
 __all__ = [
-    'IApertureSchema', 'IPhotometrySchema', 'MagSchema', 'PhotometrySchema',
+    'IApertureSchema', 'IPhotometrySchema', 'LightcurveSchema',
+    'LightcurveSourceSchema', 'MagSchema', 'PhotometrySchema',
     'PhotometryDataSchema', 'PhotSettingsSchema',
 ]
 
@@ -109,3 +111,24 @@ class PhotometrySchema(AfterglowSchema):
     area: float = Float()
     background_area: float = Float()
     background: float = Float()
+
+
+class LightcurveSourceSchema(AfterglowSchema):
+    id: str = String()
+    ra_hours: Optional[float] = Float()
+    dec_degs: Optional[float] = Float()
+    x: TList[float] = List(Float(), dump_default=[])
+    y: TList[float] = List(Float(), dump_default=[])
+    flux: TList[float] = List(Float(), dump_default=[])
+    flux_error: TList[float] = List(Float(), dump_default=[])
+    mag: TList[float] = List(Float(), dump_default=[])
+    mag_error: TList[float] = List(Float(), dump_default=[])
+
+
+class LightcurveSchema(AfterglowSchema):
+    file_ids: TList[int] = List(Integer(), dump_default=[])
+    times: TList[datetime] = List(DateTime(), dump_default=[])
+    exp_lengths: TList[float] = List(Float(), dump_default=[])
+    filters: TList[str] = List(String(allow_none=True), dump_default=[])
+    sources: TList[LightcurveSourceSchema] = List(
+        Nested(LightcurveSourceSchema), dump_default=[])
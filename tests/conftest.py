@@ -0,0 +1,32 @@
+"""
+Afterglow Core: common test fixtures
+
+Importing :mod:`afterglow_core` creates the Flask app, so the test
+configuration pointing DATA_ROOT to a temporary directory must be installed
+before the first import.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+
+_data_root = tempfile.mkdtemp(prefix='afterglow-core-test-')
+_config = os.path.join(_data_root, 'test_cfg.py')
+with open(_config, 'w') as _f:
+    _f.write(f'DATA_ROOT = {_data_root!r}\n'
+             f'DATA_FILE_ROOT = {_data_root!r}\n'
+             f'AUTH_ENABLED = False\n')
+os.environ['AFTERGLOW_CORE_CONFIG'] = _config
+
+
+@pytest.fixture
+def app():
+    """
+    Afterglow Core app with an active app context
+    """
+    from afterglow_core import app as flask_app
+
+    with flask_app.app_context():
+        yield flask_app
@@ -0,0 +1,172 @@
+"""
+Tests for columnar catalog query results: conversion to catalog objects and
+serialized sources, and column-wise post-processing in VizieR plugins
+"""
+
+import numpy as np
+from astropy.table import MaskedColumn, Table
+import pytest
+
+
+@pytest.fixture
+def catalog(app):
+    from afterglow_core.models import Catalog
+
+    class TestColumnsCatalog(Catalog):
+        name = 'test_columns'
+
+    return TestColumnsCatalog()
+
+
+@pytest.fixture
+def columns():
+    return {
+        'id': np.ma.masked_array(
+            np.array(['a', 'b', 'c', 'd'], object), [False, False, True,
+                                                     False]),
+        'ra_hours': np.array([1.0, 2, 3, 4]),
+        'dec_degs': np.array([5.0, 6, 7, 8]),
+        'mag.V': np.array([10, np.nan, 12, np.nan]),
+        'err.V': np.array([0.1, np.nan, 0, np.nan]),
+        'mag.B': np.array([11, np.nan, np.nan, 13]),
+    }
+
+
+def test_columns_to_sources(catalog, columns):
+    sources = catalog.columns_to_sources(columns)
+
+    # Sources without magnitudes are skipped, masked attributes are not set,
+    # and zero errors are unknown
+    assert [getattr(s, 'id', None) for s in sources] == ['a', None, 'd']
+    assert [s.ra_hours for s in sources] == [1, 3, 4]
+    assert all(s.catalog_name == 'test_columns' for s in sources)
+    assert sorted(sources[0].mags) == ['B', 'V']
+    assert sources[0].mags['V'].value == 10
+    assert sources[0].mags['V'].error == 0.1
+    assert getattr(sources[1].mags['V'], 'error', None) is None
+    assert list(sources[2].mags) == ['B']
+
+
+def test_columns_to_dicts(catalog, columns):
+    dicts = catalog.columns_to_dicts(columns)
+    assert dicts == [
+        {'catalog_name': 'test_columns', 'id': 'a', 'ra_hours': 1,
+         'dec_degs': 5, 'mags': {'V': {'value': 10, 'error': 0.1},
+                                 'B': {'value': 11}}},
+        {'catalog_name': 'test_columns', 'ra_hours': 3, 'dec_degs': 7,
+         'mags': {'V': {'value': 12}}},
+        {'catalog_name': 'test_columns', 'id': 'd', 'ra_hours': 4,
+         'dec_degs': 8, 'mags': {'B': {'value': 13}}},
+    ]
+
+    # Same as serialized catalog objects
+    from afterglow_core.models import CatalogSource
+
+    assert CatalogSource().dump(dicts, many=True) == \
+        [s.to_dict() for s in catalog.columns_to_sources(columns)]
+
+
+def test_no_mags(catalog):
+    # Sources are not filtered if there are no magnitude columns
+    assert catalog.columns_to_dicts({'id': np.array(['x', 'y'])}) == [
+        {'catalog_name': 'test_columns', 'id': 'x', 'mags': {}},
+        {'catalog_name': 'test_columns', 'id': 'y', 'mags': {}},
+    ]
+
+
+def test_sources_to_columns(catalog, columns):
+    from afterglow_core.models import sources_to_columns
+
+    sources = catalog.columns_to_sources(columns)
+    assert catalog.columns_to_dicts(sources_to_columns(sources)) == \
+        catalog.columns_to_dicts(columns)
+
+
+def test_concatenate_columns(catalog, columns):
+    from afterglow_core.models import concatenate_columns
+
+    other = {
+        'id': np.array([5, 6]),
+        'ra_hours': np.array([1.0, 2]),
+        'dec_degs': np.array([0.0, 0]),
+        'mag.R': np.array([1.0, 2]),
+    }
+    assert concatenate_columns([{}, columns]) is columns
+    res = concatenate_columns([columns, {}, other])
+    assert res['id'].tolist() == ['a', 'b', None, 'd', 5, 6]
+    assert np.isnan(res['mag.V'][4:]).all()
+    assert np.isnan(res['mag.R'][:4]).all()
+    assert catalog.columns_to_dicts(res) == \
+        catalog.columns_to_dicts(columns) + catalog.columns_to_dicts(other)
+
+
+def test_usno(app):
+    from afterglow_core.resources.catalog_plugins.usno_catalog import \
+        USNOB1Catalog
+
+    table = Table({
+        'USNO-B1.0': ['1', '2', '3', '4'],
+        'RAJ2000': [15.0, 30, 45, 60],
+        'DEJ2000': [1.0, 2, 3, 4],
+        'B1mag': MaskedColumn([10.0, 11, 0, 0], mask=[0, 0, 1, 0]),
+        'B2mag': [12.0, 0, 13, 0],
+        'R1mag': [9.0, 9, 9, 0],
+        'R2mag': [9.5, 9.5, 9.5, 0],
+    })
+    columns = USNOB1Catalog().table_to_columns(table)
+    assert columns['mag.B'][:3].tolist() == [11, 11, 13]
+    assert columns['mag.R'][:3].tolist() == [9.25]*3
+    assert np.isnan(columns['mag.B'][3])
+    assert len(USNOB1Catalog().columns_to_sources(columns)) == 3
+
+
+def test_landolt(app):
+    from afterglow_core.resources.catalog_plugins.landolt_catalog import \
+        LandoltCatalog
+
+    table = Table({
+        'Star': ['s1'], 'RAJ2000': ['01 02 03.0'], 'DEJ2000': ['-00 30 00'],
+        'Vmag': [10.0], 'e_Vmag': [0.01], 'B-V': [0.5], 'e_B-V': [0.01],
+        'U-B': [0.1], 'e_U-B': [0.01], 'V-R': [0.3], 'e_V-R': [0.01],
+        'R-I': [0.2], 'e_R-I': [0.01], 'V-I': [0.5], 'e_V-I': [0.01],
+    })
+    cat = LandoltCatalog()
+    source, = cat.columns_to_sources(cat.table_to_columns(table))
+    assert source.id == 's1'
+    assert source.ra_hours == pytest.approx(1 + 2/60 + 3/3600)
+    assert source.dec_degs == pytest.approx(-0.5)
+    mags = {name: m.value for name, m in source.mags.items()}
+    assert mags['B'] == pytest.approx(10.5)
+    assert mags['U'] == pytest.approx(10.6)
+    assert mags['R'] == pytest.approx(9.7)
+    assert mags['I'] == pytest.approx(9.5)
+    assert source.mags['B'].error == pytest.approx(np.hypot(0.01, 0.01))
+
+
+def test_vsx(app):
+    from afterglow_core.resources.catalog_plugins.vsx_catalog import \
+        VSXCatalog
+
+    table = Table({
+        'OID': [1, 2, 3], 'Name': ['X Cyg', 'Y', 'Z'], 'V': [0, 2, 1],
+        'Type': ['M', 'EA', 'RR'], 'max': [5.0, 6, 7],
+        'n_max': ['V', 'B', "g'"], 'f_min': ['', '', '('],
+        'min': [8.0, 9, 0.4],
+        'Period': MaskedColumn([400.0, 1, 0], mask=[0, 0, 1]),
+        'RAJ2000': [15.0, 30, 45], 'DEJ2000': [1.0, 2, 3],
+    })
+    cat = VSXCatalog()
+    sources = cat.columns_to_sources(cat.table_to_columns(table))
+
+    # Constant stars are skipped
+    assert [s.id for s in sources] == ['1', '3']
+    assert [s.name for s in sources] == ['X Cyg', 'Z']
+    assert [s.mag for s in sources] == [5, 7]
+    assert [s.amplitude for s in sources] == [3, 0.4]
+    assert sources[0].period == 400
+    assert getattr(sources[1], 'period', None) is None
+    assert [s.ra_hours for s in sources] == [1, 3]
+    # Magnitude at maximum is mapped to the passband
+    assert sources[0].V == 5
+    assert sources[1].gprime == 7
+    assert not hasattr(sources[0], 'gprime')
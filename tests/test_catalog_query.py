@@ -0,0 +1,257 @@
+"""
+Tests for the catalog query engine: region merging, deduplication, and
+concurrent queries against a stub catalog plugin
+"""
+
+from threading import Barrier, Lock, get_ident
+
+import numpy as np
+import astropy.io.fits as pyfits
+import pytest
+
+from afterglow_core.models import Catalog, CatalogSource
+
+
+def make_source(id=None, ra_hours=None, dec_degs=None) -> CatalogSource:
+    kw = {}
+    if id is not None:
+        kw['id'] = id
+    if ra_hours is not None:
+        kw['ra_hours'], kw['dec_degs'] = ra_hours, dec_degs
+    return CatalogSource(**kw)
+
+
+def test_merge_identical_boxes():
+    from afterglow_core.resources.job_plugins.catalog_query_job import \
+        merge_boxes
+
+    box = (150, 20, 0.5, 0.5)
+    assert merge_boxes([box]*10) == [box]
+
+
+def test_merge_overlapping_boxes():
+    from afterglow_core.resources.job_plugins.catalog_query_job import \
+        merge_boxes
+
+    merged = merge_boxes([(150, 0, 1, 1), (150.2, 0.1, 1, 1)])
+    assert len(merged) == 1
+    ra, dec, width, height = merged[0]
+    assert ra == pytest.approx(150.1)
+    assert dec == pytest.approx(0.05)
+    assert width == pytest.approx(1.2)
+    assert height == pytest.approx(1.1)
+
+
+def test_merge_across_ra_zero():
+    from afterglow_core.resources.job_plugins.catalog_query_job import \
+        merge_boxes
+
+    merged = merge_boxes([(359.8, 0, 1, 1), (0.2, 0, 1, 1)])
+    assert len(merged) == 1
+    ra, _, width, _ = merged[0]
+    assert ra == pytest.approx(0) or ra == pytest.approx(360)
+    assert width == pytest.approx(1.4)
+
+
+def test_no_merge_distant_boxes():
+    from afterglow_core.resources.job_plugins.catalog_query_job import \
+        merge_boxes
+
+    boxes = [(10, 0, 1, 1), (20, 0, 1, 1), (10, 30, 1, 1)]
+    assert sorted(merge_boxes(boxes)) == sorted(boxes)
+
+
+def test_remove_duplicates():
+    from afterglow_core.resources.job_plugins.catalog_query_job import \
+        remove_duplicates
+
+    sources = [
+        make_source(ra_hours=10, dec_degs=20),
+        make_source('a', 1, 2),
+        make_source(),
+        make_source('b', 3, 4),
+        make_source(ra_hours=10, dec_degs=20 + 0.001/3600),
+        make_source('a', 1, 2),
+        make_source(ra_hours=11, dec_degs=20),
+        make_source(),
+    ]
+    assert remove_duplicates(sources) == [
+        sources[0], sources[1], sources[2], sources[3], sources[6],
+        sources[7]]
+
+
+class StubCatalog(Catalog):
+    """
+    Catalog plugin stand-in returning a regular grid of sources with stable
+    IDs; records all queries and the threads they ran in
+    """
+    step = 0.01  # grid step in degrees
+
+    def __init__(self, name: str, barrier: Barrier = None):
+        super().__init__()
+        self.name = name
+        self.barrier = barrier
+        self.queries = []
+        self.threads = set()
+        self.lock = Lock()
+
+    def query_box_columns(self, ra_hours, dec_degs, width_arcmins,
+                          height_arcmins=None, constraints=None, limit=None):
+        if height_arcmins is None:
+            height_arcmins = width_arcmins
+        with self.lock:
+            self.queries.append(
+                (ra_hours, dec_degs, width_arcmins, height_arcmins))
+            self.threads.add(get_ident())
+        if self.barrier is not None:
+            self.barrier.wait()
+        ra0, dec0 = ra_hours*15, dec_degs
+        hw = width_arcmins/120/np.cos(np.deg2rad(dec0))
+        hh = height_arcmins/120
+        i, j = np.mgrid[
+            int(np.floor((dec0 - hh)/self.step)):
+            int(np.ceil((dec0 + hh)/self.step)) + 1,
+            int(np.floor((ra0 - hw)/self.step)):
+            int(np.ceil((ra0 + hw)/self.step)) + 1]
+        i, j = i.ravel(), j.ravel()
+        return {
+            'id': np.array([f'{self.name}-{a}-{b}' for a, b in zip(i, j)]),
+            'ra_hours': j*self.step/15,
+            'dec_degs': i*self.step,
+            'mag.V': np.full(len(i), 12.0),
+            'err.V': np.full(len(i), 0.01),
+        }
+
+    def query_circ_columns(self, ra_hours, dec_degs, radius_arcmins,
+                           constraints=None, limit=None):
+        return self.query_box_columns(
+            ra_hours, dec_degs, 2*radius_arcmins, 2*radius_arcmins,
+            constraints)
+
+
+@pytest.fixture
+def stub_catalogs(app, monkeypatch):
+    from afterglow_core.resources.job_plugins import catalog_query_job
+
+    monkeypatch.setitem(app.config, 'JOB_MAX_THREADS', 4)
+    monkeypatch.setitem(app.config, 'CATALOG_QUERY_THREADS', 4)
+    stubs = {}
+
+    def add(name: str, barrier: Barrier = None) -> StubCatalog:
+        stubs[name] = StubCatalog(name, barrier=barrier)
+        monkeypatch.setitem(
+            catalog_query_job.known_catalogs, name, stubs[name])
+        return stubs[name]
+
+    return add
+
+
+def make_image(ra: float, dec: float, size: int = 60) -> int:
+    """
+    Create a data file with a TAN WCS at 1"/pixel centered at (RA, Dec)
+    """
+    from afterglow_core.resources.data_files import create_data_file, get_root
+
+    hdr = pyfits.Header()
+    hdr['CTYPE1'], hdr['CTYPE2'] = 'RA---TAN', 'DEC--TAN'
+    hdr['CRVAL1'], hdr['CRVAL2'] = ra, dec
+    hdr['CRPIX1'] = hdr['CRPIX2'] = (size + 1)/2
+    hdr['CDELT1'], hdr['CDELT2'] = -1/3600, 1/3600
+    return create_data_file(
+        None, 'catalog-query-test', get_root(None),
+        np.zeros((size, size), np.float32), hdr).id
+
+
+def test_concurrent_catalogs(stub_catalogs):
+    from afterglow_core.models import Job
+    from afterglow_core.resources.job_plugins.catalog_query_job import \
+        run_catalog_query_job
+
+    # Both catalogs must be queried at the same time to pass the barrier
+    barrier = Barrier(2, timeout=5)
+    cat1 = stub_catalogs('stub1', barrier)
+    cat2 = stub_catalogs('stub2', barrier)
+
+    sources = run_catalog_query_job(
+        Job(), ['stub1', 'stub2'], ra_hours=10, dec_degs=20,
+        width_arcmins=2)
+    assert len(cat1.queries) == len(cat2.queries) == 1
+    assert cat1.threads != cat2.threads
+    assert {s.catalog_name for s in sources} == {'stub1', 'stub2'}
+    # Results are returned in the order of catalogs
+    names = [s.catalog_name for s in sources]
+    assert names == sorted(names)
+
+
+def test_query_error(stub_catalogs, monkeypatch):
+    from afterglow_core.models import Job
+    from afterglow_core.resources.job_plugins.catalog_query_job import \
+        run_catalog_query_job
+
+    cat = stub_catalogs('stub1')
+    stub_catalogs('stub2')
+
+    def fail(*_):
+        raise RuntimeError('catalog unavailable')
+
+    monkeypatch.setattr(cat, 'query_box_columns', fail)
+    with pytest.raises(RuntimeError, match='catalog unavailable'):
+        run_catalog_query_job(
+            Job(), ['stub1', 'stub2'], ra_hours=10, dec_degs=20,
+            width_arcmins=2)
+
+
+def test_overlapping_files(stub_catalogs):
+    from afterglow_core.models import Job
+    from afterglow_core.resources.job_plugins.catalog_query_job import \
+        run_catalog_query_job
+
+    cat = stub_catalogs('stub1')
+    file_ids = [make_image(150, 20), make_image(150.005, 20.005)]
+
+    sources = run_catalog_query_job(Job(), ['stub1'], file_ids=file_ids)
+
+    # Overlapping footprints are queried as one region
+    assert len(cat.queries) == 1
+    ids = [s.id for s in sources]
+    assert ids and len(set(ids)) == len(ids)
+    # All returned sources are within one of the frames
+    for s in sources:
+        assert abs(s.dec_degs - 20) < 0.01 or abs(s.dec_degs - 20.005) < 0.01
+
+
+def test_distant_files(stub_catalogs):
+    from afterglow_core.models import Job
+    from afterglow_core.resources.job_plugins.catalog_query_job import \
+        run_catalog_query_job
+
+    cat = stub_catalogs('stub1')
+    file_ids = [make_image(150, 20), make_image(160, 30)]
+
+    sources = run_catalog_query_job(Job(), ['stub1'], file_ids=file_ids)
+    assert len(cat.queries) == 2
+    ids = [s.id for s in sources]
+    assert len(set(ids)) == len(ids)
+    assert {round(s.ra_hours*15) for s in sources} == {150, 160}
+
+
+def test_job_result(stub_catalogs):
+    from afterglow_core.models import Job
+    from afterglow_core.resources.job_plugins.catalog_query_job import (
+        CatalogQueryJob, run_catalog_query_job)
+
+    stub_catalogs('stub1')
+    stub_catalogs('stub2')
+    job = CatalogQueryJob(
+        catalogs=['stub1', 'stub2'], ra_hours=10, dec_degs=20,
+        width_arcmins=2)
+    job.run()
+
+    # Columnar results are serialized directly, with the same output as for
+    # catalog objects
+    data = job.result.data
+    assert data and all(isinstance(item, dict) for item in data)
+    sources = run_catalog_query_job(
+        Job(), ['stub1', 'stub2'], ra_hours=10, dec_degs=20, width_arcmins=2)
+    assert job.result.dump(job.result)['data'] == \
+        [source.to_dict() for source in sources]
@@ -0,0 +1,121 @@
+"""
+Tests for job result memoization: cache keys and cloning of cached jobs
+"""
+
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def job_cache(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_RESULT_CACHE', True)
+    return app
+
+
+@pytest.fixture
+def data_file(job_cache):
+    from afterglow_core.resources.data_files import (
+        create_data_file, get_data_file_path, get_root)
+
+    db_data_file = create_data_file(
+        None, 'cache-test', get_root(None), np.zeros((8, 8), np.float32))
+    return db_data_file.id, get_data_file_path(None, db_data_file.id)
+
+
+def get_key(file_id: int, **args) -> str:
+    from afterglow_core.job_server import get_job_cache_key
+
+    return get_job_cache_key(
+        None, 'source_extraction', dict(file_ids=[file_id], **args))
+
+
+def test_key_stable(data_file):
+    file_id, _ = data_file
+    key = get_key(file_id)
+    assert key is not None
+    assert get_key(file_id) == key
+
+
+def test_key_depends_on_mtime(data_file):
+    file_id, filename = data_file
+    key = get_key(file_id)
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert get_key(file_id) != key
+
+
+def test_key_depends_on_size(data_file):
+    file_id, filename = data_file
+    key = get_key(file_id)
+    st = os.stat(filename)
+    with open(filename, 'ab') as f:
+        f.write(b'\0')
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert get_key(file_id) != key
+
+
+def test_key_depends_on_parameters(data_file):
+    file_id, _ = data_file
+    key = get_key(file_id, source_extraction_settings={'threshold': 2.5})
+    assert get_key(
+        file_id, source_extraction_settings={'threshold': 3}) != key
+    assert get_key(file_id) != key
+
+
+def test_key_missing_input(job_cache):
+    assert get_key(999999) is None
+
+
+def test_not_memoizable(data_file):
+    from afterglow_core.job_server import get_job_cache_key
+
+    file_id, _ = data_file
+    assert get_job_cache_key(
+        None, 'catalog_query', {'file_ids': [file_id]}) is None
+
+
+def test_clone_job(job_cache):
+    from afterglow_core.database import db
+    from afterglow_core.job_server import (
+        DbJob, DbJobState, clone_job, js)
+    from afterglow_core.models import (
+        job_file_path, job_result_dir, job_result_path)
+
+    now = datetime.utcnow()
+    db.session.add(DbJob(
+        id='cached-job', type='source_extraction', user_id=None,
+        args={'file_ids': [1]}, cache_key='0'*64))
+    db.session.add(DbJobState(
+        id='cached-job', status=js.COMPLETED, created_on=now,
+        completed_on=now, progress=100))
+    db.session.flush()
+
+    result = {'errors': [], 'warnings': [], 'data': [{'x': 1, 'y': 2}],
+              'files': {'out': {'mimetype': 'text/plain'}}}
+    os.makedirs(job_result_dir(), exist_ok=True)
+    with open(job_result_path('cached-job'), 'w', encoding='utf8') as f:
+        json.dump(result, f)
+    filename = job_file_path(None, 'cached-job', 'out')
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as f:
+        f.write(b'job file')
+
+    try:
+        db_job = clone_job(DbJob.query.get('cached-job'), 5, now)
+        assert db_job.id != 'cached-job'
+        assert db_job.session_id == 5
+        assert db_job.cache_key == '0'*64
+        assert db_job.args == {'file_ids': [1]}
+        assert db_job.state.status == js.COMPLETED
+        assert db_job.state.progress == 100
+
+        with open(job_result_path(db_job.id), 'rt', encoding='utf8') as f:
+            assert json.load(f) == result
+        with open(job_file_path(None, db_job.id, 'out'), 'rb') as f:
+            assert f.read() == b'job file'
+    finally:
+        db.session.rollback()
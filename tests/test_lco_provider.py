@@ -0,0 +1,167 @@
+"""
+Tests for the LCO data provider HTTP layer against a local mock archive
+"""
+
+import json
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from threading import Thread
+from urllib.parse import urlparse
+
+import numpy as np
+import astropy.io.fits as pyfits
+import pytest
+
+from afterglow_core.errors import AfterglowError
+from afterglow_core.resources.data_provider_plugins import lco_provider
+
+
+FRAME_ETAG = '"frame-1"'
+
+
+def make_frame() -> bytes:
+    """
+    Return a small FITS frame with an LCO filter name
+    """
+    buf = BytesIO()
+    hdu = pyfits.PrimaryHDU(np.zeros((4, 4), np.float32))
+    hdu.header['FILTER'] = 'rp'
+    hdu.writeto(buf)
+    return buf.getvalue()
+
+
+class MockArchiveHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the LCO Observation and Archive APIs
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def reply(self, status: int, body: bytes = b'',
+              content_type: str = 'application/json',
+              headers: dict = None) -> None:
+        self.send_response(status)
+        for name, val in (headers or {}).items():
+            self.send_header(name, val)
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        server = self.server
+        path = urlparse(self.path).path
+        server.requests.append((path, dict(self.headers), self.client_address))
+        if path == '/proposals/':
+            self.reply(200, json.dumps({'results': []}).encode())
+        elif path == '/frames/1/':
+            if self.headers.get('If-None-Match') == FRAME_ETAG:
+                self.reply(304, headers={'ETag': FRAME_ETAG})
+            else:
+                self.reply(200, json.dumps({
+                    'id': 1, 'url': server.base_url + '/download/1.fits',
+                }).encode(), headers={'ETag': FRAME_ETAG})
+        elif path == '/download/1.fits':
+            server.downloads += 1
+            self.reply(200, server.frame, 'image/fits')
+        else:
+            self.reply(503, b'{}')
+
+
+@pytest.fixture
+def archive(app, monkeypatch):
+    """
+    Local mock LCO archive; the LCO provider is pointed at it and uses
+    a fresh HTTP session and API cache
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockArchiveHandler)
+    server.base_url = f'http://127.0.0.1:{server.server_port}'
+    server.requests = []
+    server.downloads = 0
+    server.frame = make_frame()
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(lco_provider, 'OBSERVE_API_URL', server.base_url)
+    monkeypatch.setattr(lco_provider, 'ARCHIVE_API_URL', server.base_url)
+    monkeypatch.setattr(lco_provider, 'MAX_RETRIES', 1)
+    monkeypatch.setattr(lco_provider, '_session', None)
+    monkeypatch.setattr(lco_provider, '_api_cache', OrderedDict())
+    monkeypatch.setattr(lco_provider, 'get_token', lambda: 'test-token')
+    try:
+        yield server
+    finally:
+        if lco_provider._session is not None:
+            lco_provider._session.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_session_reuse(archive):
+    for i in range(3):
+        lco_provider.observe_api_query('proposals', {'page': i})
+
+    assert lco_provider.get_session() is lco_provider.get_session()
+    assert len(archive.requests) == 3
+    assert all(headers['Authorization'] == 'Token test-token'
+               for _, headers, _ in archive.requests)
+    # All requests went through the same keep-alive connection
+    assert len({addr for _, _, addr in archive.requests}) == 1
+
+
+def test_cache_ttl(archive, monkeypatch):
+    res = lco_provider.archive_api_query('frames/1')
+    assert lco_provider.archive_api_query('frames/1') is res
+    assert len(archive.requests) == 1
+
+    # Responses for other users are not shared
+    monkeypatch.setattr(lco_provider, 'get_token', lambda: 'other-token')
+    lco_provider.archive_api_query('frames/1')
+    assert len(archive.requests) == 2
+
+
+def test_revalidation(archive, monkeypatch):
+    monkeypatch.setattr(lco_provider, 'API_CACHE_TTL', 0)
+
+    res = lco_provider.archive_api_query('frames/1')
+    assert lco_provider.archive_api_query('frames/1') is res
+    assert len(archive.requests) == 2
+    assert 'If-None-Match' not in archive.requests[0][1]
+    assert archive.requests[1][1]['If-None-Match'] == FRAME_ETAG
+
+
+def test_error_status(archive):
+    with pytest.raises(AfterglowError) as exc_info:
+        lco_provider.observe_api_query('unavailable')
+    assert exc_info.value.code == 503
+    # The request was retried before returning the error
+    assert len(archive.requests) == 2
+
+
+def test_connection_error(archive, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockArchiveHandler)
+    port = server.server_port
+    server.server_close()
+    monkeypatch.setattr(
+        lco_provider, 'ARCHIVE_API_URL', f'http://127.0.0.1:{port}')
+
+    with pytest.raises(lco_provider.LCOError):
+        lco_provider.archive_api_query('frames/1')
+
+
+def test_frame_cache(archive, tmp_path):
+    provider = lco_provider.LCODataProvider(
+        allow_collab_obs=False, cache_dir=str(tmp_path),
+        cache_size=1 << 20)
+
+    data = provider.get_asset_data('proposal/target/1')
+    with pyfits.open(BytesIO(data)) as f:
+        assert f[0].header['FILTER'] == 'rprime'
+    assert archive.downloads == 1
+
+    assert provider.get_asset_data('proposal/target/1') == data
+    assert archive.downloads == 1
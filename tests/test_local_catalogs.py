@@ -0,0 +1,165 @@
+"""
+Tests for local HEALPix-partitioned catalogs: NESTED pixel indexing and
+import-then-query round trips
+"""
+
+import numpy as np
+from astropy.table import Table
+import pytest
+
+
+@pytest.fixture
+def local_catalogs(app):
+    from afterglow_core.resources.catalog_plugins import local_catalogs
+
+    return local_catalogs
+
+
+def random_positions(n: int, seed: int = 0):
+    """
+    Return uniformly distributed sky positions (RA in hours, Dec in degrees)
+    """
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0, 24, n), \
+        np.rad2deg(np.arcsin(rng.uniform(-1, 1, n)))
+
+
+def test_base_pixels(local_catalogs):
+    # Order 0: pixel index = base face, 0-3 north, 4-7 equator, 8-11 south
+    ra = np.array([45, 135, 225, 315, 0, 90, 180, 270, 45, 135, 225, 315])/15
+    dec = np.array([60]*4 + [0]*4 + [-60]*4)
+    assert local_catalogs.ang2pix_nest(0, ra, dec).tolist() == \
+        list(range(12))
+
+
+def test_subpixels(local_catalogs):
+    # Order 1 subpixels of face 4 (centered at RA = Dec = 0): NESTED pixel 0
+    # of a face is its southern corner, and 3 is the northern one
+    ra = np.array([0, 10, 350, 0])/15
+    dec = np.array([-10, 0, 0, 10])
+    assert local_catalogs.ang2pix_nest(1, ra, dec).tolist() == \
+        [16, 17, 18, 19]
+
+
+def test_nested_hierarchy(local_catalogs):
+    # Each pixel of order k + 1 lies within its parent pixel of order k
+    ra, dec = random_positions(10000)
+    pix = [local_catalogs.ang2pix_nest(order, ra, dec) for order in range(8)]
+    for order in range(7):
+        assert (pix[order + 1] >> 2 == pix[order]).all()
+    assert (pix[7] >= 0).all() and (pix[7] < 12*4**7).all()
+
+
+def test_equal_area(local_catalogs):
+    ra, dec = random_positions(192000, 1)
+    counts = np.bincount(
+        local_catalogs.ang2pix_nest(2, ra, dec), minlength=192)
+    assert len(counts) == 192
+    assert np.abs(counts - 1000).max() < 150
+
+
+def test_healpy(local_catalogs):
+    healpy = pytest.importorskip('healpy')
+    ra, dec = random_positions(10000, 2)
+    for order in (0, 3, 6, 10):
+        assert (local_catalogs.ang2pix_nest(order, ra, dec) ==
+                healpy.ang2pix(1 << order, ra*15, dec, nest=True,
+                               lonlat=True)).all()
+
+
+@pytest.fixture
+def catalog(local_catalogs, tmp_path):
+    """
+    Local catalog imported from two CSV dumps of random sources
+    """
+    rng = np.random.default_rng(3)
+    n = 4000
+    ra = rng.uniform(9.9, 10.1, n)
+    dec = rng.uniform(-2, 2, n)
+    tables = []
+    for i, part in enumerate(np.array_split(np.arange(n), 2)):
+        tbl = Table({
+            'Name': [f'SRC{j}' for j in part],
+            'RAdeg': ra[part]*15,
+            'DEdeg': dec[part],
+            'Vmag': rng.uniform(8, 16, len(part)),
+            'e_Vmag': np.full(len(part), 0.01),
+        })
+        filename = str(tmp_path/f'dump{i}.csv')
+        tbl.write(filename, format='ascii.csv')
+        tables.append(tbl)
+
+    path = str(tmp_path/'catalog')
+    for filename in (tmp_path/'dump0.csv', tmp_path/'dump1.csv'):
+        local_catalogs.import_local_catalog(
+            path, str(filename),
+            {'id': 'Name', 'ra_hours': 'RAdeg/15', 'dec_degs': 'DEdeg'},
+            {'V': ('Vmag', 'e_Vmag')}, order=5, format='ascii.csv')
+
+    cls = type('TestLocalCatalog', (local_catalogs.LocalCatalog,), {
+        'name': 'test_local', 'path': path})
+    return cls(), {
+        'id': np.array([f'SRC{j}' for j in range(n)]),
+        'ra_hours': ra, 'dec_degs': dec,
+        'V': np.concatenate([tbl['Vmag'] for tbl in tables]),
+    }
+
+
+def test_import(catalog):
+    cat, truth = catalog
+    assert cat.meta['num_sources'] == len(truth['id'])
+    assert cat.num_sources == len(truth['id'])
+    assert set(cat.mags) == {'V'}
+
+
+def test_query_circ(catalog):
+    cat, truth = catalog
+    ra0, dec0, r = 10, 0.5, 30
+    sources = cat.query_circ(ra0, dec0, r)
+
+    ra, dec = np.deg2rad(truth['ra_hours']*15), np.deg2rad(truth['dec_degs'])
+    cos_dist = np.sin(np.deg2rad(dec0))*np.sin(dec) + \
+        np.cos(np.deg2rad(dec0))*np.cos(dec)*np.cos(ra - np.deg2rad(ra0*15))
+    expected = set(truth['id'][cos_dist >= np.cos(np.deg2rad(r/60))])
+    assert expected
+    assert {s.id for s in sources} == expected
+    assert all(s.catalog_name == 'test_local' for s in sources)
+
+
+def test_query_box(local_catalogs, catalog):
+    cat, truth = catalog
+    ra0, dec0, w, h = 10, -0.5, 60, 30
+    sources = cat.query_box(ra0, dec0, w, h)
+
+    expected = set(truth['id'][local_catalogs.get_box_mask(
+        truth['ra_hours'], truth['dec_degs'], ra0, dec0, w, h)])
+    assert expected
+    assert {s.id for s in sources} == expected
+    for s in sources:
+        assert abs(s.dec_degs - dec0) <= h/120
+        assert abs(s.ra_hours - ra0)*15*np.cos(np.deg2rad(dec0)) <= w/120 + 1e-6
+
+    # Same result as the generic implementation over query_circ
+    generic = super(local_catalogs.LocalCatalog, cat).query_box(
+        ra0, dec0, w, h)
+    assert {s.id for s in generic} == expected
+
+
+def test_query_box_constraints(catalog):
+    cat, truth = catalog
+    sources = cat.query_box(10, 0, 60, 60, {'V': '<12'}, limit=10)
+    assert len(sources) == 10
+    mags = [s.mags['V'].value for s in sources]
+    assert max(mags) < 12
+    assert mags == sorted(mags)
+
+
+def test_query_objects(catalog):
+    cat, truth = catalog
+    names = ['SRC0', 'SRC1999', 'SRC2000', 'SRC3999', 'missing']
+    sources = cat.query_objects(names)
+    assert sorted(s.id for s in sources) == sorted(names[:-1])
+    for s in sources:
+        i = int(s.id[3:])
+        assert s.ra_hours == pytest.approx(truth['ra_hours'][i])
+        assert s.mags['V'].value == pytest.approx(truth['V'][i], abs=1e-5)
@@ -0,0 +1,145 @@
+"""
+Tests for the per-job RAM governor with a simulated worker process RSS
+"""
+
+import time
+from threading import Thread, get_ident
+
+import pytest
+
+from afterglow_core.errors.job import JobRAMLimitExceededError
+from afterglow_core.models import jobs
+
+
+class FakeRSS(object):
+    """
+    Controllable stand-in for the worker process RSS
+    """
+    def __init__(self, mb: float = 1000):
+        self.mb = mb
+
+    def __call__(self) -> float:
+        return self.mb
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    fake = FakeRSS()
+    monkeypatch.setattr(jobs, 'get_process_ram_mb', fake)
+    return fake
+
+
+def test_check_and_free_mb(app, rss):
+    governor = jobs.JobMemoryGovernor(limit_mb=100, check_interval=0)
+    assert governor.free_mb == 100
+
+    rss.mb += 60
+    assert governor.used_mb == 60
+    assert governor.free_mb == 40
+    governor.check(40)
+    with pytest.raises(JobRAMLimitExceededError):
+        governor.check(41)
+    assert governor.peak_mb == 101
+
+    rss.mb += 100
+    assert governor.free_mb == 0
+    with pytest.raises(JobRAMLimitExceededError):
+        governor.check()
+
+
+def test_unlimited(app, rss):
+    governor = jobs.JobMemoryGovernor(limit_mb=0, check_interval=0)
+    rss.mb += 1e6
+    assert governor.free_mb == float('inf')
+    governor.check(1e6)
+
+
+def test_job_check_ram(app, rss):
+    job = jobs.Job()
+    job._memory_governor = jobs.JobMemoryGovernor(
+        limit_mb=100, check_interval=0)
+    child = jobs.Job(_parent=job)
+
+    rss.mb += 90
+    assert child.get_free_ram_mb() == 10
+    child.check_ram(5)
+    with pytest.raises(JobRAMLimitExceededError):
+        child.check_ram(20)
+
+
+def test_default_limit(app, rss, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_RAM_LIMIT', 0)
+    monkeypatch.setitem(app.config, 'JOB_WORKERS', 4)
+    monkeypatch.setattr(jobs, 'get_total_ram_mb', lambda: 8000)
+    assert jobs.JobMemoryGovernor().limit_mb == 1500
+
+    monkeypatch.setitem(app.config, 'JOB_RAM_LIMIT', 500)
+    assert jobs.JobMemoryGovernor().limit_mb == 500
+
+
+def test_cgroup_limit(tmp_path, monkeypatch):
+    v2, v1 = tmp_path/'memory.max', tmp_path/'memory.limit_in_bytes'
+    monkeypatch.setattr(
+        jobs, 'CGROUP_MEMORY_LIMIT_FILES', (str(v2), str(v1)))
+    assert jobs.get_cgroup_ram_limit_mb() is None
+
+    v1.write_text(f'{512 << 20}\n')
+    assert jobs.get_cgroup_ram_limit_mb() == 512
+
+    v2.write_text('max\n')
+    assert jobs.get_cgroup_ram_limit_mb() is None
+
+    v2.write_text(f'{256 << 20}\n')
+    assert jobs.get_cgroup_ram_limit_mb() == 256
+    assert jobs.get_total_ram_mb() == 256
+
+    # cgroup v1 "unlimited" is capped by the physical RAM
+    v2.unlink()
+    v1.write_text(f'{1 << 62}\n')
+    assert jobs.get_total_ram_mb() < 1 << 42
+
+
+def test_async_abort(app, rss):
+    governor = jobs.JobMemoryGovernor(limit_mb=100, check_interval=0.01)
+    outcome = []
+    started = []
+
+    def job_thread() -> None:
+        started.append(get_ident())
+        try:
+            for _ in range(1000):
+                time.sleep(0.01)
+            outcome.append('completed')
+        except jobs.JobRAMLimitAbort:
+            outcome.append('aborted')
+
+    t = Thread(target=job_thread, daemon=True)
+    t.start()
+    while not started:
+        time.sleep(0.001)
+    governor.start(started[0])
+    try:
+        time.sleep(0.1)
+        assert not governor.exceeded
+        rss.mb += 200
+        t.join(5)
+    finally:
+        governor.stop()
+
+    assert outcome == ['aborted']
+    assert governor.exceeded
+    assert isinstance(governor.error(), JobRAMLimitExceededError)
+
+
+def test_num_workers_ram_limits(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_MAX_THREADS', 16)
+    monkeypatch.setitem(app.config, 'JOB_MAX_RAM', 1000)
+    assert jobs.get_job_num_workers(100) == 16
+    assert jobs.get_job_num_workers(100, item_ram_mb=200) == 5
+    assert jobs.get_job_num_workers(
+        100, item_ram_mb=200, free_ram_mb=500) == 2
+    assert jobs.get_job_num_workers(
+        100, item_ram_mb=2000, free_ram_mb=float('inf')) == 1
+
+    monkeypatch.setitem(app.config, 'JOB_MAX_RAM', 0)
+    assert jobs.get_job_num_workers(100, item_ram_mb=200) == 16
@@ -0,0 +1,170 @@
+"""
+Tests for batched object name queries: the shared name resolution cache and
+the SDSS multi-position cross-match
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+from astropy.coordinates.name_resolve import NameResolveError
+from astropy.table import Table
+import pytest
+
+
+class FakeClock(object):
+    def __init__(self, t: float = 1e9):
+        self.t = t
+
+    def __call__(self) -> float:
+        return self.t
+
+
+class FakeSesame(object):
+    """
+    Stand-in for SkyCoord.from_name counting lookups
+    """
+    def __init__(self):
+        self.known = {}
+        self.lookups = []
+        self.error = None
+
+    def from_name(self, name: str, frame: str = 'icrs'):
+        self.lookups.append(name)
+        if self.error is not None:
+            raise self.error
+        try:
+            ra, dec = self.known[name]
+        except KeyError:
+            raise NameResolveError(
+                f'Unable to find coordinates for name "{name}"')
+        return SimpleNamespace(
+            ra=SimpleNamespace(hour=ra), dec=SimpleNamespace(degree=dec))
+
+
+@pytest.fixture
+def sesame(app, monkeypatch):
+    from afterglow_core.resources.catalog_plugins import vizier_catalogs
+
+    fake = FakeSesame()
+    clock = FakeClock()
+    monkeypatch.setattr(vizier_catalogs, 'SkyCoord', fake)
+    monkeypatch.setattr(vizier_catalogs, '_name_cache', {})
+    monkeypatch.setattr(
+        vizier_catalogs, 'time', SimpleNamespace(time=clock))
+    monkeypatch.setitem(app.config, 'OBJECT_NAME_NOT_FOUND_TTL', 100)
+    fake.clock = clock
+    return fake
+
+
+def test_resolved_names_cached(sesame):
+    from afterglow_core.resources.catalog_plugins.vizier_catalogs import \
+        resolve_object_names
+
+    sesame.known = {'M1': (5.5, 22), 'M2': (21.5, -1)}
+    assert resolve_object_names(['M1', 'M2', 'M1']) == \
+        {'M1': (5.5, 22), 'M2': (21.5, -1)}
+    assert sorted(sesame.lookups) == ['M1', 'M2']
+
+    # Resolved names never expire
+    sesame.clock.t += 1e6
+    assert resolve_object_names(['M2']) == {'M2': (21.5, -1)}
+    assert len(sesame.lookups) == 2
+
+
+def test_not_found_ttl(sesame):
+    from afterglow_core.resources.catalog_plugins.vizier_catalogs import \
+        resolve_object_names
+
+    assert resolve_object_names(['unknown']) == {'unknown': None}
+    sesame.clock.t += 50
+    assert resolve_object_names(['unknown']) == {'unknown': None}
+    assert sesame.lookups == ['unknown']
+
+    # Expired negative entry is looked up again
+    sesame.known['unknown'] = (1, 2)
+    sesame.clock.t += 51
+    assert resolve_object_names(['unknown']) == {'unknown': (1, 2)}
+    assert sesame.lookups == ['unknown']*2
+
+
+def test_errors_not_cached(sesame):
+    from afterglow_core.resources.catalog_plugins import vizier_catalogs
+
+    sesame.known = {'M1': (5.5, 22)}
+    sesame.error = NameResolveError('All Sesame mirrors failed')
+    with pytest.raises(NameResolveError):
+        vizier_catalogs.resolve_object_names(['M1'])
+    assert not vizier_catalogs._name_cache
+
+    sesame.error = None
+    assert vizier_catalogs.resolve_object_names(['M1']) == {'M1': (5.5, 22)}
+    assert sesame.lookups == ['M1']*2
+
+
+def test_cache_eviction(app, sesame, monkeypatch):
+    from afterglow_core.resources.catalog_plugins import vizier_catalogs
+
+    monkeypatch.setitem(app.config, 'OBJECT_NAME_CACHE_SIZE', 3)
+    monkeypatch.setitem(app.config, 'CATALOG_QUERY_THREADS', 1)
+    names = [f'OBJ{i}' for i in range(5)]
+    sesame.known = {name: (i, i) for i, name in enumerate(names)}
+
+    vizier_catalogs.resolve_object_names(names)
+    # The oldest entries are evicted first
+    assert list(vizier_catalogs._name_cache) == names[2:]
+
+    vizier_catalogs.resolve_object_names(names[:1])
+    assert list(vizier_catalogs._name_cache) == names[3:] + names[:1]
+    assert sesame.lookups == names + names[:1]
+
+
+def test_sdss_nearest_objects_query():
+    from afterglow_core.resources.catalog_plugins.sdss_catalog import \
+        get_nearest_objects_query
+
+    sql = get_nearest_objects_query(
+        [(np.float64(1), np.float64(2)), (3, -4.5)], 0.5,
+        ['objID', 'ra', 'dec'])
+    assert 'FROM (VALUES (0, 15.0, 2.0), (1, 45.0, -4.5)) AS p(q, ra, dec)' \
+        in sql
+    assert 'dbo.fGetNearbyObjEq(p.ra, p.dec, 0.5)' in sql
+    assert sql.startswith('SELECT p.q, n.distance, s.objID, s.ra, s.dec ')
+
+
+def test_sdss_query_objects(sesame, monkeypatch):
+    from afterglow_core.resources.catalog_plugins import sdss_catalog
+
+    names = [f'STAR{i}' for i in range(5)]
+    sesame.known = {name: (i + 1, 10*i) for i, name in enumerate(names)}
+    queries = []
+
+    class FakeSDSS(object):
+        """
+        SkyServer stand-in: two stars near each position except the last one
+        """
+        def __call__(self):
+            return self
+
+        def query_sql(self, sql, data_release=None, cache=None):
+            queries.append(sql)
+            rows = []
+            for q in range(len(names) - 1):
+                for k, dist in ((0, 0.3), (1, 0.1)):
+                    ra, dec = sesame.known[names[q]]
+                    rows.append((
+                        q, dist, 1000*q + k, ra*15, dec,
+                        *(15 + k,)*5, *(0.01,)*5))
+            return Table(rows=rows, names=[
+                'q', 'distance', 'objID', 'ra', 'dec',
+                'u', 'g', 'r', 'i', 'z',
+                'err_u', 'err_g', 'err_r', 'err_i', 'err_z'])
+
+    monkeypatch.setattr(sdss_catalog, 'SDSS', FakeSDSS())
+    catalog = sdss_catalog.SDSSCatalog()
+    sources = catalog.query_objects(names)
+
+    # All positions were cross-matched in a single request, and the nearest
+    # star was returned for each position
+    assert len(queries) == 1
+    assert [str(s.id) for s in sources] == ['1', '1001', '2001', '3001']
+    assert all(s.mags['r'].value == 16 for s in sources)
@@ -0,0 +1,170 @@
+"""
+Tests for lightcurve photometry: batch aperture sums against SkyLib aperture
+photometry, background outlier rejection, aperture correction, mapping source
+positions through alignment transformations, and reuse of background maps
+saved by source extraction
+"""
+
+import numpy as np
+import astropy.io.fits as pyfits
+import pytest
+
+
+SIGMA = 1.5
+STARS = [(50.3, 60.7, 1e5), (120.1, 80.4, 5e4), (150.6, 150.2, 2e5)]
+
+
+@pytest.fixture
+def photometry_job(app):
+    from afterglow_core.resources.job_plugins import photometry_job
+
+    return photometry_job
+
+
+@pytest.fixture
+def frame():
+    """
+    Gaussian stars on a constant background with noise; returns the image
+    and 1-based source XYs
+    """
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[:200, :200]
+    data = np.full(x.shape, 100.0)
+    for x0, y0, flux in STARS:
+        data += flux/(2*np.pi*SIGMA**2)*np.exp(
+            -((x - x0)**2 + (y - y0)**2)/(2*SIGMA**2))
+    data += rng.normal(0, 2, data.shape)
+    xs = np.array([s[0] for s in STARS]) + 1
+    ys = np.array([s[1] for s in STARS]) + 1
+    return data, xs, ys
+
+
+def photometer(photometry_job, data, xs, ys, a=3, a_in=7, a_out=10,
+               reject_outliers=False):
+    r = a_out + 1
+    cutouts, cx, cy = photometry_job.extract_cutouts(
+        data, xs, ys, r, 2*r + 2)
+    res = photometry_job.aperture_sums(
+        cutouts[None], cx[None], cy[None], a, a, 0, a_in, a_in, a_out, a_out,
+        0, 5, reject_outliers)
+    return (cutouts[None], cx[None], cy[None]), [item[0] for item in res]
+
+
+def test_aperture_sums(photometry_job, frame):
+    from skylib.photometry import aperture_photometry
+
+    data, xs, ys = frame
+    flux, area, bkg_var, nbkg = photometer(photometry_job, data, xs, ys)[1]
+
+    source_table = np.zeros(
+        len(xs),
+        [('x', float), ('y', float), ('a', float), ('b', float),
+         ('theta', float), ('flux', float), ('saturated', int),
+         ('flag', int)])
+    source_table['x'], source_table['y'] = xs, ys
+    source_table = aperture_photometry(
+        data, source_table, a=3, a_in=7, a_out=10, apcorr_tol=0)
+
+    assert flux == pytest.approx(source_table['flux'], rel=0.01)
+    assert area == pytest.approx(np.pi*9, rel=0.02)
+    assert bkg_var == pytest.approx(4, rel=0.3)
+    assert (nbkg > 0).all()
+
+
+def test_masked_aperture(photometry_job, frame):
+    data, xs, ys = frame
+    data = np.ma.masked_array(data, np.zeros(data.shape, bool))
+    data.mask[int(ys[0]) - 1, int(xs[0]) - 1] = True
+    flux = photometer(photometry_job, data, xs, ys)[1][0]
+    assert np.isnan(flux[0])
+    assert np.isfinite(flux[1:]).all()
+
+
+def test_reject_bkg_outliers(photometry_job, frame):
+    data, xs, ys = frame
+    data = data.copy()
+    # Hot pixel in the background annulus of the first star
+    data[int(ys[0]) - 1, int(xs[0]) - 1 + 8] += 5000
+
+    _, _, bkg_var, nbkg = photometer(photometry_job, data, xs, ys)[1]
+    _, _, bkg_var1, nbkg1 = photometer(
+        photometry_job, data, xs, ys, reject_outliers=True)[1]
+    assert nbkg1[0] < nbkg[0]
+    assert bkg_var[0] > 1000
+    assert bkg_var1[0] == pytest.approx(4, rel=0.3)
+
+
+def test_aperture_correction(photometry_job, frame):
+    data, xs, ys = frame
+    (cutouts, cx, cy), (flux, *_) = photometer(photometry_job, data, xs, ys)
+    corr = photometry_job.aperture_correction(
+        cutouts, cx, cy, flux[None], 3, 3, 0, 7, 7, 10, 10, 0, 1e-4)
+    assert corr.shape == (1,)
+    # Aperture of 2 sigma encloses 1 - exp(-2) of the Gaussian flux
+    assert corr[0] == pytest.approx(1/(1 - np.exp(-2)), rel=0.02)
+    assert flux*corr[0] == pytest.approx([s[2] for s in STARS], rel=0.02)
+
+    # No correction without valid fluxes
+    assert photometry_job.aperture_correction(
+        cutouts, cx, cy, np.full((1, 3), np.nan), 3, 3, 0, 7, 7, 10, 10, 0,
+        1e-4).tolist() == [1]
+
+
+def test_transform_xy(photometry_job):
+    xs, ys = np.array([1.0, 10, 25]), np.array([1.0, 5, 30])
+
+    # Pure shift
+    x, y = photometry_job.transform_xy(xs, ys, None, np.array([2.0, -3]))
+    assert x.tolist() == (xs - 3).tolist()
+    assert y.tolist() == (ys + 2).tolist()
+
+    # Rotation about the first pixel center and shift; matrix and offset
+    # act on 0-based (y, x)
+    c, s = np.cos(0.1), np.sin(0.1)
+    x, y = photometry_job.transform_xy(
+        xs, ys, np.array([[c, -s], [s, c]]), np.array([1.0, 2]))
+    assert x == pytest.approx(s*(ys - 1) + c*(xs - 1) + 2 + 1)
+    assert y == pytest.approx(c*(ys - 1) - s*(xs - 1) + 1 + 1)
+
+
+def test_lightcurve_background_map(photometry_job, frame):
+    from afterglow_core.models import Job, PhotSettings, SourceExtractionData
+    from afterglow_core.resources.data_files import (
+        create_data_file, get_background_params, get_root,
+        save_data_file_background)
+    from afterglow_core.resources.job_plugins.source_extraction_job import \
+        SourceExtractionSettings
+
+    data, xs, ys = frame
+    expected = photometer(photometry_job, data, xs, ys)[1][0]
+
+    # Compact bump in the sky background around the first star biases its
+    # annulus background low
+    y, x = np.mgrid[:200, :200]
+    bump = 500*np.exp(
+        -((x - STARS[0][0])**2 + (y - STARS[0][1])**2)/(2*6**2))
+    extraction_settings = SourceExtractionSettings()
+    params = get_background_params(
+        extraction_settings.bk_size, extraction_settings.bk_filter_size)
+    file_ids = []
+    for i in range(2):
+        hdr = pyfits.Header()
+        hdr['DATE-OBS'] = f'2026-01-01T00:0{i}:00'
+        hdr['EXPTIME'] = 1.0
+        file_ids.append(create_data_file(
+            None, f'lightcurve-test-{i}', get_root(None),
+            (data + bump).astype(np.float32), hdr).id)
+    # Background map is saved for the first frame only
+    save_data_file_background(
+        None, file_ids[0], 100 + bump, np.full(bump.shape, 2.0), params)
+
+    sources = [SourceExtractionData(id=str(i), x=x0, y=y0)
+               for i, (x0, y0) in enumerate(zip(xs, ys))]
+    lc = photometry_job.run_lightcurve_photometry_job(
+        Job(), PhotSettings(mode='aperture', a=3, a_in=7, a_out=10,
+                            apcorr_tol=0),
+        file_ids, sources, total_stages=0)
+
+    flux = np.array([source.flux for source in lc.sources])
+    assert flux[:, 0] == pytest.approx(expected, rel=1e-3)
+    assert flux[0, 1] > expected[0]*1.02
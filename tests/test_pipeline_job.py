@@ -0,0 +1,252 @@
+"""
+Tests for the job pipeline: step ordering, in-memory handoff of intermediate
+data files, persistence of the final outputs, and error propagation
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List as TList
+
+import numpy as np
+import astropy.io.fits as pyfits
+import pytest
+from marshmallow.fields import Float, Integer, List, Nested, String
+
+from afterglow_core.errors import ValidationError
+from afterglow_core.models import Job, JobResult
+from afterglow_core.resources.data_files import (
+    DbDataFile, InMemoryDataFiles, create_data_file, get_data_file_data,
+    get_data_file_path, get_root, in_memory_data_files)
+from afterglow_core.resources.job_plugins.pipeline_job import (
+    PipelineJob, PipelineStep, sort_steps)
+
+
+# Observations made by the test step jobs while the pipeline is running
+events = []
+
+
+class FileIdsResult(JobResult):
+    file_ids: TList[int] = List(Integer(), dump_default=[])
+
+
+class MakeImageJob(Job):
+    """
+    Test step creating a single constant image
+    """
+    type = 'test_pipeline_make'
+
+    result: FileIdsResult = Nested(FileIdsResult, dump_default={})
+    value: float = Float(dump_default=0)
+
+    def run(self):
+        data = np.full((4, 4), self.value, np.float32)
+        self.result.file_ids = [create_data_file(
+            self.user_id, 'make', get_root(self.user_id), data).id]
+
+
+class AddJob(Job):
+    """
+    Test step adding a constant to each input image
+    """
+    type = 'test_pipeline_add'
+
+    result: FileIdsResult = Nested(FileIdsResult, dump_default={})
+    file_ids: TList[int] = List(Integer(), dump_default=[])
+    value: float = Float(dump_default=0)
+
+    def run(self):
+        with in_memory_data_files(self.user_id) as store:
+            events.append({
+                'step': self.value,
+                'inputs_on_disk': [
+                    os.path.isfile(get_data_file_path(self.user_id, file_id))
+                    for file_id in self.file_ids],
+                'in_memory': set(store.files),
+            })
+        for file_id in self.file_ids:
+            data = get_data_file_data(self.user_id, file_id)[0]
+            self.result.file_ids.append(create_data_file(
+                self.user_id, 'add', get_root(self.user_id),
+                data + self.value).id)
+
+
+class FailJob(Job):
+    """
+    Test step that always fails
+    """
+    type = 'test_pipeline_fail'
+
+    file_ids: TList[int] = List(Integer(), dump_default=[])
+
+    def run(self):
+        raise RuntimeError('step failed')
+
+
+class JobFileJob(Job):
+    """
+    Test step creating an extra job file with the same ID in every step
+    """
+    type = 'test_pipeline_job_file'
+
+    content: str = String(dump_default='')
+
+    def run(self):
+        self.create_job_file('out', self.content.encode())
+
+
+class StubTask(object):
+    """
+    Celery task stand-in accepting job state updates
+    """
+    def update_state(self, **_) -> None:
+        pass
+
+
+def run_pipeline(steps: list) -> PipelineJob:
+    """
+    Run a pipeline job with the given steps outside the job server
+    """
+    job = PipelineJob(id='test-pipeline', user_id=None, _task=StubTask())
+    job.steps = [PipelineStep(**step) for step in steps]
+    job.run()
+    return job
+
+
+def data_file_exists(file_id: int) -> bool:
+    return DbDataFile.query.get(file_id) is not None
+
+
+@pytest.fixture(autouse=True)
+def clear_events():
+    events.clear()
+    yield
+    events.clear()
+
+
+def test_sort_steps_order():
+    steps = [
+        PipelineStep(id='c', inputs=['b']),
+        PipelineStep(id='a'),
+        PipelineStep(id='b', inputs=['a']),
+        PipelineStep(id='d'),
+    ]
+    assert [step.id for step in sort_steps(steps)] == ['a', 'd', 'b', 'c']
+
+
+def test_sort_steps_default_ids():
+    steps = [PipelineStep(), PipelineStep(inputs=['0'])]
+    assert [step.id for step in sort_steps(steps)] == ['0', '1']
+
+
+def test_sort_steps_cycle():
+    with pytest.raises(ValidationError):
+        sort_steps([
+            PipelineStep(id='a', inputs=['b']),
+            PipelineStep(id='b', inputs=['a']),
+        ])
+
+
+def test_sort_steps_unknown_input():
+    with pytest.raises(ValidationError):
+        sort_steps([PipelineStep(id='a', inputs=['missing'])])
+
+
+def test_sort_steps_duplicate_ids():
+    with pytest.raises(ValidationError):
+        sort_steps([PipelineStep(id='a'), PipelineStep(id='a')])
+
+
+def test_in_memory_handoff(app):
+    job = run_pipeline([
+        {'id': 'make', 'job': {'type': 'test_pipeline_make', 'value': 1}},
+        {'id': 'add1', 'inputs': ['make'],
+         'job': {'type': 'test_pipeline_add', 'value': 10}},
+        {'id': 'add2', 'inputs': ['add1'],
+         'job': {'type': 'test_pipeline_add', 'value': 100}},
+    ])
+    assert not job.result.errors
+
+    # Intermediate outputs were passed in memory, and the output of "make"
+    # was released before "add2" ran
+    assert [e['inputs_on_disk'] for e in events] == [[False], [False]]
+    make_ids = set(events[0]['in_memory'])
+    assert make_ids and not make_ids & events[1]['in_memory']
+
+    # Only the final output was written to disk
+    assert len(job.result.file_ids) == 1
+    file_id = job.result.file_ids[0]
+    assert os.path.isfile(get_data_file_path(None, file_id))
+    assert (get_data_file_data(None, file_id)[0] == 111).all()
+    assert list(job.result.steps) == ['add2']
+    for other_id in make_ids:
+        assert not data_file_exists(other_id)
+        assert not os.path.isfile(get_data_file_path(None, other_id))
+
+
+def test_persist_intermediate(app):
+    job = run_pipeline([
+        {'id': 'make', 'persist': True,
+         'job': {'type': 'test_pipeline_make', 'value': 1}},
+        {'id': 'add', 'inputs': ['make'],
+         'job': {'type': 'test_pipeline_add', 'value': 1}},
+    ])
+    assert not job.result.errors
+    assert len(job.result.file_ids) == 2
+    assert set(job.result.steps) == {'make', 'add'}
+    for file_id in job.result.file_ids:
+        assert data_file_exists(file_id)
+        assert os.path.isfile(get_data_file_path(None, file_id))
+
+
+def test_error_propagation(app):
+    job = run_pipeline([
+        {'id': 'fail', 'job': {'type': 'test_pipeline_fail'}},
+        {'id': 'dependent', 'inputs': ['fail'],
+         'job': {'type': 'test_pipeline_add'}},
+        {'id': 'independent', 'job': {'type': 'test_pipeline_make'}},
+    ])
+
+    # The failed step and its dependent are reported, the independent step
+    # still completes
+    assert [error['meta']['step'] for error in job.result.errors] == \
+        ['fail', 'dependent']
+    assert 'step failed' in job.result.errors[0]['detail']
+    assert 'fail' in job.result.errors[1]['detail']
+    assert not events
+    assert list(job.result.steps) == ['independent']
+    assert len(job.result.file_ids) == 1
+
+
+def test_unknown_step_job_type(app):
+    job = run_pipeline([{'id': 'bad', 'job': {'type': 'no_such_job'}}])
+    assert [error['meta']['step'] for error in job.result.errors] == ['bad']
+
+
+def test_step_job_files(app):
+    job = run_pipeline([
+        {'id': 'x', 'job': {'type': 'test_pipeline_job_file', 'content': 'x'}},
+        {'id': 'y', 'job': {'type': 'test_pipeline_job_file', 'content': 'y'}},
+    ])
+    assert not job.result.errors
+    assert set(job.result.files) == {'x.out', 'y.out'}
+
+    from afterglow_core.models import job_file_path
+    for step_id in ('x', 'y'):
+        with open(job_file_path(None, job.id, f'{step_id}.out'), 'rb') as f:
+            assert f.read() == step_id.encode()
+
+
+def test_in_memory_store_threads():
+    store = InMemoryDataFiles()
+    fits = pyfits.HDUList([pyfits.PrimaryHDU(np.zeros((2, 2)))])
+
+    def work(file_id: int) -> None:
+        store.add_created(file_id)
+        assert store.put(file_id, '', fits)
+        if file_id % 2:
+            store.discard(file_id)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(work, range(1000)))
+
+    assert set(store.files) == store.created == set(range(0, 1000, 2))
@@ -0,0 +1,177 @@
+"""
+Tests for the on-disk file cache and the survey image tile cache
+"""
+
+import os
+import time
+from io import BytesIO
+from threading import Event, Thread
+
+import numpy as np
+import astropy.io.fits as pyfits
+from astropy.wcs import WCS
+import pytest
+
+from afterglow_core.resources.file_cache import FileCache
+from afterglow_core.resources.imaging_surveys import SurveyTileCache
+
+
+# Survey tile: 100x100 pixels at 1"/pixel centered at RA = 150, Dec = +20
+TILE_RA, TILE_DEC, TILE_SIZE = 150.0, 20.0, 100
+
+
+def make_tile() -> bytes:
+    """
+    Return a FITS survey tile with a TAN WCS
+    """
+    hdr = pyfits.Header()
+    hdr['CTYPE1'], hdr['CTYPE2'] = 'RA---TAN', 'DEC--TAN'
+    hdr['CRVAL1'], hdr['CRVAL2'] = TILE_RA, TILE_DEC
+    hdr['CRPIX1'] = hdr['CRPIX2'] = (TILE_SIZE + 1)/2
+    hdr['CDELT1'], hdr['CDELT2'] = -1/3600, 1/3600
+    data = np.arange(TILE_SIZE**2, dtype=np.float32).reshape(
+        TILE_SIZE, TILE_SIZE)
+    buf = BytesIO()
+    pyfits.PrimaryHDU(data, hdr).writeto(buf)
+    return buf.getvalue()
+
+
+class Fetcher(object):
+    """
+    Fake remote service counting requests
+    """
+    def __init__(self, data: bytes = b''):
+        self.data = data
+        self.calls = 0
+
+    def __call__(self) -> bytes:
+        self.calls += 1
+        return self.data
+
+
+@pytest.fixture
+def file_cache(tmp_path):
+    return FileCache(str(tmp_path), 1 << 20)
+
+
+@pytest.fixture
+def tile_cache(file_cache):
+    return SurveyTileCache(file_cache)
+
+
+def test_exact_hit(tile_cache):
+    fetch = Fetcher(make_tile())
+    field = (TILE_RA, TILE_DEC, TILE_SIZE/60, TILE_SIZE/60)
+
+    data = tile_cache.get('DSS', 'DSS/tile', fetch, field)
+    assert tile_cache.get('DSS', 'DSS/tile', fetch, field) == data
+    assert fetch.calls == 1
+
+
+def test_cutout_from_covering_tile(tile_cache):
+    tile = make_tile()
+    tile_cache.get('DSS', 'DSS/tile', Fetcher(tile),
+                   (TILE_RA, TILE_DEC, TILE_SIZE/60, TILE_SIZE/60))
+
+    # A 30"x30" field at the tile center is cut out without a remote request
+    fetch = Fetcher()
+    data = tile_cache.get(
+        'DSS', 'DSS/field', fetch, (TILE_RA, TILE_DEC, 0.5, 0.5))
+    assert fetch.calls == 0
+    with pyfits.open(BytesIO(data)) as f:
+        hdr, cutout = f[0].header, f[0].data
+    with pyfits.open(BytesIO(tile)) as f:
+        expected = f[0].data[35:65, 35:65]
+    assert cutout.shape == (30, 30)
+    assert (cutout == expected).all()
+    assert hdr['CRPIX1'] == hdr['CRPIX2'] == (TILE_SIZE + 1)/2 - 35
+    x, y = WCS(hdr).all_world2pix(TILE_RA, TILE_DEC, 0)
+    assert x == pytest.approx(14.5) and y == pytest.approx(14.5)
+
+
+def test_no_cutout_outside_tile(tile_cache):
+    tile_cache.get('DSS', 'DSS/tile', Fetcher(make_tile()),
+                   (TILE_RA, TILE_DEC, TILE_SIZE/60, TILE_SIZE/60))
+
+    # Field extending beyond the tile edge
+    fetch = Fetcher(b'remote')
+    assert tile_cache.get(
+        'DSS', 'DSS/edge', fetch,
+        (TILE_RA, TILE_DEC + 0.8/60, 0.5, 0.5)) == b'remote'
+    # Other survey at the same position
+    assert tile_cache.get(
+        'SDSS', 'SDSS/field', fetch, (TILE_RA, TILE_DEC, 0.5, 0.5)) == \
+        b'remote'
+    assert fetch.calls == 2
+
+
+def test_lru_eviction(tmp_path):
+    cache = FileCache(str(tmp_path), 300)
+    for i, key in enumerate('abc'):
+        cache.put(key, bytes([i])*100)
+        os.utime(cache._filename(key), (1000*(i + 1),)*2)
+
+    # Reading "a" marks it as recently used, so "b" and "c" are evicted
+    # to bring the cache 10% below its size limit
+    assert cache.get('a') is not None
+    cache.put('d', b'd'*100)
+    assert cache.get('a') == b'\0'*100
+    assert cache.get('b') is None
+    assert cache.get('c') is None
+    assert cache.get('d') == b'd'*100
+
+
+def test_request_coalescing(file_cache):
+    release = Event()
+    calls = []
+
+    def create() -> bytes:
+        calls.append(None)
+        release.wait(5)
+        return b'data'
+
+    results = []
+    threads = [
+        Thread(target=lambda: results.append(
+            file_cache.get_or_create('key', create)))
+        for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.5)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert results == [b'data']*8
+    assert file_cache.get('key') == b'data'
+
+
+def test_request_coalescing_error(file_cache):
+    release = Event()
+    calls = []
+
+    def create() -> bytes:
+        calls.append(None)
+        release.wait(5)
+        raise RuntimeError('remote error')
+
+    errors = []
+
+    def request() -> None:
+        try:
+            file_cache.get_or_create('key', create)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [Thread(target=request) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.5)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert len(errors) == 4
+    assert file_cache.get('key') is None
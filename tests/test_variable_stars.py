@@ -0,0 +1,79 @@
+"""
+Tests for the variable star query used by field calibration, with an offline
+stand-in for VizieR
+"""
+
+import numpy as np
+from astropy.table import Table
+from astropy.wcs import WCS
+
+
+def make_vsx_table(n: int) -> Table:
+    """
+    Return a VSX-like table of `n` variable stars around RA = 150, Dec = +20
+    """
+    rng = np.random.default_rng(0)
+    return Table({
+        'OID': np.arange(1, n + 1),
+        'Name': [f'VAR {i}' for i in range(1, n + 1)],
+        'V': np.zeros(n, int),
+        'Type': ['EW']*n,
+        'max': np.full(n, 12.0),
+        'n_max': ['V']*n,
+        'f_min': ['']*n,
+        'min': np.full(n, 12.5),
+        'Period': np.full(n, 0.3),
+        'RAJ2000': 150 + rng.uniform(-0.01, 0.01, n),
+        'DEJ2000': 20 + rng.uniform(-0.01, 0.01, n),
+    })
+
+
+def make_wcs() -> WCS:
+    """
+    Return WCS of a 100x100 image at 1"/pixel centered at RA = 150, Dec = +20
+    """
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crval = [150, 20]
+    wcs.wcs.crpix = [50.5, 50.5]
+    wcs.wcs.cdelt = [-1/3600, 1/3600]
+    wcs.array_shape = (100, 100)
+    return wcs
+
+
+def test_vsx_query_unlimited(app, monkeypatch):
+    from afterglow_core.resources.catalog_plugins import vizier_catalogs
+    from afterglow_core.resources.catalog_plugins.vsx_catalog import \
+        VSXCatalog
+    from afterglow_core.resources.job_plugins import field_cal_job
+
+    table = make_vsx_table(120)
+    queries = []
+
+    class FakeVizier(object):
+        """
+        Offline VizieR stand-in honoring the astroquery row limit semantics
+        """
+        def __init__(self, catalog=None, row_limit=50, **_):
+            self.catalog = catalog
+            self.row_limit = row_limit
+            queries.append(self)
+
+        def query_region(self, *_, **__):
+            if self.row_limit < 0:
+                return [table]
+            return [table[:self.row_limit]]
+
+    monkeypatch.setattr(vizier_catalogs, 'Vizier', FakeVizier)
+    monkeypatch.setattr(
+        field_cal_job, 'known_catalogs', {'VSX': VSXCatalog()})
+    monkeypatch.setitem(app.config, 'VARIABLE_STAR_CATALOG', 'VSX')
+
+    var_stars = field_cal_job.query_variable_stars([make_wcs()]*3, 5)
+
+    # Identical footprints are queried once, and all stars are returned
+    assert len(queries) == 1
+    assert queries[0].row_limit == -1
+    assert len(var_stars) == 120
+    assert {str(star.id) for star in var_stars} == \
+        {str(i) for i in range(1, 121)}